@@ -1,20 +1,19 @@
 import os
 import io
 import json
+import hashlib
 import firebase_admin
 import traceback
-import smtplib
-from datetime import datetime, timezone # Asegurar timezone importado
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+import atexit
+from datetime import datetime, timedelta, timezone # Asegurar timezone importado
 import math
-from functools import wraps
+import threading
+import time
+from functools import partial, wraps
 
 from flask import (
     Flask, request, render_template, redirect, url_for,
-    session, flash, jsonify, send_file, abort, g
+    session, flash, jsonify, send_file, abort, g, Response
 )
 # Asumiendo Flask-Login se usará más adelante para el usuario
 from flask_login import LoginManager, UserMixin, login_required, current_user, login_user, logout_user
@@ -24,14 +23,12 @@ from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import or_
 from flask_migrate import Migrate
 from urllib.parse import urlparse, urljoin
+from werkzeug.exceptions import HTTPException
 
 # Google / Gemini Imports
 import google.generativeai as genai
 from google.oauth2 import service_account
-from googleapiclient.http import MediaIoBaseDownload # Asegúrate que esta línea esté
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError 
-from googleapiclient.http import MediaIoBaseUpload
 import re # Importar re para expresiones regulares
 
 # ReportLab Imports
@@ -39,6 +36,28 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.utils import simpleSplit
 from backend.app import get_user_profile, update_user_profile as fs_update_user_profile
+from backend.drive_client import DriveClient, FakeDrive
+from backend.error_logging import setup_error_logging
+from backend.ingredient_index import IngredientIndexCache
+from backend.ingredient_parser import clean_item_name, parse_line as parse_ingredient_line_cached
+from backend.llm_backends import GeminiBackend, ReplayBackend, PURPOSE_RECIPES, PURPOSE_STRUCTURE
+from backend.llm_metrics import GenerationStats, GenerationStatsStore, LLMMetrics, call_record
+from backend.mailer import MailError, MailQueue, OutgoingMail, SmtpPool, build_message, smtp_connector
+from backend.nutrient_matrix import NutrientMatrixCache
+from backend.pdf_cache import PdfCache
+from backend.pdf_storage import (DriveStorage, LocalStorage, PdfNotFound, PdfStorageRegistry, PdfStorageUnavailable,
+                                 S3Storage)
+from backend.plan_cache import PlanCache, cache_key
+from backend.plan_jobs import JobLimitExceeded, JobQueue
+from backend.post_save import ACTIVE_STATES as POST_SAVE_ACTIVE_STATES, PostSavePipeline, StepAborted, is_stale as is_post_save_stale
+from backend.plan_structure import LINE_BLANK, LINE_DAY, LINE_MEAL, STRUCTURE_VERSION, build_plan_structure, structure_key
+from backend.prompt_builder import (compact_base_foods, compact_prompt, group_ingredient_names, is_empty, join_known,
+                                    relevant_ingredient_names)
+from backend.recipe_batches import RECETARIO_MARKER, assemble_recetario, make_batches, map_concurrently
+from backend.recipe_index import index_recetario, index_recipes
+from backend.shopping_list import (SHOPPING_LIST_VERSION, CanonicalIngredient, Canonicalizer, ShoppingListAccumulator,
+                                   build_shopping_list, cache_key as shopping_list_cache_key, is_current as shopping_list_is_current)
+from backend.unit_conversion import UnitConversionTableCache, normalize_unit, apply_plan as apply_conversion_plan
 from reportlab.lib import colors
 
 # Configuración Local
@@ -55,28 +74,20 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login_page'
 import logging
-import subprocess
 
-class CustomErrorHandler(logging.FileHandler):
-    def emit(self, record):
-        super().emit(record)
-        if record.levelno >= logging.ERROR:
-            try:
-                subprocess.run(["python", "export_last_traceback.py"])
-            except Exception as e:
-                print("Error al ejecutar el script de extracción de traceback:", e)
-
-# Inicializar logging con el handler personalizado
-handler = CustomErrorHandler('error.log')
-handler.setLevel(logging.ERROR)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-
-app.logger.addHandler(handler)
-app.logger.setLevel(logging.ERROR)
+# Errores a error.log vía QueueHandler/QueueListener: la escritura y la exportación del último
+# traceback ocurren en un hilo de fondo, nunca en el hilo de la request.
+error_log_pipeline = setup_error_logging(
+    app.logger, app.config['ERROR_LOG_PATH'],
+    traceback_path=app.config.get('ERROR_TRACEBACK_EXPORT_PATH'),
+    min_interval_seconds=app.config.get('ERROR_TRACEBACK_EXPORT_INTERVAL_SECONDS'),
+)
 
 @app.errorhandler(Exception)
 def manejar_excepcion(e):
+    # Los abort() (403, 404, 304...) conservan su código; solo lo inesperado es un 500
+    if isinstance(e, HTTPException):
+        return e
     app.logger.exception("Excepción capturada:")
     return "Error interno del servidor", 500
 
@@ -92,9 +103,16 @@ def is_safe_url(target: str) -> bool:
         test_url.scheme in ('http', 'https') and ref_url.netloc == test_url.netloc
     )
 
-# Explicitly set logger level for debugging
-app.logger.setLevel(logging.DEBUG)
-app.logger.info("Flask logger level set to DEBUG.") # Test log
+# Nivel del logger según configuración (LOG_LEVEL=DEBUG para depurar; producción queda en INFO).
+# Un nombre inválido no impide arrancar: se usa INFO y se avisa.
+_log_level_name = str(app.config.get('LOG_LEVEL') or 'INFO').upper()
+_log_level = logging.getLevelName(_log_level_name) # int para nombres conocidos, "Level X" si no
+if not isinstance(_log_level, int):
+    app.logger.setLevel(logging.INFO)
+    app.logger.warning("LOG_LEVEL %r no es un nivel de logging válido; se usa INFO.", app.config.get('LOG_LEVEL'))
+else:
+    app.logger.setLevel(_log_level)
+app.logger.info("Flask logger level set to %s.", logging.getLevelName(app.logger.level))
 
 try:
     if app.config['GEMINI_API_KEY']:
@@ -326,6 +344,8 @@ class ChatMessage(db.Model):
 
 # *** NUEVO MODELO: Evaluation (reemplaza a Plan) ***
 class Evaluation(db.Model):
+    # Última evaluación de un paciente (lista de compras, app del paciente) con una sola lectura del índice
+    __table_args__ = (db.Index('ix_evaluation_patient_id_consultation_date', 'patient_id', 'consultation_date'),)
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
@@ -372,12 +392,21 @@ class Evaluation(db.Model):
 
     # Plan y Observaciones de esta evaluación
     edited_plan_text = db.Column(db.Text) # El plan textual (editado)
+    # Plan parseado una sola vez al guardar (días, comidas, recetas con ingredientes; ver backend/plan_structure.py)
+    plan_structure_json = db.Column(db.Text, nullable=True)
+    plan_structure_key = db.Column(db.String(64), nullable=True) # Hash del texto (y versión del parser) de plan_structure_json
+    # Lista de compras del paciente, calculada al guardar a partir de la estructura del plan
+    shopping_list_json = db.Column(db.Text, nullable=True)
+    shopping_list_key = db.Column(db.String(64), nullable=True) # También sirve de ETag de /api/patient/me/shopping_list
     user_observations = db.Column(db.Text) # Observaciones del profesional
     structured_plan_input_json = db.Column(db.Text) # JSON con TODOS los datos usados para generar el prompt
 
     # PDF en Drive para esta evaluación
     pdf_storage_path = db.Column(db.String(255), nullable=True) # Nombre de columna corregido para coincidir con la migración
     historical_pdf_ids_json = db.Column(db.Text, default='[]')
+    # Estado de las tareas posteriores al guardado (PDF técnico guardado, PDF del paciente; ver backend/post_save.py)
+    post_save_status = db.Column(db.String(20), nullable=True, index=True) # pending / running / done / failed
+    post_save_state_json = db.Column(db.Text, nullable=True) # Estado e intentos de cada paso
     # ——— Nuevos campos ———
     # Micronutrientes (guardados como dict JSON: {'Potasio': mg, 'Calcio': mg,})
     micronutrients_json = db.Column(db.Text, default='{}')
@@ -385,6 +414,8 @@ class Evaluation(db.Model):
     base_foods_json     = db.Column(db.Text, default='[]')
     # Campo para almacenar los rangos de referencia calculados para esta evaluación
     references_json = db.Column(db.Text, default='{}')
+    # Llamadas al modelo con que se generó el plan (latencias, tokens, bloqueos; ver GenerationStats)
+    generation_stats_json = db.Column(db.Text, nullable=True)
 
 
     # Métodos de ayuda para acceder/almacenar los campos
@@ -415,6 +446,54 @@ class Evaluation(db.Model):
     def references(self, value):
         self.references_json = json.dumps(value or {})
 
+    def refresh_plan_structure(self):
+        """Reconstruye plan_structure_json solo si edited_plan_text (o la versión del parser) cambió. Retorna True si lo reconstruyó."""
+        key = structure_key(self.edited_plan_text or "")
+        if self.plan_structure_json and self.plan_structure_key == key:
+            return False
+        self.plan_structure_json = json.dumps(build_plan_structure(self.edited_plan_text or ""), ensure_ascii=False)
+        self.plan_structure_key = key
+        return True
+    def get_plan_structure(self):
+        """Plan parseado guardado; si quedó desactualizado (o es una evaluación anterior) se reconstruye en la instancia."""
+        if self.refresh_plan_structure():
+            app.logger.info("Evaluation %s: estructura del plan reconstruida (no estaba guardada o el texto cambió).", self.id)
+        return json.loads(self.plan_structure_json)
+    def refresh_shopping_list(self):
+        """
+        Recalcula shopping_list_json solo si edited_plan_text, la versión de la lista o las tablas de ingredientes
+        y equivalencias cambiaron. Retorna True si lo recalculó.
+        """
+        canonicalizer = get_shopping_list_canonicalizer()
+        key = shopping_list_cache_key(self.edited_plan_text or "", canonicalizer.fingerprint)
+        if self.shopping_list_json and self.shopping_list_key == key:
+            return False
+        lista = build_shopping_list(self.get_plan_structure(), canonicalizer)
+        self.shopping_list_json = json.dumps(lista, ensure_ascii=False)
+        self.shopping_list_key = key
+        return True
+    def get_shopping_list(self):
+        """{'has_recetario', 'items': {categoría: [líneas]}}; se recalcula en la instancia si quedó desactualizada."""
+        self.refresh_shopping_list()
+        return json.loads(self.shopping_list_json)
+
+    def get_post_save_state(self):
+        try:
+            return json.loads(self.post_save_state_json) if self.post_save_state_json else None
+        except (json.JSONDecodeError, TypeError):
+            return None
+    def set_post_save_state(self, state):
+        self.post_save_state_json = json.dumps(state) if isinstance(state, dict) else None
+        self.post_save_status = state.get('status') if isinstance(state, dict) else None
+
+    def get_generation_stats(self):
+        try:
+            return json.loads(self.generation_stats_json) if self.generation_stats_json else None
+        except (json.JSONDecodeError, TypeError):
+            return None
+    def set_generation_stats(self, stats):
+        self.generation_stats_json = json.dumps(stats) if isinstance(stats, dict) else None
+
     # Métodos JSON (similar a Patient)
     def _safe_json_loads(self, json_string):
          if not json_string: return []
@@ -500,6 +579,8 @@ class IngredientNutrient(db.Model):
     # Ejemplo: iron_mg = db.Column(db.Float, default=0.0)
     # O un campo JSON para flexibilidad:
     micronutrients_json = db.Column(db.Text, default='{}') # {'Hierro_mg': 5.0, 'VitaminaC_mg': 30.0}
+    # Última edición de la fila: con la cantidad de filas y el id máximo detecta cambios sin leer la tabla (ver _nutrient_matrix_fingerprint)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     def get_micronutrients(self):
         try: return json.loads(self.micronutrients_json)
@@ -736,281 +817,128 @@ def calculate_get(tmb, activity_factor):
 
 # --- Funciones Auxiliares (Gemini, PDF, Drive, Email) ---
 
+def _cargar_credenciales_drive():
+    return service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+
+def crear_cliente_drive():
+    """
+    Crea el cliente de Drive indicado en DRIVE_BACKEND (ver backend/drive_client.py): 'google' (por defecto),
+    que carga las credenciales y construye el servicio recién en el primer uso, o 'fake', en memoria y sin red.
+    """
+    nombre_backend = (app.config.get('DRIVE_BACKEND') or 'google').lower()
+    if nombre_backend == 'fake':
+        return FakeDrive()
+    if nombre_backend != 'google':
+        raise ValueError(f"DRIVE_BACKEND desconocido: {nombre_backend}")
+    return DriveClient(_cargar_credenciales_drive, timeout=app.config.get('DRIVE_HTTP_TIMEOUT_SECONDS') or 60,
+                       pool_size=app.config.get('DRIVE_HTTP_POOL_SIZE') or 4)
+
+# Un único cliente por proceso, compartido entre hilos
+drive_client = crear_cliente_drive()
+
 def get_drive_service():
-    if not os.path.exists(SERVICE_ACCOUNT_FILE):
+    """El cliente de Drive del proceso, o None si faltan las credenciales."""
+    if isinstance(drive_client, DriveClient) and not os.path.exists(SERVICE_ACCOUNT_FILE):
         app.logger.error(f"ERROR: No se encontró '{SERVICE_ACCOUNT_FILE}'.")
         return None
+    return drive_client
+
+def crear_almacenamiento_pdf():
+    """
+    Drivers de almacenamiento de los PDFs técnicos (ver backend/pdf_storage.py). Los PDFs nuevos se guardan con
+    PDF_STORAGE_BACKEND ('drive' por defecto, 'local' o 's3'); los ya guardados se leen con el driver de su ubicación.
+    """
+    drivers = [DriveStorage(get_drive_service, lambda: DRIVE_FOLDER_ID),
+               LocalStorage(app.config.get('PDF_STORAGE_LOCAL_DIR') or os.path.join(app.root_path, 'storage', 'pdfs'))]
+    if app.config.get('PDF_STORAGE_S3_BUCKET'):
+        try:
+            drivers.append(S3Storage.from_config(
+                app.config['PDF_STORAGE_S3_BUCKET'], prefix=app.config.get('PDF_STORAGE_S3_PREFIX') or '',
+                endpoint_url=app.config.get('PDF_STORAGE_S3_ENDPOINT_URL'), region=app.config.get('PDF_STORAGE_S3_REGION'),
+                access_key_id=app.config.get('PDF_STORAGE_S3_ACCESS_KEY_ID'),
+                secret_access_key=app.config.get('PDF_STORAGE_S3_SECRET_ACCESS_KEY')))
+        except PdfStorageUnavailable as e:
+            app.logger.error("ERROR: Almacenamiento S3 de PDFs no disponible: %s", e)
+    return PdfStorageRegistry(drivers, default=(app.config.get('PDF_STORAGE_BACKEND') or 'drive').lower())
+
+pdf_storage = crear_almacenamiento_pdf()
+
+def guardar_pdf_almacenado(pdf_buffer, nombre_archivo):
+    """
+    Guarda el PDF con el almacenamiento configurado. Retorna su ubicación ('local:...', 's3:...', 'drive:...') o None si falló.
+    Lanza PdfStorageUnavailable si el almacenamiento no está configurado (reintentar no sirve).
+    """
+    pdf_buffer.seek(0)
     try:
-        creds = service_account.Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-        service = build('drive', 'v3', credentials=creds)
-        app.logger.info("INFO: Servicio Google Drive autenticado.")
-        return service
+        location = pdf_storage.put(pdf_buffer, nombre_archivo)
+    except PdfStorageUnavailable as e:
+        app.logger.error("ERROR: No se pudo guardar el PDF '%s': %s.", nombre_archivo, e)
+        raise
     except Exception as e:
-        app.logger.error(f"ERROR: Creando servicio Drive: {e}")
+        app.logger.error("Error inesperado guardando el PDF '%s': %s", nombre_archivo, e, exc_info=True)
         return None
+    app.logger.info("PDF '%s' guardado en %s.", nombre_archivo, location)
+    if not pdf_storage.local_path(location):
+        # Verlo no lo vuelve a descargar del almacenamiento remoto
+        remote_pdf_cache.put_bytes(stored_pdf_cache_key(location), pdf_buffer.getvalue())
+    return location
+
+# Copias locales de los PDFs guardados en almacenamientos remotos (Drive, S3), por ubicación; ver backend/pdf_cache.py
+remote_pdf_cache = PdfCache(
+    app.config.get('REMOTE_PDF_CACHE_DIR'),
+    max_entries=app.config.get('REMOTE_PDF_CACHE_MAX_ENTRIES'),
+    max_bytes=app.config.get('REMOTE_PDF_CACHE_MAX_BYTES'),
+)
 
-def download_from_drive(file_id):
+def stored_pdf_cache_key(location):
+    return cache_key('stored_pdf', *pdf_storage.split(location))
+
+def obtener_pdf_almacenado(location):
     """
-    Downloads a file from Google Drive given its file ID.
-    Returns a BytesIO buffer with the file content, or None on error.
+    PDF guardado: los del disco local se sirven directamente; los remotos a través de la caché local, descargándolos
+    solo si no están en disco, y una sola vez aunque lleguen varias solicitudes a la vez.
+    Retorna (ruta, None), (None, bytes) si la caché está desactivada o no se pudo escribir, o (None, None) si no se pudo leer.
     """
-    service = get_drive_service()
-    if not service:
-        app.logger.error("ERROR: No se pudo obtener servicio Drive para descargar.")
-        return None
+    try:
+        path = pdf_storage.local_path(location)
+    except PdfNotFound:
+        return None, None
+    if path:
+        return path, None
 
+    # Los fragmentos descargados van directo al archivo de la caché: la memoria no crece con el tamaño del PDF
     try:
-        request = service.files().get_media(fileId=file_id)
-        file_content_buffer = io.BytesIO()
-        # Corregir el constructor de MediaIoBaseDownload
-        downloader = MediaIoBaseDownload(fd=file_content_buffer, request=request, chunksize=1024*1024)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-            if status: # El objeto status puede ser None si el chunk no tiene progreso para reportar
-                 app.logger.debug(f"Descargando archivo {file_id}: {int(status.progress() * 100)}%.")
-
-        file_content_buffer.seek(0) # Rewind the buffer
-        app.logger.info(f"Archivo {file_id} descargado exitosamente de Drive.")
-        return file_content_buffer
+        return remote_pdf_cache.get_or_load(stored_pdf_cache_key(location), lambda: pdf_storage.open(location))
+    except PdfNotFound:
+        app.logger.error("PDF almacenado %s no encontrado.", location)
     except HttpError as error:
-        app.logger.error(f'Error HttpError descargando de Drive (ID: {file_id}): {error}', exc_info=True)
-        if error.resp.status == 404: # Específicamente para archivo no encontrado
-            app.logger.error(f"Archivo con ID {file_id} no encontrado en Drive.")
-        return None
+        app.logger.error("Error HttpError descargando el PDF almacenado %s: %s", location, error, exc_info=True)
     except Exception as e:
-        app.logger.error(f'Error inesperado descargando de Drive (ID: {file_id}): {e}', exc_info=True)
-        return None
+        app.logger.error("Error inesperado descargando el PDF almacenado %s: %s", location, e, exc_info=True)
+    return None, None
 
 def _clean_item_name_further(name_str: str) -> str:
     """Helper to perform final cleaning on a presumed item name."""
-    original_input_for_log = name_str # Guardar el original para logging
-    app.logger.debug(f"NUTR_CLEAN_DEBUG (_clean_item_name_further) - INPUT: '{name_str}'")
-    
-    # 1. Strip general whitespace and common list markers
-    cleaned_name = name_str.lstrip('*-• ').strip()
-
-    # Eliminar dos puntos al final y otros caracteres que podrían quedar pegados
-    cleaned_name = cleaned_name.rstrip(':,*-.').strip()
-
-    # 2. Remove specific parenthesized quantities/units if not caught by main parser
-    cleaned_name = re.sub(r"\s*\((?:aprox\.\s*)?[\d.,/\s]+(?:g|ml|kg|l|unidad|taza|cucharada|cucharadita|pizca|porcion|rebanada|filete|pieza)[a-zA-ZáéíóúñÑ]*\s*\)$", "", cleaned_name, flags=re.IGNORECASE).strip()
-
-    # Remove leading phrases like "bloque de", "diente de", etc.
-    leading_phrases_to_remove = [
-        "bloque de ", "diente de ", "loncha de ", "filete de ", 
-        "cabeza de ", "ramita de ", "hojas de ", "trozo de "
-    ]
-    for phrase in leading_phrases_to_remove:
-        if cleaned_name.lower().startswith(phrase):
-            cleaned_name = cleaned_name[len(phrase):].strip()
-            app.logger.debug(f"NUTR_CLEAN_DEBUG (_clean_item_name_further) - After removing leading phrase '{phrase}': '{cleaned_name}'")
-
-    # 3. Remove general parenthetical explanations (e.g., (opcional), (escurrido))
-    # This is more aggressive, so it's after specific quantity/unit removal.
-    # Avoid removing if it's like "Maiz (Zea mays)" - check if content is mostly non-numeric/non-unit
-    cleaned_name = re.sub(r"\s*\((?![^)]*Zea mays)(?:[^()]*?)\)$", lambda m: "" if not re.search(r'\d', m.group(0)) and not any(u in m.group(0).lower() for u in ['g','ml','kg','l','taza']) else m.group(0), cleaned_name, flags=re.IGNORECASE).strip()
-    app.logger.debug(f"NUTR_CLEAN_DEBUG (_clean_item_name_further) - After removing general parentheses: '{cleaned_name}'")
-
-    # Remove common trailing adjectives/phrases.
-    # This list needs to be curated carefully.
-    trailing_phrases_to_remove = [
-        "cocidos", "cocidas", "crudos", "crudas", "picados", "picadas", "molidos", "molidas", "rallados", "ralladas", # Plurales
-        "cocido", "cocida", "crudo", "cruda", "picado", "picada", "molido", "molida", "rallado", "rallada", # Singulares
-        "en cubos", "en trozos", "en juliana", "en rodajas", "en floretes", "fileteado", "troceado", "troceada", "laminado", "laminada",
-        "frescos", "frescas", "enteros", "enteras", "congelados", "congeladas", "secos", "secas", # Plurales
-        "fresco", "fresca", "entero", "entera", "congelado", "congelada", "seco", "seca", # Singulares
-        "medianos", "medianas", "pequeños", "pequeñas", # Plurales - 'grandes' puede ser parte de un nombre
-        # "grandes", # Comentado porque "huevo grande" es válido
-        "mediano", "mediana", "pequeño", "pequeña", "grande", "cortado", "cortada", "pelado", "pelada", "desmenuzado", "desmenuzada", "deshuesado", "deshuesada", # Singulares
-        "maduro", "madura", "rallado", "rallada", r"etc\.", r"aprox\.",
-        "sin piel", "con piel", "deshuesado", "deshuesada", "escurrido", "escurrida", "en conserva", "al natural", "en agua",
-        "firme, prensado y", "firme", "prensado", "triturado", "virgen extra", "en lonchas", "asadas", "salteadas", "cocidas", "cocidos" # Específicos para casos vistos
-    ]
-    for phrase in trailing_phrases_to_remove:
-        # Regex to match the phrase at the end, possibly preceded by a comma or space
-        # Ensures we don't cut off part of a compound name if the phrase is in the middle.
-        pattern = rf"^(.*?)(?:,\s*|\s+)\b{re.escape(phrase)}\b\s*$"
-        match = re.match(pattern, cleaned_name, re.IGNORECASE)
-        if match and match.group(1).strip(): 
-            cleaned_name = match.group(1).strip()
-            app.logger.debug(f"NUTR_CLEAN_DEBUG (_clean_item_name_further) - After removing trailing phrase '{phrase}': '{cleaned_name}'")
-    
-    # 4. Remove leading quantities like "1/2", "2", "10 unidades de"
-    cleaned_name = re.sub(r"^\s*(?:\d+/\d+\s+|\d+\s+(?:unidad(?:es)?\s+de\s+)?)", "", cleaned_name, flags=re.IGNORECASE).strip()
-    app.logger.debug(f"NUTR_CLEAN_DEBUG (_clean_item_name_further) - After removing leading quantities: '{cleaned_name}'")
-
-    cleaned_name = re.sub(r"\s+\d+/\d+$", "", cleaned_name).strip()
-    
-    if cleaned_name.lower().startswith("de ") and len(cleaned_name.split()) > 2:
-        cleaned_name = cleaned_name[3:].strip()
-    # app.logger.debug(f"_clean_item_name_further - OUTPUT: '{cleaned_name.strip()}'") # Puede ser muy verboso
-    return cleaned_name.strip()
+    return clean_item_name(name_str)
 
 def _parse_ingredient_line(line_text_with_star: str) -> dict:
     """
     Parses a single ingredient line to extract item, quantity, and unit.
     Prioritizes standardized units (g, ml) and common household units.
+    Los patrones están precompilados y el resultado se cachea por línea (ver backend/ingredient_parser.py).
     """
-    original_line = line_text_with_star
-    text_to_parse = line_text_with_star.lstrip('*').strip()
-
-    item_name = text_to_parse
-    quantity = 0.0
-    unit = "N/A" 
-    
-    std_parenthesized_match = re.search(
-        r"\((?:aprox\.\s*)?([\d.,/\s]+)\s*([gmkltzcs]+[a-zA-ZáéíóúñÑ]*)\s*\)",
-        text_to_parse,
-        re.IGNORECASE
-    )
-    
-    if std_parenthesized_match:
-        qty_str_paren = std_parenthesized_match.group(1).strip()
-        unit_str_paren = std_parenthesized_match.group(2).strip().lower()
-        parsed_qty_from_paren = None
-        parsed_unit_from_paren = None
-        try:
-            if '/' in qty_str_paren:
-                num, den = map(float, qty_str_paren.split('/'))
-                parsed_qty_from_paren = num / den if den != 0 else 0.0
-            else:
-                parsed_qty_from_paren = float(qty_str_paren.replace(',', '.'))
-
-            if unit_str_paren in ['gramos', 'gr', 'grs', 'grm', 'g']: parsed_unit_from_paren = 'g'
-            elif unit_str_paren in ['mililitros', 'ml', 'mls', 'mlt', 'cc']: parsed_unit_from_paren = 'ml'
-            elif unit_str_paren in ['kilos', 'kg', 'kgs']: parsed_qty_from_paren *= 1000; parsed_unit_from_paren = 'g'
-            elif unit_str_paren in ['litros', 'lts', 'l', 'litro']: parsed_qty_from_paren *= 1000; parsed_unit_from_paren = 'ml'
-            else: 
-                parsed_qty_from_paren = None 
-                parsed_unit_from_paren = None
-            
-            if parsed_qty_from_paren is not None:
-                definitive_quantity = parsed_qty_from_paren
-                definitive_unit = parsed_unit_from_paren
-                # Remove the matched parenthesized part AND any leading list markers for cleaning
-                text_for_item_name_extraction = text_to_parse.replace(std_parenthesized_match.group(0), "").lstrip('*-• ').strip()
-                
-                item_name_final = _clean_item_name_further(text_for_item_name_extraction)
-
-                app.logger.info(f"_parse_ingredient_line (Parenthesized Std Qty + Item Re-Parse): Item='{item_name_final}', Qty={definitive_quantity}, Unit='{definitive_unit}' from '{original_line}'")
-                return {'item': item_name_final, 'quantity': definitive_quantity, 'unit': definitive_unit, 'original_line': original_line}
-        except ValueError:
-            app.logger.warning(f"_parse_ingredient_line - ValueError parsing parenthesized std quantity '{qty_str_paren}' from '{original_line}'.")
-
-    qty_unit_pattern = r"([\d.,/\s]+)\s*([a-zA-ZáéíóúÁÉÍÓÚñÑ]+(?:\s+de)?)"
-    match_A = re.match(rf"^{qty_unit_pattern}\s+(.+)", text_to_parse, re.IGNORECASE)
-    match_B = re.match(rf"(.+?)\s+{qty_unit_pattern}$", text_to_parse, re.IGNORECASE)
-
-    chosen_match = None
-    item_name_candidate = text_to_parse 
-
-    if match_A:
-        chosen_match = match_A
-        qty_str = chosen_match.group(1).strip()
-        unit_str_raw = chosen_match.group(2).strip()
-        item_name_candidate = chosen_match.group(3).lstrip('*-• ').strip() # Clean leading markers
-    elif match_B:
-        chosen_match = match_B
-        item_name_candidate = chosen_match.group(1).lstrip('*-• ').strip() # Clean leading markers
-        if item_name_candidate and item_name_candidate.endswith(':'):
-            item_name_candidate = item_name_candidate[:-1].strip()
-        qty_str = chosen_match.group(2).strip()
-        unit_str_raw = chosen_match.group(3).strip()
-
-    if chosen_match:
-        try:
-            if '/' in qty_str:
-                num, den = map(float, qty_str.split('/'))
-                parsed_quantity = num / den if den != 0 else 0.0
-            else:
-                parsed_quantity = float(qty_str.replace(',', '.'))
-            
-            quantity = parsed_quantity
-            unit_str_cleaned_for_check = unit_str_raw.lower().replace(" de", "").strip()
-            final_item_name_candidate = item_name_candidate
-            final_unit = "N/A"
-
-            known_units_map = {
-                'g': 'g', 'gramos': 'g', 'gr': 'g', 'grs': 'g', 'grm': 'g',
-                'ml': 'ml', 'mililitros': 'ml', 'mls': 'ml', 'mlt': 'ml', 'cc': 'ml',
-                'kg': 'g', 'kilos': 'g', 'kgs': 'g', 
-                'l': 'ml', 'litros': 'ml', 'lts': 'ml', 'litro': 'ml', 
-                'cucharadita': 'cucharadita', 'cdta': 'cucharadita', 'cucharaditas': 'cucharadita', 'cucharadita de té': 'cucharadita', 'cucharadita te': 'cucharadita', 'cdté': 'cucharadita',
-                'cucharada': 'cucharada', 'cda': 'cucharada', 'cucharadas': 'cucharada', 'cucharada sopera': 'cucharada', 'cs': 'cucharada', 'cdas': 'cucharada',
-                'taza': 'taza', 'tz': 'taza', 'tazas': 'taza',
-                'unidad': 'unidad', 'unidades': 'unidad', 'unid': 'unidad', 'u': 'unidad', 'un.': 'unidad',
-                'pieza': 'pieza', 'piezas': 'pieza', 'pz': 'pieza',
-                'filete': 'filete', 'filetes': 'filete',
-                'rebanada': 'rebanada', 'rebanadas': 'rebanada',
-                'porcion': 'porcion', 'porción': 'porcion', 'porciones': 'porcion'
-            }
-            normalized_unit_from_map = known_units_map.get(unit_str_cleaned_for_check)
-
-            if normalized_unit_from_map:
-                final_unit = normalized_unit_from_map
-                if unit_str_cleaned_for_check in ['kg', 'kilos', 'kgs']: quantity *= 1000
-                elif unit_str_cleaned_for_check in ['l', 'litros', 'lts', 'litro']: quantity *= 1000
-            else:
-                final_item_name_candidate = f"{unit_str_raw} {item_name_candidate}".strip()
-                if quantity == 1.0 or quantity == 0.5 or (quantity > 0 and quantity < 2 and "/" in qty_str):
-                    final_unit = "unidad"
-                app.logger.debug(f"_parse_ingredient_line: Non-standard unit '{unit_str_raw}' treated as part of item. New item candidate: '{final_item_name_candidate}', New unit: '{final_unit}'.")
-
-            item_name_to_return = _clean_item_name_further(final_item_name_candidate)
-            app.logger.info(f"_parse_ingredient_line (General Pattern): Item='{item_name_to_return}', Qty={quantity}, Unit='{final_unit}' from '{original_line}'")
-            return {'item': item_name_to_return, 'quantity': quantity, 'unit': final_unit, 'original_line': original_line}
-
-        except ValueError:
-            app.logger.warning(f"_parse_ingredient_line - ValueError parsing general quantity '{qty_str}' from '{original_line}'. Fallback.")
-            item_name = _clean_item_name_further(text_to_parse)
-            quantity = 0.0 
-            unit = "N/A"   
-            if not item_name and text_to_parse:
-                item_name = text_to_parse.strip()
-                app.logger.warning(f"_parse_ingredient_line (Fallback after General Pattern error, _clean_item_name_further resulted in empty, using raw): Item='{item_name}' from '{original_line}'")
-            else:
-                app.logger.info(f"_parse_ingredient_line (Fallback after General Pattern error): Item='{item_name}' from '{original_line}'")
-            # No retornamos aquí, dejamos que caiga al fallback general si no se pudo parsear cantidad
-            pass # Explicitly fall through
-
-    # --- Fallback logic if no specific quantity/unit pattern matched above ---
-    item_name_final_cleaned = _clean_item_name_further(text_to_parse)
-    parsed_quantity_final = 0.0
-    parsed_unit_final = "N/A"
-
-    al_gusto_keywords = ["al gusto", "a gusto", "cantidad necesaria", "c.n.", "c/n", "a su gusto"]
-    common_spices_for_pizca = [
-        "sal y pimienta", "sal", "pimienta", "especias", "orégano", "comino", 
-        "nuez moscada", "pimentón", "curry", "cúrcuma", "jengibre en polvo", 
-        "ajo en polvo", "cebolla en polvo", "canela", "clavo molido", "laurel",
-        "tomillo", "romero", "albahaca", "perejil seco", "cilantro seco" 
-    ]
-
-    original_text_lower = text_to_parse.lower()
-    item_name_lower_for_check = item_name_final_cleaned.lower()
-
-    is_explicitly_al_gusto = any(keyword in original_text_lower for keyword in al_gusto_keywords)
-    is_common_spice_candidate_for_pizca = item_name_lower_for_check in common_spices_for_pizca
-
-    if is_explicitly_al_gusto or is_common_spice_candidate_for_pizca:
-        parsed_quantity_final = 1.0
-        parsed_unit_final = "pizca"
-        log_message_prefix = "Al Gusto/Spice Default"
-    else:
-        log_message_prefix = "Fallback/Simple Item"
-
-    if not item_name_final_cleaned and text_to_parse: 
-        item_name_final_cleaned = text_to_parse.strip()
-        app.logger.warning(f"_parse_ingredient_line ({log_message_prefix}, _clean_item_name_further resulted in empty, using raw): Item='{item_name_final_cleaned}', Qty={parsed_quantity_final}, Unit='{parsed_unit_final}' from '{original_line}'")
+    parsed = parse_ingredient_line_cached(line_text_with_star)
+    if parsed.used_raw_text:
+        app.logger.warning("_parse_ingredient_line (%s, _clean_item_name_further resulted in empty, using raw): item=%r qty=%s unit=%r line=%r",
+                           parsed.strategy, parsed.item, parsed.quantity, parsed.unit, line_text_with_star)
     else:
-        app.logger.info(f"_parse_ingredient_line ({log_message_prefix}): Item='{item_name_final_cleaned}', Qty={parsed_quantity_final}, Unit='{parsed_unit_final}' from '{original_line}'")
+        app.logger.debug("_parse_ingredient_line (%s): item=%r qty=%s unit=%r line=%r",
+                         parsed.strategy, parsed.item, parsed.quantity, parsed.unit, line_text_with_star)
+    return {'item': parsed.item, 'quantity': parsed.quantity, 'unit': parsed.unit, 'original_line': line_text_with_star}
 
-    return {'item': item_name_final_cleaned, 'quantity': parsed_quantity_final, 'unit': parsed_unit_final, 'original_line': original_line}
 
 
-
-def parse_recipe_from_text(recipe_identifier, full_plan_text):
+def parse_recipe_from_text(recipe_identifier, full_plan_text, recipe_index=None):
     """
     Parses a specific recipe's ingredients and instructions from the full AI-generated text.
     Assumes the text includes a '== RECETARIO DETALLADO ==' section.
@@ -1019,202 +947,160 @@ def parse_recipe_from_text(recipe_identifier, full_plan_text):
         recipe_identifier (str): Can be the recipe name (cleaned) OR the recipe number string (e.g., "N°5").
                                  Using the number string is more robust.
         full_plan_text (str): The complete text of the plan including the recetario.
+        recipe_index (RecipeIndex): Index of full_plan_text, when the caller already built it
+                                    (see backend/recipe_index.py; by default the memoized index of the text is used).
 
-    Returns a dict {'ingredients': [], 'instructions': '', 'description': ''}
+    Returns a dict {'name', 'ingredients': [], 'instructions': '', 'description': '', 'num_servings'}
     or None if the recipe is not found or parsing fails.
     """
-    original_recipe_identifier_for_log = str(recipe_identifier) # Guardar para logging
     if not recipe_identifier or not full_plan_text:
         app.logger.warning("parse_recipe_from_text: recipe_identifier o full_plan_text vacío.")
         return None
 
-    # Find the RECETARIO DETALLADO section
-    recetario_start_match = re.search(r"== RECETARIO DETALLADO ==", full_plan_text, re.IGNORECASE)
-    
-    if not recetario_start_match:
-        app.logger.warning("RECETARIO DETALLADO section not found in plan text.")
+    if recipe_index is None:
+        recipe_index = index_recipes(full_plan_text)
+    if not len(recipe_index):
+        app.logger.warning("RECETARIO DETALLADO section not found in plan text (or it has no recipes).")
         return None
 
-    recetario_text = full_plan_text[recetario_start_match.end():]
-    recetario_text = recetario_text.lstrip() # Eliminar espacios/saltos de línea iniciales
-    app.logger.debug(f"parse_recipe_from_text: recetario_text (limpio, primeros 200 chars): '{recetario_text[:200]}'")
+    entry = recipe_index.find(str(recipe_identifier))
+    if entry is None:
+        app.logger.warning("Recipe with identifier %r not found in RECETARIO DETALLADO section.", str(recipe_identifier))
+        return None
+    app.logger.debug("parse_recipe_from_text: Found %r as %s %r", recipe_identifier, entry.label, entry.title)
 
+    # Texto original si no contiene un número (ej. "a gusto"); por defecto 1 porción
+    num_servings = entry.num_servings if entry.num_servings is not None else (entry.servings or "1 porción")
+    return {
+        'name': entry.title,
+        'ingredients': [_parse_ingredient_line(line) for line in entry.ingredient_lines], # _parse_ingredient_line ya loguea
+        'instructions': entry.instructions,
+        'description': "",
+        'num_servings': num_servings
+    }
 
-    recipe_match = None
-    actual_recipe_name_from_recetario = None
-    recipe_block_text = None
-    
-    is_identifier_a_number_str = re.match(r"N°(\d+)", str(recipe_identifier), re.IGNORECASE)
-
-    if is_identifier_a_number_str:
-        recipe_num_str_exact = is_identifier_a_number_str.group(0) # Esto será "N°X"
-        # Patrón para capturar (1) el título y (2) el cuerpo de la receta.
-        recipe_pattern = re.compile(
-            rf"Receta\s*{re.escape(recipe_num_str_exact)}:\s*([^\n]+)\n((?:.|\n)*?)(?=\n\s*Receta\s*(?:N°|No\.|N\.)?\s*\d+:|\Z)",
-            re.DOTALL | re.IGNORECASE
-        )
-        app.logger.debug(f"parse_recipe_from_text: Buscando por NÚMERO: '{recipe_num_str_exact}' con patrón: '{recipe_pattern.pattern}' en recetario_text que empieza con: '{recetario_text[:50]}...'")
-        recipe_match = recipe_pattern.search(recetario_text)
-        if recipe_match:
-            actual_recipe_name_from_recetario = recipe_match.group(1).strip()
-            recipe_block_text = recipe_match.group(2).strip()
-            app.logger.info(f"parse_recipe_from_text: Found by number '{recipe_identifier}'. Actual title: '{actual_recipe_name_from_recetario}'")
-    
-    # Si no se encontró por número O si el identificador no era numérico, intentar por nombre
-    if not recipe_match:
-        cleaned_recipe_name_for_search = str(recipe_identifier).strip() # Usar el identificador original si no era "N°X"
-        escaped_recipe_name = re.escape(cleaned_recipe_name_for_search)
-        # Este patrón asume que 'cleaned_recipe_name_for_search' es el título exacto después de "Receta N°X: "
-        recipe_pattern_name_search = re.compile(
-            rf"Receta\s*(?:N°|No\.|N\.)?\s*\d+:\s*{escaped_recipe_name}(?:[^\n]*)\n(.*?)(?=\n\s*Receta\s*(?:N°|No\.|N\.)?\s*\d+:|\Z)",
-            re.DOTALL | re.IGNORECASE
-        )
-        app.logger.debug(f"parse_recipe_from_text: Buscando por NOMBRE: '{cleaned_recipe_name_for_search}' con patrón: '{recipe_pattern_name_search.pattern}'")
-        recipe_match = recipe_pattern_name_search.search(recetario_text)
-        if recipe_match:
-            actual_recipe_name_from_recetario = cleaned_recipe_name_for_search # El identificador era el nombre
-            recipe_block_text = recipe_match.group(1).strip()
-            app.logger.info(f"parse_recipe_from_text: Found by name '{actual_recipe_name_from_recetario}'.")
-
-    if not recipe_match or not recipe_block_text:
-        app.logger.warning(f"Recipe with identifier '{original_recipe_identifier_for_log}' not found in RECETARIO DETALLADO section or format unexpected after all attempts.")
-        return None
 
-    ingredients_list = []
-    instructions_text = ""
-    description_text = "" 
-    servings_text_parsed = "1 porción" 
 
-    ingredients_match = re.search(r"Ingredientes\s*\(.*?\):\s*\n(.*?)(?=\nPreparación:|\Z)", recipe_block_text, re.DOTALL | re.IGNORECASE)
-    if ingredients_match:
-        ingredients_block = ingredients_match.group(1).strip()
-        
-        for line in ingredients_block.split('\n'):
-            line = line.strip()
-            if not line.startswith('*'): 
-                continue
-            
-            parsed_ingredient = _parse_ingredient_line(line) # _parse_ingredient_line ya loguea
-            ingredients_list.append(parsed_ingredient)
+# --- Funciones para Cálculo Nutricional de Preparaciones ---
 
+def _load_ingredient_index_rows():
+    return db.session.query(Ingredient.id, Ingredient.name, Ingredient.synonyms_json).all()
 
-    instructions_match = re.search(r"Preparación:\s*\n(.*?)(?=\nCondimentos Sugeridos:|\nSugerencia de Presentación:|\Z)", recipe_block_text, re.DOTALL | re.IGNORECASE)
-    if instructions_match:
-        instructions_text = instructions_match.group(1).strip()
+# Índice en memoria (nombre exacto, prefijo, subcadena, sinónimo, token) construido una vez por proceso.
+# Se invalida desde las rutas /api/ingredients que modifican la tabla.
+_ingredient_index_cache = IngredientIndexCache(
+    _load_ingredient_index_rows, ttl_seconds=app.config.get('INGREDIENT_INDEX_TTL_SECONDS')
+)
 
-    servings_match_local = re.search(r"Porciones que Rinde:\s*(.*?)(?=\n)", recipe_block_text, re.IGNORECASE)
-    if servings_match_local:
-        servings_text_parsed = servings_match_local.group(1).strip()
-        num_match = re.search(r"(\d+[\.,]?\d*)", servings_text_parsed)
-        if num_match:
-            try:
-                servings_text_parsed = float(num_match.group(1).replace(',', '.'))
-            except ValueError:
-                app.logger.warning(f"No se pudo convertir '{num_match.group(1)}' a float para num_servings en receta '{actual_recipe_name_from_recetario}'. Usando texto original.")
+def get_ingredient_index():
+    return _ingredient_index_cache.get()
+
+def _load_nutrient_matrix_records():
+    rows_by_ingredient = {}
+    for row in IngredientNutrient.query.order_by(IngredientNutrient.id).all():
+        rows_by_ingredient.setdefault(row.ingredient_id, []).append(row)
+    records = []
+    for ingredient_id, nutrient_rows in rows_by_ingredient.items():
+        ref = _pick_nutrient_reference(nutrient_rows)
+        records.append((
+            ingredient_id, ref.reference_quantity, ref.reference_unit,
+            ref.calories, ref.protein_g, ref.carb_g, ref.fat_g, ref.get_micronutrients()
+        ))
+    return records
+
+def _nutrient_matrix_fingerprint():
+    """
+    (cantidad de filas, id máximo, última edición) de ingredient_nutrient: una sola consulta sobre índices, sin leer las filas.
+    Detecta altas, bajas y ediciones hechas con el ORM desde cualquier proceso (updated_at); un UPDATE en SQL a mano que no
+    toque updated_at no se ve: después de uno, ejecutar rebuild_nutrient_matrix().
+    """
+    count, max_id, last_update = db.session.query(
+        db.func.count(IngredientNutrient.id), db.func.max(IngredientNutrient.id), db.func.max(IngredientNutrient.updated_at)
+    ).one()
+    return (count, max_id, last_update.isoformat() if last_update else None)
+
+# Matriz densa de nutrientes (una fila por ingrediente) para sumar recetas con numpy.
+# Si numpy no está instalado, get_nutrient_matrix() retorna None y se usa el cálculo por ingrediente.
+_nutrient_matrix_cache = NutrientMatrixCache(
+    _load_nutrient_matrix_records, _nutrient_matrix_fingerprint,
+    directory=app.config.get('NUTRIENT_MATRIX_DIR'),
+    ttl_seconds=app.config.get('NUTRIENT_MATRIX_TTL_SECONDS')
+)
 
-    return {
-        'name': actual_recipe_name_from_recetario,
-        'ingredients': ingredients_list,
-        'instructions': instructions_text,
-        'description': description_text,
-        'num_servings': servings_text_parsed 
-    }
+def get_nutrient_matrix():
+    return _nutrient_matrix_cache.get()
 
+def rebuild_nutrient_matrix():
+    return _nutrient_matrix_cache.rebuild()
 
+def invalidate_ingredient_caches():
+    """Invalida el índice de nombres, la matriz de nutrientes y la tabla de conversión tras cambios en ingredientes."""
+    _ingredient_index_cache.invalidate()
+    _nutrient_matrix_cache.invalidate()
+    _unit_conversion_cache.invalidate()
+    app.logger.debug("Cachés de ingredientes invalidados.")
 
-# --- Funciones para Cálculo Nutricional de Preparaciones ---
+def _empty_nutritional_info():
+    return {"calories": 0, "protein_g": 0, "carb_g": 0, "fat_g": 0, "micros": {}}
 
-# !!! IMPORTANTE: Esta función ahora consulta la base de datos.
-# !!! Asegúrate de haber poblado las tablas Ingredient, IngredientNutrient y UnitEquivalence.
-def get_ingredient_nutritional_info(ingredient_item_name, quantity, unit):
-    """
-    Busca información nutricional para un ingrediente dado su nombre, cantidad y unidad
-    consultando la base de datos.
-    Retorna un diccionario con calorías, macros (g), y micros (dict) para la cantidad dada.
-    """
-    if not ingredient_item_name or quantity is None or quantity <= 0:
-        app.logger.debug(f"NUTR_CALC_DEBUG (get_ingredient_nutritional_info): Invalid input for '{ingredient_item_name}' (qty: {quantity}). Returning zeros.")
-        return {"calories": 0, "protein_g": 0, "carb_g": 0, "fat_g": 0, "micros": {}}
-    
+def _match_seems_different(ingredient, normalized_name):
+    """Basic dissimilarity check for token matches: a very simple heuristic."""
+    search_tokens = [token for token in normalized_name.split() if len(token) > 2]
+    return ingredient.strategy == "Token-based Match" and (
+        len(ingredient.name.split()) > len(search_tokens) + 2 or
+        abs(len(ingredient.name) - len(normalized_name)) > 15 # Arbitrary length diff
+    )
+
+def _resolve_ingredient_for_nutrition(ingredient_item_name, quantity, unit):
+    """Limpia el nombre y lo resuelve contra el índice de ingredientes. Retorna IngredientMatch o None."""
     final_cleaned_name_for_search = _clean_item_name_further(ingredient_item_name) 
     normalized_name_for_search = final_cleaned_name_for_search.lower().strip()
-    app.logger.debug(f"NUTR_CALC_DEBUG (get_ingredient_nutritional_info): Original item (ahora es parsed_item_name): '{ingredient_item_name}', Final cleaned for search: '{final_cleaned_name_for_search}', Normalized for DB: '{normalized_name_for_search}', Qty: {quantity}, Unit: '{unit}'")
+    app.logger.debug("NUTR_CALC_DEBUG resolve: item=%r cleaned=%r normalized=%r qty=%s unit=%r",
+                     ingredient_item_name, final_cleaned_name_for_search, normalized_name_for_search, quantity, unit)
 
-    ingredient = Ingredient.query.filter(Ingredient.name.ilike(normalized_name_for_search)).first()
-    match_strategy = "Exact Match"
+    ingredient = get_ingredient_index().resolve(normalized_name_for_search)
 
-    if not ingredient:
-        match_strategy = "Prefix Match"
-        app.logger.debug(f"NUTR_CALC_DEBUG (get_ingredient_nutritional_info): {match_strategy} - Attempting for '{normalized_name_for_search}%'.")
-        ingredient = Ingredient.query.filter(Ingredient.name.ilike(f"{normalized_name_for_search}%")).order_by(db.func.length(Ingredient.name)).first()
-        if ingredient:
-            app.logger.info(f"NUTR_CALC_INFO: Ingredient '{normalized_name_for_search}' found by {match_strategy} as '{ingredient.name}' (ID: {ingredient.id}).")
-
-    if not ingredient:
-        match_strategy = "Substring Match"
-        app.logger.debug(f"NUTR_CALC_DEBUG (get_ingredient_nutritional_info): {match_strategy} - Attempting for '%{normalized_name_for_search}%'.")
-        if len(normalized_name_for_search) > 3: 
-            ingredient = Ingredient.query.filter(Ingredient.name.ilike(f"%{normalized_name_for_search}%")).order_by(db.func.length(Ingredient.name)).first()
-        if ingredient:
-            app.logger.info(f"NUTR_CALC_INFO: Ingredient '{normalized_name_for_search}' found by {match_strategy} as '{ingredient.name}' (ID: {ingredient.id}).")
+    if ingredient:
+        if _match_seems_different(ingredient, normalized_name_for_search):
+            app.logger.warning("NUTR_CALC_WARNING: %s for %r found %r (ID: %s), but it seems quite different. Using it cautiously.",
+                               ingredient.strategy, normalized_name_for_search, ingredient.name, ingredient.id)
+        else:
+            app.logger.debug("NUTR_CALC_DEBUG resolved: name=%r strategy=%s match=%r id=%s",
+                             normalized_name_for_search, ingredient.strategy, ingredient.name, ingredient.id)
+    else:
+        app.logger.error("NUTR_CALC_ERROR: Ingredient %r (from original %r) NOT FOUND in DB after all attempts.",
+                         normalized_name_for_search, ingredient_item_name)
+    return ingredient
 
-    if not ingredient:
-        match_strategy = "Synonym Match"
-        app.logger.debug(f"NUTR_CALC_DEBUG (get_ingredient_nutritional_info): {match_strategy} - Attempting for '{normalized_name_for_search}'.")
-        all_ingredients_with_synonyms = Ingredient.query.filter(Ingredient.synonyms_json.isnot(None)).all()
-        for ing_with_syn in all_ingredients_with_synonyms:
-            if normalized_name_for_search in ing_with_syn.get_synonyms():
-                ingredient = ing_with_syn
-                app.logger.info(f"NUTR_CALC_INFO: Ingredient '{normalized_name_for_search}' found by {match_strategy} as '{ingredient.name}' (ID: {ingredient.id}).")
-                break
-        
-    # Attempt 5: Token-based matching if still no ingredient found
-    if not ingredient and len(normalized_name_for_search.split()) > 1: # Only if multiple words
-        match_strategy = "Token-based Match"
-        app.logger.debug(f"NUTR_CALC_DEBUG (get_ingredient_nutritional_info): {match_strategy} - Attempting for '{normalized_name_for_search}'.")
-        search_tokens = [token for token in normalized_name_for_search.split() if len(token) > 2] # Ignore very short tokens
-        if search_tokens:
-            first_token_query = Ingredient.query.filter(Ingredient.name.ilike(f"%{search_tokens[0]}%"))
-            potential_matches = first_token_query.order_by(
-                db.case((Ingredient.name.ilike(f"{search_tokens[0]}%"), 0), else_=1), # Prefer matches starting with token
-                db.func.length(Ingredient.name) # Then prefer shorter names
-            ).limit(5).all() # Limit to a few potential matches
-
-            if potential_matches:
-                # Basic dissimilarity check: if the found name is too different, log a stronger warning or discard.
-                # This is a very simple heuristic.
-                ingredient = potential_matches[0]
-                if len(ingredient.name.split()) > len(search_tokens) + 2 or \
-                   abs(len(ingredient.name) - len(normalized_name_for_search)) > 15: # Arbitrary length diff
-                    app.logger.warning(f"NUTR_CALC_WARNING: {match_strategy} for '{normalized_name_for_search}' found '{ingredient.name}' (ID: {ingredient.id}), but it seems quite different. Using it cautiously.")
-                else:
-                    app.logger.info(f"NUTR_CALC_INFO: Ingredient '{normalized_name_for_search}' found by {match_strategy} (token: '{search_tokens[0]}') as '{ingredient.name}' (ID: {ingredient.id}).")
-    
-    if ingredient and match_strategy == "Exact Match": # Log exact matches too for completeness
-         app.logger.info(f"NUTR_CALC_INFO: Ingredient '{normalized_name_for_search}' found by {match_strategy} as '{ingredient.name}' (ID: {ingredient.id}).")
+def _reference_scaling_factor(ingredient_item_name, ingredient, reference_quantity, reference_unit, quantity, unit):
+    """
+    Convierte la cantidad a la unidad de referencia y retorna el factor de escala
+    (cantidad convertida / cantidad de referencia), o None si la conversión falla.
+    """
+    quantity_in_ref_unit = convert_quantity_to_reference_unit(ingredient.id, quantity, unit, reference_unit)
 
-    if not ingredient:
-        app.logger.error(f"NUTR_CALC_ERROR: Ingredient '{normalized_name_for_search}' (from original '{ingredient_item_name}') NOT FOUND in DB after all attempts.")
-        return {"calories": 0, "protein_g": 0, "carb_g": 0, "fat_g": 0, "micros": {}}
+    if quantity_in_ref_unit is None or reference_quantity <= 0:
+         app.logger.error("NUTR_CALC_ERROR: Unit conversion FAILED for %r ('%s %s' to %r). Result: %s",
+                          ingredient_item_name, quantity, unit, reference_unit, quantity_in_ref_unit)
+         return None
     
-    app.logger.debug(f"NUTR_CALC_DEBUG (get_ingredient_nutritional_info): Using Ingredient ID: {ingredient.id} ('{ingredient.name}') for calculations based on search for '{normalized_name_for_search}'.")
-    nutri_ref = IngredientNutrient.query.filter_by(ingredient_id=ingredient.id, reference_unit='g', reference_quantity=100.0).first()
-    if not nutri_ref:
-         nutri_ref = IngredientNutrient.query.filter_by(ingredient_id=ingredient.id).first()
+    app.logger.debug("NUTR_CALC_DEBUG converted: item=%r qty=%s unit=%r", ingredient_item_name, quantity_in_ref_unit, reference_unit)
+    return quantity_in_ref_unit / reference_quantity
 
+def _scale_nutrient_reference(ingredient_item_name, ingredient, nutri_ref, quantity, unit):
+    """Convierte la cantidad a la unidad de referencia de `nutri_ref` y escala sus nutrientes."""
     if not nutri_ref:
-        app.logger.error(f"NUTR_CALC_ERROR: Nutrient reference data NOT FOUND for Ingredient ID: {ingredient.id} ('{ingredient.name}')")
-        return {"calories": 0, "protein_g": 0, "carb_g": 0, "fat_g": 0, "micros": {}}
+        app.logger.error("NUTR_CALC_ERROR: Nutrient reference data NOT FOUND for Ingredient ID: %s (%r)", ingredient.id, ingredient.name)
+        return _empty_nutritional_info()
     
-    app.logger.debug(f"NUTR_CALC_DEBUG (get_ingredient_nutritional_info): Found nutri_ref for ID {ingredient.id}. Ref Qty: {nutri_ref.reference_quantity}{nutri_ref.reference_unit}, Cal: {nutri_ref.calories}")
-    quantity_in_ref_unit = convert_quantity_to_reference_unit(ingredient.id, quantity, unit, nutri_ref.reference_unit)
+    app.logger.debug("NUTR_CALC_DEBUG reference: id=%s ref=%s%s cal=%s",
+                     ingredient.id, nutri_ref.reference_quantity, nutri_ref.reference_unit, nutri_ref.calories)
+    factor = _reference_scaling_factor(
+        ingredient_item_name, ingredient, nutri_ref.reference_quantity, nutri_ref.reference_unit, quantity, unit
+    )
+    if factor is None:
+        return _empty_nutritional_info()
 
-    if quantity_in_ref_unit is None or nutri_ref.reference_quantity <= 0:
-         app.logger.error(f"NUTR_CALC_ERROR: Unit conversion FAILED for '{ingredient_item_name}' ('{quantity} {unit}' to '{nutri_ref.reference_unit}'). Result: {quantity_in_ref_unit}")
-         return {"calories": 0, "protein_g": 0, "carb_g": 0, "fat_g": 0, "micros": {}}
-    
-    app.logger.debug(f"NUTR_CALC_DEBUG (get_ingredient_nutritional_info): Converted quantity for '{ingredient_item_name}' is {quantity_in_ref_unit} {nutri_ref.reference_unit}")
-    factor = quantity_in_ref_unit / nutri_ref.reference_quantity
     scaled_micros = {k: (v * factor if isinstance(v, (int, float)) else v) for k, v in nutri_ref.get_micronutrients().items()}
     
     result = {
@@ -1224,153 +1110,177 @@ def get_ingredient_nutritional_info(ingredient_item_name, quantity, unit):
         "fat_g": round(nutri_ref.fat_g * factor, 2) if nutri_ref.fat_g is not None else 0.0,
         "micros": scaled_micros
     }
-    app.logger.debug(f"NUTR_CALC_DEBUG (get_ingredient_nutritional_info): Scaled nutrients for '{ingredient_item_name}': Cal={result['calories']}, P={result['protein_g']}, C={result['carb_g']}, F={result['fat_g']}")
+    app.logger.debug("NUTR_CALC_DEBUG scaled: item=%r cal=%s p=%s c=%s f=%s",
+                     ingredient_item_name, result['calories'], result['protein_g'], result['carb_g'], result['fat_g'])
     return result
 
+def _pick_nutrient_reference(nutrient_rows):
+    """Prefiere la fila por 100 g; si no existe, la primera disponible (mismo criterio que las consultas individuales)."""
+    for row in nutrient_rows:
+        if row.reference_unit == 'g' and row.reference_quantity == 100.0:
+            return row
+    return nutrient_rows[0] if nutrient_rows else None
+
+# !!! IMPORTANTE: Esta función ahora consulta la base de datos.
+# !!! Asegúrate de haber poblado las tablas Ingredient, IngredientNutrient y UnitEquivalence.
+def get_ingredient_nutritional_info(ingredient_item_name, quantity, unit):
+    """
+    Busca información nutricional para un ingrediente dado su nombre, cantidad y unidad
+    consultando la base de datos.
+    Retorna un diccionario con calorías, macros (g), y micros (dict) para la cantidad dada.
+    """
+    if not ingredient_item_name or quantity is None or quantity <= 0:
+        app.logger.debug("NUTR_CALC_DEBUG invalid input: item=%r qty=%s. Returning zeros.", ingredient_item_name, quantity)
+        return _empty_nutritional_info()
+
+    ingredient = _resolve_ingredient_for_nutrition(ingredient_item_name, quantity, unit)
+    if not ingredient:
+        return _empty_nutritional_info()
+    
+    app.logger.debug("NUTR_CALC_DEBUG using: id=%s name=%r", ingredient.id, ingredient.name)
+    nutri_ref = IngredientNutrient.query.filter_by(ingredient_id=ingredient.id, reference_unit='g', reference_quantity=100.0).first()
+    if not nutri_ref:
+         nutri_ref = IngredientNutrient.query.filter_by(ingredient_id=ingredient.id).first()
+
+    return _scale_nutrient_reference(ingredient_item_name, ingredient, nutri_ref, quantity, unit)
+
+def _resolve_nutrition_batch(items):
+    """
+    Resuelve todos los nombres de `items` (nombre, cantidad, unidad) contra el índice en memoria.
+    Retorna una lista de IngredientMatch o None por ítem.
+    """
+    resolved = []
+    for ingredient_item_name, quantity, unit in items:
+        if not ingredient_item_name or quantity is None or quantity <= 0:
+            app.logger.debug("NUTR_CALC_DEBUG invalid input: item=%r qty=%s. Returning zeros.", ingredient_item_name, quantity)
+            resolved.append(None)
+            continue
+        resolved.append(_resolve_ingredient_for_nutrition(ingredient_item_name, quantity, unit))
+    return resolved
+
+def get_ingredients_nutritional_info_batch(items):
+    """
+    Versión por lotes de get_ingredient_nutritional_info.
+    `items` es una lista de tuplas (nombre, cantidad, unidad). Resuelve primero todos los nombres
+    contra el índice en memoria y luego trae IngredientNutrient con una sola
+    consulta IN. Retorna una lista de resultados en el mismo orden que `items`.
+    """
+    resolved = _resolve_nutrition_batch(items)
+
+    ingredient_ids = {match.id for match in resolved if match}
+    nutrient_rows_by_id = {}
+    if ingredient_ids:
+        for row in IngredientNutrient.query.filter(IngredientNutrient.ingredient_id.in_(ingredient_ids)).order_by(IngredientNutrient.id).all():
+            nutrient_rows_by_id.setdefault(row.ingredient_id, []).append(row)
+
+    results = []
+    for (ingredient_item_name, quantity, unit), ingredient in zip(items, resolved):
+        if not ingredient:
+            results.append(_empty_nutritional_info())
+            continue
+        nutri_ref = _pick_nutrient_reference(nutrient_rows_by_id.get(ingredient.id, []))
+        results.append(_scale_nutrient_reference(ingredient_item_name, ingredient, nutri_ref, quantity, unit))
+    return results
+
+
+
+def _calculate_totals_with_matrix(matrix, items):
+    """
+    Totales de una receta usando la matriz de nutrientes: se calcula un factor de escala por
+    ingrediente y luego un único producto factores × filas de la matriz.
+    """
+    resolved = _resolve_nutrition_batch(items)
+    rows, factors = [], []
+    for (ingredient_item_name, quantity, unit), ingredient in zip(items, resolved):
+        if not ingredient:
+            continue
+        row = matrix.row(ingredient.id)
+        if row is None:
+            app.logger.error("NUTR_CALC_ERROR: Nutrient reference data NOT FOUND for Ingredient ID: %s (%r)", ingredient.id, ingredient.name)
+            continue
+        reference_quantity, reference_unit = matrix.reference(row)
+        factor = _reference_scaling_factor(ingredient_item_name, ingredient, reference_quantity, reference_unit, quantity, unit)
+        if factor is None:
+            continue
+        rows.append(row)
+        factors.append(factor)
+    return matrix.totals(rows, factors)
+
+
+
+def _load_unit_conversion_rows():
+    ingredients = db.session.query(Ingredient.id, Ingredient.name).all()
+    equivalences = db.session.query(
+        UnitEquivalence.ingredient_id, UnitEquivalence.household_unit, UnitEquivalence.grams_per_unit
+    ).order_by(UnitEquivalence.id).all()
+    return ingredients, equivalences
+
+# Tabla de conversión (ingredient_id, unidad normalizada) -> factor, con densidades por ingrediente.
+# Se carga una vez desde unit_equivalence y se refresca al invalidar o al vencer el TTL.
+_unit_conversion_cache = UnitConversionTableCache(
+    _load_unit_conversion_rows, ttl_seconds=app.config.get('UNIT_CONVERSION_TTL_SECONDS')
+)
+
+def get_unit_conversion_table():
+    return _unit_conversion_cache.get()
+
+def _resolve_shopping_list_names(names):
+    """Resuelve de una vez los nombres de la lista de compras contra el índice en memoria (sin consultas por ítem)."""
+    index = get_ingredient_index()
+    resolved = {}
+    for name in names:
+        normalized_name = _clean_item_name_further(name).lower().strip()
+        match = index.resolve(normalized_name)
+        # Coincidencias por token dudosas no se agrupan: podrían juntar productos distintos
+        if match and not _match_seems_different(match, normalized_name):
+            resolved[name] = CanonicalIngredient(match.id, match.name)
+    app.logger.debug("Lista de compras: %d de %d ítems resueltos a ingredientes de la BD.", len(resolved), len(names))
+    return resolved
+
+def _convert_for_shopping_list(ingredient_id, quantity, unit, reference_unit):
+    return get_unit_conversion_table().convert(ingredient_id, quantity, unit, reference_unit)
+
+def _shopping_list_fingerprint(index_version, table_version):
+    return hashlib.sha1(f"{index_version}|{table_version}".encode('utf-8')).hexdigest()
+
+def shopping_list_tables_fingerprint():
+    """
+    Versión de ingredient (nombres y sinónimos) y unit_equivalence, las tablas con que se agrupa la lista de compras.
+    Forma parte de la clave guardada de cada lista y de su ETag: al editar un ingrediente, sinónimo o equivalencia
+    (invalidate_ingredient_caches() o el TTL de esos cachés) las listas guardadas quedan desactualizadas.
+    Sale de las versiones que el índice y la tabla de conversión calculan al cargarse: no lee las tablas.
+    """
+    return _shopping_list_fingerprint(_ingredient_index_cache.version(), _unit_conversion_cache.version())
 
+def get_shopping_list_canonicalizer():
+    """Agrupa la lista de compras por ingrediente de la BD, en gramos (o ml) según UnitEquivalence."""
+    return Canonicalizer(_resolve_shopping_list_names, _convert_for_shopping_list,
+                         fingerprint=_shopping_list_fingerprint(get_ingredient_index().version, get_unit_conversion_table().version))
 
-# !!! IMPORTANTE: Esta es una función de EJEMPLO/PLACEHOLDER para conversión de unidades.
-# !!! Debes reemplazarla con tu lógica real que use la tabla UnitEquivalence.
 def convert_quantity_to_reference_unit(ingredient_id, quantity, unit, reference_unit):
     """
     Convierte una cantidad de una unidad de entrada (`unit`) a una unidad de referencia (`reference_unit`)
-    para un `ingredient_id` específico, utilizando la tabla `UnitEquivalence`.
+    para un `ingredient_id` específico, utilizando la tabla de conversión precalculada
+    (equivalencias de UnitEquivalence + densidades por ingrediente).
 
     Retorna la cantidad convertida en la `reference_unit` o None si la conversión no es posible.
     """
     if unit is None or reference_unit is None or quantity is None or quantity <= 0:
-        app.logger.debug(f"convert_quantity: Entrada inválida - ing_id: {ingredient_id}, unit: {unit}, ref_unit: {reference_unit}, qty: {quantity}")
+        app.logger.debug("convert_quantity: Entrada inválida - ing_id=%s unit=%r ref_unit=%r qty=%s", ingredient_id, unit, reference_unit, quantity)
         return None
 
-    unit_norm_initial = unit.lower().strip()
+    unit_norm = normalize_unit(unit)
     ref_unit_norm = reference_unit.lower().strip() # La unidad de referencia de la BD ya debería ser estándar
 
-    # Mapa para normalizar unidades de entrada del usuario a las formas canónicas
-    # almacenadas en UnitEquivalence.household_unit (que son generadas por populate_equivalences.py)
-    _UNIT_NORMALIZATION_MAP = {
-        # A g/ml/kg/l (estos luego son manejados por lógica específica)
-        "gramos": "g", "grs": "g", "grm": "g", "gr": "g", "g.": "g",
-        "mililitros": "ml", "mls": "ml", "mlt": "ml", "cc": "ml",
-        "kilos": "kg", "kgs": "kg", "kilogramo": "kg", "kilogramos": "kg",
-        "litros": "l", "lts": "l", "litro": "l",
-
-        # A "taza" (coincide con populate_equivalences.py)
-        "tazas": "taza", "tzs": "taza", "tz": "taza",
-
-        # A "cucharada sopera" (coincide con populate_equivalences.py)
-        "cucharadas soperas": "cucharada sopera", "cda sopera": "cucharada sopera",
-        "cdas soperas": "cucharada sopera", "cs": "cucharada sopera",
-        "cucharada": "cucharada sopera",  # Asume que "cucharada" genérica implica "sopera"
-        "cucharadas": "cucharada sopera",
-        "cda": "cucharada sopera",
-        "cdas": "cucharada sopera",
-
-        # A "cucharadita de té" (coincide con populate_equivalences.py)
-        "cucharaditas de te": "cucharadita de té", "cdta de te": "cucharadita de té",
-        "cucharadita te": "cucharadita de té",
-        "cucharaditas": "cucharadita de té", # Asume que "cucharadita" genérica implica "de té"
-        "cucharadita": "cucharadita de té",
-        "cdtas": "cucharadita de té",
-        "cdta": "cucharadita de té",
-        "cucharita": "cucharadita de té",
-        "cucharitas": "cucharadita de té",
-
-        # A "unidad mediana" (coincide con populate_equivalences.py)
-        "unidades medianas": "unidad mediana", "unid mediana": "unidad mediana", "ud mediana": "unidad mediana",
-
-        # A "rebanada mediana" (coincide con populate_equivalences.py)
-        "rebanadas medianas": "rebanada mediana",
-
-        # A "porción mediana" (coincide con populate_equivalences.py)
-        "porciones medianas": "porción mediana",
-
-        # Unidades genéricas (se buscarán tal cual si no están en el mapa,
-        # o se mapean a su forma singular estándar si es necesario)
-        "unidades": "unidad", "unids": "unidad", "un": "unidad", "ud": "unidad", # mapea a "unidad"
-        "piezas": "pieza", "pzs": "pieza", "pz": "pieza", # mapea a "pieza"
-        "filetes": "filete", # mapea a "filete"
-        "rebanadas": "rebanada", # mapea a "rebanada"
-        "porciones": "porcion", # mapea a "porcion"
-    }
-    
-    unit_norm = _UNIT_NORMALIZATION_MAP.get(unit_norm_initial, unit_norm_initial)
-    app.logger.debug(f"convert_quantity: IngID {ingredient_id}. Unidad entrada: '{unit}', Normalizada a: '{unit_norm}'. Ref: '{ref_unit_norm}'. Cantidad: {quantity}")
-# Dentro de convert_quantity_to_reference_unit
-
-    ingredient_db = Ingredient.query.get(ingredient_id)
-    ingredient_name_lower = ingredient_db.name.lower() if ingredient_db else ""
-
-    # Conversiones directas ml <-> g usando densidades asumidas
-    if unit_norm == 'ml' and ref_unit_norm == 'g':
-        density = 1.0 # Default para agua/líquidos similares
-        if "aceite" in ingredient_name_lower:
-            density = 0.92
-        elif "salsa de soja" in ingredient_name_lower or "soya" in ingredient_name_lower : # ser más específico
-            density = 1.18 # Densidad aproximada para salsa de soja
-        elif "leche" in ingredient_name_lower:
-            density = 1.03
-        # Añadir más densidades si es necesario
-        app.logger.info(f"convert_quantity: IngID {ingredient_id} ('{ingredient_name_lower}'). Convirtiendo {quantity}ml a g usando densidad {density} g/ml.")
-        return quantity * density
-    elif unit_norm == 'g' and ref_unit_norm == 'ml':
-        density = 1.0 # Default para agua/líquidos similares
-        if "aceite" in ingredient_name_lower:
-            density = 0.92
-        elif "salsa de soja" in ingredient_name_lower or "soya" in ingredient_name_lower:
-            density = 1.18
-        elif "leche" in ingredient_name_lower:
-            density = 1.03
-        app.logger.info(f"convert_quantity: IngID {ingredient_id} ('{ingredient_name_lower}'). Convirtiendo {quantity}g a ml usando densidad {density} g/ml.")
-        return quantity / density if density != 0 else None
-
-    # Lógica existente para kg/l y unidades caseras
-    if unit_norm == 'kg':
-        quantity *= 1000
-        unit_norm = 'g'
-        app.logger.debug(f"convert_quantity: IngID {ingredient_id}. Convertido kg a g. Nueva cantidad: {quantity}, unidad: {unit_norm}")
-    elif unit_norm == 'l':
-        quantity *= 1000
-        unit_norm = 'ml'
-        app.logger.debug(f"convert_quantity: IngID {ingredient_id}. Convertido l a ml. Nueva cantidad: {quantity}, unidad: {unit_norm}")
-
-    if unit_norm == ref_unit_norm:
-        app.logger.debug(f"convert_quantity: IngID {ingredient_id}. Unidades coinciden después de normalización ('{unit_norm}'). Retornando cantidad: {quantity}")
-        return quantity
-
-    # Handle "pizca" conversion to grams (assign a small, somewhat arbitrary value)
-    if unit_norm == 'pizca' and ref_unit_norm == 'g':
-        app.logger.debug(f"convert_quantity: IngID {ingredient_id}. Convirtiendo 'pizca' a gramos. Usando 0.5g por defecto.")
-        return quantity * 0.5 # Asumimos que 1 pizca es ~0.5g. Ajusta si es necesario.
-
-    equivalence_entry = UnitEquivalence.query.filter_by(
-        ingredient_id=ingredient_id,
-        household_unit=unit_norm
-    ).first()
-
-    if equivalence_entry and equivalence_entry.grams_per_unit is not None:
-        grams_from_household = quantity * equivalence_entry.grams_per_unit
-        app.logger.debug(f"convert_quantity: IngID {ingredient_id}, {quantity} {unit} ({unit_norm}) -> {grams_from_household}g via UnitEquivalence.")
-        if ref_unit_norm == 'g':
-            return grams_from_household
-        elif ref_unit_norm == 'ml':
-            # Convertido a gramos, ahora de gramos a ml (necesita densidad inversa)
-            density_inv = 1.0 # Default para agua
-            if "aceite" in ingredient_name_lower: density_inv = 0.92
-            elif "salsa de soja" in ingredient_name_lower or "soya" in ingredient_name_lower: density_inv = 1.18
-            elif "leche" in ingredient_name_lower: density_inv = 1.03
-            app.logger.info(f"convert_quantity: IngID {ingredient_id} ('{ingredient_name_lower}'). Convirtiendo {grams_from_household}g a ml usando densidad {density_inv} g/ml (inversa).")
-            return grams_from_household / density_inv if density_inv != 0 else None
-        else:
-            app.logger.warning(f"convert_quantity: IngID {ingredient_id}. Convertido a {grams_from_household}g desde unidad casera, pero la unidad de referencia es '{ref_unit_norm}', no 'g' ni 'ml'.")
-            return None
-
-    # Manejar 'unidad' como unidad de referencia (si la unidad de entrada también es 'unidad' después de normalizar)
-    if ref_unit_norm == 'unidad' and unit_norm == 'unidad':
-        app.logger.debug(f"convert_quantity: IngID {ingredient_id}. Unidad de entrada y referencia son 'unidad'. Retornando cantidad: {quantity}")
-        return quantity
+    plan = get_unit_conversion_table().plan(ingredient_id, unit_norm, ref_unit_norm)
+    if plan is None:
+        app.logger.warning("convert_quantity: No se encontró regla de conversión para IngID %s de '%s %s' (normalizado a %r) a %r (normalizado a %r).",
+                           ingredient_id, quantity, unit, unit_norm, reference_unit, ref_unit_norm)
+        return None
 
-    app.logger.warning(f"convert_quantity: No se encontró regla de conversión para IngID {ingredient_id} de '{quantity} {unit}' (normalizado a '{unit_norm}') a '{reference_unit}' (normalizado a '{ref_unit_norm}').")
-    return None
+    converted = apply_conversion_plan(plan, quantity)
+    app.logger.debug("convert_quantity: IngID %s, %s %s (%s) -> %s %s.", ingredient_id, quantity, unit, unit_norm, converted, ref_unit_norm)
+    return converted
 
 
 def calculate_total_nutritional_info(ingredients_list):
@@ -1385,17 +1295,15 @@ def calculate_total_nutritional_info(ingredients_list):
     total_micros = {} # Diccionario para sumar micronutrientes (requiere manejo de unidades)
 
     if not isinstance(ingredients_list, list):
-        app.logger.error(f"NUTR_CALC_DEBUG (calculate_total_nutritional_info): Received invalid type for ingredients_list: {type(ingredients_list)}")
+        app.logger.error("NUTR_CALC_DEBUG (calculate_total_nutritional_info): Received invalid type for ingredients_list: %s", type(ingredients_list))
         return {"calories": 0.0, "protein_g": 0.0, "carb_g": 0.0, "fat_g": 0.0, "micros": {}}
-    app.logger.debug(f"NUTR_CALC_DEBUG (calculate_total_nutritional_info): Type is OK for ingredients_list: {type(ingredients_list)}")
-    
-    app.logger.debug(f"NUTR_CALC_DEBUG (calculate_total_nutritional_info): Calculating for ingredients_list: {ingredients_list}")
+    app.logger.debug("NUTR_CALC_DEBUG (calculate_total_nutritional_info): Calculating for %d ingredients: %s", len(ingredients_list), ingredients_list)
+    items_to_calculate = [] # (nombre, cantidad, unidad) para el cálculo por lotes
     for ingredient in ingredients_list: # Corregido: ingredient_data -> ingredient
         if isinstance(ingredient, dict): # Nueva estructura esperada
             # Usar 'parsed_item_name' para la búsqueda, y 'quantity', 'unit' que vienen del frontend/guardado.
             # 'original_description' es solo para mostrar al usuario.
             item_name_to_search = ingredient.get('parsed_item_name')
-            original_desc_for_log = ingredient.get('original_description', item_name_to_search)
             quantity_str = ingredient.get('quantity')
             unit = ingredient.get('unit')
             
@@ -1403,9 +1311,22 @@ def calculate_total_nutritional_info(ingredients_list):
             except (ValueError, TypeError): quantity = 0.0
 
             if not item_name_to_search: # Si parsed_item_name está vacío, no podemos buscar
-                app.logger.warning(f"NUTR_CALC_DEBUG: 'parsed_item_name' faltante o vacío para el ingrediente: {ingredient}. Saltando.")
+                app.logger.warning("NUTR_CALC_DEBUG: 'parsed_item_name' faltante o vacío para el ingrediente: %s. Saltando.", ingredient)
                 continue
-            nutri_info = get_ingredient_nutritional_info(item_name_to_search, quantity, unit)
+            items_to_calculate.append((item_name_to_search, quantity, unit))
+        else:
+            app.logger.error("NUTR_CALC_DEBUG (calculate_total_nutritional_info): Elemento inesperado en ingredients_list (no es dict): %s", ingredient)
+
+    matrix = get_nutrient_matrix()
+    if matrix is not None:
+        matrix_totals = _calculate_totals_with_matrix(matrix, items_to_calculate)
+        total_calories = matrix_totals["calories"]
+        total_protein_g = matrix_totals["protein_g"]
+        total_carb_g = matrix_totals["carb_g"]
+        total_fat_g = matrix_totals["fat_g"]
+        total_micros = matrix_totals["micros"]
+    else: # Sin numpy: suma ingrediente por ingrediente
+        for nutri_info in get_ingredients_nutritional_info_batch(items_to_calculate):
             total_calories += nutri_info.get("calories", 0.0)
             total_protein_g += nutri_info.get("protein_g", 0.0)
             total_carb_g += nutri_info.get("carb_g", 0.0)
@@ -1416,8 +1337,6 @@ def calculate_total_nutritional_info(ingredients_list):
                     total_micros[micro_key] = total_micros.get(micro_key, 0.0) + micro_value
                 else: # If not numeric, just store/overwrite
                     total_micros[micro_key] = micro_value
-        else:
-            app.logger.error(f"NUTR_CALC_DEBUG (calculate_total_nutritional_info): Elemento inesperado en ingredients_list (no es dict): {ingredient}")
 
 
     final_totals = {
@@ -1427,33 +1346,27 @@ def calculate_total_nutritional_info(ingredients_list):
         "fat_g": round(total_fat_g, 2),
         "micros": total_micros 
     }
-    app.logger.debug(f"NUTR_CALC_DEBUG (calculate_total_nutritional_info): Final totals: Cal={final_totals['calories']}, P={final_totals['protein_g']}, C={final_totals['carb_g']}, F={final_totals['fat_g']}")
+    app.logger.debug("NUTR_CALC_DEBUG totals: cal=%s p=%s c=%s f=%s",
+                     final_totals['calories'], final_totals['protein_g'], final_totals['carb_g'], final_totals['fat_g'])
     return final_totals
 
 # Helper function to format base_foods for the prompt
 # Defined at module level to ensure it's available when generar_estructura_plan_prompt is called.
 def format_base_foods_for_prompt(base_foods_list):
-    if not base_foods_list:
+    """Una línea "nombre: ingredientes" por preparación (sin repetidos); las que solo traen nombre van juntas."""
+    preparaciones = compact_base_foods(base_foods_list)
+    if not preparaciones:
         return "Ninguna especificada."
-    
-    formatted_string = ""
-    for prep_data in base_foods_list:
-        if isinstance(prep_data, dict): # Assumes the new detailed format
-            name = prep_data.get('name', 'Preparación sin nombre')
-            original_ingredients = prep_data.get('original_ingredients', [])
-            ingredients_str_parts = []
-            if original_ingredients:
-                for ing in original_ingredients: # ing is expected to be like {'item': 'nombre_ingrediente'}
-                    item_name = ing.get('item', 'N/A')
-                    ingredients_str_parts.append(item_name)
-                ingredients_desc = f" (Ingredientes base originales: {', '.join(ingredients_str_parts)})" if ingredients_str_parts else ""
-            else:
-                ingredients_desc = " (Ingredientes originales no detallados)"
-            formatted_string += f"*   **{name}**{ingredients_desc}\n"
-        elif isinstance(prep_data, str): # Maintains compatibility if only the name is sent
-            formatted_string += f"*   **{prep_data}** (Ingredientes originales no detallados)\n"
-            
-    return formatted_string.strip() if formatted_string else "Ninguna especificada."
+    # Los nombres de ingredientes de la BD llevan comas ("Huevo, entero, crudo"): se separan con ";"
+    lineas = [f"* {name}: {'; '.join(items)}" for name, items in preparaciones if items]
+    solo_nombres = [name for name, items in preparaciones if not items]
+    if solo_nombres:
+        lineas.append(f"* {', '.join(solo_nombres)} (ingredientes no detallados)")
+    return "\n".join(lineas)
+
+def _diet_type_for_prompt(plan_input_data):
+    """Tipo de dieta del plan, compartido por los prompts de estructura y de recetas."""
+    return plan_input_data.get('other_diet_type_text') or plan_input_data.get('diet_type') or "General saludable"
 
 def generar_estructura_plan_prompt(plan_input_data):
     """Prepara el prompt para generar la ESTRUCTURA del plan nutricional."""
@@ -1470,11 +1383,7 @@ def generar_estructura_plan_prompt(plan_input_data):
     preferences_str = ', '.join(plan_input_data.get('preferences', [])) or 'Ninguna especificada'
     aversions_str = ', '.join(plan_input_data.get('aversions', [])) or 'Ninguna especificada'
     
-    diet_type_str = plan_input_data.get('diet_type')
-    if plan_input_data.get('other_diet_type_text'):
-        diet_type_str = plan_input_data.get('other_diet_type_text')
-    if not diet_type_str:
-        diet_type_str = "General saludable"
+    diet_type_str = _diet_type_for_prompt(plan_input_data)
 
     # --- Sección para identificar restricciones críticas por patología ---
     critical_dietary_restrictions_notes = []
@@ -1513,6 +1422,31 @@ def generar_estructura_plan_prompt(plan_input_data):
     else:
         gestational_age_display = f"{gestational_age_prompt} semanas"
 
+    # Solo se envían las medidas e índices conocidos (sin líneas "N/A")
+    perimetros_str = join_known([('P. Muñeca', plan_input_data.get('wrist_circumference_cm')),
+                                 ('P. Cintura', plan_input_data.get('waist_circumference_cm')),
+                                 ('P. Cadera', plan_input_data.get('hip_circumference_cm'))], {
+                                     'P. Muñeca': ' cm', 'P. Cintura': ' cm', 'P. Cadera': ' cm'})
+    indices = []
+    for etiqueta, valor, riesgo in (('IMC', 'calculated_imc', 'imc_risk'), ('ICC', 'calculated_waist_hip_ratio', 'whr_risk'),
+                                    ('ICA', 'calculated_waist_height_ratio', 'whtr_risk')):
+        if not is_empty(plan_input_data.get(valor)):
+            riesgo_str = '' if is_empty(plan_input_data.get(riesgo)) else f" (Riesgo: {plan_input_data.get(riesgo)})"
+            indices.append(f"{etiqueta}: {plan_input_data.get(valor)}{riesgo_str}")
+    if not is_empty(plan_input_data.get('calculated_ideal_weight')):
+        indices.append(f"Peso Ideal (Est.): {plan_input_data.get('calculated_ideal_weight')} kg")
+    medidas_opcionales = "".join(f"\n    * {linea}" for linea in (perimetros_str, '; '.join(indices)) if linea)
+    objetivos_str = join_known([('Objetivo Peso', plan_input_data.get('target_weight')),
+                                ('Objetivo Cintura', plan_input_data.get('target_waist_cm'))],
+                               {'Objetivo Peso': ' kg', 'Objetivo Cintura': ' cm'}) or 'Objetivo Peso: N/A'
+    # Condiciones de textura ya listadas en la Sección C, citadas como ejemplo en la Sección G
+    condiciones_textura = [plan_input_data.get('postoperative_text')] + [
+        p for p in plan_input_data.get('pathologies', [])
+        if 'deglutorio' in p.lower() or 'gastrectomía' in p.lower() or 'intestino corto' in p.lower()]
+    condiciones_textura = [c for c in condiciones_textura if not is_empty(c)]
+    ejemplos_textura = ', '.join(f'"{c}"' for c in condiciones_textura)
+    ejemplos_textura = f" (ej. {ejemplos_textura})" if ejemplos_textura else ""
+
     prompt = f"""
     Eres un asistente experto en nutrición clínica altamente capacitado. Tu tarea es generar un BORRADOR de la ESTRUCTURA de un plan nutricional SEMANAL DETALLADO y PERSONALIZADO para ser utilizado y modificado por un Licenciado en Nutrición.
     El plan debe basarse estrictamente en la siguiente información integral. Sé preciso, claro y considera TODAS las variables.
@@ -1524,12 +1458,7 @@ def generar_estructura_plan_prompt(plan_input_data):
     * Edad Gestacional: {gestational_age_display}
 
     **B. ANTROPOMETRÍA (Consulta):**
-    * Altura: {plan_input_data.get('height_cm', 'N/A')} cm; Peso Actual: {plan_input_data.get('weight_at_plan', 'N/A')} kg
-    * P. Muñeca: {plan_input_data.get('wrist_circumference_cm', 'N/A')} cm; P. Cintura: {plan_input_data.get('waist_circumference_cm', 'N/A')} cm; P. Cadera: {plan_input_data.get('hip_circumference_cm', 'N/A')} cm
-    * IMC: {plan_input_data.get('calculated_imc', 'N/A')} (Riesgo: {plan_input_data.get('imc_risk', 'N/A')})
-    * ICC: {plan_input_data.get('calculated_waist_hip_ratio', 'N/A')} (Riesgo: {plan_input_data.get('whr_risk', 'N/A')})
-    * ICA: {plan_input_data.get('calculated_waist_height_ratio', 'N/A')} (Riesgo: {plan_input_data.get('whtr_risk', 'N/A')})
-    * Peso Ideal (Est.): {plan_input_data.get('calculated_ideal_weight', 'N/A')} kg
+    * Altura: {plan_input_data.get('height_cm', 'N/A')} cm; Peso Actual: {plan_input_data.get('weight_at_plan', 'N/A')} kg{medidas_opcionales}
     * **GET (Gasto Energético Total Estimado): {plan_input_data.get('calculated_calories', 'N/A')} kcal (TMB: {plan_input_data.get('tmb', 'N/A')} kcal, Factor Act: {plan_input_data.get('activity_factor', 'N/A')}) - ¡ESTE ES EL OBJETIVO CALÓRICO DIARIO ESTRICTO DEL PLAN!**
 
     **C. CONDICIONES CLÍNICAS Y CONTEXTO:**
@@ -1540,7 +1469,7 @@ def generar_estructura_plan_prompt(plan_input_data):
 
     **D. DIETA Y OBJETIVOS:**
     * **Tipo Dieta Base (GUÍA PRINCIPAL Y OBLIGATORIA): {diet_type_str}** - El plan DEBE reflejar fielmente los principios, alimentos, métodos de cocción y combinaciones típicas de esta dieta en TODAS las comidas. **Las sugerencias de comidas deben ser ejemplos característicos, VARIADOS y apetecibles de la gastronomía asociada a este tipo de dieta. EVITA ABSOLUTAMENTE sugerencias de comidas que, aunque nutricionalmente puedan ser completas, resulten extrañas, poco palatables o no tengan lógica culinaria dentro del contexto de una alimentación normal y placentera.**
-    * Objetivo Peso: {plan_input_data.get('target_weight', 'N/A')} kg; Objetivo Cintura: {plan_input_data.get('target_waist_cm', 'N/A')} cm
+    * {objetivos_str}
     * **Macros Objetivo (DISTRIBUCIÓN ESTRICTA): {macros_obj}** - La ingesta diaria debe cumplir esta distribución porcentual de macronutrientes. 
     * **NOTA SOBRE MACROS Y ACTIVIDAD FÍSICA:** Si el paciente realiza actividad física regular (Factor Actividad > 1.3), asegurar un aporte de carbohidratos de al menos 3-5 g/kg de peso corporal actual/día, a menos que una restricción crítica por patología (Sección H) o un tipo de dieta explícitamente bajo en carbohidratos (ej. cetogénica) lo impida. Si se especifica "Dieta Hiperproteica", el objetivo es 1.8-2.2 g de proteína/kg de peso objetivo/día, pero balanceado con el mínimo de carbohidratos mencionado y grasas saludables para alcanzar el GET.
 
@@ -1551,12 +1480,12 @@ def generar_estructura_plan_prompt(plan_input_data):
     * Colesterol: {plan_input_data.get('micronutrients',{}).get('cholesterol_mg','N/A')} mg (LÍMITE MÁXIMO DIARIO TOTAL)
     * **NOTA CRÍTICA:** Es IMPERATIVO que el contenido total diario de Potasio, Sodio y Colesterol del plan NO EXCEDA los límites máximos especificados. Selecciona alimentos y ajusta cantidades meticulosamente para cumplir estos límites.
 
-    **F. PREPARACIONES SUGERIDAS POR EL USUARIO (Intentar incluir algunas, adaptando cantidades):**
+    **F. PREPARACIONES SUGERIDAS POR EL USUARIO (nombre: ingredientes base originales; intentar incluir algunas, adaptando cantidades):**
     {format_base_foods_for_prompt(plan_input_data.get('base_foods',[]))}
     **(Estas son preparaciones de preferencia del usuario. Si las incluyes, intenta mantener la ESENCIA de sus ingredientes originales listados, pero DEBES AJUSTAR LAS CANTIDADES de cada ingrediente para que el plato final y el día completo cumplan ESTRICTAMENTE con los objetivos calóricos (Sección B), de macronutrientes (Sección D) y micronutrientes (Sección E) del paciente. No te limites solo a estas preparaciones; el plan debe ser variado.)**
 
     **G. CONSIDERACIONES ESPECIALES DE TEXTURA Y CONSISTENCIA (SI APLICA):**
-    Si se indican patologías como "Trastorno Deglutorio", "Intestino Corto" o condiciones postoperatorias que requieran modificaciones de textura (ej. "{plan_input_data.get('postoperative_text', 'N/A')}", "{', '.join([p for p in plan_input_data.get('pathologies', []) if 'deglutorio' in p.lower() or 'gastrectomía' in p.lower() or 'intestino corto' in p.lower()])}"), TODAS las comidas (incluyendo desayunos y colaciones) deben ser de consistencia blanda, puré, o líquida según sea apropiado para la condición. Para "Intestino Corto", además de la textura, considera comidas más pequeñas y frecuentes si es necesario, y una buena hidratación.
+    Si se indican patologías como "Trastorno Deglutorio", "Intestino Corto" o condiciones postoperatorias que requieran modificaciones de textura{ejemplos_textura}, TODAS las comidas (incluyendo desayunos y colaciones) deben ser de consistencia blanda, puré, o líquida según sea apropiado para la condición. Para "Intestino Corto", además de la textura, considera comidas más pequeñas y frecuentes si es necesario, y una buena hidratación.
     **IMPORTANTE PARA TEXTURAS MODIFICADAS Y CONDICIONES COMPLEJAS:** Aunque la textura deba ser modificada o haya condiciones como "Intestino Corto" o "Diabetes Gestacional", es ABSOLUTAMENTE CRÍTICO que el plan CUMPLA con el GET (Gasto Energético Total Estimado - Sección B) y la distribución de MACROS OBJETIVO (Sección D).
         *   **PRIORIDAD ABSOLUTA AL GET Y MACROS:** Ajusta las cantidades de los ingredientes en las preparaciones (incluso si son blandas o purés) para alcanzar el GET diario. Esto es más importante que mantener porciones pequeñas si el GET no se cumple.
         *   Para lograr esto con texturas blandas/puré:
@@ -1595,17 +1524,31 @@ def generar_estructura_plan_prompt(plan_input_data):
     
     **Genera el BORRADOR de la ESTRUCTURA del plan nutricional semanal ahora, siguiendo TODAS estas instrucciones al pie de la letra. La PRIORIDAD NÚMERO UNO es alcanzar el GET (Sección B). Presta MÁXIMA ATENCIÓN a la Sección H (Restricciones Críticas por Patología) si está presente, ya que sus directrices anulan cualquier otra instrucción conflictiva. Luego, enfócate en el cumplimiento ESTRICTO de los objetivos de macronutrientes (Sección D o H, considerando la nota sobre actividad física), las restricciones de micronutrientes (Sección E), las consideraciones de textura (Sección G), la variedad de platos (incluyendo frutas y verduras diversas), y la eliminación total de cualquier texto que no sea el plan de comidas.**
     """
-    return prompt
+    return compact_prompt(prompt)
 
-def generar_recetas_detalladas_prompt(lista_nombres_platos_con_numero, plan_input_data):
-    """Prepara el prompt para generar las RECETAS DETALLADAS."""
+# Máximo de ingredientes de la BD listados en cada lote de recetas
+MAX_INGREDIENTES_PROMPT_RECETAS = 300
+
+def _available_ingredient_names_for_prompt():
+    """Nombres de todos los ingredientes de la BD; cada lote de recetas lista solo los relacionados con sus platos."""
+    try:
+        available_ingredients_from_db = [name for (name,) in db.session.query(Ingredient.name).order_by(Ingredient.name)]
+        app.logger.info(f"Se obtuvieron {len(available_ingredients_from_db)} nombres de ingredientes de la BD para el prompt de recetas.")
+        return available_ingredients_from_db
+    except Exception as e:
+        app.logger.error(f"Error al obtener ingredientes de la BD para el prompt: {e}")
+        return []
+
+def generar_recetas_detalladas_prompt(lista_nombres_platos_con_numero, plan_input_data, available_ingredients_from_db=None):
+    """
+    Prepara el prompt para generar las RECETAS DETALLADAS.
+    `available_ingredients_from_db` permite reutilizar la lista de ingredientes entre lotes; si es None se consulta la BD.
+    Del contexto del paciente, el lote solo recibe lo que restringe las recetas (tipo de dieta y alergias); de la lista
+    de ingredientes, solo los que comparten una palabra con sus platos (ver relevant_ingredient_names).
+    """
     
     allergies_str = ', '.join(plan_input_data.get('allergies', [])) or 'Ninguna conocida'
-    diet_type_str = plan_input_data.get('diet_type')
-    if plan_input_data.get('other_diet_type_text'):
-        diet_type_str = plan_input_data.get('other_diet_type_text')
-    if not diet_type_str:
-        diet_type_str = "General saludable"
+    diet_type_str = _diet_type_for_prompt(plan_input_data)
 
     platos_para_prompt = ""
     for numero_receta, nombre_plato in lista_nombres_platos_con_numero:
@@ -1613,14 +1556,11 @@ def generar_recetas_detalladas_prompt(lista_nombres_platos_con_numero, plan_inpu
 
     # Obtener una lista de nombres de ingredientes de la base de datos
     # Podrías hacer esto más selectivo si la lista es demasiado grande (ej. los más comunes, o por categoría)
-    available_ingredients_from_db = []
-    try:
-        # Tomar solo los primeros N para no hacer el prompt demasiado largo, o filtrar por relevancia
-        ingredients_db_objects = Ingredient.query.order_by(Ingredient.name).limit(300).all() # Limitar para no exceder el prompt
-        available_ingredients_from_db = [ing.name for ing in ingredients_db_objects]
-        app.logger.info(f"Se obtuvieron {len(available_ingredients_from_db)} nombres de ingredientes de la BD para el prompt de recetas.")
-    except Exception as e:
-        app.logger.error(f"Error al obtener ingredientes de la BD para el prompt: {e}")
+    if available_ingredients_from_db is None:
+        available_ingredients_from_db = _available_ingredient_names_for_prompt()
+    available_ingredients_from_db = relevant_ingredient_names(
+        available_ingredients_from_db, [nombre_plato for _, nombre_plato in lista_nombres_platos_con_numero],
+        limit=MAX_INGREDIENTES_PROMPT_RECETAS)
 
     prompt = f"""
     Eres un asistente experto en nutrición clínica altamente capacitado. Tu tarea es generar las RECETAS DETALLADAS para una lista de platos, destinadas a un Licenciado en Nutrición.
@@ -1629,8 +1569,8 @@ def generar_recetas_detalladas_prompt(lista_nombres_platos_con_numero, plan_inpu
     *   **Tipo de Dieta Base OBLIGATORIA:** {diet_type_str}
     *   **Alergias a EVITAR ESTRICTAMENTE (incluyendo derivados y sinónimos):** {allergies_str}
 
-    **LISTA DE INGREDIENTES DISPONIBLES (Prioriza su uso exacto o muy similar):**
-    {', '.join(available_ingredients_from_db) if available_ingredients_from_db else "No hay lista específica, usa ingredientes comunes y apropiados."}
+    **LISTA DE INGREDIENTES DISPONIBLES (Prioriza su uso exacto o muy similar; "Base (variante / variante)" agrupa las variantes de un mismo alimento):**
+    {group_ingredient_names(available_ingredients_from_db) if available_ingredients_from_db else "No hay lista específica, usa ingredientes comunes y apropiados."}
     **(Si un ingrediente de la lista es muy específico, como 'Arroz, grano, blanco, pulido, crudo', puedes usar una forma más común como 'Arroz blanco crudo' en la receta, pero intenta que el nombre base del alimento coincida con alguno de la lista).**
 
     **INSTRUCCIONES PARA LA GENERACIÓN DE RECETAS:**
@@ -1662,7 +1602,7 @@ def generar_recetas_detalladas_prompt(lista_nombres_platos_con_numero, plan_inpu
 
     **Genera el RECETARIO DETALLADO ahora, siguiendo TODAS estas instrucciones al pie de la letra. Asegúrate de generar una receta para CADA plato listado y de eliminar cualquier texto superfluo.**
     """
-    return prompt
+    return compact_prompt(prompt)
 
 def extraer_nombres_de_recetas(texto_plan_estructura):
     """Extrae los nombres de los platos y sus números de receta del plan estructurado."""
@@ -1681,14 +1621,228 @@ def extraer_nombres_de_recetas(texto_plan_estructura):
     app.logger.info(f"Recetas extraídas para desarrollo: {lista_final_recetas}")
     return lista_final_recetas
 
-def generar_plan_nutricional_v2(plan_input_data):
-    """Genera plan nutricional completo en dos pasos: estructura y luego recetas."""
-    if not app.config['GEMINI_API_KEY']:
+# Caché de respuestas de Gemini por contenido (modelo + configuración + prompt); ver backend/plan_cache.py
+plan_cache = PlanCache(
+    app.config.get('PLAN_CACHE_DIR'),
+    ttl_seconds=app.config.get('PLAN_CACHE_TTL_SECONDS'),
+    max_entries=app.config.get('PLAN_CACHE_MAX_ENTRIES'),
+    max_bytes=app.config.get('PLAN_CACHE_MAX_BYTES'),
+)
+
+# Configuración fija de las llamadas a Gemini
+GEMINI_GENERATION_PARAMS = dict(
+    temperature=0.7, 
+    top_p=0.9,       
+    top_k=40,        
+    max_output_tokens=8000 # Aumentado para permitir planes más largos
+)
+GEMINI_SAFETY_SETTINGS = [{"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}, {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}, {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}, {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}]
+
+# Backends ya creados, por configuración: el modelo y el plan grabado se preparan una sola vez
+_backends_llm = {}
+_backends_llm_lock = threading.Lock()
+
+def crear_backend_llm():
+    """
+    Backend de generación indicado en LLM_BACKEND (ver backend/llm_backends.py):
+    'gemini' (por defecto) o 'replay', que responde con el plan grabado en LLM_REPLAY_FIXTURE
+    tras la latencia configurada, sin red ni tokens (pruebas de carga, ver load_test_plan.py).
+    Se reutiliza mientras no cambie su configuración (o, para 'replay', el archivo grabado).
+    """
+    nombre_backend = (app.config.get('LLM_BACKEND') or 'gemini').lower()
+    if nombre_backend == 'replay':
+        fixture = app.config['LLM_REPLAY_FIXTURE']
+        clave = (nombre_backend, fixture, os.path.getmtime(fixture),
+                 app.config.get('LLM_REPLAY_LATENCY_SECONDS') or 0.0,
+                 app.config.get('LLM_REPLAY_CHARS_PER_SECOND') or None)
+        crear = lambda: ReplayBackend.from_file(fixture, latency_seconds=clave[3], chars_per_second=clave[4])
+    elif nombre_backend == 'gemini':
+        clave = (nombre_backend, app.config.get('GEMINI_MODEL_NAME') or 'gemini-1.5-pro-latest',
+                 bool(app.config.get('GEMINI_EXACT_TOKEN_COUNT')))
+        crear = lambda: GeminiBackend(clave[1], GEMINI_GENERATION_PARAMS, GEMINI_SAFETY_SETTINGS,
+                                      exact_token_count=clave[2])
+    else:
+        raise ValueError(f"LLM_BACKEND desconocido: {nombre_backend}")
+    with _backends_llm_lock:
+        backend = _backends_llm.get(clave)
+        if backend is None:
+            backend = _backends_llm[clave] = crear()
+        return backend
+
+# Latencia, tokens y bloqueos de cada llamada al modelo (ver /metrics/llm)
+llm_metrics = LLMMetrics()
+# Resumen de cada generación (ver GenerationStats), hasta que se guarde con la evaluación: el cliente solo envía el id
+estadisticas_generacion = GenerationStatsStore()
+
+class GeneracionCancelada(Exception):
+    """Quien pidió el plan ya no lo espera (p. ej. cerró la conexión SSE): no se hacen más llamadas al modelo."""
+
+def _comprobar_cancelacion(cancelado):
+    if cancelado is not None and cancelado.is_set():
+        raise GeneracionCancelada()
+
+def _generar_texto_con_cache(llm, prompt, proposito, forzar_regeneracion=False, on_chunk=None, estadisticas=None, cancelado=None):
+    """
+    Genera el texto de `prompt` con el backend `llm`, consultando antes plan_cache.
+    La clave es el hash de llm.cache_context() (modelo, configuración de generación, safety settings) y el prompt.
+    Un acierto no llama al modelo y entrega el texto completo como único fragmento; con `forzar_regeneracion`
+    se ignora la entrada existente y se reemplaza. Solo se guardan respuestas completas (no bloqueadas).
+    Cada llamada se registra en llm_metrics y, si se pasa, en `estadisticas` (GenerationStats del plan).
+    Retorna (texto, razón_bloqueo, mensaje_bloqueo); si la respuesta fue bloqueada, el texto es el parcial (o "").
+    Si `cancelado` (threading.Event) se activa, lanza GeneracionCancelada antes de llamar al modelo o en el
+    siguiente fragmento de la respuesta, que queda sin consumir (y sin guardar en la caché).
+    """
+    def registrar(registro):
+        llm_metrics.record_call(registro)
+        if estadisticas is not None:
+            estadisticas.add_call(registro)
+
+    inicio = time.perf_counter()
+    clave = cache_key(llm.cache_context(), prompt)
+    if not forzar_regeneracion:
+        texto_cacheado = plan_cache.get(clave)
+        if texto_cacheado is not None:
+            app.logger.info("Respuesta de Gemini tomada de la caché de planes: key=%s", clave[:12])
+            if on_chunk:
+                on_chunk(texto_cacheado)
+            registrar(call_record(proposito, time.perf_counter() - inicio, cache_hit=True, prompt_chars=len(prompt)))
+            return texto_cacheado, None, ""
+
+    _comprobar_cancelacion(cancelado)
+    # Tamaño del prompt informado antes de enviarlo (estimado, o exacto con GEMINI_EXACT_TOKEN_COUNT)
+    tokens_prompt = llm.count_tokens(prompt)
+    app.logger.info("Enviando prompt a Gemini: purpose=%s chars=%d tokens=%d", proposito, len(prompt), tokens_prompt)
+    inicio = time.perf_counter()
+
+    primer_fragmento = []
+    def on_chunk_medido(texto):
+        _comprobar_cancelacion(cancelado)
+        if not primer_fragmento:
+            primer_fragmento.append(time.perf_counter() - inicio)
+        if on_chunk:
+            on_chunk(texto)
+
+    try:
+        resultado = llm.generate(prompt, purpose=proposito, on_chunk=on_chunk_medido if on_chunk or cancelado else None)
+    except GeneracionCancelada:
+        app.logger.info("Llamada a Gemini interrumpida: purpose=%s (generación cancelada).", proposito)
+        raise
+    except Exception as e:
+        registrar(call_record(proposito, time.perf_counter() - inicio, error=type(e).__name__, prompt_chars=len(prompt),
+                              prompt_tokens_estimate=tokens_prompt))
+        raise
+    latencia = time.perf_counter() - inicio
+    registro = call_record(proposito, latencia, usage=resultado.usage, block_reason=resultado.block_reason,
+                           partial=bool(resultado.text), first_chunk_seconds=primer_fragmento[0] if primer_fragmento else None,
+                           prompt_chars=len(prompt), prompt_tokens_estimate=tokens_prompt)
+    registrar(registro)
+    app.logger.info("LLM call: purpose=%s latency=%.2fs prompt_tokens=%s output_tokens=%s blocked=%s",
+                    proposito, latencia, registro.get('prompt_tokens'), registro.get('output_tokens'),
+                    resultado.block_reason is not None)
+    if resultado.block_reason is None and resultado.text:
+        plan_cache.put(clave, resultado.text)
+    return resultado.text, resultado.block_reason, resultado.block_message
+
+def _receta_no_generada(numero_receta, nombre_plato):
+    """Bloque de reemplazo para una receta que ningún lote devolvió (se conserva el título para el PDF)."""
+    return (f"Receta {numero_receta}: {nombre_plato}\n"
+            "Preparación:\nNo se pudo generar la receta detallada con IA. Por favor, desarróllala manualmente.")
+
+def generar_recetario_por_lotes(llm, lista_platos_para_recetas, plan_input_data, emit=None, forzar_regeneracion=False, estadisticas=None,
+                                cancelado=None):
+    """
+    Genera el RECETARIO DETALLADO en lotes de GEMINI_RECIPES_PER_BATCH recetas, enviados en paralelo
+    (hasta GEMINI_RECIPE_CONCURRENCY llamadas a la vez). Los recetarios parciales se reensamblan
+    ordenados por número de receta. Lotes más chicos también evitan que se corte la respuesta
+    por el límite de tokens de salida.
+    Con `emit(evento, datos)` se emite 'recipes_start', un evento 'recipes' por fragmento de cada lote
+    y 'recipes_batch_done' {batch} cuando termina cada lote.
+    Cada lote se busca primero en plan_cache (ver _generar_texto_con_cache).
+    Con `cancelado` activado, los lotes que no empezaron no llaman al modelo y los que están en curso se cortan.
+    """
+    lotes = make_batches(lista_platos_para_recetas, app.config.get('GEMINI_RECIPES_PER_BATCH') or 3)
+    # Los prompts se arman en este hilo (consultan la BD); los hilos del pool solo llaman a Gemini
+    ingredientes_para_prompt = _available_ingredient_names_for_prompt()
+    prompts = [generar_recetas_detalladas_prompt(lote, plan_input_data, ingredientes_para_prompt) for lote in lotes]
+    app.logger.info(f"Enviando {len(prompts)} lotes de RECETAS DETALLADAS ({len(lista_platos_para_recetas)} recetas) a Gemini.")
+    if emit:
+        emit('recipes_start', {'batches': len(prompts), 'recipes': len(lista_platos_para_recetas)})
+
+    def generar_lote(indice_y_prompt):
+        indice, prompt_lote = indice_y_prompt
+        try:
+            return _generar_lote(indice, prompt_lote)
+        finally:
+            if emit:
+                emit('recipes_batch_done', {'batch': indice})
+
+    def _generar_lote(indice, prompt_lote):
+        on_chunk = (lambda texto: emit('recipes', {'batch': indice, 'text': texto})) if emit else None
+        try:
+            texto, reason_value, reason_message = _generar_texto_con_cache(
+                llm, prompt_lote, PURPOSE_RECIPES, forzar_regeneracion=forzar_regeneracion, on_chunk=on_chunk,
+                estadisticas=estadisticas, cancelado=cancelado)
+        except GeneracionCancelada:
+            return None, None
+        except Exception as e:
+            app.logger.error(f"Error inesperado llamando a Gemini para RECETAS (lote {indice + 1}/{len(prompts)}): {e}", exc_info=True)
+            return None, None
+        if reason_value is not None:
+            if texto:
+                app.logger.warning(f"Respuesta de RECETAS Gemini bloqueada en lote {indice + 1} (Razón: {reason_value} - {reason_message}). Usando texto parcial: {texto[:100]}...")
+            else:
+                app.logger.error(f"Respuesta de RECETAS Gemini bloqueada o vacía en lote {indice + 1}. Razón: {reason_value} - {reason_message}.")
+                return None, f"{reason_value} - {reason_message}"
+        app.logger.info(f"Lote {indice + 1}/{len(prompts)} de RECETAS DETALLADAS recibido de Gemini.")
+        return texto, None
+
+    resultados = map_concurrently(generar_lote, list(enumerate(prompts)), app.config.get('GEMINI_RECIPE_CONCURRENCY') or 4)
+    _comprobar_cancelacion(cancelado)
+    textos_lotes = [texto for texto, _ in resultados]
+
+    if not any(textos_lotes):
+        razones_bloqueo = [razon for _, razon in resultados if razon]
+        if razones_bloqueo:
+            return f"\n\n---\nError: La IA bloqueó la generación de recetas detalladas (Razón: {razones_bloqueo[0]}). Por favor, desarróllalas manualmente."
+        return "\n\n---\nError inesperado al generar recetas detalladas con IA. Por favor, desarróllalas manualmente."
+
+    texto_recetario, faltantes = assemble_recetario(textos_lotes, lista_platos_para_recetas, placeholder=_receta_no_generada)
+    if faltantes:
+        app.logger.warning(f"Recetas sin desarrollar tras generar por lotes: {faltantes}")
+    app.logger.info("Texto de RECETARIO DETALLADO obtenido.")
+    return texto_recetario
+
+def generar_plan_nutricional_v2(plan_input_data, emit=None, forzar_regeneracion=False, estadisticas=None, cancelado=None):
+    """
+    Genera el plan (ver _generar_plan_nutricional_v2) y registra en llm_metrics su duración y cantidad de recetas.
+    `estadisticas` (GenerationStats) acumula las llamadas al modelo de este plan, para guardarlas con la evaluación.
+    Si `cancelado` (threading.Event) se activa, deja de llamar al modelo y retorna un texto "Error: ...".
+    """
+    estadisticas = estadisticas if estadisticas is not None else GenerationStats()
+    try:
+        plan = _generar_plan_nutricional_v2(plan_input_data, emit, forzar_regeneracion, estadisticas, cancelado)
+    except GeneracionCancelada:
+        app.logger.info("Generación del plan cancelada tras %.2fs.", estadisticas.elapsed())
+        return "Error: Generación del plan cancelada."
+    resumen = estadisticas.summary()
+    llm_metrics.record_plan(estadisticas.recipes or 0, estadisticas.elapsed(), ok=not plan.startswith("Error:"))
+    app.logger.info("Plan generation: seconds=%.2f model_calls=%d cache_hits=%d recipes=%s prompt_tokens=%d output_tokens=%d",
+                    resumen['elapsed_seconds'], resumen['model_calls'], resumen['cache_hits'], resumen['recipes'],
+                    resumen['prompt_tokens'], resumen['output_tokens'])
+    return plan
+
+def _generar_plan_nutricional_v2(plan_input_data, emit, forzar_regeneracion, estadisticas, cancelado=None):
+    """
+    Genera plan nutricional completo en dos pasos: estructura y luego recetas (en lotes paralelos).
+    Si se pasa `emit(evento, datos)`, las respuestas de Gemini se piden en streaming y se emiten
+    eventos 'structure' y 'recipes' con cada fragmento (ver /generar_plan/jobs/<job_id>/stream).
+    Las respuestas se reutilizan desde plan_cache si los prompts no cambiaron, salvo con `forzar_regeneracion`.
+    """
+    if (app.config.get('LLM_BACKEND') or 'gemini').lower() == 'gemini' and not app.config['GEMINI_API_KEY']:
         return "Error: API Key de Gemini no configurada."
 
-    model_name = 'gemini-1.5-pro-latest'
     try:
-        model = genai.GenerativeModel(model_name)
+        llm = crear_backend_llm()
     except Exception as model_error:
         app.logger.error(f"ERROR: Creando modelo Gemini: {model_error}")
         return "Error: Inicializando modelo IA."
@@ -1696,94 +1850,43 @@ def generar_plan_nutricional_v2(plan_input_data):
     # --- PASO 1: Generar la ESTRUCTURA del Plan ---
     prompt_estructura = generar_estructura_plan_prompt(plan_input_data)
     app.logger.info("Enviando prompt para ESTRUCTURA del plan a Gemini.")
-    
-    safety_settings=[{"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}, {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}, {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}, {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"}]
-    generation_config = genai.types.GenerationConfig(
-        temperature=0.7, 
-        top_p=0.9,       
-        top_k=40,        
-        max_output_tokens=8000 # Aumentado para permitir planes más largos
-    )
 
     texto_plan_estructura = ""
     try:
-        response_estructura = model.generate_content(
-            prompt_estructura, 
-            generation_config=generation_config,
-            safety_settings=safety_settings
-        )
+        on_chunk = (lambda texto: emit('structure', {'text': texto})) if emit else None
+        texto_plan_estructura, reason_value, reason_message = _generar_texto_con_cache(
+            llm, prompt_estructura, PURPOSE_STRUCTURE, forzar_regeneracion=forzar_regeneracion, on_chunk=on_chunk,
+            estadisticas=estadisticas, cancelado=cancelado)
         app.logger.info("Respuesta de ESTRUCTURA recibida de Gemini.")
         
-        if not response_estructura.parts:
-            block_reason_attr = getattr(response_estructura, 'prompt_feedback', None)
-            reason_value = getattr(block_reason_attr, 'block_reason', "Razón desconocida")
-            reason_message = getattr(block_reason_attr, 'block_reason_message', "")
-            
-            partial_text = ""
-            if hasattr(response_estructura, 'candidates') and response_estructura.candidates:
-                candidate = response_estructura.candidates[0]
-                if hasattr(candidate, 'content') and candidate.content.parts:
-                    partial_text = candidate.content.parts[0].text
-            
-            if partial_text:
-                app.logger.warning(f"Respuesta de ESTRUCTURA Gemini bloqueada (Razón: {reason_value} - {reason_message}). Usando texto parcial: {partial_text[:100]}...")
-                texto_plan_estructura = partial_text
+        if reason_value is not None:
+            if texto_plan_estructura:
+                app.logger.warning(f"Respuesta de ESTRUCTURA Gemini bloqueada (Razón: {reason_value} - {reason_message}). Usando texto parcial: {texto_plan_estructura[:100]}...")
             else:
                 app.logger.error(f"Respuesta de ESTRUCTURA Gemini bloqueada o vacía. Razón: {reason_value} - {reason_message}")
                 return f"Error: La IA bloqueó la respuesta para la estructura del plan (Razón: {reason_value} - {reason_message})."
         else:
-            texto_plan_estructura = response_estructura.text
             app.logger.info("Texto de ESTRUCTURA del plan obtenido.")
 
+    except GeneracionCancelada:
+        raise
     except Exception as e:
         app.logger.error(f"Error llamando a Gemini para ESTRUCTURA: {e}", exc_info=True)
         return "Error inesperado al generar estructura del plan con IA."
 
-    # --- PASO 2: Extraer nombres de recetas y generar RECETAS DETALLADAS ---
+    # --- PASO 2: Extraer nombres de recetas y generar RECETAS DETALLADAS (lotes en paralelo) ---
     lista_platos_para_recetas = extraer_nombres_de_recetas(texto_plan_estructura)
+    estadisticas.recipes = len(lista_platos_para_recetas)
 
     if not lista_platos_para_recetas:
         app.logger.warning("No se encontraron referencias a recetas (Ver Receta N°X) en la estructura del plan. No se generarán recetas detalladas.")
-        # Aún así, proceder a generar la sección de recetas, pero con una lista vacía,
-        # para que el marcador "== RECETARIO DETALLADO ==" se incluya.
-        prompt_recetas = generar_recetas_detalladas_prompt([], plan_input_data) 
+        # Se incluye igualmente el marcador "== RECETARIO DETALLADO ==" (sin llamar a Gemini)
+        texto_recetario_detallado = RECETARIO_MARKER + "\n"
     else:
-        prompt_recetas = generar_recetas_detalladas_prompt(lista_platos_para_recetas, plan_input_data)
-    app.logger.info(f"Enviando prompt para RECETAS DETALLADAS ({len(lista_platos_para_recetas)} recetas) a Gemini.")
-    
-    texto_recetario_detallado = ""
-    try:
-        response_recetas = model.generate_content(
-            prompt_recetas, 
-            generation_config=generation_config, # Reutilizar config o ajustar si es necesario
-            safety_settings=safety_settings
+        texto_recetario_detallado = generar_recetario_por_lotes(
+            llm, lista_platos_para_recetas, plan_input_data, emit=emit, forzar_regeneracion=forzar_regeneracion,
+            estadisticas=estadisticas, cancelado=cancelado
         )
-        app.logger.info("Respuesta de RECETAS DETALLADAS recibida de Gemini.")
-
-        if not response_recetas.parts:
-            block_reason_attr = getattr(response_recetas, 'prompt_feedback', None)
-            reason_value = getattr(block_reason_attr, 'block_reason', "Razón desconocida")
-            reason_message = getattr(block_reason_attr, 'block_reason_message', "")
-            
-            partial_text_recetas = ""
-            if hasattr(response_recetas, 'candidates') and response_recetas.candidates:
-                candidate = response_recetas.candidates[0]
-                if hasattr(candidate, 'content') and candidate.content.parts:
-                    partial_text_recetas = candidate.content.parts[0].text
-
-            if partial_text_recetas:
-                 app.logger.warning(f"Respuesta de RECETAS Gemini bloqueada (Razón: {reason_value} - {reason_message}). Usando texto parcial de recetas: {partial_text_recetas[:100]}...")
-                 texto_recetario_detallado = partial_text_recetas
-            else:
-                app.logger.error(f"Respuesta de RECETAS Gemini bloqueada o vacía. Razón: {reason_value} - {reason_message}. No se generaron recetas detalladas.")
-                texto_recetario_detallado = f"\n\n---\nError: La IA bloqueó la generación de recetas detalladas (Razón: {reason_value} - {reason_message}). Por favor, desarróllalas manualmente."
-        else:
-            texto_recetario_detallado = response_recetas.text
-            app.logger.info("Texto de RECETARIO DETALLADO obtenido.")
-
-    except Exception as e:
-        app.logger.error(f"Error inesperado llamando a Gemini para RECETAS: {e}", exc_info=True)
-        texto_recetario_detallado = "\n\n---\nError inesperado al generar recetas detalladas con IA. Por favor, desarróllalas manualmente."
 
     # --- PASO 3: Combinar estructura y recetas ---
     plan_completo = texto_plan_estructura + "\n\n" + texto_recetario_detallado
@@ -1798,140 +1901,33 @@ def generar_plan_nutricional_v2(plan_input_data):
 def parse_all_recipes_from_text_block(recetario_text):
     """
     Parses all recipes from the '== RECETARIO DETALLADO ==' text block.
-    Returns a list of parsed recipe dictionaries.
+    Returns a list of parsed recipe dictionaries, read from the memoized index of the block
+    (a single pass over the text; see backend/recipe_index.py).
     """
-    app.logger.debug(f"--- Iniciando parse_all_recipes_from_text_block ---")
     if not recetario_text or recetario_text.strip() == "No se pudieron parsear las recetas detalladas." or "Error:" in recetario_text :
         app.logger.warning("Texto del recetario vacío o con error previo. No se parsearán recetas.")
         return []
 
-    app.logger.debug(f"Texto del recetario recibido (primeros 1000 chars):\n{recetario_text[:1000]}")
     recipes = []
-
-    # Eliminar el marcador inicial si está presente para evitar que interfiera con el primer split
-    clean_recetario_text = re.sub(r"^\s*== RECETARIO DETALLADO ==\s*\n?", "", recetario_text, flags=re.IGNORECASE).strip()
-    if not clean_recetario_text:
-        app.logger.warning("Texto del recetario vacío después de quitar el marcador inicial.")
-        return []
-
-    # Dividir el texto en bloques de recetas individuales.
-    # El lookahead positivo (?=...) asegura que el delimitador "Receta N°X:" se mantenga al inicio de cada bloque subsiguiente.
-    recipe_blocks_raw = re.split(r"\n(?=\s*\**\s*Receta\s*(?:N°|No\.|N\.)?\s*\d+:)", clean_recetario_text, flags=re.IGNORECASE)
-    app.logger.debug(f"Bloques crudos después del split inicial: {len(recipe_blocks_raw)}")
-
-    for i, block_text_raw in enumerate(recipe_blocks_raw):
-        block_text = block_text_raw.strip()
-        if not block_text:
+    for entry in index_recetario(recetario_text):
+        if not entry.title: # Una receta es válida si al menos tiene un nombre
+            app.logger.warning("Receta %s omitida por falta de nombre.", entry.label)
             continue
+        if not entry.ingredient_lines:
+            app.logger.warning("    No se encontró la sección 'Ingredientes:' para %r", entry.title)
+        if not entry.instructions:
+            app.logger.warning("    No se encontró la sección 'Preparación:' para %r", entry.title)
+        recipes.append({
+            'number': f"Receta {entry.label}",
+            'name': entry.title,
+            'servings': entry.servings,
+            'ingredients': [{'raw_line': text} for text in entry.ingredients], # Lista de dicts {'raw_line': '...'}
+            'instructions': entry.instructions,
+            'condiments': entry.condiments,
+            'presentation': entry.presentation
+        })
 
-        app.logger.debug(f"Procesando bloque crudo {i}: '{block_text[:200]}...'")
-
-        # Patrón para capturar el número de receta y el nombre.
-        # Es más robusto si el nombre puede contener saltos de línea antes de las secciones.
-        # Modificado para manejar ** y detenerse antes de "Rinde:" o "Porciones que Rinde:"
-        # Intento 1: Título en una línea, seguido de secciones clave en nuevas líneas.
-        title_match_attempt1 = re.match(
-            r"\**\s*(Receta\s*(?:N°|No\.|N\.)?\s*\d+):\s*([^\n]+?)\s*\**\s*(?=\n\s*(?:Porciones que Rinde:|Rinde:|Ingredientes:|Preparación:)|$)",
-            block_text,
-            re.IGNORECASE | re.DOTALL
-        )
-        title_match = title_match_attempt1
- #
-        if not title_match:
-            # Intento 2: Título más simple que solo toma la primera línea que empieza con "Receta..."
-            title_match_attempt2 = re.match(
-                r"\**\s*(Receta\s*(?:N°|No\.|N\.)?\s*\d+):\s*([^\n]+)",
-                block_text,
-                re.IGNORECASE
-            )
-            title_match = title_match_attempt2
-            if not title_match:
-                app.logger.warning(f"No se pudo parsear el título para el bloque (ambos intentos fallaron): '{block_text[:250]}...'")
-                continue
-        
-        recipe_number_full = title_match.group(1).strip()
-        recipe_name = title_match.group(2).strip().replace('\n', ' ') # Unir nombre si tiene saltos de línea
-        app.logger.debug(f"  Título parseado: {recipe_number_full} - {recipe_name}")
-
-        content_after_title = block_text[title_match.end():].strip()
-        app.logger.debug(f"  Contenido después del título (primeros 100 chars): '{content_after_title[:100]}...'")
-
-        ingredients_list_for_pdf = []
-        instructions_text = ""
-        servings_text = ""
-        condiments_text = ""
-        presentation_text = ""
-
-        servings_match = re.search(r"Porciones que Rinde:\s*(.*?)(?=\n\s*(?:Ingredientes:|Preparación:)|$)", content_after_title, re.DOTALL | re.IGNORECASE)
-        if servings_match:
-            servings_text = servings_match.group(1).strip()
-            app.logger.debug(f"    Porciones: {servings_text}")
-
-        # Regex to capture ingredients. Stops at known section headers OR a line that looks like a sub-recipe title (e.g., "Mayonesa:")
-        # OR a numbered list item (likely start of preparation steps if "Preparación:" was missed) OR end of block.
-        # Lookahead for sub-header: newline, optional spaces, then text ending with colon.
-        ingredients_section_regex = r"Ingredientes\s*(?:\([^)]*\))?:\s*\n((?:.|\n)*?)(?=\n\s*(?:Preparación:|Condimentos Sugeridos:|Sugerencia de Presentación:|[A-ZÁÉÍÓÚÑ][A-Za-zÁÉÍÓÚáéíóúñÑ\s(),'-]*:|\d+\.\s)|$)"
-        
-        ingredients_section_match = re.search(ingredients_section_regex, content_after_title, re.DOTALL | re.IGNORECASE)
-        if ingredients_section_match:
-            ingredients_block_text = ingredients_section_match.group(1).strip()
-            app.logger.debug(f"    Bloque de Ingredientes detectado:\n{ingredients_block_text[:250]}...")
-            current_ingredients = []
-            for line in ingredients_block_text.split('\n'):
-                line = line.strip()
-                if line.startswith(('*', '-', '•')):
-                    ingredient_text_cleaned = line.lstrip('*-• ').strip()
-                    if ingredient_text_cleaned:
-                        # Aquí no llamamos a _parse_ingredient_line, solo guardamos la línea cruda para el PDF
-                        current_ingredients.append({'raw_line': ingredient_text_cleaned})
-                        app.logger.debug(f"      Ingrediente añadido (raw): '{ingredient_text_cleaned}'")
-                elif line: # Considerar líneas que no son viñetas como parte del ingrediente anterior si es multilínea
-                    # Only append if it's a continuation, not a new sub-header or prep step.
-                    is_sub_header_candidate = re.match(r"^\s*[A-Za-zÁÉÍÓÚáéíóúñÑ][A-Za-zÁÉÍÓÚáéíóúñÑ\s(),'-]*:", line)
-                    is_prep_step_candidate = re.match(r"^\s*\d+\.\s+", line)
-
-                    if current_ingredients and 'raw_line' in current_ingredients[-1] and \
-                       not is_sub_header_candidate and not is_prep_step_candidate:
-                        current_ingredients[-1]['raw_line'] += " " + line
-                        app.logger.debug(f"      Línea continuada de ingrediente: '{line}' añadida a '{current_ingredients[-1]['raw_line']}'")
-                    else: 
-                        app.logger.debug(f"      Línea en ingredientes NO reconocida como viñeta o continuación válida: '{line}' (SubHeader: {bool(is_sub_header_candidate)}, PrepStep: {bool(is_prep_step_candidate)})")
-            ingredients_list_for_pdf = current_ingredients
-        else:
-            app.logger.warning(f"    No se encontró la sección 'Ingredientes:' para '{recipe_name}'")
-
-        prep_match = re.search(r"Preparación:\s*\n(.*?)(?=\n\s*(?:Condimentos Sugeridos:|Sugerencia de Presentación:)|$)", content_after_title, re.DOTALL | re.IGNORECASE)
-        if prep_match:
-            instructions_text = prep_match.group(1).strip()
-            app.logger.debug(f"    Preparación (primeros 100 chars): {instructions_text[:100]}...")
-        else:
-            app.logger.warning(f"    No se encontró la sección 'Preparación:' para '{recipe_name}'")
-
-        condiments_match = re.search(r"Condimentos Sugeridos:\s*(.*?)(?=\n\s*(?:Sugerencia de Presentación:)|$)", content_after_title, re.DOTALL | re.IGNORECASE)
-        if condiments_match:
-            condiments_text = condiments_match.group(1).strip()
-            app.logger.debug(f"    Condimentos: {condiments_text[:100]}...")
-
-        presentation_match = re.search(r"Sugerencia de Presentación(?:/Servicio)?:\s*(.*?)(?=\n\nReceta\s*(?:N°|No\.|N\.)?\s*\d+:|$)", content_after_title, re.DOTALL | re.IGNORECASE)
-        if presentation_match:
-            presentation_text = presentation_match.group(1).strip()
-            app.logger.debug(f"    Presentación: {presentation_text[:100]}...")
-
-        if recipe_name: # Una receta es válida si al menos tiene un nombre
-            recipes.append({
-                'number': recipe_number_full,
-                'name': recipe_name,
-                'servings': servings_text,
-                'ingredients': ingredients_list_for_pdf, # Lista de dicts {'raw_line': '...'}
-                'instructions': instructions_text,
-                'condiments': condiments_text,
-                'presentation': presentation_text
-            })
-            app.logger.info(f"Receta '{recipe_name}' parseada y añadida.")
-        else:
-            app.logger.warning(f"Receta omitida por falta de nombre. Bloque: '{block_text[:100]}...'")
-
-    app.logger.debug(f"--- parse_all_recipes_from_text_block finalizado. Recetas parseadas: {len(recipes)} ---")
+    app.logger.info("parse_all_recipes_from_text_block: %d recetas parseadas.", len(recipes))
     return recipes
 
 
@@ -1941,6 +1937,12 @@ def parse_all_recipes_from_text_block(recetario_text):
 
 
 
+def _estructura_plan_para_pdf(evaluation_instance, texto_sin_plan):
+    """Estructura guardada del plan; si la evaluación no tiene texto se arma con el aviso que muestran los PDFs."""
+    if not evaluation_instance.edited_plan_text:
+        return build_plan_structure(texto_sin_plan)
+    return evaluation_instance.get_plan_structure()
+
 # (Función crear_pdf_v2 - CORREGIDA)
 def crear_pdf_v2(evaluation_instance):
     buffer = io.BytesIO()
@@ -2035,43 +2037,32 @@ def crear_pdf_v2(evaluation_instance):
         current_y -= _line_height_for_sections * 0.8
 
         draw_section_title("IV. Plan Semanal Sugerido")
-        full_plan_text = evaluation_instance.edited_plan_text or "Plan no disponible."
-        app.logger.debug(f"PDF_DEBUG (crear_pdf_v2): full_plan_text (primeros 300): '{full_plan_text[:300]}'")
-        recetario_marker = "== RECETARIO DETALLADO =="
-        plan_parts = full_plan_text.split(recetario_marker, 1)
-        plan_structure_text = plan_parts[0].strip()
-        recetario_block_text = plan_parts[1].strip() if len(plan_parts) > 1 else ""
-        app.logger.debug(f"PDF_DEBUG (crear_pdf_v2): plan_structure_text (primeros 300): '{plan_structure_text[:300]}'")
-        app.logger.debug(f"PDF_DEBUG (crear_pdf_v2): recetario_block_text (primeros 300): '{recetario_block_text[:300]}'")
-
-        if plan_structure_text:
-            day_regex_tech = re.compile(r"^\s*\*\*(Lunes|Martes|Miércoles|Jueves|Viernes|Sábado|Domingo)\s*\*\*(?::)?", re.IGNORECASE)
-            meal_regex_tech = re.compile(r"^\s*\*?\s*(Desayuno|Colación Mañana|Almuerzo|Colación Tarde|Cena|Merienda)\s*:\s*", re.IGNORECASE)
-            plan_lines_tech = plan_structure_text.split('\n')
+        # Estructura parseada al guardar (sin regex al generar el PDF)
+        plan_estructura = _estructura_plan_para_pdf(evaluation_instance, "Plan no disponible.")
+        app.logger.debug(f"PDF_DEBUG (crear_pdf_v2): {len(plan_estructura['lines'])} líneas de plan, {len(plan_estructura['recipes'])} recetas")
+
+        if plan_estructura['lines']:
             line_height_tech_ref = 11
 
-            for i_tech, line_raw_tech in enumerate(plan_lines_tech):
-                line_tech = line_raw_tech.strip()
-                if not line_tech:
+            for i_tech, linea_tech in enumerate(plan_estructura['lines']):
+                line_tech = linea_tech['text']
+                if linea_tech['kind'] == LINE_BLANK:
                     current_y -= line_height_tech_ref * 0.5 
                     continue
-                is_day_title_tech = day_regex_tech.match(line_tech)
-                is_meal_title_tech = meal_regex_tech.match(line_tech)
                 font_name_tech = "Helvetica"; font_size_tech = 9.0; indent_tech = 0
                 space_before_tech = 0; line_spacing_mult_tech = 1.2
-                if is_day_title_tech:
+                if linea_tech['kind'] == LINE_DAY:
                     font_name_tech = "Helvetica-Bold"; font_size_tech = 10.0
                     if i_tech > 0: space_before_tech = line_height_tech_ref * 0.9
-                    line_tech = day_regex_tech.sub(r"\1:", line_tech).upper()
+                    line_tech = line_tech.upper()
                     app.logger.debug(f"PDF_DEBUG (crear_pdf_v2): Plan - Día: '{line_tech}'")
-                elif is_meal_title_tech:
+                elif linea_tech['kind'] == LINE_MEAL:
                     font_name_tech = "Helvetica-Bold"; font_size_tech = 9.0; indent_tech = 5
                     space_before_tech = line_height_tech_ref * 0.4
-                    line_tech = meal_regex_tech.sub(r"\1:", line_tech)
                     app.logger.debug(f"PDF_DEBUG (crear_pdf_v2): Plan - Comida: '{line_tech}'")
                 else:
-                    indent_tech = 10; cleaned_line_tech = line_tech.lstrip("*-• ").strip()
-                    line_tech = f"• {cleaned_line_tech}" if cleaned_line_tech else ""
+                    indent_tech = 10
+                    line_tech = f"• {line_tech}" if line_tech else ""
                     line_spacing_mult_tech = 1.15
                     # app.logger.debug(f"PDF_DEBUG (crear_pdf_v2): Plan - Item: '{line_tech}'") # Puede ser muy verboso
                 current_y -= space_before_tech
@@ -2086,11 +2077,11 @@ def crear_pdf_v2(evaluation_instance):
             p.setFont("Helvetica", 9.5) # Asegurar que la fuente se establece antes de llamar a draw_text_block_with_style
             current_y = draw_text_block_with_style(p, current_y, x_margin, max_width, _line_height_for_sections, evaluation_instance.user_observations, "Helvetica", 9.5, indent=0, line_spacing_factor=1.1)
 
-        if recetario_block_text:
+        if plan_estructura['has_recetario']:
             p.showPage(); current_y = height - y_margin
             draw_section_title("VI. Recetario Detallado")
             line_height_recipe_tech = 10.5
-            parsed_recipes_tech = parse_all_recipes_from_text_block(recetario_block_text)
+            parsed_recipes_tech = plan_estructura['recipes']
             app.logger.info(f"PDF_DEBUG (crear_pdf_v2): Recetas parseadas para PDF técnico: {len(parsed_recipes_tech)}")
 
             if parsed_recipes_tech:
@@ -2164,6 +2155,47 @@ def draw_text_block_with_style(p, current_y, x_margin, max_width, line_height_re
     return new_y
 
 # --- NUEVA FUNCIÓN: PDF para el Paciente ---
+# Subir al cambiar el diseño de crear_pdf_paciente: los PDFs cacheados con el diseño anterior dejan de usarse
+PATIENT_PDF_TEMPLATE_VERSION = 1
+
+# PDFs de paciente ya renderizados, por hash del contenido que muestran; ver backend/pdf_cache.py
+pdf_cache = PdfCache(
+    app.config.get('PDF_CACHE_DIR'),
+    max_entries=app.config.get('PDF_CACHE_MAX_ENTRIES'),
+    max_bytes=app.config.get('PDF_CACHE_MAX_BYTES'),
+)
+
+def patient_pdf_cache_key(evaluation):
+    """Hash de todo lo que muestra el PDF de paciente: cambia (e invalida la caché) al editar la evaluación."""
+    patient = evaluation.patient
+    return cache_key(
+        'patient_pdf', PATIENT_PDF_TEMPLATE_VERSION, STRUCTURE_VERSION, evaluation.id,
+        evaluation.edited_plan_text, evaluation.user_observations,
+        patient.name if patient else None, patient.surname if patient else None,
+        evaluation.consultation_date.isoformat() if evaluation.consultation_date else None,
+    )
+
+def obtener_pdf_paciente(evaluation):
+    """
+    PDF de paciente desde la caché, renderizándolo y guardándolo si falta.
+    Retorna (ruta, None) si está en disco, (None, buffer) si la caché está desactivada o no se pudo escribir,
+    o (None, None) si no se pudo generar.
+    """
+    key = patient_pdf_cache_key(evaluation)
+    path = pdf_cache.get_path(key)
+    if path:
+        app.logger.debug("PDF de paciente de Evaluación ID %s servido desde la caché (%s).", evaluation.id, key[:12])
+        return path, None
+    pdf_buffer = crear_pdf_paciente(evaluation)
+    data = pdf_buffer.getvalue()
+    if not data:
+        return None, None
+    path = pdf_cache.put_bytes(key, data)
+    if path:
+        return path, None
+    pdf_buffer.seek(0)
+    return None, pdf_buffer
+
 def crear_pdf_paciente(evaluation_instance):
     buffer = io.BytesIO()
     p = canvas.Canvas(buffer, pagesize=letter)
@@ -2199,42 +2231,29 @@ def crear_pdf_paciente(evaluation_instance):
             p.setFillColor(colors.black)
         
         draw_patient_section_title("Mi Plan de Alimentación Semanal")
-        full_plan_text = evaluation_instance.edited_plan_text or "El plan de alimentación se detallará durante la consulta."
-        app.logger.debug(f"PDF_DEBUG (crear_pdf_paciente): full_plan_text (primeros 300): '{full_plan_text[:300]}'")
-        recetario_marker = "== RECETARIO DETALLADO =="
-        plan_parts = full_plan_text.split(recetario_marker, 1)
-        plan_structure_text = plan_parts[0].strip()
-        recetario_block_text = plan_parts[1].strip() if len(plan_parts) > 1 else ""
-        app.logger.debug(f"PDF_DEBUG (crear_pdf_paciente): plan_structure_text (primeros 300): '{plan_structure_text[:300]}'")
-        app.logger.debug(f"PDF_DEBUG (crear_pdf_paciente): recetario_block_text (primeros 300): '{recetario_block_text[:300]}'")
+        plan_estructura = _estructura_plan_para_pdf(evaluation_instance, "El plan de alimentación se detallará durante la consulta.")
+        app.logger.debug(f"PDF_DEBUG (crear_pdf_paciente): {len(plan_estructura['lines'])} líneas de plan, {len(plan_estructura['recipes'])} recetas")
         
-        if plan_structure_text:
-            day_regex_patient = re.compile(r"^\s*\*\*(Lunes|Martes|Miércoles|Jueves|Viernes|Sábado|Domingo)\s*\*\*(?::)?", re.IGNORECASE)
-            meal_regex_patient = re.compile(r"^\s*\*?\s*(Desayuno|Colación Mañana|Almuerzo|Colación Tarde|Cena|Merienda)\s*:\s*", re.IGNORECASE)
-            plan_lines_patient = plan_structure_text.split('\n')
-
-            for i_patient, line_raw_patient in enumerate(plan_lines_patient):
-                line_patient = line_raw_patient.strip()
-                if not line_patient:
+        if plan_estructura['lines']:
+            for i_patient, linea_patient in enumerate(plan_estructura['lines']):
+                line_patient = linea_patient['text']
+                if linea_patient['kind'] == LINE_BLANK:
                     current_y -= line_height_base * 0.5
                     continue
-                is_day_title_patient = day_regex_patient.match(line_patient)
-                is_meal_title_patient = meal_regex_patient.match(line_patient)
                 font_name_patient = "Helvetica"; font_size_patient = 10.5; indent_patient = 0
                 space_before_patient = 0; line_spacing_mult_patient = 1.2
-                if is_day_title_patient:
+                if linea_patient['kind'] == LINE_DAY:
                     font_name_patient = "Helvetica-Bold"; font_size_patient = 12
                     if i_patient > 0: space_before_patient = line_height_base * 0.8
-                    line_patient = day_regex_patient.sub(r"\1:", line_patient).upper()
+                    line_patient = line_patient.upper()
                     app.logger.debug(f"PDF_DEBUG (crear_pdf_paciente): Plan - Día: '{line_patient}'")
-                elif is_meal_title_patient:
+                elif linea_patient['kind'] == LINE_MEAL:
                     font_name_patient = "Helvetica-Bold"; font_size_patient = 11; indent_patient = 10
                     space_before_patient = line_height_base * 0.3
-                    line_patient = meal_regex_patient.sub(r"\1:", line_patient)
                     app.logger.debug(f"PDF_DEBUG (crear_pdf_paciente): Plan - Comida: '{line_patient}'")
                 else:
-                    indent_patient = 20; cleaned_line_patient = line_patient.lstrip("*-• ").strip()
-                    line_patient = f"• {cleaned_line_patient}" if cleaned_line_patient else ""
+                    indent_patient = 20
+                    line_patient = f"• {line_patient}" if line_patient else ""
                     line_spacing_mult_patient = 1.15
                     # app.logger.debug(f"PDF_DEBUG (crear_pdf_paciente): Plan - Item: '{line_patient}'") # Puede ser muy verboso
                 current_y -= space_before_patient
@@ -2244,11 +2263,11 @@ def crear_pdf_paciente(evaluation_instance):
         
         current_y -= line_height_base 
 
-        parsed_recipes = parse_all_recipes_from_text_block(recetario_block_text)
+        parsed_recipes = plan_estructura['recipes']
         app.logger.info(f"PDF_DEBUG (crear_pdf_paciente): Recetas parseadas para PDF paciente: {len(parsed_recipes)}")
 
         if parsed_recipes:
-            estimated_plan_lines = len(plan_structure_text.split('\n'))
+            estimated_plan_lines = len(plan_estructura['lines'])
             if current_y < y_margin + line_height_base * 10 or estimated_plan_lines > 30: # Estimación simple
                 p.showPage(); current_y = height - y_margin
             
@@ -2299,78 +2318,85 @@ def crear_pdf_paciente(evaluation_instance):
         app.logger.error(f"Error creando PDF para PACIENTE (Evaluación ID {evaluation_instance.id if evaluation_instance else 'N/A'}): {pdf_error}", exc_info=True)
         return io.BytesIO()
 
-# (subir_a_drive_v2 - sin cambios)
-def subir_a_drive_v2(pdf_buffer, nombre_archivo):
-    if not DRIVE_FOLDER_ID:
-        app.logger.error("ERROR: DRIVE_FOLDER_ID no configurado.")
-        return None
-    service = get_drive_service()
-    if not service:
-        app.logger.error("ERROR: No se pudo obtener servicio Drive.")
-        return None
-    file_metadata = {'name': nombre_archivo, 'parents': [DRIVE_FOLDER_ID]}
-    pdf_buffer.seek(0)
-    media = MediaIoBaseUpload(fd=pdf_buffer, mimetype='application/pdf', chunksize=1024*1024, resumable=True)
-    try:
-        file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-        file_id = file.get("id")
-        app.logger.info(f'Archivo subido a Drive con ID: {file_id}')
-        return file_id
-    except HttpError as error:
-        app.logger.error(f'Error HttpError subiendo a Drive: {error}', exc_info=True)
-        return None
-    except Exception as e:
-        app.logger.error(f'Error inesperado subiendo a Drive: {e}', exc_info=True)
+# --- Email: cola de salida con conexiones SMTP reutilizadas (ver backend/mailer.py) ---
+# MAIL_USERNAME/MAIL_PASSWORD son opcionales: sin usuario no se hace LOGIN (p. ej. con backend/debug_smtp.py)
+MAIL_REQUIRED_CONFIGS = ('MAIL_SERVER', 'MAIL_PORT', 'MAIL_DEFAULT_SENDER')
+
+def email_configurado():
+    missing = [conf for conf in MAIL_REQUIRED_CONFIGS if not app.config.get(conf)]
+    if missing:
+        app.logger.error("Error: Faltan configs email: %s", ', '.join(missing))
+    return not missing
+
+def _registrar_email_fallido(mail):
+    app.logger.error("Email '%s' a %s no enviado tras %s intento(s): %s",
+                     mail.description, mail.recipient, mail.attempts, mail.error)
+
+mail_pool = SmtpPool(
+    smtp_connector(app.config.get('MAIL_SERVER'), app.config.get('MAIL_PORT'),
+                   use_ssl=app.config.get('MAIL_USE_SSL'), use_tls=app.config.get('MAIL_USE_TLS'),
+                   username=app.config.get('MAIL_USERNAME'), password=app.config.get('MAIL_PASSWORD'),
+                   timeout=app.config.get('MAIL_TIMEOUT_SECONDS') or 30),
+    size=app.config.get('MAIL_POOL_SIZE') or 2,
+    idle_timeout=app.config.get('MAIL_IDLE_TIMEOUT_SECONDS') or 60,
+    max_messages=app.config.get('MAIL_MAX_MESSAGES_PER_CONNECTION') or 100,
+)
+mail_queue = MailQueue(
+    mail_pool.send_many,
+    workers=app.config.get('MAIL_WORKERS') or 1,
+    batch_size=app.config.get('MAIL_BATCH_SIZE') or 20,
+    max_attempts=app.config.get('MAIL_MAX_ATTEMPTS') or 5,
+    backoff_seconds=app.config.get('MAIL_BACKOFF_SECONDS') or 10,
+    context=app.app_context,
+    on_failure=_registrar_email_fallido,
+)
+# Al salir se da un margen para enviar lo que quedó en la cola y se cierran las conexiones (atexit: orden inverso)
+atexit.register(mail_pool.close)
+atexit.register(mail_queue.close)
+
+def encolar_email(destinatario, asunto, cuerpo_html, adjuntos=(), owner=None, descripcion=''):
+    """
+    Encola un email HTML con adjuntos opcionales ((nombre, bytes, tipo MIME)); lo envía un hilo de mail_queue.
+    Retorna el OutgoingMail (consultable en /estado_email/<mail_id>) o None si el email no está configurado.
+    """
+    if not email_configurado():
         return None
+    mensaje = build_message(app.config['MAIL_DEFAULT_SENDER'], destinatario, asunto, cuerpo_html, adjuntos)
+    mail = mail_queue.enqueue(mensaje, owner=owner, description=descripcion)
+    app.logger.info("Email '%s' a %s encolado (%s).", descripcion, destinatario, mail.id)
+    return mail
 
-# (enviar_email_con_adjunto - sin cambios)
-def enviar_email_con_adjunto(destinatario, asunto, cuerpo_html, pdf_buffer, nombre_archivo_pdf):
-    required_configs = ['MAIL_SERVER', 'MAIL_PORT', 'MAIL_USERNAME', 'MAIL_PASSWORD', 'MAIL_DEFAULT_SENDER']
-    if not all(app.config.get(conf) for conf in required_configs):
-        missing = [conf for conf in required_configs if not app.config.get(conf)]
-        app.logger.error(f"Error: Faltan configs email: {', '.join(missing)}")
-        return False
-    
-    remitente = app.config['MAIL_DEFAULT_SENDER']
-    msg = MIMEMultipart('alternative')
-    msg['From'] = remitente
-    msg['To'] = destinatario
-    msg['Subject'] = asunto
-    msg.attach(MIMEText(cuerpo_html, 'html', 'utf-8'))
-
-    # Modificado para manejar el caso donde no hay adjunto
-    if pdf_buffer and nombre_archivo_pdf:
-        pdf_buffer.seek(0)
-        pdf_content = pdf_buffer.read()
-        if pdf_content:
-            part = MIMEBase('application', 'octet-stream')
-            part.set_payload(pdf_content)
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', f'attachment; filename="{nombre_archivo_pdf}"')
-            msg.attach(part)
-    
-    try:
-        server = None
-        if app.config['MAIL_USE_SSL']:
-            import ssl
-            context = ssl.create_default_context()
-            server = smtplib.SMTP_SSL(app.config['MAIL_SERVER'], app.config['MAIL_PORT'], context=context)
-        elif app.config['MAIL_USE_TLS']:
-            server = smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT'])
-            server.ehlo()
-            server.starttls()
-            server.ehlo()
-        else:
-            server = smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT'])
-        
-        server.login(app.config['MAIL_USERNAME'], app.config['MAIL_PASSWORD'])
-        server.sendmail(remitente, destinatario, msg.as_string())
-        server.quit()
-        app.logger.info(f"Email enviado a {destinatario}")
-        return True
-    except Exception as e:
-        app.logger.error(f"Error enviando email: {e}", exc_info=True)
-        return False
+def _email_plan_paciente(evaluation_id):
+    """Arma, en el hilo de envío, el email con el plan de una evaluación y el PDF del paciente adjunto."""
+    evaluation = Evaluation.query.get(evaluation_id)
+    patient = evaluation.patient if evaluation else None
+    if not patient or not patient.email:
+        raise MailError(f"La evaluación {evaluation_id} no existe o su paciente no tiene email.")
+    pdf_path, pdf_buffer = obtener_pdf_paciente(evaluation)
+    if pdf_path:
+        with open(pdf_path, 'rb') as pdf_file:
+            pdf_data = pdf_file.read()
+    else:
+        pdf_data = pdf_buffer.getvalue() if pdf_buffer else b''
+    if not pdf_data:
+        raise RuntimeError(f"No se pudo generar el PDF del paciente para Evaluación ID {evaluation_id}.")
+
+    nombre_pdf_paciente = f"PlanNutricional_{patient.surname}_{patient.cedula}_{evaluation.consultation_date.strftime('%Y%m%d')}.pdf"
+    asunto = f"Tu Plan Nutricional Personalizado de NutriApp - {patient.name} {patient.surname}"
+    cuerpo_html_email = f"""
+    <p>Hola {patient.name},</p><br>
+    <p>Adjunto encontrarás tu plan de alimentación personalizado correspondiente a la evaluación del {evaluation.consultation_date.strftime('%d/%m/%Y')}.</p>
+    <p>Si tienes alguna pregunta, no dudes en contactarme.</p><br/>
+    <p>Saludos cordiales,</p>
+    <p><strong>Tu Nutricionista - NutriApp</strong></p>
+    """
+    return build_message(app.config['MAIL_DEFAULT_SENDER'], patient.email, asunto, cuerpo_html_email,
+                         [(nombre_pdf_paciente, pdf_data, 'application/pdf')])
+
+def email_plan_pendiente(evaluation, owner=None):
+    """OutgoingMail con el plan de la evaluación; el PDF se obtiene recién al enviarlo (ver _email_plan_paciente)."""
+    return OutgoingMail(build=partial(_email_plan_paciente, evaluation.id), owner=owner,
+                        description=f"plan de Evaluación ID {evaluation.id}")
 
 # --- Rutas de Flask ---
 
@@ -2728,7 +2754,8 @@ def get_evaluation_data(evaluation_id):
         'user_observations': evaluation.user_observations, 
         'micronutrients': evaluation.get_micronutrients(), 
         'base_foods': evaluation.get_base_foods(),
-        'references': evaluation.references # Añadido para que /get_evaluation_data también devuelva referencias
+        'references': evaluation.references, # Añadido para que /get_evaluation_data también devuelva referencias
+        'generation_stats': evaluation.get_generation_stats()
     }
     app.logger.info(f"Devolviendo datos para Evaluación ID: {evaluation_id}")
     return jsonify(evaluation_data)
@@ -2840,6 +2867,110 @@ def calcular_valores():
          app.logger.error(f"Error inesperado en /calcular_valores: {e}", exc_info=True)
          return jsonify({'error': 'Error interno del servidor al calcular valores.'}), 500
 
+def _construir_plan_input_data(data):
+    """
+    Valida los datos recibidos por /generar_plan y calcula los valores derivados (edad, IMC, GET, riesgos...).
+    Retorna (plan_input_data_complete, None) o (None, (respuesta_json, status)) si faltan datos o son inválidos.
+    Los ValueError/KeyError de conversión se propagan al endpoint.
+    """
+    patient_id = data.get('patient_id') 
+    name = data.get('name')
+    surname = data.get('surname')
+    cedula = data.get('cedula')
+    dob_str = data.get('dob') 
+    sex = data.get('sex')
+    email = data.get('email')
+    phone_number = data.get('phone_number')
+    education_level = data.get('education_level')
+    purchasing_power = data.get('purchasing_power')
+
+    height_cm = float(data.get('height_cm')) if data.get('height_cm') else None
+    weight_at_plan = float(data.get('weight_at_plan')) if data.get('weight_at_plan') else None
+    wrist_cm = float(data.get('wrist_circumference_cm')) if data.get('wrist_circumference_cm') else None
+    waist_cm = float(data.get('waist_circumference_cm')) if data.get('waist_circumference_cm') else None
+    hip_cm = float(data.get('hip_circumference_cm')) if data.get('hip_circumference_cm') else None
+    
+    try:
+        gestational_age_weeks = int(data.get('gestational_age_weeks', 0)) if data.get('gestational_age_weeks') else 0
+    except (ValueError, TypeError):
+        gestational_age_weeks = 0 
+        app.logger.warning("Valor de edad gestacional no válido, usando 0.")
+
+    activity_factor = float(data.get('activity_factor', 1.2)) if data.get('activity_factor') else 1.2
+
+    pathologies = data.get('pathologies', []) 
+    other_pathologies_text = data.get('other_pathologies_text', '')
+    postoperative_text = data.get('postoperative_text', '')
+
+    allergies = data.get('allergies', [])
+    intolerances = data.get('intolerances', [])
+    preferences = data.get('preferences', [])
+    aversions = data.get('aversions', [])
+
+    diet_type = data.get('diet_type')
+    other_diet_type_text = data.get('other_diet_type_text', '')
+    target_weight = float(data.get('target_weight')) if data.get('target_weight') else None
+    target_waist_cm = float(data.get('target_waist_cm')) if data.get('target_waist_cm') else None
+    target_protein_perc = float(data.get('target_protein_perc')) if data.get('target_protein_perc') else None
+    target_carb_perc = float(data.get('target_carb_perc')) if data.get('target_carb_perc') else None
+    target_fat_perc = float(data.get('target_fat_perc')) if data.get('target_fat_perc') else None
+    
+    micronutrients_from_request = data.get('micronutrients', {})
+    base_foods_from_request = data.get('base_foods', [])
+
+    required_for_plan_generation = [name, surname, cedula, dob_str, sex, height_cm, weight_at_plan, activity_factor, target_weight]
+    if not all(field is not None and (not isinstance(field, str) or field.strip() != '') for field in required_for_plan_generation):
+        app.logger.warning(f"BACKEND /generar_plan: Faltan datos esenciales. Datos recibidos: {data}")
+        return None, (jsonify({'error': 'Faltan datos esenciales del paciente o del plan para generar (Nombre, Apellido, CI, Fecha Nac, Sexo, Altura, Peso Actual, Factor Actividad, Peso Objetivo).'}), 400)
+
+    try:
+        dob_date = datetime.strptime(dob_str, '%Y-%m-%d').date()
+    except ValueError:
+        app.logger.warning(f"BACKEND /generar_plan: Formato fecha DOB inválido: {dob_str}")
+        return None, (jsonify({'error': 'Formato de Fecha de Nacimiento inválido. Use YYYY-MM-DD.'}), 400)
+    
+    age = Patient(dob=dob_date).calculate_age() 
+    if age is None:
+        app.logger.warning(f"BACKEND /generar_plan: No se pudo calcular la edad para DOB: {dob_str}")
+        return None, (jsonify({'error': 'Fecha de nacimiento no permite calcular edad válida.'}), 400)
+
+    imc = calculate_imc(weight_at_plan, height_cm)
+    complexion = calculate_complexion(height_cm, wrist_cm, sex)
+    waist_hip_ratio = calculate_waist_hip_ratio(waist_cm, hip_cm)
+    waist_height_ratio = calculate_waist_height_ratio(waist_cm, height_cm)
+    ideal_weight_base = calculate_ideal_weight_devine(height_cm, sex)
+    ideal_weight = adjust_ideal_weight_for_complexion(ideal_weight_base, complexion)
+    tmb = calculate_tmb_mifflin(weight_at_plan, height_cm, age, sex)
+    get = calculate_get(tmb, activity_factor)
+    imc_risk = assess_imc_risk(imc)
+    whr_risk = assess_whr_risk(waist_hip_ratio, sex)
+    whtr_risk = assess_whtr_risk(waist_height_ratio)
+
+    plan_input_data_complete = {
+        'patient_id': patient_id,
+        'name': name, 'surname': surname, 'cedula': cedula, 'dob': dob_str, 'sex': sex,
+        'email': email, 'phone_number': phone_number, 'education_level': education_level,
+        'purchasing_power': purchasing_power, 'height_cm': height_cm,
+        'weight_at_plan': weight_at_plan, 'wrist_circumference_cm': wrist_cm,
+        'waist_circumference_cm': waist_cm, 'hip_circumference_cm': hip_cm,
+        'gestational_age_weeks': gestational_age_weeks, 'activity_factor': activity_factor,
+        'pathologies': pathologies, 'other_pathologies_text': other_pathologies_text,
+        'postoperative_text': postoperative_text, 'allergies': allergies,
+        'intolerances': intolerances, 'preferences': preferences, 'aversions': aversions,
+        'diet_type': diet_type, 'other_diet_type_text': other_diet_type_text,
+        'target_weight': target_weight, 'target_waist_cm': target_waist_cm,
+        'target_protein_perc': target_protein_perc, 'target_carb_perc': target_carb_perc,
+        'target_fat_perc': target_fat_perc,
+        'age': age, 'calculated_imc': imc, 'calculated_complexion': complexion,
+        'calculated_waist_hip_ratio': waist_hip_ratio, 'calculated_waist_height_ratio': waist_height_ratio,
+        'calculated_ideal_weight': ideal_weight, 'tmb': tmb, 'calculated_calories': get,
+        'imc_risk': imc_risk, 'whr_risk': whr_risk, 'whtr_risk': whtr_risk,
+        'micronutrients': micronutrients_from_request, 
+        'base_foods': base_foods_from_request,
+        'references': data.get('references', {}) # <<< AÑADIR ESTA LÍNEA        
+    }
+    return plan_input_data_complete, None
+
 @app.route('/generar_plan', methods=['POST'])
 def generar_plan_endpoint():
     data = request.json
@@ -2847,114 +2978,29 @@ def generar_plan_endpoint():
     app.logger.debug(f"Datos recibidos en /generar_plan: {data}")
 
     try:
-        patient_id = data.get('patient_id') 
-        name = data.get('name')
-        surname = data.get('surname')
-        cedula = data.get('cedula')
-        dob_str = data.get('dob') 
-        sex = data.get('sex')
-        email = data.get('email')
-        phone_number = data.get('phone_number')
-        education_level = data.get('education_level')
-        purchasing_power = data.get('purchasing_power')
-
-        height_cm = float(data.get('height_cm')) if data.get('height_cm') else None
-        weight_at_plan = float(data.get('weight_at_plan')) if data.get('weight_at_plan') else None
-        wrist_cm = float(data.get('wrist_circumference_cm')) if data.get('wrist_circumference_cm') else None
-        waist_cm = float(data.get('waist_circumference_cm')) if data.get('waist_circumference_cm') else None
-        hip_cm = float(data.get('hip_circumference_cm')) if data.get('hip_circumference_cm') else None
-        
-        try:
-            gestational_age_weeks = int(data.get('gestational_age_weeks', 0)) if data.get('gestational_age_weeks') else 0
-        except (ValueError, TypeError):
-            gestational_age_weeks = 0 
-            app.logger.warning("Valor de edad gestacional no válido, usando 0.")
-
-        activity_factor = float(data.get('activity_factor', 1.2)) if data.get('activity_factor') else 1.2
-
-        pathologies = data.get('pathologies', []) 
-        other_pathologies_text = data.get('other_pathologies_text', '')
-        postoperative_text = data.get('postoperative_text', '')
-
-        allergies = data.get('allergies', [])
-        intolerances = data.get('intolerances', [])
-        preferences = data.get('preferences', [])
-        aversions = data.get('aversions', [])
-
-        diet_type = data.get('diet_type')
-        other_diet_type_text = data.get('other_diet_type_text', '')
-        target_weight = float(data.get('target_weight')) if data.get('target_weight') else None
-        target_waist_cm = float(data.get('target_waist_cm')) if data.get('target_waist_cm') else None
-        target_protein_perc = float(data.get('target_protein_perc')) if data.get('target_protein_perc') else None
-        target_carb_perc = float(data.get('target_carb_perc')) if data.get('target_carb_perc') else None
-        target_fat_perc = float(data.get('target_fat_perc')) if data.get('target_fat_perc') else None
-        
-        micronutrients_from_request = data.get('micronutrients', {})
-        base_foods_from_request = data.get('base_foods', [])
-
-        required_for_plan_generation = [name, surname, cedula, dob_str, sex, height_cm, weight_at_plan, activity_factor, target_weight]
-        if not all(field is not None and (not isinstance(field, str) or field.strip() != '') for field in required_for_plan_generation):
-            app.logger.warning(f"BACKEND /generar_plan: Faltan datos esenciales. Datos recibidos: {data}")
-            return jsonify({'error': 'Faltan datos esenciales del paciente o del plan para generar (Nombre, Apellido, CI, Fecha Nac, Sexo, Altura, Peso Actual, Factor Actividad, Peso Objetivo).'}), 400
-
-        try:
-            dob_date = datetime.strptime(dob_str, '%Y-%m-%d').date()
-        except ValueError:
-            app.logger.warning(f"BACKEND /generar_plan: Formato fecha DOB inválido: {dob_str}")
-            return jsonify({'error': 'Formato de Fecha de Nacimiento inválido. Use YYYY-MM-DD.'}), 400
-        
-        age = Patient(dob=dob_date).calculate_age() 
-        if age is None:
-            app.logger.warning(f"BACKEND /generar_plan: No se pudo calcular la edad para DOB: {dob_str}")
-            return jsonify({'error': 'Fecha de nacimiento no permite calcular edad válida.'}), 400
-
-        imc = calculate_imc(weight_at_plan, height_cm)
-        complexion = calculate_complexion(height_cm, wrist_cm, sex)
-        waist_hip_ratio = calculate_waist_hip_ratio(waist_cm, hip_cm)
-        waist_height_ratio = calculate_waist_height_ratio(waist_cm, height_cm)
-        ideal_weight_base = calculate_ideal_weight_devine(height_cm, sex)
-        ideal_weight = adjust_ideal_weight_for_complexion(ideal_weight_base, complexion)
-        tmb = calculate_tmb_mifflin(weight_at_plan, height_cm, age, sex)
-        get = calculate_get(tmb, activity_factor)
-        imc_risk = assess_imc_risk(imc)
-        whr_risk = assess_whr_risk(waist_hip_ratio, sex)
-        whtr_risk = assess_whtr_risk(waist_height_ratio)
-
-        plan_input_data_complete = {
-            'patient_id': patient_id,
-            'name': name, 'surname': surname, 'cedula': cedula, 'dob': dob_str, 'sex': sex,
-            'email': email, 'phone_number': phone_number, 'education_level': education_level,
-            'purchasing_power': purchasing_power, 'height_cm': height_cm,
-            'weight_at_plan': weight_at_plan, 'wrist_circumference_cm': wrist_cm,
-            'waist_circumference_cm': waist_cm, 'hip_circumference_cm': hip_cm,
-            'gestational_age_weeks': gestational_age_weeks, 'activity_factor': activity_factor,
-            'pathologies': pathologies, 'other_pathologies_text': other_pathologies_text,
-            'postoperative_text': postoperative_text, 'allergies': allergies,
-            'intolerances': intolerances, 'preferences': preferences, 'aversions': aversions,
-            'diet_type': diet_type, 'other_diet_type_text': other_diet_type_text,
-            'target_weight': target_weight, 'target_waist_cm': target_waist_cm,
-            'target_protein_perc': target_protein_perc, 'target_carb_perc': target_carb_perc,
-            'target_fat_perc': target_fat_perc,
-            'age': age, 'calculated_imc': imc, 'calculated_complexion': complexion,
-            'calculated_waist_hip_ratio': waist_hip_ratio, 'calculated_waist_height_ratio': waist_height_ratio,
-            'calculated_ideal_weight': ideal_weight, 'tmb': tmb, 'calculated_calories': get,
-            'imc_risk': imc_risk, 'whr_risk': whr_risk, 'whtr_risk': whtr_risk,
-            'micronutrients': micronutrients_from_request, 
-            'base_foods': base_foods_from_request,
-            'references': data.get('references', {}) # <<< AÑADIR ESTA LÍNEA        
-        } 
+        plan_input_data_complete, error_response = _construir_plan_input_data(data)
+        if error_response is not None:
+            return error_response
 
+        # "force_regenerate": true ignora la caché de planes y vuelve a llamar a Gemini
+        forzar_regeneracion = bool(data.get('force_regenerate'))
         app.logger.info("Llamando a generar_plan_nutricional_v2 con datos completos para el plan.")
-        gemini_text_completo = generar_plan_nutricional_v2(plan_input_data_complete)
+        estadisticas = GenerationStats()
+        gemini_text_completo = generar_plan_nutricional_v2(plan_input_data_complete, forzar_regeneracion=forzar_regeneracion,
+                                                           estadisticas=estadisticas)
 
         if gemini_text_completo.startswith("Error:"):
              app.logger.error(f"Error devuelto por la función de generación de Gemini: {gemini_text_completo}")
              return jsonify({'error': gemini_text_completo}), 500
 
         app.logger.info("Plan generado exitosamente por Gemini.")
+        resumen = estadisticas.summary()
+        propietario = current_user.get_id() if current_user.is_authenticated else None
         return jsonify({
             'gemini_raw_text': gemini_text_completo, 
-            'plan_data_for_save': plan_input_data_complete 
+            'plan_data_for_save': plan_input_data_complete,
+            'generation_stats': resumen,
+            'generation_id': estadisticas_generacion.put(propietario, resumen)
          })
 
     except ValueError as e:
@@ -2969,6 +3015,162 @@ def generar_plan_endpoint():
         return jsonify({'error': 'Ocurrió un error inesperado al generar el plan.'}), 500
 
 
+# --- Generación de planes en segundo plano ---
+# Los trabajos corren en un pool de hilos propio, así la generación no ocupa un worker WSGI.
+# El estado vive en memoria del proceso que recibió el trabajo (ver backend/plan_jobs.py).
+plan_job_queue = JobQueue(
+    workers=app.config.get('PLAN_JOB_WORKERS') or 2,
+    per_owner_limit=app.config.get('PLAN_JOBS_PER_USER'),
+    retention_seconds=app.config.get('PLAN_JOB_RETENTION_SECONDS') or 3600,
+)
+
+def _ejecutar_trabajo_plan(job, plan_input_data_complete, forzar_regeneracion=False):
+    """
+    Cuerpo de un trabajo de /generar_plan/jobs. Va dejando en job.progress la etapa y el texto parcial
+    ('structure_text' y 'recipes_text' por lote) para quien consulta el estado, y publica cada evento de la
+    generación en el trabajo para /generar_plan/jobs/<job_id>/stream. job.cancel() detiene la generación.
+    """
+    def emit(evento, datos):
+        job.publish(evento, datos)
+        if evento == 'structure':
+            job.append_text('structure_text', datos['text'])
+        elif evento == 'recipes_start':
+            job.set_progress(stage='recipes', recipe_batches=datos['batches'], recipes=datos['recipes'],
+                             recipe_batches_done=0, recipes_text=[""] * datos['batches'])
+        elif evento == 'recipes':
+            job.append_text('recipes_text', datos['text'], index=datos['batch'])
+        elif evento == 'recipes_batch_done':
+            job.increment('recipe_batches_done')
+
+    with app.app_context():
+        job.set_progress(stage='structure')
+        estadisticas = GenerationStats()
+        try:
+            gemini_text_completo = generar_plan_nutricional_v2(plan_input_data_complete, emit=emit, forzar_regeneracion=forzar_regeneracion,
+                                                               estadisticas=estadisticas, cancelado=job.cancelled)
+        except Exception as e:
+            app.logger.error("Error inesperado en el trabajo de plan %s: %s", job.id, e, exc_info=True)
+            raise RuntimeError('Ocurrió un error inesperado al generar el plan.')
+        if job.cancelled.is_set():
+            app.logger.info("Trabajo de plan %s detenido: cancelado por el usuario.", job.id)
+            raise RuntimeError("Error: Generación del plan cancelada.")
+        if gemini_text_completo.startswith("Error:"):
+            app.logger.error("Error devuelto por la función de generación de Gemini (trabajo %s): %s", job.id, gemini_text_completo)
+            raise RuntimeError(gemini_text_completo)
+        job.set_progress(stage='done')
+        app.logger.info("Plan generado exitosamente por Gemini (trabajo %s).", job.id)
+        resumen = estadisticas.summary()
+        return {'gemini_raw_text': gemini_text_completo, 'plan_data_for_save': plan_input_data_complete,
+                'generation_stats': resumen, 'generation_id': estadisticas_generacion.put(job.owner, resumen)}
+
+@app.route('/generar_plan/jobs', methods=['POST'])
+@login_required
+def crear_trabajo_generar_plan():
+    """
+    Encola la generación del plan y responde de inmediato (202) con el id del trabajo.
+    El estado y el resultado se consultan en /generar_plan/jobs/<job_id>.
+    """
+    data = request.json
+    app.logger.info("Recibida solicitud para /generar_plan/jobs")
+    try:
+        plan_input_data_complete, error_response = _construir_plan_input_data(data)
+        if error_response is not None:
+            return error_response
+    except (ValueError, KeyError) as e:
+        app.logger.error(f"Datos inválidos en /generar_plan/jobs: {e}", exc_info=True)
+        return jsonify({'error': f'Error en el formato de un dato al procesar el plan: {e}'}), 400
+
+    try:
+        job = plan_job_queue.submit(current_user.get_id(), _ejecutar_trabajo_plan, plan_input_data_complete,
+                                    forzar_regeneracion=bool(data.get('force_regenerate')))
+    except JobLimitExceeded:
+        limite = plan_job_queue.per_owner_limit
+        return jsonify({'error': f'Ya tienes {limite} generación(es) de plan en curso. Espera a que termine antes de iniciar otra.'}), 429
+
+    app.logger.info("Trabajo de plan %s encolado.", job.id)
+    return jsonify({
+        'job_id': job.id,
+        'status': job.state,
+        'status_url': url_for('estado_trabajo_generar_plan', job_id=job.id),
+        'stream_url': url_for('stream_trabajo_generar_plan', job_id=job.id)
+    }), 202
+
+@app.route('/generar_plan/jobs/<job_id>', methods=['GET'])
+@login_required
+def estado_trabajo_generar_plan(job_id):
+    """Estado de un trabajo: status (queued/running/done/error), progress, y al terminar result o error."""
+    job = plan_job_queue.get(job_id, owner=current_user.get_id())
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado o expirado.'}), 404
+    return jsonify(job.snapshot())
+
+@app.route('/generar_plan/jobs/<job_id>', methods=['DELETE'])
+@login_required
+def cancelar_trabajo_generar_plan(job_id):
+    """Cancela un trabajo en curso: no se hacen más llamadas al modelo y el trabajo termina con error."""
+    job = plan_job_queue.get(job_id, owner=current_user.get_id())
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado o expirado.'}), 404
+    if job.active:
+        job.cancel()
+        app.logger.info("Trabajo de plan %s cancelado por el usuario.", job.id)
+    return jsonify(job.snapshot()), 202
+
+@app.route('/generar_plan/jobs/<job_id>/stream', methods=['GET'])
+@login_required
+def stream_trabajo_generar_plan(job_id):
+    """
+    Progreso de un trabajo como Server-Sent Events (apto para EventSource): 'structure' {text},
+    'recipes_start' {batches, recipes}, 'recipes' {batch, text} con cada fragmento de un lote a medida que llega,
+    'recipes_batch_done' {batch} al terminar cada lote, y al final 'done' (el resultado, igual que el de
+    /generar_plan) o 'error' {error}. Cada evento lleva su número como id: al reconectarse, EventSource envía
+    Last-Event-ID y se retoma desde ahí. Cerrar la conexión no cancela el trabajo (ver DELETE).
+    """
+    job = plan_job_queue.get(job_id, owner=current_user.get_id())
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado o expirado.'}), 404
+    try:
+        enviados = max(0, int(request.headers.get('Last-Event-ID') or 0))
+    except ValueError:
+        enviados = 0
+    espera = app.config.get('PLAN_JOB_STREAM_KEEPALIVE_SECONDS') or 15
+
+    def formatear(evento, datos, numero=None):
+        id_linea = f"id: {numero}\n" if numero is not None else ""
+        return f"{id_linea}event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False, default=str)}\n\n"
+
+    def eventos_sse():
+        nonlocal enviados
+        yield ": generando\n\n" # Comentario SSE para que el navegador reciba los headers de inmediato
+        while True:
+            eventos, terminado = job.wait_events(enviados, timeout=espera)
+            for evento, datos in eventos:
+                enviados += 1
+                yield formatear(evento, datos, enviados)
+            if terminado:
+                snapshot = job.snapshot()
+                if snapshot['status'] == 'done':
+                    yield formatear('done', snapshot['result'])
+                else:
+                    yield formatear('error', {'error': snapshot['error'] or 'Error al generar el plan.'})
+                return
+            if not eventos:
+                yield ": keep-alive\n\n"
+
+    return Response(eventos_sse(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics/llm', methods=['GET'])
+@login_required
+def metricas_llm():
+    """
+    Métricas agregadas (desde el inicio del proceso) de las llamadas al modelo: por propósito
+    (estructura / recetas) llamadas, aciertos de caché, bloqueos y textos parciales, tokens, e histogramas
+    de latencia, tiempo al primer fragmento y tokens de prompt/salida; por plan, recetas extraídas y duración.
+    """
+    return jsonify(llm_metrics.snapshot())
+
+
 @app.route('/paciente/<int:patient_id>/invitar', methods=['POST'])
 @login_required
 def invitar_paciente(patient_id):
@@ -3007,10 +3209,11 @@ def invitar_paciente(patient_id):
         asunto = "¡Bienvenido/a a NutriApp! Configura tu cuenta."
         cuerpo_html = render_template('email/invitacion_paciente.html', patient_name=patient.name, action_url=link)
         
-        enviado = enviar_email_con_adjunto(patient.email, asunto, cuerpo_html, None, None)
+        mail = encolar_email(patient.email, asunto, cuerpo_html, owner=current_user.id,
+                             descripcion=f"invitación de Paciente ID {patient.id}")
 
-        if enviado:
-            return jsonify({'message': f'Invitación enviada exitosamente a {patient.email}.'}), 200
+        if mail:
+            return jsonify({'message': f'Invitación enviada a {patient.email}.', 'mail_id': mail.id}), 202
         else:
             return jsonify({'error': 'Se creó la cuenta pero no se pudo enviar el email de invitación.'}), 500
 
@@ -3063,86 +3266,290 @@ def get_my_latest_plan():
         'nutritionist_observations': latest_evaluation.user_observations or "Sin observaciones adicionales."
     })
 
+def _shopping_list_etag(evaluation_id, shopping_list_key, consultation_date):
+    """
+    ETag de la lista de compras: evaluación, fecha mostrada, clave de la lista (incluye la versión vigente) y huella
+    actual de las tablas de ingredientes, que cambia el ETag aunque la lista guardada aún no se haya recalculado.
+    """
+    fecha = consultation_date.strftime('%Y%m%d') if consultation_date else 'na'
+    return f"sl{SHOPPING_LIST_VERSION}-{evaluation_id}-{fecha}-{shopping_list_key[:32]}-{shopping_list_tables_fingerprint()[:12]}"
+
 @app.route('/api/patient/me/shopping_list')
 @patient_auth_required
 def get_my_shopping_list():
     """
-    API that generates and returns the shopping list for the patient's latest plan.
+    API that returns the shopping list for the patient's latest plan.
+    The list is computed when the evaluation is saved; repeat loads with a matching ETag get a 304.
     """
     patient = g.patient
-    app.logger.info(f"API: Generando lista de compras para Paciente ID {patient.id}")
-
-    latest_evaluation = patient.evaluations.order_by(Evaluation.consultation_date.desc()).first()
 
+    # Solo las columnas necesarias para validar el ETag (una lectura por índice, sin cargar el plan)
+    latest = (db.session.query(Evaluation.id, Evaluation.consultation_date, Evaluation.shopping_list_key)
+              .filter(Evaluation.patient_id == patient.id)
+              .order_by(Evaluation.consultation_date.desc())
+              .first())
+    if latest and latest.shopping_list_key:
+        etag = _shopping_list_etag(latest.id, latest.shopping_list_key, latest.consultation_date)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+    latest_evaluation = Evaluation.query.get(latest.id) if latest else None
     if not latest_evaluation or not latest_evaluation.edited_plan_text:
         return jsonify({'error': 'No se encontró un plan para generar la lista de compras.'}), 404
 
-    full_plan_text = latest_evaluation.edited_plan_text
-    recetario_marker = "== RECETARIO DETALLADO =="
-    plan_parts = full_plan_text.split(recetario_marker, 1)
-    recetario_block_text = plan_parts[1].strip() if len(plan_parts) > 1 else ""
+    if latest_evaluation.refresh_shopping_list():
+        # Evaluación anterior a la lista precalculada (o versión nueva): guardarla para las próximas cargas
+        app.logger.info("API: Lista de compras calculada y guardada para Evaluación ID %s", latest_evaluation.id)
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning("API: No se pudo guardar la lista de compras de la Evaluación ID %s: %s", latest_evaluation.id, e)
+            latest_evaluation.refresh_shopping_list()
+    shopping_list = json.loads(latest_evaluation.shopping_list_json)
 
-    if not recetario_block_text:
+    if not shopping_list['has_recetario']:
         return jsonify({'error': 'El plan no contiene un recetario detallado.'}), 404
 
-    parsed_recipes = parse_all_recipes_from_text_block(recetario_block_text)
-    
-    # Diccionario para sumar las cantidades totales por ingrediente y unidad
-    summed_ingredients = {}
-
-    for recipe in parsed_recipes:
-        for ingredient_data in recipe.get('ingredients', []):
-            raw_line = ingredient_data.get('raw_line')
-            if not raw_line: continue
-
-            parsed_ingredient = _parse_ingredient_line(f"* {raw_line}")
-            item_name = parsed_ingredient.get('item')
-            quantity = parsed_ingredient.get('quantity')
-            unit = parsed_ingredient.get('unit')
-
-            if not item_name or quantity is None or unit is None or unit == "N/A": continue
-
-            # Usar el nombre en minúsculas como clave para agrupar sin importar mayúsculas
-            item_key = item_name.lower().strip()
-            summed_ingredients.setdefault(item_key, {'display_name': item_name.capitalize(), 'units': {}})
-            summed_ingredients[item_key]['units'].setdefault(unit, 0.0)
-            summed_ingredients[item_key]['units'][unit] += quantity
-
-    # --- Nueva Lógica de Categorización y Formateo ---
-    pantry_items = ["aceite", "sal", "pimienta", "vinagre", "salsa de soja", "curry", "comino", "orégano", "laurel", "tomillo", "romero", "pimentón", "jengibre", "canela", "nuez moscada", "ajo en polvo", "cebolla en polvo", "caldo", "levadura", "miel", "azúcar", "edulcorante", "mostaza", "ketchup"]
-    categories = {
-        "Frutas y Verduras": [],
-        "Proteínas (Carnes, Aves, Pescado, Tofu)": [],
-        "Granos, Legumbres y Pasta": [],
-        "Lácteos y Huevos": [],
-        "Despensa (Aceites, Condimentos, Salsas, etc.)": [],
-        "Otros": []
-    }
+    response = jsonify({
+        'evaluation_date': latest_evaluation.consultation_date.strftime('%d/%m/%Y'),
+        'shopping_list_items': shopping_list['items']
+    })
+    response.set_etag(_shopping_list_etag(latest_evaluation.id, latest_evaluation.shopping_list_key, latest_evaluation.consultation_date))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
-    for item_key, data in summed_ingredients.items():
-        display_name = data['display_name']
-        
-        # Determinar si es un item de despensa
-        is_pantry_item = any(pantry_word in item_key for pantry_word in pantry_items)
+# Filas leídas por lote al recorrer el historial de evaluaciones (la memoria no crece con el historial)
+SHOPPING_LIST_STREAM_BATCH = 50
 
-        if is_pantry_item:
-            formatted_item = display_name
-            categories["Despensa (Aceites, Condimentos, Salsas, etc.)"].append(formatted_item)
-        else:
-            # Para no-despensa, mostrar cantidades sumadas
-            quantities_str = ", ".join([f'{round(qty, 2) if qty % 1 != 0 else int(qty)} {unit}' for unit, qty in data['units'].items()])
-            formatted_item = f"{display_name}: {quantities_str}"
-            
-            # Lógica simple de categorización (se puede mejorar)
-            if any(w in item_key for w in ["pollo", "carne", "pescado", "salmón", "merluza", "atún", "tofu", "ternera", "cerdo", "pavo"]): categories["Proteínas (Carnes, Aves, Pescado, Tofu)"].append(formatted_item)
-            elif any(w in item_key for w in ["arroz", "quinoa", "lenteja", "garbanzo", "fideo", "pasta", "pan"]): categories["Granos, Legumbres y Pasta"].append(formatted_item)
-            elif any(w in item_key for w in ["leche", "queso", "yogur", "huevo"]): categories["Lácteos y Huevos"].append(formatted_item)
-            elif any(w in item_key for w in ["agua"]): continue # Omitir agua de la lista de compras
-            else: categories["Frutas y Verduras"].append(formatted_item) # Default para el resto
+def _refresh_stored_shopping_lists(evaluation_ids):
+    """
+    Calcula y guarda, por lotes, la lista de compras de evaluaciones que no la tienen al día.
+    Genera (id, fecha de consulta, lista) a medida que se guarda cada lote: en memoria hay a lo sumo un lote de listas.
+    """
+    for start in range(0, len(evaluation_ids), SHOPPING_LIST_STREAM_BATCH):
+        batch = evaluation_ids[start:start + SHOPPING_LIST_STREAM_BATCH]
+        refreshed = []
+        for evaluation in Evaluation.query.filter(Evaluation.id.in_(batch)).order_by(Evaluation.id).all():
+            evaluation.refresh_plan_structure()
+            evaluation.refresh_shopping_list()
+            refreshed.append((evaluation.id, evaluation.consultation_date, evaluation.shopping_list_json))
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.warning("API: No se pudieron guardar listas de compras recalculadas (%s): %s", batch, e)
+        db.session.expunge_all()
+        for evaluation_id, consultation_date, shopping_list_json in refreshed:
+            yield evaluation_id, consultation_date, json.loads(shopping_list_json)
+
+def _extend_date_range(first_date, last_date, consultation_date):
+    if consultation_date is None:
+        return first_date, last_date
+    if first_date is None or consultation_date < first_date:
+        first_date = consultation_date
+    if last_date is None or consultation_date > last_date:
+        last_date = consultation_date
+    return first_date, last_date
+
+@app.route('/api/patient/me/shopping_list/range')
+@patient_auth_required
+def get_my_multi_plan_shopping_list():
+    """
+    API that merges the shopping lists of several plans: the latest `plans` evaluations, or those
+    whose consultation date is between `start_date` and `end_date` (YYYY-MM-DD, both inclusive).
+    Stored lists are read in batches and merged one at a time; plan texts are not loaded.
+    """
+    patient = g.patient
+    max_plans = app.config.get('SHOPPING_LIST_MAX_PLANS', 52)
+    plans_arg = request.args.get('plans')
+    start_arg, end_arg = request.args.get('start_date'), request.args.get('end_date')
+
+    query = (db.session.query(Evaluation.id, Evaluation.consultation_date, Evaluation.shopping_list_json)
+             .filter(Evaluation.patient_id == patient.id,
+                     Evaluation.edited_plan_text.isnot(None), Evaluation.edited_plan_text != ''))
+    if start_arg or end_arg:
+        try:
+            if start_arg:
+                query = query.filter(Evaluation.consultation_date >= datetime.strptime(start_arg, '%Y-%m-%d'))
+            if end_arg:
+                query = query.filter(Evaluation.consultation_date < datetime.strptime(end_arg, '%Y-%m-%d') + timedelta(days=1))
+        except ValueError:
+            return jsonify({'error': 'Las fechas deben tener el formato AAAA-MM-DD.'}), 400
+        query = query.order_by(Evaluation.consultation_date.asc())
+    elif plans_arg:
+        try:
+            plans = int(plans_arg)
+        except ValueError:
+            plans = 0
+        if not 1 <= plans <= max_plans:
+            return jsonify({'error': f'El parámetro plans debe estar entre 1 y {max_plans}.'}), 400
+        query = query.order_by(Evaluation.consultation_date.desc()).limit(plans)
+    else:
+        return jsonify({'error': 'Indique plans (cantidad de planes) o start_date/end_date.'}), 400
+
+    accumulator = ShoppingListAccumulator()
+    first_date = last_date = None
+    tables_fingerprint = shopping_list_tables_fingerprint()
+    # IDs de evaluaciones sin lista guardada, de una versión anterior o de tablas de ingredientes ya editadas; sus listas
+    # se recalculan después del recorrido (no se escribe con el cursor abierto), por lotes que se suman y se descartan
+    stale_ids = []
+    for row in query.yield_per(SHOPPING_LIST_STREAM_BATCH):
+        stored = json.loads(row.shopping_list_json) if row.shopping_list_json else None
+        if not shopping_list_is_current(stored, tables_fingerprint):
+            stale_ids.append(row.id)
+            continue
+        if stored['has_recetario']:
+            accumulator.add(stored)
+            first_date, last_date = _extend_date_range(first_date, last_date, row.consultation_date)
+    if stale_ids:
+        app.logger.info("API: Calculando %d listas de compras no guardadas para Paciente ID %s", len(stale_ids), patient.id)
+        for _, consultation_date, stored in _refresh_stored_shopping_lists(stale_ids):
+            if stored['has_recetario']:
+                accumulator.add(stored)
+                first_date, last_date = _extend_date_range(first_date, last_date, consultation_date)
+
+    if not accumulator.plans:
+        return jsonify({'error': 'No se encontraron planes con recetario para generar la lista de compras.'}), 404
 
     return jsonify({
-        'evaluation_date': latest_evaluation.consultation_date.strftime('%d/%m/%Y'),
-        'shopping_list_items': categories
+        'plans_count': accumulator.plans,
+        'first_date': first_date.strftime('%d/%m/%Y'),
+        'last_date': last_date.strftime('%d/%m/%Y'),
+        'shopping_list_items': accumulator.categories()
+    })
+
+# --- Tareas posteriores al guardado de una evaluación ---
+# El PDF técnico (guardado en Drive u otro almacenamiento) y el PDF del paciente se generan en segundo plano después del commit,
+# con reintentos; el estado queda en la evaluación (post_save_status / post_save_state_json), así la UI lo
+# consulta en /estado_pdf/<id> desde cualquier proceso. Ver backend/post_save.py.
+POST_SAVE_STEP_PDF_COMPLETO = 'pdf_completo'
+POST_SAVE_STEP_PDF_PACIENTE = 'pdf_paciente'
+
+def _nombre_pdf_completo(evaluation):
+    patient = evaluation.patient
+    return f"EvaluacionNutricional_COMPLETA_{patient.surname}_{patient.cedula}_{evaluation.consultation_date.strftime('%Y%m%d_%H%M')}.pdf"
+
+def _paso_pdf_completo(evaluation_id):
+    """Renderiza el PDF técnico y lo guarda (ver guardar_pdf_almacenado). No hace nada si la evaluación ya tiene su PDF guardado."""
+    evaluation = Evaluation.query.get(evaluation_id)
+    if evaluation is None or evaluation.pdf_storage_path:
+        return True
+    pdf_buffer = crear_pdf_v2(evaluation)
+    if not pdf_buffer.getbuffer().nbytes:
+        app.logger.error("POST_SAVE: PDF técnico vacío para Evaluación ID %s.", evaluation_id)
+        return False
+    try:
+        location = guardar_pdf_almacenado(pdf_buffer, _nombre_pdf_completo(evaluation))
+    except PdfStorageUnavailable as e:
+        raise StepAborted(str(e))
+    if not location:
+        return False
+    # Solo si sigue sin PDF: actualizar_evaluacion pudo guardar uno más nuevo mientras se renderizaba este
+    resultado = db.session.execute(
+        db.update(Evaluation)
+        .where(Evaluation.id == evaluation_id, Evaluation.pdf_storage_path.is_(None))
+        .values(pdf_storage_path=location))
+    db.session.commit()
+    if not resultado.rowcount:
+        app.logger.info("POST_SAVE: Evaluación ID %s ya tiene un PDF guardado; se descarta %s.", evaluation_id, location)
+        try:
+            pdf_storage.delete(location)
+        except Exception as e:
+            app.logger.warning("POST_SAVE: No se pudo borrar el PDF descartado %s: %s", location, e)
+        return True
+    app.logger.info("POST_SAVE: PDF completo de Evaluación ID %s guardado (%s).", evaluation_id, location)
+    return True
+
+def _paso_pdf_paciente(evaluation_id):
+    """Deja el PDF del paciente en la caché: verlo o enviarlo por email no lo vuelve a renderizar."""
+    evaluation = Evaluation.query.get(evaluation_id)
+    if evaluation is None:
+        return True
+    pdf_path, pdf_buffer = obtener_pdf_paciente(evaluation)
+    return bool(pdf_path or pdf_buffer)
+
+def _cargar_estado_post_guardado(evaluation_id):
+    db.session.rollback() # Descarta lo que haya dejado a medias un paso fallido
+    evaluation = Evaluation.query.get(evaluation_id)
+    return evaluation.get_post_save_state() if evaluation else None
+
+def _guardar_estado_post_guardado(evaluation_id, state):
+    db.session.rollback()
+    evaluation = Evaluation.query.get(evaluation_id)
+    if evaluation is None:
+        return
+    evaluation.set_post_save_state(state)
+    db.session.commit()
+
+post_save_pipeline = PostSavePipeline(
+    JobQueue(workers=app.config.get('POST_SAVE_WORKERS') or 2, per_owner_limit=1,
+             retention_seconds=600, thread_name_prefix='post-save'),
+    [(POST_SAVE_STEP_PDF_COMPLETO, _paso_pdf_completo), (POST_SAVE_STEP_PDF_PACIENTE, _paso_pdf_paciente)],
+    _cargar_estado_post_guardado, _guardar_estado_post_guardado,
+    max_attempts=app.config.get('POST_SAVE_MAX_ATTEMPTS') or 3,
+    backoff_seconds=app.config.get('POST_SAVE_BACKOFF_SECONDS') or 2,
+    context=app.app_context,
+)
+
+# Las tareas que quedaron a medias en un proceso anterior (reinicio o caída) se vuelven a encolar con la primera
+# solicitud que atiende este proceso; las que se actualizaron después de iniciarlo son de otro proceso vivo.
+_INICIO_PROCESO = time.time()
+_tareas_post_guardado_reanudadas = threading.Event()
+_reanudar_tareas_lock = threading.Lock()
+
+def reanudar_tareas_post_guardado():
+    """Encola las tareas posteriores al guardado pendientes o en curso que no avanzan desde antes de iniciar el proceso.
+    Retorna la cantidad encolada. Ver también resume_post_save_tasks.py (ejecución manual, con --failed)."""
+    ids = [row.id for row in db.session.query(Evaluation.id)
+           .filter(Evaluation.post_save_status.in_(POST_SAVE_ACTIVE_STATES)).order_by(Evaluation.id)]
+    encoladas = 0
+    for evaluation_id in ids:
+        evaluation = Evaluation.query.get(evaluation_id)
+        state = evaluation.get_post_save_state() if evaluation else None
+        if not state or (state.get('updated_at') or 0) >= _INICIO_PROCESO or post_save_pipeline.is_active(evaluation_id):
+            continue
+        if post_save_pipeline.enqueue(evaluation_id):
+            encoladas += 1
+    if encoladas:
+        app.logger.warning("POST_SAVE: %s tarea(s) interrumpida(s) por un reinicio; se vuelven a encolar.", encoladas)
+    return encoladas
+
+@app.before_request
+def _reanudar_tareas_post_guardado_al_iniciar():
+    if _tareas_post_guardado_reanudadas.is_set() or not app.config.get('POST_SAVE_RESUME_ON_STARTUP'):
+        return
+    with _reanudar_tareas_lock:
+        if _tareas_post_guardado_reanudadas.is_set():
+            return
+        _tareas_post_guardado_reanudadas.set()
+        try:
+            reanudar_tareas_post_guardado()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error("POST_SAVE: No se pudieron reanudar las tareas pendientes: %s", e, exc_info=True)
+
+@app.route('/estado_pdf/<int:evaluation_id>', methods=['GET'])
+@login_required
+def estado_pdf(evaluation_id):
+    """Estado de las tareas posteriores al guardado: status (pending/running/done/failed), pasos y ubicación del PDF guardado."""
+    evaluation = Evaluation.query.get_or_404(evaluation_id)
+    if evaluation.user_id != current_user.id:
+        abort(403)
+    state = evaluation.get_post_save_state()
+    # Una tarea sin avances hace rato perdió su hilo (reinicio o caída del proceso): se vuelve a encolar
+    if is_post_save_stale(state, app.config.get('POST_SAVE_STALE_SECONDS') or 600) \
+            and not post_save_pipeline.is_active(evaluation.id):
+        app.logger.warning("POST_SAVE: tarea de Evaluación ID %s abandonada; se vuelve a encolar.", evaluation.id)
+        post_save_pipeline.enqueue(evaluation.id)
+    return jsonify({
+        'evaluation_id': evaluation.id,
+        'status': evaluation.post_save_status,
+        'steps': (state or {}).get('steps', {}),
+        'pdf_storage_path': evaluation.pdf_storage_path,
     })
 
 @app.route('/guardar_evaluacion', methods=['POST'])
@@ -3306,6 +3713,11 @@ def guardar_evaluacion():
         app.logger.info(f"Finalizar: Datos de 'references' recibidos del frontend: {references_from_frontend}")
         if references_from_frontend:
             nueva_evaluacion.references = references_from_frontend
+        # Estadísticas de la generación de este plan (tokens, latencias), guardadas en el servidor bajo 'generation_id'
+        nueva_evaluacion.set_generation_stats(estadisticas_generacion.get(data.get('generation_id'), current_user.get_id()))
+        # Parsear el plan una sola vez aquí; PDFs y lista de compras leen la estructura guardada
+        nueva_evaluacion.refresh_plan_structure()
+        nueva_evaluacion.refresh_shopping_list()
 
         db.session.add(nueva_evaluacion)
         db.session.commit() 
@@ -3327,6 +3739,7 @@ def guardar_evaluacion():
             elif plan_data.get('diet_type'):
                 tag_from_diet_type = plan_data.get('diet_type').lower().strip().replace(" ", "_") # Normalizar
 
+            indice_recetas = index_recipes(full_plan_text_for_favorites) # Un solo parseo del recetario para todas las favoritas
             for recipe_title_from_frontend in selected_favorite_recipes_titles:
                 match_num_part = re.search(r"(N°\d+)", recipe_title_from_frontend, re.IGNORECASE)
                 recipe_identifier_for_parse = None
@@ -3343,7 +3756,7 @@ def guardar_evaluacion():
                     app.logger.warning(f"FAV_SAVE (GuardarEval): No se pudo extraer 'N°X' de '{recipe_title_from_frontend}'. Usando nombre: '{recipe_identifier_for_parse}' para parseo.")
                 
                 app.logger.debug(f"FAV_SAVE (GuardarEval): Identificador FINAL para parseo: '{recipe_identifier_for_parse}'")
-                parsed_recipe_data = parse_recipe_from_text(recipe_identifier_for_parse, full_plan_text_for_favorites)
+                parsed_recipe_data = parse_recipe_from_text(recipe_identifier_for_parse, full_plan_text_for_favorites, indice_recetas)
 
                 if parsed_recipe_data:
                     actual_recipe_name_from_recetario_log = parsed_recipe_data.get('name', 'Nombre no encontrado en parseo')
@@ -3419,6 +3832,9 @@ def guardar_evaluacion():
                     except Exception as fav_save_e:
                         app.logger.error(f"FAV_SAVE (GuardarEval): Error al procesar la receta favorita '{actual_recipe_name_from_recetario}': {fav_save_e}", exc_info=True)
         
+        # Los PDFs (y guardar el técnico) se hacen después del commit, en segundo plano (ver post_save_pipeline)
+        nueva_evaluacion.set_post_save_state(post_save_pipeline.new_state())
+
         # Commit general después de procesar todas las favoritas y la evaluación principal
         # Este commit también guardará los cambios en el paciente si fue actualizado.
         try:
@@ -3432,33 +3848,11 @@ def guardar_evaluacion():
             # Por ahora, permitimos que continúe para la generación del PDF, pero el estado de la BD puede ser inconsistente.
             flash('Error crítico al guardar todos los datos. Algunos cambios podrían no haberse guardado.', 'danger')
             
-        app.logger.info(f"Generando PDF para Evaluación ID: {nueva_evaluacion.id}")
-        nombre_pdf_completo = f"EvaluacionNutricional_COMPLETA_{paciente.surname}_{paciente.cedula}_{nueva_evaluacion.consultation_date.strftime('%Y%m%d_%H%M')}.pdf"
-        pdf_buffer_completo = crear_pdf_v2(nueva_evaluacion)
-        pdf_completo_generado_ok = pdf_buffer_completo.getbuffer().nbytes > 0
-
-        drive_file_id = None
-        if pdf_completo_generado_ok:
-             drive_file_id = subir_a_drive_v2(pdf_buffer_completo, nombre_pdf_completo)
-             if drive_file_id:
-                  nueva_evaluacion.pdf_storage_path = drive_file_id
-                  db.session.commit()
-                  app.logger.info("PDF Completo subido a Drive y ID guardado.")
-             else: 
-                  flash('Advertencia: No se pudo subir el PDF a Google Drive.', 'warning')
-        
-        nombre_pdf_paciente = f"PlanNutricional_{paciente.surname}_{paciente.cedula}_{nueva_evaluacion.consultation_date.strftime('%Y%m%d')}.pdf"
-        pdf_buffer_paciente = crear_pdf_paciente(nueva_evaluacion)
-        pdf_paciente_generado_ok = pdf_buffer_paciente.getbuffer().nbytes > 0
+        post_save_encolado = bool(nueva_evaluacion.id) and post_save_pipeline.enqueue(nueva_evaluacion.id)
+        if post_save_encolado:
+            app.logger.info("PDFs de Evaluación ID %s encolados para generarse en segundo plano.", nueva_evaluacion.id)
 
-        if not pdf_paciente_generado_ok and paciente.email:
-            flash('Advertencia: Se guardó la evaluación, pero no se pudo generar el PDF para enviar al paciente.', 'warning')
-        
         msg = f"Nueva Evaluación (ID: {nueva_evaluacion.id}) para {paciente.name} guardada."
-        if pdf_completo_generado_ok: msg += " PDF completo generado."
-        if drive_file_id: msg += " PDF completo subido a Drive."
-        if pdf_paciente_generado_ok and paciente.email: msg += " PDF para paciente generado y listo para enviar."
-        elif pdf_paciente_generado_ok and not paciente.email: msg += " PDF para paciente generado (paciente sin email)."
 
         app.logger.info(f"Finalización completada para Evaluación ID {nueva_evaluacion.id}")
         return jsonify({
@@ -3466,7 +3860,8 @@ def guardar_evaluacion():
             'patient_id': paciente.id, 
             'evaluation_id': nueva_evaluacion.id,
             'patient_email': paciente.email,
-            'pdf_paciente_generado_ok': pdf_paciente_generado_ok
+            'post_save_status': nueva_evaluacion.post_save_status,
+            'post_save_status_url': url_for('estado_pdf', evaluation_id=nueva_evaluacion.id) if nueva_evaluacion.id else None
         })
 
     except ValueError as e:
@@ -3581,8 +3976,14 @@ def actualizar_evaluacion_endpoint(evaluation_id):
         micronutrients_to_set = {k: v_data[f"mic_{k.split('_')[0]}"] for k in ['potassium_mg', 'calcium_mg', 'sodium_mg', 'cholesterol_mg'] if v_data.get(f"mic_{k.split('_')[0]}") is not None}
         evaluation.set_micronutrients(micronutrients_to_set if micronutrients_to_set else evaluation.get_micronutrients())
         evaluation.set_base_foods(plan_data.get('base_foods', evaluation.get_base_foods()))
+        estadisticas_plan = estadisticas_generacion.get(data.get('generation_id'), current_user.get_id())
+        if estadisticas_plan is not None: # Solo si el plan se regeneró en esta edición
+            evaluation.set_generation_stats(estadisticas_plan)
         evaluation.consultation_date = datetime.now(timezone.utc)
         evaluation.user_id = current_user.id # Re-asegurar la propiedad
+        if evaluation.refresh_plan_structure(): # Solo se vuelve a parsear si el texto del plan cambió
+            app.logger.info("ACTUALIZAR_EVALUACION: estructura del plan reconstruida para Evaluación ID %s", evaluation_id)
+        evaluation.refresh_shopping_list()
 
         db.session.commit()
 
@@ -3600,6 +4001,7 @@ def actualizar_evaluacion_endpoint(evaluation_id):
             elif plan_data.get('diet_type'):
                 tag_from_diet_type = plan_data.get('diet_type').lower().strip().replace(" ", "_") # Normalizar
 
+            indice_recetas = index_recipes(full_plan_text_for_favorites) # Un solo parseo del recetario para todas las favoritas
             for recipe_title_from_frontend in selected_favorite_recipes_titles:
                 match_num_part = re.search(r"(N°\d+)", recipe_title_from_frontend, re.IGNORECASE)
                 recipe_identifier_for_parse = None
@@ -3616,7 +4018,7 @@ def actualizar_evaluacion_endpoint(evaluation_id):
                     app.logger.warning(f"FAV_SAVE (ActualizarEval): No se pudo extraer 'N°X' de '{recipe_title_from_frontend}'. Usando nombre: '{recipe_identifier_for_parse}' para parseo.")
 
                 app.logger.debug(f"FAV_SAVE (ActualizarEval): Identificador FINAL para parseo: '{recipe_identifier_for_parse}'")
-                parsed_recipe_data = parse_recipe_from_text(recipe_identifier_for_parse, full_plan_text_for_favorites)
+                parsed_recipe_data = parse_recipe_from_text(recipe_identifier_for_parse, full_plan_text_for_favorites, indice_recetas)
 
                 if parsed_recipe_data:
                     actual_recipe_name_from_recetario_log = parsed_recipe_data.get('name', 'Nombre no encontrado en parseo')
@@ -3707,19 +4109,22 @@ def actualizar_evaluacion_endpoint(evaluation_id):
         pdf_buffer_tecnico_actualizado = crear_pdf_v2(evaluation)
 
         if pdf_buffer_tecnico_actualizado.getbuffer().nbytes > 0:
-            nuevo_drive_file_id = subir_a_drive_v2(pdf_buffer_tecnico_actualizado, nombre_pdf_tecnico_actualizado)
-            if nuevo_drive_file_id:
+            try:
+                nueva_ubicacion_pdf = guardar_pdf_almacenado(pdf_buffer_tecnico_actualizado, nombre_pdf_tecnico_actualizado)
+            except PdfStorageUnavailable:
+                nueva_ubicacion_pdf = None
+            if nueva_ubicacion_pdf:
                 if evaluation.pdf_storage_path:
-                    app.logger.info(f"ACTUALIZAR_EVALUACION: Guardando PDF anterior ID '{evaluation.pdf_storage_path}' en historial.")
+                    app.logger.info(f"ACTUALIZAR_EVALUACION: Guardando PDF anterior '{evaluation.pdf_storage_path}' en historial.")
                     evaluation.add_historical_pdf_id(evaluation.pdf_storage_path)
                 
-                evaluation.pdf_storage_path = nuevo_drive_file_id
+                evaluation.pdf_storage_path = nueva_ubicacion_pdf
                 
                 db.session.commit()
-                app.logger.info(f"ACTUALIZAR_EVALUACION: PDF técnico regenerado y subido a Drive. Nuevo Drive ID: {nuevo_drive_file_id}")
+                app.logger.info(f"ACTUALIZAR_EVALUACION: PDF técnico regenerado y guardado. Nueva ubicación: {nueva_ubicacion_pdf}")
             else:
-                app.logger.warning(f"ACTUALIZAR_EVALUACION: PDF técnico regenerado, pero falló la subida a Drive para Evaluación ID: {evaluation_id}.")
-                flash('Advertencia: La evaluación se actualizó, pero no se pudo re-subir el PDF técnico a Google Drive.', 'warning')
+                app.logger.warning(f"ACTUALIZAR_EVALUACION: PDF técnico regenerado, pero no se pudo guardar para Evaluación ID: {evaluation_id}.")
+                flash('Advertencia: La evaluación se actualizó, pero no se pudo guardar el PDF técnico.', 'warning')
         else:
             app.logger.error(f"ACTUALIZAR_EVALUACION: Falló la regeneración del PDF técnico (buffer vacío) para Evaluación ID: {evaluation_id}.")
 
@@ -3747,17 +4152,22 @@ def ver_pdf(evaluation_id: int):
     nombre_archivo_base = f"EvaluacionNutricional_COMPLETA_{evaluation.patient.surname}_{evaluation.patient.cedula}_{evaluation.consultation_date.strftime('%Y%m%d_%H%M')}.pdf"
 
     if evaluation.pdf_storage_path:
-        app.logger.info(f"Intentando descargar PDF almacenado (Drive ID: {evaluation.pdf_storage_path}) para Evaluación ID: {evaluation.id}")
-        pdf_buffer = download_from_drive(evaluation.pdf_storage_path)
-        
-        if pdf_buffer and pdf_buffer.getbuffer().nbytes > 0:
-            app.logger.info(f"PDF almacenado descargado exitosamente para Evaluación ID: {evaluation.id}")
-            pdf_buffer.seek(0)
-            return send_file(pdf_buffer, mimetype='application/pdf', download_name=nombre_archivo_base, as_attachment=False)
-        else:
-            app.logger.warning(f"No se pudo descargar el PDF almacenado (ID: {evaluation.pdf_storage_path}) para Evaluación ID {evaluation.id}. El archivo podría no existir en Drive o hubo un error.")
-            flash("No se pudo recuperar el PDF almacenado. Puede que haya sido eliminado de Google Drive o hubo un error al descargarlo. Se intentará regenerar.", "warning")
-            # Fallback a regenerar si la descarga falla
+        # Un PDF guardado no cambia (uno nuevo tiene otra ubicación); send_file responde también pedidos por rangos
+        etag = stored_pdf_cache_key(evaluation.pdf_storage_path)
+        for _ in range(2): # Un reintento si el archivo fue desalojado entre la búsqueda y el envío
+            pdf_path, pdf_data = obtener_pdf_almacenado(evaluation.pdf_storage_path)
+            if not pdf_path and not pdf_data:
+                break
+            try:
+                response = send_file(pdf_path or io.BytesIO(pdf_data), mimetype='application/pdf', download_name=nombre_archivo_base,
+                                     as_attachment=False, conditional=True, etag=etag, max_age=0)
+            except FileNotFoundError:
+                continue
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        app.logger.warning(f"No se pudo leer el PDF almacenado ({evaluation.pdf_storage_path}) para Evaluación ID {evaluation.id}. El archivo podría no existir o hubo un error.")
+        flash("No se pudo recuperar el PDF almacenado. Puede que haya sido eliminado o hubo un error al descargarlo. Se intentará regenerar.", "warning")
+        # Fallback a regenerar si la descarga falla
 
     # Si no hay pdf_storage_path o la descarga falló, se regenera.
     app.logger.warning(f"Regenerando PDF para Evaluación ID {evaluation.id} (ya sea porque no hay path o la descarga falló).")
@@ -3782,25 +4192,29 @@ def ver_pdf_paciente(evaluation_id: int):
     evaluation = Evaluation.query.get_or_404(evaluation_id)
 
     try:
-        # Para el PDF del paciente, generalmente se regenera ya que su contenido puede ser
-        # un subconjunto o tener un formato diferente al PDF completo del nutricionista.
-        # Si se decidiera almacenar también el PDF del paciente, se seguiría una lógica similar a /ver_pdf.
-        app.logger.info(f"Generando PDF de PACIENTE para Evaluación ID: {evaluation.id} (Paciente: {evaluation.patient.surname})")
-        pdf_buffer = crear_pdf_paciente(evaluation)
-        if not pdf_buffer.getbuffer().nbytes > 0:
-             app.logger.error(f"Error: El buffer del PDF del paciente para Evaluación ID {evaluation_id} está vacío.")
-             abort(500, description="Error al generar contenido del PDF para el paciente.")
-
-        pdf_buffer.seek(0)
+        # El PDF del paciente se sirve desde la caché en disco (clave = hash de su contenido),
+        # con ETag para que el navegador no vuelva a descargarlo si no cambió.
         nombre_archivo = f"PlanNutricional_{evaluation.patient.surname}_{evaluation.patient.cedula}_{evaluation.consultation_date.strftime('%Y%m%d')}.pdf"
-
-        return send_file(pdf_buffer, mimetype='application/pdf', download_name=nombre_archivo, as_attachment=False)
+        etag = patient_pdf_cache_key(evaluation)
+        for _ in range(2): # Un reintento si el archivo fue desalojado entre la búsqueda y el envío
+            pdf_path, pdf_buffer = obtener_pdf_paciente(evaluation)
+            if not pdf_path and not pdf_buffer:
+                app.logger.error(f"Error: El buffer del PDF del paciente para Evaluación ID {evaluation_id} está vacío.")
+                abort(500, description="Error al generar contenido del PDF para el paciente.")
+            try:
+                response = send_file(pdf_path or pdf_buffer, mimetype='application/pdf', download_name=nombre_archivo,
+                                     as_attachment=False, conditional=True, etag=etag, max_age=0)
+            except FileNotFoundError:
+                continue
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        abort(500, description="Error al generar PDF para el paciente.")
     except Exception as e:
         app.logger.error(f"Error al generar/enviar PDF de PACIENTE para Evaluación ID {evaluation_id}: {e}", exc_info=True)        
         abort(500, description="Error al generar PDF para el paciente.")
 
 @app.route('/enviar_plan_por_email/<int:evaluation_id>', methods=['POST'])
-# @login_required # Descomentar si se implementa login
+@login_required
 def enviar_plan_email_route(evaluation_id):
     app.logger.info(f"Recibida solicitud para enviar email para Evaluación ID: {evaluation_id}")
     evaluation = Evaluation.query.get_or_404(evaluation_id)
@@ -3814,35 +4228,63 @@ def enviar_plan_email_route(evaluation_id):
         app.logger.warning(f"Intento de enviar email para Evaluación ID {evaluation_id}, pero Paciente ID {patient.id} ({patient.name} {patient.surname}) no tiene email registrado.")
         return jsonify({'error': 'El paciente no tiene una dirección de email registrada.'}), 400
 
-    try:
-        app.logger.info(f"Enviando email con plan a {patient.email} para Evaluación ID {evaluation_id}.")
-        nombre_pdf_paciente = f"PlanNutricional_{patient.surname}_{patient.cedula}_{evaluation.consultation_date.strftime('%Y%m%d')}.pdf"
-        pdf_buffer_paciente = crear_pdf_paciente(evaluation)
-
-        if not pdf_buffer_paciente or pdf_buffer_paciente.getbuffer().nbytes == 0:
-            app.logger.error(f"No se pudo generar el PDF del paciente para Evaluación ID {evaluation_id} al intentar enviar email.")
-            return jsonify({'error': 'No se pudo generar el PDF del paciente para el envío.'}), 500
-
-        asunto = f"Tu Plan Nutricional Personalizado de NutriApp - {patient.name} {patient.surname}"
-        cuerpo_html_email = f"""
-        <p>Hola {patient.name},</p><br>
-        <p>Adjunto encontrarás tu plan de alimentación personalizado correspondiente a la evaluación del {evaluation.consultation_date.strftime('%d/%m/%Y')}.</p>
-        <p>Si tienes alguna pregunta, no dudes en contactarme.</p><br/>
-        <p>Saludos cordiales,</p>
-        <p><strong>Tu Nutricionista - NutriApp</strong></p>
-        """
-        email_enviado = enviar_email_con_adjunto(patient.email, asunto, cuerpo_html_email, pdf_buffer_paciente, nombre_pdf_paciente)
+    if not email_configurado():
+        return jsonify({'error': 'El envío de emails no está configurado en el servidor.'}), 503
 
-        if email_enviado:
-            app.logger.info(f"Email con plan enviado exitosamente a {patient.email} para Evaluación ID {evaluation_id}.")
-            return jsonify({'message': f'Plan enviado por email a {patient.email} exitosamente.'}), 200
-        else: 
-            app.logger.error(f"Falló el envío de email a {patient.email} para Evaluación ID {evaluation_id} (la función de envío devolvió False).")
-            return jsonify({'error': 'No se pudo enviar el email con el plan al paciente (falló la función de envío).'}), 500
-    # El bloque 'except' debe estar alineado con el 'try'
-    except Exception as e: 
-        app.logger.error(f"Error INESPERADO al intentar enviar email para Evaluación ID {evaluation_id}: {e}", exc_info=True)
-        return jsonify({'error': 'Error interno del servidor al procesar el envío de email.'}), 500
+    # El PDF se obtiene y el email se envía en segundo plano (mail_queue); aquí solo se encola
+    mail = mail_queue.enqueue_many([email_plan_pendiente(evaluation, current_user.id)])[0]
+    app.logger.info(f"Email con plan a {patient.email} para Evaluación ID {evaluation_id} encolado ({mail.id}).")
+    return jsonify({
+        'message': f'Plan en camino por email a {patient.email}.',
+        'mail_id': mail.id,
+        'status_url': url_for('estado_email', mail_id=mail.id),
+    }), 202
+
+@app.route('/enviar_planes_por_email', methods=['POST'])
+@login_required
+def enviar_planes_email_route():
+    """
+    Envío masivo: encola el plan de cada evaluación propia de {"evaluation_ids": [...]}, un email por paciente.
+    Los emails salen en tandas por una misma conexión SMTP; el estado de cada uno está en /estado_email/<mail_id>.
+    """
+    data = request.get_json(silent=True) or {}
+    evaluation_ids = data.get('evaluation_ids')
+    max_evaluations = app.config.get('MAIL_BULK_MAX_EVALUATIONS') or 200
+    if not isinstance(evaluation_ids, list) or not evaluation_ids \
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in evaluation_ids):
+        return jsonify({'error': 'Se esperaba "evaluation_ids": una lista de IDs de evaluación.'}), 400
+    evaluation_ids = list(dict.fromkeys(evaluation_ids))
+    if len(evaluation_ids) > max_evaluations:
+        return jsonify({'error': f'Máximo {max_evaluations} evaluaciones por envío.'}), 400
+    if not email_configurado():
+        return jsonify({'error': 'El envío de emails no está configurado en el servidor.'}), 503
+
+    evaluations = {e.id: e for e in Evaluation.query.filter(
+        Evaluation.id.in_(evaluation_ids), Evaluation.user_id == current_user.id).all()}
+    pendientes, encolados, omitidos = [], [], []
+    for evaluation_id in evaluation_ids:
+        evaluation = evaluations.get(evaluation_id)
+        if evaluation is None:
+            omitidos.append({'evaluation_id': evaluation_id, 'error': 'Evaluación no encontrada.'})
+        elif not evaluation.patient or not evaluation.patient.email:
+            omitidos.append({'evaluation_id': evaluation_id, 'error': 'El paciente no tiene email registrado.'})
+        else:
+            mail = email_plan_pendiente(evaluation, current_user.id)
+            pendientes.append(mail)
+            encolados.append({'evaluation_id': evaluation_id, 'mail_id': mail.id})
+    mail_queue.enqueue_many(pendientes)
+    app.logger.info("Envío masivo: %s plan(es) encolado(s), %s omitido(s) (Usuario ID %s).",
+                    len(encolados), len(omitidos), current_user.id)
+    return jsonify({'queued': encolados, 'skipped': omitidos}), 202
+
+@app.route('/estado_email/<mail_id>', methods=['GET'])
+@login_required
+def estado_email(mail_id):
+    """Estado de un email encolado: status (queued/sending/sent/failed), intentos y último error."""
+    mail = mail_queue.get(mail_id, owner=current_user.id)
+    if mail is None:
+        return jsonify({'error': 'Email no encontrado o expirado.'}), 404
+    return jsonify(mail.snapshot())
 
 
 
@@ -4692,6 +5134,7 @@ def create_ingredient():
     try:
         db.session.add(new_ingredient)
         db.session.commit()
+        invalidate_ingredient_caches()
         return jsonify(new_ingredient.to_dict()), 201
     except Exception as e:
         db.session.rollback()
@@ -4733,6 +5176,7 @@ def update_ingredient(ingredient_id):
             nutrient_entry.fat_g = fat_g
 
     db.session.commit()
+    invalidate_ingredient_caches()
     return jsonify(ingredient.to_dict()), 200
 
 @app.route('/api/ingredients/<int:ingredient_id>', methods=['DELETE'])
@@ -4741,6 +5185,7 @@ def delete_ingredient(ingredient_id):
     ingredient = Ingredient.query.get_or_404(ingredient_id)
     db.session.delete(ingredient)
     db.session.commit()
+    invalidate_ingredient_caches()
     return jsonify({'message': 'Ingrediente eliminado correctamente.'}), 200
 
 
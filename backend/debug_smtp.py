@@ -0,0 +1,159 @@
+"""A local SMTP server that keeps what it receives, for development and tests.
+
+Point the app at it with ``MAIL_SERVER=localhost MAIL_PORT=1025
+MAIL_USE_TLS=False`` (and no ``MAIL_USERNAME``), then run::
+
+    python -m backend.debug_smtp --port 1025
+
+Every accepted message is printed and kept in :attr:`DebugSmtpServer.messages`.
+The server speaks just enough SMTP for :mod:`smtplib` (no TLS, no AUTH) and
+can be told to refuse recipients or to fail deliveries, which is how the
+mailer tests exercise retries and permanent failures.
+"""
+from __future__ import annotations
+
+import argparse
+import socketserver
+import threading
+from email import message_from_bytes, policy
+from email.message import EmailMessage
+from typing import List, NamedTuple, Set
+
+
+class ReceivedMail(NamedTuple):
+    mail_from: str
+    rcpt_tos: List[str]
+    data: bytes
+
+    def message(self) -> EmailMessage:
+        return message_from_bytes(self.data, policy=policy.default)
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    server: "DebugSmtpServer"
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self) -> None:
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply("220 debug-smtp ready")
+        mail_from, rcpt_tos = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command, _, arg = line.decode("utf-8", "replace").strip().partition(" ")
+            command = command.upper()
+            if command == "EHLO":
+                self.reply("250-debug-smtp")
+                self.reply("250 8BITMIME")
+            elif command == "HELO":
+                self.reply("250 debug-smtp")
+            elif command == "MAIL":
+                mail_from, rcpt_tos = _address(arg), []
+                self.reply("250 OK")
+            elif command == "RCPT":
+                address = _address(arg)
+                if address in server.refused:
+                    self.reply("550 No such user")
+                else:
+                    rcpt_tos.append(address)
+                    self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = self._read_data()
+                with server.lock:
+                    fail = server.fail_next > 0
+                    if fail:
+                        server.fail_next -= 1
+                    else:
+                        server.messages.append(ReceivedMail(mail_from, rcpt_tos, data))
+                if fail:
+                    self.reply("451 Try again later")
+                else:
+                    if server.echo:
+                        print(f"--- {mail_from} -> {', '.join(rcpt_tos)} ({len(data)} bytes)\n"
+                              f"{data.decode('utf-8', 'replace')}\n---", flush=True)
+                    self.reply("250 OK: queued")
+                mail_from, rcpt_tos = None, []
+            elif command in ("RSET", "NOOP"):
+                if command == "RSET":
+                    mail_from, rcpt_tos = None, []
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def _read_data(self) -> bytes:
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b".\r\n", b".\n"):
+                return b"".join(lines)
+            lines.append(line[1:] if line.startswith(b"..") else line)
+
+
+def _address(arg: str) -> str:
+    # "FROM:<a@b.c> SIZE=123" -> "a@b.c"
+    _, _, value = arg.partition(":")
+    return value.strip().split(" ")[0].strip("<>")
+
+
+class DebugSmtpServer(socketserver.ThreadingTCPServer):
+    """Threaded SMTP sink on ``host:port`` (port 0 picks a free one; see :attr:`port`).
+
+    ``refused`` recipients get a permanent 550; each unit of ``fail_next``
+    answers one message with a temporary 451 instead of accepting it.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, echo: bool = False):
+        super().__init__((host, port), _SmtpHandler)
+        self.messages: List[ReceivedMail] = []
+        self.refused: Set[str] = set()
+        self.fail_next = 0
+        self.connections = 0
+        self.echo = echo
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "DebugSmtpServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="debug-smtp", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> "DebugSmtpServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+if __name__ == "__main__":  # pragma: no cover - manual use
+    parser = argparse.ArgumentParser(description="Local SMTP server that prints the messages it receives.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    args = parser.parse_args()
+    server = DebugSmtpServer(args.host, args.port, echo=True)
+    print(f"debug-smtp listening on {args.host}:{server.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
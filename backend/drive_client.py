@@ -0,0 +1,237 @@
+"""Process-wide Google Drive client.
+
+Loading the service-account key and building the Drive service
+(``googleapiclient.discovery.build`` parses the whole discovery document)
+used to happen on every upload and download. :class:`DriveClient` does both
+once, on first use, and is shared by every thread: the service object only
+builds requests, while the HTTP transports (``httplib2.Http`` is not
+thread-safe) are authorized, keep-alive connections kept in a small pool. Each
+call checks one out and returns it when done, so a request thread of the
+threaded server reuses the connection an earlier thread left instead of
+opening its own. Credentials are refreshed under a lock shortly before they
+expire instead of on the first 401.
+
+:class:`FakeDrive` keeps uploaded files in memory behind the same interface
+(``upload``, ``download``, ``size``, ``read_range``, ``delete``), for tests
+and offline runs.
+"""
+from __future__ import annotations
+
+import contextlib
+import io
+import itertools
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional
+
+try:
+    import google_auth_httplib2  # type: ignore
+    import httplib2  # type: ignore
+    from googleapiclient.discovery import build  # type: ignore
+    from googleapiclient.errors import HttpError  # type: ignore
+    from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload  # type: ignore
+except Exception:  # pragma: no cover - allow missing dependency
+    google_auth_httplib2 = httplib2 = build = None  # type: ignore
+    HttpError = MediaIoBaseDownload = MediaIoBaseUpload = None  # type: ignore
+
+CHUNK_SIZE = 1024 * 1024
+PDF_MIMETYPE = "application/pdf"
+
+
+class DriveFileNotFound(Exception):
+    """The requested file id does not exist (or is not visible to the service account)."""
+
+
+def _rewind(data: Any) -> io.BytesIO:
+    if isinstance(data, (bytes, bytearray)):
+        return io.BytesIO(bytes(data))
+    data.seek(0)
+    return data
+
+
+class DriveClient:
+    """Drive v3 client built lazily from ``load_credentials()`` and shared between threads.
+
+    Up to ``pool_size`` idle transports are kept; a call that finds none idle
+    opens a new one, which is dropped on return if the pool is already full.
+    """
+
+    def __init__(self, load_credentials: Callable[[], Any], timeout: Optional[float] = 60,
+                 build_service: Optional[Callable[..., Any]] = None,
+                 make_http: Optional[Callable[[], Any]] = None, pool_size: int = 4):
+        self.load_credentials = load_credentials
+        self.timeout = timeout
+        self.pool_size = max(1, int(pool_size or 1))
+        self._build_service = build_service or (
+            lambda credentials: build("drive", "v3", credentials=credentials, cache_discovery=False))
+        self._make_http = make_http or (lambda: httplib2.Http(timeout=self.timeout))
+        self._lock = threading.Lock()
+        self._idle: "queue.LifoQueue[Any]" = queue.LifoQueue(maxsize=self.pool_size)
+        self._credentials: Any = None
+        self._service: Any = None
+        self.builds = 0
+        self.connects = 0
+
+    @property
+    def service(self) -> Any:
+        """The shared service object, built on first access."""
+        if self._service is None:
+            with self._lock:
+                if self._service is None:
+                    credentials = self.load_credentials()
+                    self._service = self._build_service(credentials)
+                    self._credentials = credentials
+                    self.builds += 1
+        return self._service
+
+    @contextlib.contextmanager
+    def http(self) -> Iterator[Any]:
+        """An authorized transport checked out of the pool for the ``with`` block, credentials refreshed if needed."""
+        self.service  # Builds the service (and loads the credentials) on first use
+        idle = self._idle
+        try:
+            http = idle.get_nowait()
+        except queue.Empty:
+            http = google_auth_httplib2.AuthorizedHttp(self._credentials, http=self._make_http())
+            with self._lock:
+                self.connects += 1
+        self._refresh_credentials()
+        try:
+            yield http
+        except Exception as error:
+            # An HTTP error status came with a complete response; anything else may leave the connection mid-request
+            if HttpError is not None and isinstance(error, HttpError):
+                self._release(idle, http)
+            raise
+        self._release(idle, http)
+
+    def _release(self, idle: "queue.LifoQueue[Any]", http: Any) -> None:
+        if idle is not self._idle:  # reset() since the checkout
+            return
+        try:
+            idle.put_nowait(http)
+        except queue.Full:
+            pass
+
+    def _refresh_credentials(self) -> None:
+        credentials = self._credentials
+        if credentials is None or getattr(credentials, "valid", True):
+            return
+        with self._lock:
+            # ``valid`` turns False a little before expiry, so requests never go out with a stale token
+            if not credentials.valid:
+                credentials.refresh(google_auth_httplib2.Request(self._make_http()))
+
+    def reset(self) -> None:
+        """Drop the service and the pooled transports (e.g. after rotating the key file)."""
+        with self._lock:
+            self._service = self._credentials = None
+            self._idle = queue.LifoQueue(maxsize=self.pool_size)
+
+    def upload(self, data: Any, name: str, folder_id: str, mimetype: str = PDF_MIMETYPE) -> Optional[str]:
+        """Upload ``data`` (bytes or a file-like object) into ``folder_id``; returns the new file id."""
+        media = MediaIoBaseUpload(fd=_rewind(data), mimetype=mimetype, chunksize=CHUNK_SIZE, resumable=True)
+        metadata = {"name": name, "parents": [folder_id]}
+        with self.http() as http:
+            created = self.service.files().create(body=metadata, media_body=media, fields="id").execute(http=http)
+        return created.get("id")
+
+    def download(self, file_id: str, on_progress: Optional[Callable[[float], None]] = None) -> io.BytesIO:
+        """Content of ``file_id`` in a rewound buffer; raises :class:`DriveFileNotFound` on 404."""
+        buffer = io.BytesIO()
+        try:
+            with self.http() as http:
+                request = self.service.files().get_media(fileId=file_id)
+                request.http = http
+                downloader = MediaIoBaseDownload(fd=buffer, request=request, chunksize=CHUNK_SIZE)
+                done = False
+                while not done:
+                    status, done = downloader.next_chunk()
+                    if status and on_progress:
+                        on_progress(status.progress())
+        except HttpError as error:
+            if getattr(error.resp, "status", None) == 404:
+                raise DriveFileNotFound(file_id) from error
+            raise
+        buffer.seek(0)
+        return buffer
+
+    def size(self, file_id: str) -> int:
+        """Size in bytes of ``file_id``; raises :class:`DriveFileNotFound` on 404."""
+        try:
+            with self.http() as http:
+                metadata = self.service.files().get(fileId=file_id, fields="size").execute(http=http)
+        except HttpError as error:
+            if getattr(error.resp, "status", None) == 404:
+                raise DriveFileNotFound(file_id) from error
+            raise
+        return int(metadata.get("size") or 0)
+
+    def read_range(self, file_id: str, start: int, end: int) -> bytes:
+        """Bytes ``start``..``end`` (inclusive) of ``file_id``, in one ranged request."""
+        request = self.service.files().get_media(fileId=file_id)
+        with self.http() as http:
+            response, content = http.request(request.uri, method="GET", headers={"range": f"bytes={start}-{end}"})
+        if response.status == 404:
+            raise DriveFileNotFound(file_id)
+        if response.status >= 400:
+            raise HttpError(response, content, uri=request.uri)
+        return content
+
+    def delete(self, file_id: str) -> None:
+        """Delete ``file_id``; a file that is already gone is not an error."""
+        try:
+            with self.http() as http:
+                self.service.files().delete(fileId=file_id).execute(http=http)
+        except HttpError as error:
+            if getattr(error.resp, "status", None) != 404:
+                raise
+
+
+class FakeDrive:
+    """In-memory Drive with the :class:`DriveClient` interface; ids are ``fake-1``, ``fake-2``..."""
+
+    def __init__(self) -> None:
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.uploads = 0
+        self.downloads = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def upload(self, data: Any, name: str, folder_id: str, mimetype: str = PDF_MIMETYPE) -> Optional[str]:
+        content = _rewind(data).read()
+        with self._lock:
+            file_id = f"fake-{next(self._ids)}"
+            self.files[file_id] = {"name": name, "parents": [folder_id], "mimetype": mimetype, "content": content}
+            self.uploads += 1
+        return file_id
+
+    def download(self, file_id: str, on_progress: Optional[Callable[[float], None]] = None) -> io.BytesIO:
+        with self._lock:
+            entry = self.files.get(file_id)
+            self.downloads += 1
+        if entry is None:
+            raise DriveFileNotFound(file_id)
+        if on_progress:
+            on_progress(1.0)
+        return io.BytesIO(entry["content"])
+
+    def _content(self, file_id: str) -> bytes:
+        with self._lock:
+            entry = self.files.get(file_id)
+        if entry is None:
+            raise DriveFileNotFound(file_id)
+        return entry["content"]
+
+    def size(self, file_id: str) -> int:
+        return len(self._content(file_id))
+
+    def read_range(self, file_id: str, start: int, end: int) -> bytes:
+        return self._content(file_id)[start:end + 1]
+
+    def delete(self, file_id: str) -> None:
+        with self._lock:
+            self.files.pop(file_id, None)
+
+    def reset(self) -> None:
+        """Nothing is cached outside ``files``; kept for interface parity."""
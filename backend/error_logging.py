@@ -0,0 +1,130 @@
+"""Non-blocking error logging for NutriApp.
+
+ERROR records are handed to a ``QueueHandler`` and written by a
+``QueueListener`` thread, so the request thread never waits on disk or on the
+traceback export. The export keeps a copy of the most recent error (with its
+traceback) in a separate file; bursts of errors are coalesced and the file is
+rewritten at most once per ``min_interval_seconds``.
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+DEFAULT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+DEFAULT_EXPORT_INTERVAL_SECONDS = 5.0
+
+
+class TracebackExporter(logging.Handler):
+    """Writes the latest record to ``path``, rate-limited with a trailing flush."""
+
+    def __init__(self, path: str, min_interval_seconds: float = DEFAULT_EXPORT_INTERVAL_SECONDS):
+        super().__init__(level=logging.ERROR)
+        self.path = path
+        self.min_interval = min_interval_seconds
+        self.exports = 0
+        self._pending: Optional[logging.LogRecord] = None
+        self._last_export: Optional[float] = None
+        self._timer: Optional[threading.Timer] = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Called with self.lock held (see logging.Handler.handle)
+        self._pending = record
+        now = time.monotonic()
+        if self._last_export is None or now - self._last_export >= self.min_interval:
+            self._export()
+        elif self._timer is None:
+            self._timer = threading.Timer(self.min_interval - (now - self._last_export), self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _export(self) -> None:
+        record, self._pending = self._pending, None
+        if record is None:
+            return
+        self._last_export = time.monotonic()
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as fh:
+                fh.write(self.format(record) + '\n')
+            os.replace(tmp_path, self.path)
+            self.exports += 1
+        except Exception:
+            self.handleError(record)
+
+    def _flush_from_timer(self) -> None:
+        self.acquire()
+        try:
+            self._timer = None
+            self._export()
+        finally:
+            self.release()
+
+    def flush(self) -> None:
+        self.acquire()
+        try:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._export()
+        finally:
+            self.release()
+
+    def close(self) -> None:
+        self.flush()
+        super().close()
+
+
+class ErrorLogPipeline:
+    """The queue listener plus its handlers; :meth:`stop` drains and closes them."""
+
+    def __init__(self, listener: logging.handlers.QueueListener, queue_handler: logging.Handler):
+        self.listener = listener
+        self.queue_handler = queue_handler
+        self._stopped = False
+
+    def stop(self) -> None:
+        if self._stopped:
+            return
+        self._stopped = True
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+
+
+def setup_error_logging(logger: logging.Logger, log_path: str, traceback_path: Optional[str] = None,
+                        min_interval_seconds: Optional[float] = None,
+                        fmt: str = DEFAULT_FORMAT) -> ErrorLogPipeline:
+    """Attach a ``QueueHandler`` for ERROR records to ``logger`` and start the listener.
+
+    Records go to ``log_path`` and, if ``traceback_path`` is given, the latest
+    one is exported there. The listener is stopped (and the export flushed)
+    at interpreter exit.
+    """
+    formatter = logging.Formatter(fmt)
+    file_handler = logging.FileHandler(log_path)
+    file_handler.setLevel(logging.ERROR)
+    file_handler.setFormatter(formatter)
+    handlers = [file_handler]
+    if traceback_path:
+        interval = DEFAULT_EXPORT_INTERVAL_SECONDS if min_interval_seconds is None else min_interval_seconds
+        exporter = TracebackExporter(traceback_path, interval)
+        exporter.setFormatter(formatter)
+        handlers.append(exporter)
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setLevel(logging.ERROR)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    logger.addHandler(queue_handler)
+
+    pipeline = ErrorLogPipeline(listener, queue_handler)
+    atexit.register(pipeline.stop)
+    return pipeline
@@ -0,0 +1,185 @@
+"""In-memory ingredient name resolution index for NutriApp.
+
+Replicates, without touching the database, the lookup cascade that
+``get_ingredient_nutritional_info`` used to run as successive ``ILIKE``
+queries: exact name, prefix, substring, synonym and first-token match.
+"""
+from __future__ import annotations
+
+import bisect
+import hashlib
+import json
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+
+class IngredientMatch(NamedTuple):
+    id: int
+    name: str
+    strategy: str
+
+
+def _parse_synonyms(raw: Optional[str]) -> List[str]:
+    """Decode ``synonyms_json`` exactly like ``Ingredient.get_synonyms``."""
+    try:
+        syns = json.loads(raw)
+        return [s.lower().strip() for s in syns if isinstance(s, str)]
+    except (json.JSONDecodeError, TypeError):
+        return []
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class IngredientIndex:
+    """Immutable lookup structure built from ``(id, name, synonyms_json)`` rows.
+
+    ``version`` is a digest of those rows, taken while building: equal rows
+    give the same version in every process, without reading the table again.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[int, str, Optional[str]]]):
+        self._names: Dict[int, str] = {}
+        self._exact: Dict[str, int] = {}
+        self._synonyms: Dict[str, int] = {}
+        # (lower_name, id) sorted lexicographically for prefix range scans
+        self._sorted: List[Tuple[str, int]] = []
+        # ids ordered by name length, the tie-break every ILIKE query used
+        self._by_length: List[int] = []
+        # trigram -> ids, narrows substring candidates before verification
+        self._trigrams: Dict[str, Set[int]] = {}
+        self._lower: Dict[int, str] = {}
+        digest = hashlib.sha1()
+
+        for ing_id, name, synonyms_json in sorted(rows, key=lambda r: r[0]):
+            digest.update(repr((ing_id, name, synonyms_json)).encode("utf-8"))
+            if not name:
+                continue
+            lower = name.lower()
+            self._names[ing_id] = name
+            self._lower[ing_id] = lower
+            self._exact.setdefault(lower, ing_id)
+            for syn in _parse_synonyms(synonyms_json):
+                self._synonyms.setdefault(syn, ing_id)
+            for gram in _trigrams(lower):
+                self._trigrams.setdefault(gram, set()).add(ing_id)
+
+        self._sorted = sorted((lower, ing_id) for ing_id, lower in self._lower.items())
+        self._by_length = sorted(self._lower, key=lambda i: (len(self._lower[i]), i))
+        self._rank = {ing_id: pos for pos, ing_id in enumerate(self._by_length)}
+        self.version = digest.hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _match(self, ing_id: int, strategy: str) -> IngredientMatch:
+        return IngredientMatch(ing_id, self._names[ing_id], strategy)
+
+    def _containing(self, needle: str) -> List[int]:
+        """Ids whose lowercase name contains ``needle``, shortest name first."""
+        if len(needle) >= 3:
+            postings = [self._trigrams.get(g, set()) for g in _trigrams(needle)]
+            postings.sort(key=len)
+            candidates = set.intersection(*postings) if postings else set()
+        else:
+            candidates = set(self._lower)
+        hits = [i for i in candidates if needle in self._lower[i]]
+        hits.sort(key=self._rank.__getitem__)
+        return hits
+
+    def exact(self, name: str) -> Optional[int]:
+        return self._exact.get(name)
+
+    def prefix(self, name: str) -> Optional[int]:
+        start = bisect.bisect_left(self._sorted, (name, -1))
+        best = None
+        for lower, ing_id in self._sorted[start:]:
+            if not lower.startswith(name):
+                break
+            if best is None or self._rank[ing_id] < self._rank[best]:
+                best = ing_id
+        return best
+
+    def substring(self, name: str) -> Optional[int]:
+        hits = self._containing(name)
+        return hits[0] if hits else None
+
+    def synonym(self, name: str) -> Optional[int]:
+        return self._synonyms.get(name)
+
+    def token(self, name: str) -> Optional[int]:
+        search_tokens = [t for t in name.split() if len(t) > 2]
+        if not search_tokens:
+            return None
+        first = search_tokens[0]
+        hits = self._containing(first)
+        if not hits:
+            return None
+        # Prefer names starting with the token, then shorter names
+        hits.sort(key=lambda i: (0 if self._lower[i].startswith(first) else 1, self._rank[i]))
+        return hits[0]
+
+    def resolve(self, normalized_name: str) -> Optional[IngredientMatch]:
+        """Run the exact/prefix/substring/synonym/token cascade on a lowercase name."""
+        if not normalized_name:
+            return None
+        ing_id = self.exact(normalized_name)
+        if ing_id is not None:
+            return self._match(ing_id, "Exact Match")
+        ing_id = self.prefix(normalized_name)
+        if ing_id is not None:
+            return self._match(ing_id, "Prefix Match")
+        if len(normalized_name) > 3:
+            ing_id = self.substring(normalized_name)
+            if ing_id is not None:
+                return self._match(ing_id, "Substring Match")
+        ing_id = self.synonym(normalized_name)
+        if ing_id is not None:
+            return self._match(ing_id, "Synonym Match")
+        if len(normalized_name.split()) > 1:
+            ing_id = self.token(normalized_name)
+            if ing_id is not None:
+                return self._match(ing_id, "Token-based Match")
+        return None
+
+
+class IngredientIndexCache:
+    """Process-wide holder that lazily (re)builds an :class:`IngredientIndex`.
+
+    ``loader`` returns the ``(id, name, synonyms_json)`` rows. The index is
+    rebuilt after :meth:`invalidate` or once ``ttl_seconds`` have elapsed,
+    which keeps other worker processes from serving a stale index forever.
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[Tuple[int, str, Optional[str]]]],
+                 ttl_seconds: Optional[float] = None):
+        self._loader = loader
+        self._ttl = ttl_seconds
+        self._index: Optional[IngredientIndex] = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self) -> bool:
+        if self._index is None:
+            return False
+        return not self._ttl or (time.monotonic() - self._built_at) < self._ttl
+
+    def get(self) -> IngredientIndex:
+        if self._is_fresh():
+            return self._index  # type: ignore[return-value]
+        with self._lock:
+            if not self._is_fresh():
+                self._index = IngredientIndex(self._loader())
+                self._built_at = time.monotonic()
+            return self._index  # type: ignore[return-value]
+
+    def version(self) -> str:
+        """Version of the index in use, built if there is none; unlike :meth:`get` it never rebuilds on TTL expiry."""
+        index = self._index
+        return index.version if index is not None else self.get().version
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._index = None
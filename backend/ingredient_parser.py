@@ -0,0 +1,251 @@
+"""Ingredient line parser for NutriApp recipes.
+
+Turns AI-generated recipe lines such as ``"*   1/2 taza de arroz (aprox. 100g)"``
+into ``{'item', 'quantity', 'unit', 'original_line'}``. Every pattern is
+compiled once at import time and results are memoized per raw line, since the
+same lines recur across plans, shopping lists and favorites.
+"""
+from __future__ import annotations
+
+import logging
+import re
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PARSE_CACHE_SIZE = 4096
+
+STRATEGY_PARENTHESIZED = "Parenthesized Std Qty + Item Re-Parse"
+STRATEGY_GENERAL = "General Pattern"
+STRATEGY_AL_GUSTO = "Al Gusto/Spice Default"
+STRATEGY_FALLBACK = "Fallback/Simple Item"
+
+LEADING_PHRASES = (
+    "bloque de ", "diente de ", "loncha de ", "filete de ",
+    "cabeza de ", "ramita de ", "hojas de ", "trozo de ",
+)
+
+# Applied once each, in this order; duplicates are intentional (a phrase may
+# be stripped again after a later one exposed it).
+TRAILING_PHRASES = (
+    "cocidos", "cocidas", "crudos", "crudas", "picados", "picadas", "molidos", "molidas", "rallados", "ralladas",
+    "cocido", "cocida", "crudo", "cruda", "picado", "picada", "molido", "molida", "rallado", "rallada",
+    "en cubos", "en trozos", "en juliana", "en rodajas", "en floretes", "fileteado", "troceado", "troceada", "laminado", "laminada",
+    "frescos", "frescas", "enteros", "enteras", "congelados", "congeladas", "secos", "secas",
+    "fresco", "fresca", "entero", "entera", "congelado", "congelada", "seco", "seca",
+    "medianos", "medianas", "pequeños", "pequeñas",
+    # "grandes" is left out on purpose: "huevo grande" is a valid name
+    "mediano", "mediana", "pequeño", "pequeña", "grande", "cortado", "cortada", "pelado", "pelada", "desmenuzado", "desmenuzada", "deshuesado", "deshuesada",
+    "maduro", "madura", "rallado", "rallada", r"etc\.", r"aprox\.",
+    "sin piel", "con piel", "deshuesado", "deshuesada", "escurrido", "escurrida", "en conserva", "al natural", "en agua",
+    "firme, prensado y", "firme", "prensado", "triturado", "virgen extra", "en lonchas", "asadas", "salteadas", "cocidas", "cocidos",
+)
+
+KNOWN_UNITS = {
+    'g': 'g', 'gramos': 'g', 'gr': 'g', 'grs': 'g', 'grm': 'g',
+    'ml': 'ml', 'mililitros': 'ml', 'mls': 'ml', 'mlt': 'ml', 'cc': 'ml',
+    'kg': 'g', 'kilos': 'g', 'kgs': 'g',
+    'l': 'ml', 'litros': 'ml', 'lts': 'ml', 'litro': 'ml',
+    'cucharadita': 'cucharadita', 'cdta': 'cucharadita', 'cucharaditas': 'cucharadita', 'cucharadita de té': 'cucharadita', 'cucharadita te': 'cucharadita', 'cdté': 'cucharadita',
+    'cucharada': 'cucharada', 'cda': 'cucharada', 'cucharadas': 'cucharada', 'cucharada sopera': 'cucharada', 'cs': 'cucharada', 'cdas': 'cucharada',
+    'taza': 'taza', 'tz': 'taza', 'tazas': 'taza',
+    'unidad': 'unidad', 'unidades': 'unidad', 'unid': 'unidad', 'u': 'unidad', 'un.': 'unidad',
+    'pieza': 'pieza', 'piezas': 'pieza', 'pz': 'pieza',
+    'filete': 'filete', 'filetes': 'filete',
+    'rebanada': 'rebanada', 'rebanadas': 'rebanada',
+    'porcion': 'porcion', 'porción': 'porcion', 'porciones': 'porcion',
+}
+_THOUSANDFOLD_UNITS = frozenset(['kg', 'kilos', 'kgs', 'l', 'litros', 'lts', 'litro'])
+
+# Units accepted inside a parenthesized quantity, e.g. "(aprox. 120g)"
+_PAREN_UNITS = {
+    'gramos': ('g', 1), 'gr': ('g', 1), 'grs': ('g', 1), 'grm': ('g', 1), 'g': ('g', 1),
+    'mililitros': ('ml', 1), 'ml': ('ml', 1), 'mls': ('ml', 1), 'mlt': ('ml', 1), 'cc': ('ml', 1),
+    'kilos': ('g', 1000), 'kg': ('g', 1000), 'kgs': ('g', 1000),
+    'litros': ('ml', 1000), 'lts': ('ml', 1000), 'l': ('ml', 1000), 'litro': ('ml', 1000),
+}
+
+AL_GUSTO_KEYWORDS = ("al gusto", "a gusto", "cantidad necesaria", "c.n.", "c/n", "a su gusto")
+PIZCA_SPICES = frozenset([
+    "sal y pimienta", "sal", "pimienta", "especias", "orégano", "comino",
+    "nuez moscada", "pimentón", "curry", "cúrcuma", "jengibre en polvo",
+    "ajo en polvo", "cebolla en polvo", "canela", "clavo molido", "laurel",
+    "tomillo", "romero", "albahaca", "perejil seco", "cilantro seco",
+])
+
+_PAREN_QTY_SUFFIX_RE = re.compile(
+    r"\s*\((?:aprox\.\s*)?[\d.,/\s]+(?:g|ml|kg|l|unidad|taza|cucharada|cucharadita|pizca|porcion|rebanada|filete|pieza)[a-zA-ZáéíóúñÑ]*\s*\)$",
+    re.IGNORECASE)
+# Trailing "(opcional)"-style notes; "Maíz (Zea mays)" is kept
+_PAREN_NOTE_SUFFIX_RE = re.compile(r"\s*\((?![^)]*Zea mays)(?:[^()]*?)\)$", re.IGNORECASE)
+_DIGIT_RE = re.compile(r"\d")
+_PAREN_NOTE_KEEP_IF = ('g', 'ml', 'kg', 'l', 'taza')
+_TRAILING_PHRASE_RES = tuple(
+    re.compile(rf"^(.*?)(?:,\s*|\s+)\b{re.escape(phrase)}\b\s*$", re.IGNORECASE)
+    for phrase in TRAILING_PHRASES
+)
+# Single alternation over all phrases: if it does not match, none of the
+# individual patterns can, which is the common case.
+_ANY_TRAILING_PHRASE_RE = re.compile(
+    r"(?:,\s*|\s+)\b(?:%s)\b\s*$" % "|".join(re.escape(p) for p in dict.fromkeys(TRAILING_PHRASES)),
+    re.IGNORECASE)
+_LEADING_QTY_RE = re.compile(r"^\s*(?:\d+/\d+\s+|\d+\s+(?:unidad(?:es)?\s+de\s+)?)", re.IGNORECASE)
+_TRAILING_FRACTION_RE = re.compile(r"\s+\d+/\d+$")
+
+_STD_PARENTHESIZED_RE = re.compile(
+    r"\((?:aprox\.\s*)?([\d.,/\s]+)\s*([gmkltzcs]+[a-zA-ZáéíóúñÑ]*)\s*\)", re.IGNORECASE)
+_QTY_UNIT = r"([\d.,/\s]+)\s*([a-zA-ZáéíóúÁÉÍÓÚñÑ]+(?:\s+de)?)"
+_QTY_FIRST_RE = re.compile(rf"^{_QTY_UNIT}\s+(.+)", re.IGNORECASE)
+_QTY_LAST_RE = re.compile(rf"(.+?)\s+{_QTY_UNIT}$", re.IGNORECASE)
+
+
+class ParsedLine(NamedTuple):
+    item: str
+    quantity: float
+    unit: str
+    strategy: str
+    # True when cleaning left nothing and the raw text was used as the item
+    used_raw_text: bool = False
+
+
+def _drop_note(match: "re.Match[str]") -> str:
+    text = match.group(0)
+    if not _DIGIT_RE.search(text) and not any(u in text.lower() for u in _PAREN_NOTE_KEEP_IF):
+        return ""
+    return text
+
+
+def _strip_trailing_phrases(name: str) -> str:
+    position = 0
+    while position < len(_TRAILING_PHRASE_RES) and _ANY_TRAILING_PHRASE_RE.search(name):
+        for index in range(position, len(_TRAILING_PHRASE_RES)):
+            match = _TRAILING_PHRASE_RES[index].match(name)
+            if match and match.group(1).strip():
+                name = match.group(1).strip()
+                position = index + 1
+                break
+        else:
+            break
+    return name
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def clean_item_name(name: str) -> str:
+    """Strip list markers, quantities, notes and descriptive words from an item name."""
+    cleaned = name.lstrip('*-• ').strip()
+    cleaned = cleaned.rstrip(':,*-.').strip()
+    cleaned = _PAREN_QTY_SUFFIX_RE.sub("", cleaned).strip()
+
+    for phrase in LEADING_PHRASES:
+        if cleaned.lower().startswith(phrase):
+            cleaned = cleaned[len(phrase):].strip()
+
+    cleaned = _PAREN_NOTE_SUFFIX_RE.sub(_drop_note, cleaned).strip()
+    cleaned = _strip_trailing_phrases(cleaned)
+    cleaned = _LEADING_QTY_RE.sub("", cleaned).strip()
+    cleaned = _TRAILING_FRACTION_RE.sub("", cleaned).strip()
+
+    if cleaned.lower().startswith("de ") and len(cleaned.split()) > 2:
+        cleaned = cleaned[3:].strip()
+    return cleaned.strip()
+
+
+def _parse_quantity(text: str) -> float:
+    if '/' in text:
+        num, den = map(float, text.split('/'))
+        return num / den if den != 0 else 0.0
+    return float(text.replace(',', '.'))
+
+
+def _parse_parenthesized(text: str) -> Optional[ParsedLine]:
+    match = _STD_PARENTHESIZED_RE.search(text)
+    if not match:
+        return None
+    qty_str = match.group(1).strip()
+    try:
+        quantity = _parse_quantity(qty_str)
+    except ValueError:
+        logger.warning("Could not parse parenthesized quantity %r in %r", qty_str, text)
+        return None
+    unit_info = _PAREN_UNITS.get(match.group(2).strip().lower())
+    if unit_info is None:
+        return None
+    unit, factor = unit_info
+    if factor != 1:
+        quantity *= factor
+    rest = text.replace(match.group(0), "").lstrip('*-• ').strip()
+    return ParsedLine(clean_item_name(rest), quantity, unit, STRATEGY_PARENTHESIZED)
+
+
+def _parse_general(text: str) -> Optional[ParsedLine]:
+    match = _QTY_FIRST_RE.match(text)
+    if match:
+        qty_str, unit_raw = match.group(1).strip(), match.group(2).strip()
+        item = match.group(3).lstrip('*-• ').strip()
+    else:
+        match = _QTY_LAST_RE.match(text)
+        if not match:
+            return None
+        item = match.group(1).lstrip('*-• ').strip()
+        if item and item.endswith(':'):
+            item = item[:-1].strip()
+        qty_str, unit_raw = match.group(2).strip(), match.group(3).strip()
+
+    try:
+        quantity = _parse_quantity(qty_str)
+    except ValueError:
+        logger.warning("Could not parse quantity %r in %r; falling back", qty_str, text)
+        return None
+
+    unit_key = unit_raw.lower().replace(" de", "").strip()
+    unit = KNOWN_UNITS.get(unit_key)
+    if unit:
+        if unit_key in _THOUSANDFOLD_UNITS:
+            quantity *= 1000
+    else:
+        # Not a unit ("pechuga", "diente"...): it belongs to the item name
+        item = f"{unit_raw} {item}".strip()
+        unit = "N/A"
+        if quantity == 1.0 or quantity == 0.5 or (0 < quantity < 2 and "/" in qty_str):
+            unit = "unidad"
+    return ParsedLine(clean_item_name(item), quantity, unit, STRATEGY_GENERAL)
+
+
+def _parse_fallback(text: str) -> ParsedLine:
+    item = clean_item_name(text)
+    lowered = text.lower()
+    if any(k in lowered for k in AL_GUSTO_KEYWORDS) or item.lower() in PIZCA_SPICES:
+        quantity, unit, strategy = 1.0, "pizca", STRATEGY_AL_GUSTO
+    else:
+        quantity, unit, strategy = 0.0, "N/A", STRATEGY_FALLBACK
+    if not item and text:
+        return ParsedLine(text.strip(), quantity, unit, strategy, True)
+    return ParsedLine(item, quantity, unit, strategy)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_line(line: str) -> ParsedLine:
+    """Parse a raw recipe line (memoized); see :func:`parse_ingredient_line`."""
+    text = line.lstrip('*').strip()
+    return _parse_parenthesized(text) or _parse_general(text) or _parse_fallback(text)
+
+
+def parse_ingredient_line(line: str) -> Dict[str, object]:
+    """Parse ``line`` into a fresh ``{'item', 'quantity', 'unit', 'original_line'}`` dict.
+
+    Standardized parenthesized quantities (g/ml/kg/l) win, then a leading or
+    trailing "quantity unit" pair, then "al gusto"/spice defaults (1 pizca).
+    """
+    parsed = parse_line(line)
+    return {'item': parsed.item, 'quantity': parsed.quantity, 'unit': parsed.unit, 'original_line': line}
+
+
+def cache_info() -> Tuple[object, object]:
+    """``lru_cache`` statistics for (line parsing, name cleaning)."""
+    return parse_line.cache_info(), clean_item_name.cache_info()
+
+
+def cache_clear() -> None:
+    parse_line.cache_clear()
+    clean_item_name.cache_clear()
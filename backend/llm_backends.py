@@ -0,0 +1,209 @@
+"""Text-generation backends used by plan generation.
+
+``generar_plan_nutricional_v2`` talks to an :class:`LLMBackend` instead of a
+``genai.GenerativeModel``. :class:`GeminiBackend` calls Gemini;
+:class:`ReplayBackend` answers from a recorded plan (structure plus
+recetario, the same text Gemini returns) after a configurable delay, so the
+generation and save paths can be exercised and load-tested offline.
+"""
+from __future__ import annotations
+
+import abc
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import google.generativeai as genai  # type: ignore
+except Exception:  # pragma: no cover - allow missing dependency
+    genai = None  # type: ignore
+
+from backend.prompt_builder import estimate_tokens
+from backend.recipe_batches import RECETARIO_MARKER, split_recipes
+
+PURPOSE_STRUCTURE = "structure"
+PURPOSE_RECIPES = "recipes"
+
+# "N°3. Lentejas guisadas" lines listing the dishes in a recipe prompt
+_REQUESTED_RECIPE_RE = re.compile(r"^[ \t]*N°(\d+)\.[ \t]*(.+?)[ \t]*$", re.MULTILINE)
+
+
+class GenerationResult(NamedTuple):
+    """Generated text; ``block_reason`` is not ``None`` when the response was blocked
+    (``text`` then holds whatever partial text was returned, possibly "").
+    ``usage`` has ``prompt_tokens``, ``output_tokens`` and ``total_tokens`` when known."""
+    text: str
+    block_reason: Any = None
+    block_message: str = ""
+    usage: Optional[Dict[str, int]] = None
+
+
+class LLMBackend(abc.ABC):
+    """Interface: :meth:`generate` one prompt, optionally streaming text to ``on_chunk``.
+
+    Instances are shared between concurrent plan generations, so ``generate`` must be thread-safe."""
+
+    name = "base"
+
+    def cache_context(self) -> Dict[str, Any]:
+        """Everything besides the prompt that determines the output (used in cache keys)."""
+        return {"backend": self.name}
+
+    def count_tokens(self, prompt: str) -> int:
+        """Prompt size in tokens, reported before sending (an estimate unless the backend can count)."""
+        return estimate_tokens(prompt)
+
+    @abc.abstractmethod
+    def generate(self, prompt: str, purpose: str = PURPOSE_STRUCTURE,
+                 on_chunk: Optional[Callable[[str], None]] = None) -> GenerationResult:
+        """Generate the response to ``prompt``, passing each text fragment to ``on_chunk`` as it arrives."""
+
+
+class GeminiBackend(LLMBackend):
+    """``genai.GenerativeModel`` with fixed generation config and safety settings."""
+
+    name = "gemini"
+
+    def __init__(self, model_name: str, generation_params: Dict[str, Any],
+                 safety_settings: Sequence[Dict[str, str]], exact_token_count: bool = False):
+        if genai is None:
+            raise RuntimeError("google-generativeai is not installed; the Gemini backend is unavailable.")
+        self.model_name = model_name
+        self.generation_params = dict(generation_params)
+        self.safety_settings = list(safety_settings)
+        self.exact_token_count = exact_token_count
+        self._model = genai.GenerativeModel(model_name)
+        self._generation_config = genai.types.GenerationConfig(**self.generation_params)
+
+    def cache_context(self) -> Dict[str, Any]:
+        return {"model": self.model_name, "generation_config": self.generation_params,
+                "safety_settings": self.safety_settings}
+
+    def count_tokens(self, prompt: str) -> int:
+        if not self.exact_token_count:
+            return estimate_tokens(prompt)
+        try:
+            return int(self._model.count_tokens(prompt).total_tokens)
+        except Exception:  # The count is informative only; never block generation on it
+            return estimate_tokens(prompt)
+
+    def generate(self, prompt: str, purpose: str = PURPOSE_STRUCTURE,
+                 on_chunk: Optional[Callable[[str], None]] = None) -> GenerationResult:
+        kwargs = {"generation_config": self._generation_config, "safety_settings": self.safety_settings}
+        if on_chunk is None:
+            return self.result_from_response(self._model.generate_content(prompt, **kwargs))
+        response = self._model.generate_content(prompt, stream=True, **kwargs)
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:  # Chunk without text (e.g. blocked); the reason is checked once resolved
+                text = ""
+            if text:
+                on_chunk(text)
+        response.resolve()
+        return self.result_from_response(response)
+
+    @staticmethod
+    def usage_from_response(response: Any) -> Optional[Dict[str, int]]:
+        metadata = getattr(response, "usage_metadata", None)
+        if metadata is None:
+            return None
+        usage = {
+            "prompt_tokens": getattr(metadata, "prompt_token_count", None),
+            "output_tokens": getattr(metadata, "candidates_token_count", None),
+            "total_tokens": getattr(metadata, "total_token_count", None),
+        }
+        return {key: int(value) for key, value in usage.items() if value is not None} or None
+
+    @classmethod
+    def result_from_response(cls, response: Any) -> GenerationResult:
+        usage = cls.usage_from_response(response)
+        if response.parts:
+            return GenerationResult(response.text, usage=usage)
+        feedback = getattr(response, "prompt_feedback", None)
+        reason = getattr(feedback, "block_reason", "Razón desconocida")
+        message = getattr(feedback, "block_reason_message", "")
+        partial = ""
+        candidates = getattr(response, "candidates", None)
+        if candidates:
+            content = getattr(candidates[0], "content", None)
+            if content is not None and content.parts:
+                partial = content.parts[0].text
+        return GenerationResult(partial, reason, message, usage)
+
+
+class ReplayBackend(LLMBackend):
+    """Deterministic offline backend replaying a recorded plan.
+
+    Structure prompts get the recorded structure. Recipe prompts get, for each
+    requested "N°X. Nombre" line, the recorded recipe N°X (or the first
+    recorded recipe when there is none) retitled as requested. Each call
+    waits ``latency_seconds`` before the first chunk and then streams the text
+    at ``chars_per_second`` (``None`` = all at once).
+    """
+
+    name = "replay"
+
+    def __init__(self, structure_text: str, recipes: Dict[int, str], latency_seconds: float = 0.0,
+                 chars_per_second: Optional[float] = None, chunk_chars: int = 200,
+                 sleep: Callable[[float], None] = time.sleep, label: str = ""):
+        if not recipes:
+            raise ValueError("The replay fixture has no recipes.")
+        self.structure_text = structure_text
+        self.recipes = dict(recipes)
+        self.latency_seconds = max(0.0, float(latency_seconds or 0.0))
+        self.chars_per_second = chars_per_second or None
+        self.chunk_chars = max(1, int(chunk_chars))
+        self.label = label
+        self.calls = 0
+        self._sleep = sleep
+        self._calls_lock = threading.Lock()
+
+    @classmethod
+    def from_plan_text(cls, plan_text: str, **kwargs: Any) -> "ReplayBackend":
+        structure, _, recetario = plan_text.partition(RECETARIO_MARKER)
+        return cls(structure.strip(), dict(split_recipes(recetario)), **kwargs)
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs: Any) -> "ReplayBackend":
+        with open(path, encoding="utf-8") as fh:
+            text = fh.read()
+        kwargs.setdefault("label", path)
+        return cls.from_plan_text(text, **kwargs)
+
+    def cache_context(self) -> Dict[str, Any]:
+        return {"backend": self.name, "fixture": self.label}
+
+    @staticmethod
+    def requested_recipes(prompt: str) -> List[Tuple[int, str]]:
+        return [(int(number), name) for number, name in _REQUESTED_RECIPE_RE.findall(prompt)]
+
+    def _recipe_block(self, number: int, name: str) -> str:
+        block = self.recipes.get(number) or self.recipes[min(self.recipes)]
+        _, _, body = block.partition("\n")
+        return f"Receta N°{number}: {name}\n{body}"
+
+    def render(self, prompt: str, purpose: str) -> str:
+        if purpose == PURPOSE_RECIPES:
+            blocks = [self._recipe_block(number, name) for number, name in self.requested_recipes(prompt)]
+            return RECETARIO_MARKER + "\n\n" + "\n\n".join(blocks) + "\n"
+        return self.structure_text
+
+    def generate(self, prompt: str, purpose: str = PURPOSE_STRUCTURE,
+                 on_chunk: Optional[Callable[[str], None]] = None) -> GenerationResult:
+        with self._calls_lock:
+            self.calls += 1
+        text = self.render(prompt, purpose)
+        if self.latency_seconds:
+            self._sleep(self.latency_seconds)
+        for start in range(0, len(text), self.chunk_chars):
+            chunk = text[start:start + self.chunk_chars]
+            if self.chars_per_second:
+                self._sleep(len(chunk) / self.chars_per_second)
+            if on_chunk is not None:
+                on_chunk(chunk)
+        # Replayed calls report estimated usage so token accounting can be load-tested
+        prompt_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        return GenerationResult(text, usage={"prompt_tokens": prompt_tokens, "output_tokens": output_tokens,
+                                             "total_tokens": prompt_tokens + output_tokens})
@@ -0,0 +1,225 @@
+"""Latency and token accounting for LLM calls made during plan generation.
+
+:class:`LLMMetrics` aggregates every call process-wide (counters plus
+fixed-bucket histograms per purpose) for the metrics endpoint.
+:class:`GenerationStats` collects the calls of a single plan so the totals
+can be stored with the evaluation that uses it; :class:`GenerationStatsStore`
+keeps those summaries server-side until the plan is saved, so clients only
+hand back an id.
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS_SECONDS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+TOKEN_BUCKETS = (500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+RECIPE_BUCKETS = (0, 2, 4, 6, 8, 10, 14, 20)
+
+_USAGE_KEYS = ("prompt_tokens", "output_tokens", "total_tokens")
+
+
+class Histogram:
+    """Fixed-bucket histogram; :meth:`to_dict` reports cumulative counts (observations <= bound)."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self) -> Dict[str, Any]:
+        cumulative, running = {}, 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            running += count
+            cumulative[str(bound)] = running
+        return {"count": self.count, "sum": round(self.sum, 6), "buckets": cumulative}
+
+
+class _PurposeStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.blocked = 0
+        self.partial_fallbacks = 0
+        self.tokens = {key: 0 for key in _USAGE_KEYS}
+        self.calls_without_usage = 0
+        self.latency = Histogram(LATENCY_BUCKETS_SECONDS)
+        self.first_chunk = Histogram(LATENCY_BUCKETS_SECONDS)
+        self.prompt_tokens = Histogram(TOKEN_BUCKETS)
+        self.output_tokens = Histogram(TOKEN_BUCKETS)
+        self.block_reasons: Dict[str, int] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls, "errors": self.errors, "cache_hits": self.cache_hits,
+            "blocked": self.blocked, "partial_fallbacks": self.partial_fallbacks,
+            "block_reasons": dict(self.block_reasons), "tokens": dict(self.tokens),
+            "calls_without_usage": self.calls_without_usage,
+            "latency_seconds": self.latency.to_dict(), "first_chunk_seconds": self.first_chunk.to_dict(),
+            "prompt_tokens": self.prompt_tokens.to_dict(), "output_tokens": self.output_tokens.to_dict(),
+        }
+
+
+def call_record(purpose: str, latency_seconds: float, usage: Optional[Dict[str, int]] = None,
+                block_reason: Any = None, partial: bool = False, cache_hit: bool = False,
+                first_chunk_seconds: Optional[float] = None, error: Optional[str] = None,
+                prompt_chars: Optional[int] = None, prompt_tokens_estimate: Optional[int] = None) -> Dict[str, Any]:
+    """One call as a JSON-serialisable dict (the unit shared by both collectors)."""
+    record: Dict[str, Any] = {"purpose": purpose, "latency_seconds": round(latency_seconds, 4),
+                              "cache_hit": cache_hit}
+    if usage:
+        record.update({key: usage[key] for key in _USAGE_KEYS if usage.get(key) is not None})
+    if first_chunk_seconds is not None:
+        record["first_chunk_seconds"] = round(first_chunk_seconds, 4)
+    if prompt_chars is not None:
+        record["prompt_chars"] = prompt_chars
+    if prompt_tokens_estimate is not None:
+        record["prompt_tokens_estimate"] = prompt_tokens_estimate
+    if block_reason is not None:
+        record["block_reason"] = str(block_reason)
+        record["partial"] = partial
+    if error:
+        record["error"] = error
+    return record
+
+
+class LLMMetrics:
+    """Process-wide aggregates, keyed by call purpose ("structure", "recipes")."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._by_purpose: Dict[str, _PurposeStats] = {}
+            self._plans = 0
+            self._plans_failed = 0
+            self._recipes = Histogram(RECIPE_BUCKETS)
+            self._plan_latency = Histogram(LATENCY_BUCKETS_SECONDS)
+            self._since = time.time()
+
+    def record_call(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            stats = self._by_purpose.setdefault(record["purpose"], _PurposeStats())
+            stats.calls += 1
+            if record.get("error"):
+                stats.errors += 1
+                return
+            if record.get("cache_hit"):
+                stats.cache_hits += 1
+                return
+            stats.latency.observe(record["latency_seconds"])
+            if "first_chunk_seconds" in record:
+                stats.first_chunk.observe(record["first_chunk_seconds"])
+            if "prompt_tokens" in record or "output_tokens" in record:
+                for key in _USAGE_KEYS:
+                    stats.tokens[key] += record.get(key) or 0
+                if record.get("prompt_tokens") is not None:
+                    stats.prompt_tokens.observe(record["prompt_tokens"])
+                if record.get("output_tokens") is not None:
+                    stats.output_tokens.observe(record["output_tokens"])
+            else:
+                stats.calls_without_usage += 1
+            if "block_reason" in record:
+                stats.blocked += 1
+                stats.block_reasons[record["block_reason"]] = stats.block_reasons.get(record["block_reason"], 0) + 1
+                if record.get("partial"):
+                    stats.partial_fallbacks += 1
+
+    def record_plan(self, recipes: int, latency_seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            self._plans += 1
+            if not ok:
+                self._plans_failed += 1
+                return
+            self._recipes.observe(recipes)
+            self._plan_latency.observe(latency_seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "since": self._since,
+                "plans": {"total": self._plans, "failed": self._plans_failed,
+                          "recipes_per_plan": self._recipes.to_dict(),
+                          "latency_seconds": self._plan_latency.to_dict()},
+                "calls": {purpose: stats.to_dict() for purpose, stats in sorted(self._by_purpose.items())},
+            }
+
+
+class GenerationStats:
+    """Calls of one plan generation; :meth:`summary` is what gets stored with the evaluation."""
+
+    def __init__(self):
+        self.calls: List[Dict[str, Any]] = []
+        self.recipes: Optional[int] = None
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add_call(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self.calls.append(record)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = list(self.calls)
+        totals = {key: sum(c.get(key) or 0 for c in calls) for key in _USAGE_KEYS}
+        return {
+            "calls": calls,
+            "recipes": self.recipes,
+            "elapsed_seconds": round(self.elapsed(), 4),
+            "model_calls": sum(1 for c in calls if not c.get("cache_hit")),
+            "cache_hits": sum(1 for c in calls if c.get("cache_hit")),
+            "blocked": sum(1 for c in calls if "block_reason" in c),
+            **totals,
+        }
+
+
+class GenerationStatsStore:
+    """Recent :meth:`GenerationStats.summary` results by generation id, for the evaluation that saves the plan.
+
+    Holds at most ``max_entries`` summaries (oldest dropped first) for up to
+    ``ttl_seconds``. Like plan jobs, entries live in this process's memory.
+    """
+
+    def __init__(self, max_entries: int = 500, ttl_seconds: float = 24 * 3600):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[Hashable, float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, owner: Hashable, summary: Dict[str, Any]) -> str:
+        """Keep ``summary`` for ``owner``; returns the id to claim it with."""
+        generation_id = uuid.uuid4().hex
+        with self._lock:
+            self._entries[generation_id] = (owner, time.time(), summary)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return generation_id
+
+    def get(self, generation_id: Any, owner: Hashable) -> Optional[Dict[str, Any]]:
+        """The summary stored under ``generation_id`` by ``owner``, or ``None`` (unknown, expired, or not theirs)."""
+        if not isinstance(generation_id, str):
+            return None
+        with self._lock:
+            entry = self._entries.get(generation_id)
+        if entry is None or entry[0] != owner:
+            return None
+        _, created_at, summary = entry
+        if self.ttl_seconds and time.time() - created_at > self.ttl_seconds:
+            return None
+        return summary
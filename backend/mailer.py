@@ -0,0 +1,439 @@
+"""Outbound e-mail: pooled SMTP connections and a background send queue.
+
+Sending used to open a connection, run STARTTLS and LOGIN, send one message
+and QUIT on every call, inside the request. Here request handlers only
+:meth:`MailQueue.enqueue`; worker threads take up to ``batch_size`` due
+messages at a time and deliver them over one connection from an
+:class:`SmtpPool`, which keeps logged-in connections open between batches
+(checked with NOOP after being idle, replaced after ``max_messages``).
+
+A message that fails with a temporary error (connection dropped, 4xx reply)
+goes back to the queue with exponential backoff, up to ``max_attempts``
+deliveries; permanent errors (5xx replies, refused recipients, bad login)
+fail it at once. A queued item may carry a ``build`` callable instead of a
+ready message, so expensive parts (e.g. rendering a PDF attachment) run in
+the worker rather than in the request.
+
+The queue lives in the memory of the process that accepted the message:
+messages still waiting when the process exits are lost (see
+:meth:`MailQueue.close`, which gives them a short grace period).
+"""
+from __future__ import annotations
+
+import contextlib
+import heapq
+import itertools
+import logging
+import smtplib
+import ssl
+import threading
+import time
+import uuid
+from email.message import EmailMessage
+from typing import Any, Callable, ContextManager, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+Attachment = Tuple[str, bytes, str]  # (filename, content, MIME type)
+
+
+class MailError(Exception):
+    """A message that cannot be sent, whatever the number of attempts."""
+
+
+def build_message(sender: str, recipient: str, subject: str, html: str,
+                  attachments: Iterable[Attachment] = ()) -> EmailMessage:
+    """An HTML message with optional attachments (``(filename, content, "type/subtype")``)."""
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = recipient
+    msg["Subject"] = subject
+    msg.set_content(html, subtype="html", charset="utf-8")
+    for filename, content, mime_type in attachments:
+        maintype, _, subtype = (mime_type or "application/octet-stream").partition("/")
+        msg.add_attachment(content, maintype=maintype, subtype=subtype, filename=filename)
+    return msg
+
+
+def smtp_connector(host: str, port: int, use_ssl: bool = False, use_tls: bool = True,
+                   username: Optional[str] = None, password: Optional[str] = None,
+                   timeout: float = 30) -> Callable[[], smtplib.SMTP]:
+    """Factory of connected (and, if ``username`` is set, logged-in) SMTP clients."""
+
+    def connect() -> smtplib.SMTP:
+        if use_ssl:
+            smtp = smtplib.SMTP_SSL(host, port, timeout=timeout, context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(host, port, timeout=timeout)
+        try:
+            if use_tls and not use_ssl:
+                smtp.ehlo()
+                smtp.starttls(context=ssl.create_default_context())
+                smtp.ehlo()
+            if username:
+                smtp.login(username, password or "")
+        except Exception:
+            smtp.close()
+            raise
+        return smtp
+
+    return connect
+
+
+def is_permanent(exc: BaseException) -> bool:
+    """Whether retrying ``exc`` cannot help (5xx reply, refused recipients, bad login, unbuildable message)."""
+    if isinstance(exc, (MailError, smtplib.SMTPRecipientsRefused, smtplib.SMTPAuthenticationError,
+                        smtplib.SMTPNotSupportedError)):
+        return True
+    code = getattr(exc, "smtp_code", None)
+    return isinstance(code, int) and code >= 500
+
+
+def _connection_broken(exc: BaseException) -> bool:
+    # SMTPException subclasses OSError; other OSErrors are socket failures
+    return isinstance(exc, smtplib.SMTPServerDisconnected) or (
+        isinstance(exc, OSError) and not isinstance(exc, smtplib.SMTPResponseException)
+        and not isinstance(exc, smtplib.SMTPRecipientsRefused))
+
+
+class _Connection:
+    def __init__(self, smtp: smtplib.SMTP, now: float):
+        self.smtp = smtp
+        self.messages = 0
+        self.last_used = now
+
+
+class SmtpPool:
+    """Up to ``size`` idle connections from ``connect()``, reused between sends.
+
+    An idle connection is dropped after ``idle_timeout`` seconds and checked
+    with NOOP before reuse once idle for ``check_after`` seconds; a connection
+    that has sent ``max_messages`` messages is closed.
+    """
+
+    def __init__(self, connect: Callable[[], smtplib.SMTP], size: int = 2, idle_timeout: float = 60,
+                 check_after: float = 5, max_messages: int = 100, clock: Callable[[], float] = time.monotonic):
+        self.connect = connect
+        self.size = max(1, int(size or 1))
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.max_messages = max(1, int(max_messages or 1))
+        self.clock = clock
+        self.connects = 0
+        self._idle: List[_Connection] = []
+        self._lock = threading.Lock()
+
+    def send_many(self, messages: Sequence[EmailMessage]) -> List[Optional[Exception]]:
+        """Send ``messages`` in order over pooled connections; the error of each one, or ``None`` if sent."""
+        errors: List[Optional[Exception]] = []
+        conn: Optional[_Connection] = None
+        try:
+            for index, msg in enumerate(messages):
+                if conn is None:
+                    try:
+                        conn = self._acquire()
+                    except Exception as exc:
+                        # Cannot reach the server: the rest of the batch would fail the same way
+                        errors.extend([exc] * (len(messages) - index))
+                        break
+                try:
+                    conn.smtp.send_message(msg)
+                    conn.messages += 1
+                    errors.append(None)
+                except Exception as exc:
+                    errors.append(exc)
+                    if _connection_broken(exc):
+                        self._close(conn)
+                        conn = None
+                if conn is not None and conn.messages >= self.max_messages:
+                    self._quit(conn)
+                    conn = None
+        finally:
+            if conn is not None:
+                self._release(conn)
+        return errors
+
+    def _acquire(self) -> _Connection:
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                break
+            idle = self.clock() - conn.last_used
+            if idle >= self.idle_timeout:
+                self._quit(conn)
+                continue
+            if idle >= self.check_after and not self._alive(conn):
+                self._close(conn)
+                continue
+            return conn
+        smtp = self.connect()
+        with self._lock:
+            self.connects += 1
+        return _Connection(smtp, self.clock())
+
+    def _release(self, conn: _Connection) -> None:
+        conn.last_used = self.clock()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        self._quit(conn)
+
+    @staticmethod
+    def _alive(conn: _Connection) -> bool:
+        try:
+            return conn.smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    @staticmethod
+    def _quit(conn: _Connection) -> None:
+        try:
+            conn.smtp.quit()
+        except Exception:
+            SmtpPool._close(conn)
+
+    @staticmethod
+    def _close(conn: _Connection) -> None:
+        try:
+            conn.smtp.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        """QUIT every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._quit(conn)
+
+
+class OutgoingMail:
+    """One queued message and its delivery state."""
+
+    def __init__(self, message: Optional[EmailMessage] = None,
+                 build: Optional[Callable[[], Optional[EmailMessage]]] = None,
+                 owner: Optional[Hashable] = None, description: str = ""):
+        if (message is None) == (build is None):
+            raise ValueError("Give either a message or a build callable")
+        self.id = uuid.uuid4().hex
+        self.message = message
+        self.build = build
+        self.owner = owner
+        self.description = description
+        self.state = QUEUED
+        self.attempts = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def recipient(self) -> Optional[str]:
+        return self.message["To"] if self.message is not None else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-serialisable copy of the delivery state."""
+        return {
+            "mail_id": self.id,
+            "status": self.state,
+            "attempts": self.attempts,
+            "error": self.error,
+            "description": self.description,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class MailQueue:
+    """Messages waiting for delivery, sent by ``workers`` threads in batches.
+
+    ``send_batch(messages)`` returns one error (or ``None``) per message, e.g.
+    :meth:`SmtpPool.send_many`. Builds and ``on_failure(mail)`` run inside
+    ``context()`` (e.g. a Flask app context). Worker threads start on the first
+    enqueue; finished mails stay pollable for ``retention_seconds``.
+    """
+
+    def __init__(self, send_batch: Callable[[Sequence[EmailMessage]], Sequence[Optional[Exception]]],
+                 workers: int = 1, batch_size: int = 20, max_attempts: int = 5, backoff_seconds: float = 10.0,
+                 retention_seconds: float = 3600,
+                 context: Callable[[], ContextManager[Any]] = contextlib.nullcontext,
+                 on_failure: Optional[Callable[[OutgoingMail], None]] = None,
+                 thread_name_prefix: str = "mail"):
+        self.send_batch = send_batch
+        self.workers = max(1, int(workers or 1))
+        self.batch_size = max(1, int(batch_size or 1))
+        self.max_attempts = max(1, int(max_attempts or 1))
+        self.backoff_seconds = backoff_seconds
+        self.retention_seconds = retention_seconds
+        self.context = context
+        self.on_failure = on_failure
+        self.thread_name_prefix = thread_name_prefix
+        self.sent = 0
+        self.failed = 0
+        self._mails: Dict[str, OutgoingMail] = {}
+        self._due: List[Tuple[float, int, OutgoingMail]] = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._threads: List[threading.Thread] = []
+        self._closing = False
+        self._cond = threading.Condition()
+
+    def enqueue(self, message: Optional[EmailMessage] = None,
+                build: Optional[Callable[[], Optional[EmailMessage]]] = None,
+                owner: Optional[Hashable] = None, description: str = "") -> OutgoingMail:
+        """Queue ``message`` (or the message ``build()`` returns in the worker) for delivery."""
+        return self.enqueue_many([OutgoingMail(message, build, owner, description)])[0]
+
+    def enqueue_many(self, mails: Sequence[OutgoingMail]) -> List[OutgoingMail]:
+        """Queue several :class:`OutgoingMail` at once; they go out in batches of ``batch_size``."""
+        now = time.monotonic()
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("Mail queue is closed")
+            self._purge_finished()
+            for mail in mails:
+                self._mails[mail.id] = mail
+                heapq.heappush(self._due, (now, next(self._seq), mail))
+            self._start_workers()
+            self._cond.notify_all()
+        return list(mails)
+
+    def get(self, mail_id: str, owner: Optional[Hashable] = None) -> Optional[OutgoingMail]:
+        """The mail, or ``None`` if unknown, purged, or (when given) owned by someone else."""
+        with self._cond:
+            self._purge_finished()
+            mail = self._mails.get(mail_id)
+        if mail is None or (owner is not None and mail.owner != owner):
+            return None
+        return mail
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._due) + self._in_flight
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until nothing is queued, waiting for a retry or being sent; ``False`` on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._due or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 10) -> bool:
+        """Stop accepting mail, give the queue ``timeout`` seconds to drain, then stop the workers."""
+        with self._cond:
+            self._closing = True
+        drained = self.flush(timeout)
+        with self._cond:
+            self._due.clear()
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        return drained
+
+    def _start_workers(self) -> None:
+        # Called with self._cond held
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"{self.thread_name_prefix}-{len(self._threads)}",
+                                      daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _next_batch(self) -> Optional[List[OutgoingMail]]:
+        with self._cond:
+            while True:
+                if self._closing and not self._due:
+                    return None
+                now = time.monotonic()
+                if self._due and self._due[0][0] <= now:
+                    break
+                self._cond.wait(self._due[0][0] - now if self._due else None)
+            batch = []
+            while self._due and self._due[0][0] <= now and len(batch) < self.batch_size:
+                mail = heapq.heappop(self._due)[2]
+                mail.state = SENDING
+                mail.attempts += 1
+                batch.append(mail)
+            self._in_flight += len(batch)
+            return batch
+
+    def _work(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._deliver(batch)
+            except Exception as exc:  # pragma: no cover - _deliver handles its own errors
+                logger.exception("Mail worker error")
+                for mail in batch:
+                    if mail.state == SENDING:
+                        self._finish(mail, exc)
+            finally:
+                with self._cond:
+                    self._in_flight -= len(batch)
+                    self._cond.notify_all()
+
+    def _deliver(self, batch: List[OutgoingMail]) -> None:
+        with self.context():
+            ready = []
+            for mail in batch:
+                if mail.message is None:
+                    try:
+                        mail.message = mail.build()
+                        if mail.message is None:
+                            raise MailError("nothing to send")
+                    except Exception as exc:
+                        self._finish(mail, exc)
+                        continue
+                ready.append(mail)
+            if ready:
+                try:
+                    errors = list(self.send_batch([mail.message for mail in ready]))
+                except Exception as exc:
+                    errors = [exc] * len(ready)
+                for mail, error in zip(ready, errors):
+                    self._finish(mail, error)
+
+    def _finish(self, mail: OutgoingMail, error: Optional[BaseException]) -> None:
+        if error is None:
+            with self._cond:
+                mail.state, mail.error, mail.finished_at = SENT, None, time.time()
+                self.sent += 1
+            return
+        mail.error = str(error) or error.__class__.__name__
+        if not is_permanent(error) and mail.attempts < self.max_attempts:
+            delay = self.backoff_seconds * 2 ** (mail.attempts - 1)
+            logger.warning("Mail %s to %s failed (attempt %d), retrying in %.1fs: %s",
+                           mail.id, mail.recipient, mail.attempts, delay, mail.error)
+            with self._cond:
+                mail.state = QUEUED
+                if not self._closing:
+                    heapq.heappush(self._due, (time.monotonic() + delay, next(self._seq), mail))
+                    self._cond.notify_all()
+                    return
+        with self._cond:
+            mail.state, mail.finished_at = FAILED, time.time()
+            self.failed += 1
+        if self.on_failure is not None:
+            try:
+                self.on_failure(mail)
+            except Exception:  # pragma: no cover - a failing hook must not stop the worker
+                logger.exception("Mail on_failure hook error")
+
+    def _purge_finished(self) -> None:
+        # Called with self._cond held
+        cutoff = time.time() - self.retention_seconds
+        expired = [mail_id for mail_id, mail in self._mails.items()
+                   if mail.finished_at is not None and mail.finished_at < cutoff]
+        for mail_id in expired:
+            del self._mails[mail_id]
@@ -0,0 +1,236 @@
+"""Dense columnar nutrient matrix for NutriApp recipe totals.
+
+One row per ingredient (its reference ``IngredientNutrient`` entry) and one
+column per nutrient: calories, macros and every micronutrient key written by
+``populate_ingredients.py`` from the BDcsv.csv header. Recipe totals become a
+gather of the recipe rows followed by a single weighted product.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover - allow missing dependency
+    np = None  # type: ignore
+
+
+MACRO_KEYS = ["calories", "protein_g", "carb_g", "fat_g"]
+
+# Micronutrient keys in BDcsv.csv header order (see populate_ingredients.header_map)
+MICRONUTRIENT_KEYS = [
+    "agua_g", "ac_grasos_saturados_g", "ac_grasos_monoinsaturados_g",
+    "ac_grasos_poliinsaturados_g", "agpw6_g", "agpw3_g", "colesterol_mg",
+    "fibra_dietetica_g", "cenizas_g", "sodio_mg", "potasio_mg", "calcio_mg",
+    "fosforo_mg", "hierro_mg", "zinc_mg", "tiamina_mg", "riboflavina_mg",
+    "niacina_mg", "vitamina_c_mg",
+]
+
+# (ingredient_id, reference_quantity, reference_unit, calories, protein_g, carb_g, fat_g, micros)
+NutrientRecord = Tuple[int, float, str, Optional[float], Optional[float], Optional[float], Optional[float], Dict[str, Any]]
+
+_VALUES_FILE = "values.npy"
+_PRESENT_FILE = "present.npy"
+_META_FILE = "meta.json"
+
+
+def is_available() -> bool:
+    return np is not None
+
+
+class NutrientMatrix:
+    """Rows are ingredients, columns are ``MACRO_KEYS`` followed by micronutrients."""
+
+    def __init__(self, ingredient_ids: Sequence[int], reference_quantities: Sequence[float],
+                 reference_units: Sequence[str], columns: Sequence[str], values, present,
+                 extras: Optional[Dict[int, Dict[str, Any]]] = None, fingerprint: Any = None):
+        self.ingredient_ids = list(ingredient_ids)
+        self.reference_quantities = list(reference_quantities)
+        self.reference_units = list(reference_units)
+        self.columns = list(columns)
+        self.values = values
+        self.present = present
+        # Non-numeric micronutrient values per row, copied as-is (never scaled)
+        self.extras = extras or {}
+        self.fingerprint = fingerprint
+        self._row_by_id = {ing_id: row for row, ing_id in enumerate(self.ingredient_ids)}
+
+    @classmethod
+    def from_records(cls, records: Iterable[NutrientRecord], fingerprint: Any = None) -> "NutrientMatrix":
+        if np is None:
+            raise RuntimeError("numpy is not installed; the nutrient matrix is unavailable.")
+        records = list(records)
+        columns = list(MACRO_KEYS) + list(MICRONUTRIENT_KEYS)
+        col_index = {c: j for j, c in enumerate(columns)}
+        for record in records:
+            for key, value in record[7].items():
+                if key not in col_index and isinstance(value, (int, float)):
+                    col_index[key] = len(columns)
+                    columns.append(key)
+
+        values = np.zeros((len(records), len(columns)), dtype=np.float64)
+        present = np.zeros((len(records), len(columns)), dtype=bool)
+        extras: Dict[int, Dict[str, Any]] = {}
+        ids, ref_qty, ref_unit = [], [], []
+        for row, (ing_id, qty, unit, cal, prot, carb, fat, micros) in enumerate(records):
+            ids.append(ing_id)
+            ref_qty.append(qty)
+            ref_unit.append(unit)
+            for j, macro in enumerate((cal, prot, carb, fat)):
+                values[row, j] = macro if macro is not None else 0.0
+            for key, value in micros.items():
+                if isinstance(value, (int, float)):
+                    values[row, col_index[key]] = value
+                    present[row, col_index[key]] = True
+                else:
+                    extras.setdefault(row, {})[key] = value
+        return cls(ids, ref_qty, ref_unit, columns, values, present, extras, fingerprint)
+
+    def __len__(self) -> int:
+        return len(self.ingredient_ids)
+
+    def row(self, ingredient_id: int) -> Optional[int]:
+        return self._row_by_id.get(ingredient_id)
+
+    def reference(self, row: int) -> Tuple[float, str]:
+        return self.reference_quantities[row], self.reference_units[row]
+
+    def totals(self, rows: Sequence[int], factors: Sequence[float]) -> Dict[str, Any]:
+        """Recipe totals as ``factors @ values[rows]``.
+
+        Macros are rounded to 2 decimals per ingredient before summing, the
+        same way ``get_ingredient_nutritional_info`` does.
+        """
+        result: Dict[str, Any] = {key: 0.0 for key in MACRO_KEYS}
+        result["micros"] = {}
+        if not rows:
+            return result
+        rows_arr = np.asarray(rows, dtype=np.intp)
+        weights = np.asarray(factors, dtype=np.float64)
+        block = self.values[rows_arr]
+
+        n_macros = len(MACRO_KEYS)
+        for j, key in enumerate(MACRO_KEYS):
+            result[key] = sum(round(float(v) * f, 2) for v, f in zip(block[:, j], factors))
+
+        micro_sums = weights @ block[:, n_macros:]
+        micro_present = self.present[rows_arr, n_macros:].any(axis=0)
+        micros: Dict[str, Any] = {}
+        for j in np.flatnonzero(micro_present):
+            micros[self.columns[n_macros + j]] = float(micro_sums[j])
+        for row in rows:
+            micros.update(self.extras.get(row, {}))
+        result["micros"] = micros
+        return result
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        # Write to temporary files and rename: other processes may have the
+        # previous arrays memory-mapped.
+        for name, array in ((_VALUES_FILE, self.values), (_PRESENT_FILE, self.present)):
+            tmp_path = os.path.join(directory, name + ".tmp")
+            with open(tmp_path, "wb") as fh:
+                np.save(fh, array)
+            os.replace(tmp_path, os.path.join(directory, name))
+        meta = {
+            "ingredient_ids": self.ingredient_ids,
+            "reference_quantities": self.reference_quantities,
+            "reference_units": self.reference_units,
+            "columns": self.columns,
+            "extras": {str(k): v for k, v in self.extras.items()},
+            "fingerprint": self.fingerprint,
+        }
+        tmp_path = os.path.join(directory, _META_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(meta, fh)
+        os.replace(tmp_path, os.path.join(directory, _META_FILE))
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> Optional["NutrientMatrix"]:
+        """Load a saved matrix (memory-mapped by default); ``None`` if missing or unreadable."""
+        if np is None:
+            return None
+        try:
+            with open(os.path.join(directory, _META_FILE), encoding="utf-8") as fh:
+                meta = json.load(fh)
+            mode = "r" if mmap else None
+            values = np.load(os.path.join(directory, _VALUES_FILE), mmap_mode=mode)
+            present = np.load(os.path.join(directory, _PRESENT_FILE), mmap_mode=mode)
+        except (OSError, ValueError):
+            return None
+        extras = {int(k): v for k, v in meta.get("extras", {}).items()}
+        fingerprint = meta.get("fingerprint")
+        return cls(meta["ingredient_ids"], meta["reference_quantities"], meta["reference_units"],
+                   meta["columns"], values, present, extras,
+                   tuple(fingerprint) if isinstance(fingerprint, list) else fingerprint)
+
+
+class NutrientMatrixCache:
+    """Process-wide holder for the matrix, backed by an optional on-disk copy.
+
+    ``loader`` returns the nutrient records and ``fingerprint`` a cheap,
+    JSON-serialisable marker of the source table (e.g. its row count, max id
+    and last update time) used to detect a stale file, including rows edited
+    in place; it is checked on every reload, so it should not read the rows.
+    :meth:`invalidate` drops both the in-memory and the on-disk copy; other
+    processes pick up the change after ``ttl_seconds``.
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[NutrientRecord]],
+                 fingerprint: Callable[[], Any], directory: Optional[str] = None,
+                 ttl_seconds: Optional[float] = None):
+        self._loader = loader
+        self._fingerprint = fingerprint
+        self._directory = directory
+        self._ttl = ttl_seconds
+        self._matrix: Optional[NutrientMatrix] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self) -> bool:
+        if self._matrix is None:
+            return False
+        return not self._ttl or (time.monotonic() - self._loaded_at) < self._ttl
+
+    def get(self) -> Optional[NutrientMatrix]:
+        if np is None:
+            return None
+        if self._is_fresh():
+            return self._matrix
+        with self._lock:
+            if not self._is_fresh():
+                self._matrix = self._load_or_build()
+                self._loaded_at = time.monotonic()
+            return self._matrix
+
+    def _load_or_build(self) -> NutrientMatrix:
+        current = self._fingerprint()
+        if self._directory:
+            cached = NutrientMatrix.load(self._directory)
+            if cached is not None and cached.fingerprint == current:
+                return cached
+        matrix = NutrientMatrix.from_records(self._loader(), fingerprint=current)
+        if self._directory:
+            try:
+                matrix.save(self._directory)
+            except OSError:
+                pass  # The on-disk copy is only a startup optimisation
+        return matrix
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._matrix = None
+            if self._directory:
+                try:
+                    os.remove(os.path.join(self._directory, _META_FILE))
+                except OSError:
+                    pass
+
+    def rebuild(self) -> Optional[NutrientMatrix]:
+        """Ignore any saved copy and rebuild from the database now."""
+        self.invalidate()
+        return self.get()
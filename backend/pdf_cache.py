@@ -0,0 +1,129 @@
+"""On-disk cache of rendered PDFs.
+
+ReportLab layout of a long recetario is CPU-heavy, and the same patient PDF
+is rendered for every view and again before emailing it. Rendered files are
+stored as ``<key>.pdf`` where the key hashes everything the PDF shows (see
+:func:`backend.plan_cache.cache_key`), so an edited evaluation simply gets a
+new key and stale files age out. Eviction follows :class:`PlanCache`: least
+recently used first once ``max_entries`` or ``max_bytes`` is exceeded. Hits
+are returned as file paths so they can be served with ``send_file``.
+
+:meth:`PdfCache.get_or_load` makes it a read-through cache for PDFs fetched
+from elsewhere (Drive): on a miss one caller loads the bytes, or streams the
+chunks straight into the cache file, while concurrent callers for the same
+key wait for that load instead of starting their own.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+
+from backend.plan_cache import PlanCache
+
+
+class _Load:
+    """One in-flight :meth:`PdfCache.get_or_load` miss, shared by the callers waiting on it."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.path: Optional[str] = None
+        self.data: Optional[bytes] = None
+
+
+class PdfCache(PlanCache):
+    """Binary variant of :class:`PlanCache` whose entries are plain PDF files."""
+
+    suffix = ".pdf"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loads = 0
+        self._loading: Dict[str, _Load] = {}
+        self._loading_lock = threading.Lock()
+
+    def get_path(self, key: str) -> Optional[str]:
+        """Path of the cached file for ``key`` (refreshing its LRU clock), or ``None``."""
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.misses += 1
+            return None
+        now = time.time()
+        if self._expired(stat.st_mtime, now) or not stat.st_size:
+            self._remove(path)
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        self.hits += 1
+        return path
+
+    def put_bytes(self, key: str, data: bytes) -> Optional[str]:
+        """Store ``data`` and return its path; ``None`` when disabled or the write failed."""
+        if not self.directory or not data:
+            return None
+        return self._path(key) if self._write(key, data) else None
+
+    def put_chunks(self, key: str, chunks: Iterable[bytes]) -> Optional[str]:
+        """Stream ``chunks`` into the entry for ``key`` and return its path; ``None`` when disabled, empty or the write failed."""
+        if not self.directory:
+            return None
+        return self._path(key) if self._write_chunks(key, chunks) else None
+
+    def get_or_load(self, key: str, load: Callable[[], Union[bytes, Iterable[bytes], None]]
+                    ) -> Tuple[Optional[str], Optional[bytes]]:
+        """Read-through lookup: ``(path, None)`` on a hit or once ``load()`` is stored, ``(None, data)``
+        when the cache is disabled or the write failed, ``(None, None)`` when ``load`` returned nothing
+        (or raised, in the caller that ran it). Concurrent misses for ``key`` share one ``load()``.
+        ``load`` may return an iterable of chunks instead of bytes: they are written to the cache file as
+        they arrive (joined in memory only when the cache is disabled), and a failed write returns ``(None, None)``."""
+        path = self.get_path(key)
+        if path:
+            return path, None
+        with self._loading_lock:
+            pending = self._loading.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._loading[key] = _Load()
+        if not leader:
+            pending.done.wait()
+            return pending.path, pending.data
+        try:
+            # Another caller may have finished loading between the miss and taking the lead
+            pending.path = self._peek(key)
+            if pending.path is None:
+                data = load()
+                self.loads += 1
+                if isinstance(data, (bytes, bytearray)):
+                    if data:
+                        pending.path = self.put_bytes(key, data)
+                        pending.data = None if pending.path else data
+                elif data is not None:
+                    if self.directory:
+                        pending.path = self.put_chunks(key, data)
+                    else:
+                        pending.data = b"".join(data) or None
+        finally:
+            with self._loading_lock:
+                del self._loading[key]
+            pending.done.set()
+        return pending.path, pending.data
+
+    def _peek(self, key: str) -> Optional[str]:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        return path if os.path.isfile(path) and os.path.getsize(path) else None
+
+    def get(self, key: str) -> Optional[str]:
+        raise TypeError("PdfCache stores binary files; use get_path().")
+
+    def put(self, key: str, text: str) -> None:
+        raise TypeError("PdfCache stores binary files; use put_bytes().")
@@ -0,0 +1,346 @@
+"""Pluggable storage for the technical evaluation PDFs.
+
+``Evaluation.pdf_storage_path`` and the entries of ``historical_pdf_ids_json``
+hold a *location* ``"<scheme>:<key>"``, where the scheme names the driver that
+stored the file: ``local`` (:class:`LocalStorage`, a directory), ``s3``
+(:class:`S3Storage`, any S3-compatible service such as MinIO) or ``drive``
+(:class:`DriveStorage`, Google Drive). Values without a known scheme are the
+bare Drive file ids saved before storage was pluggable and are read through
+the Drive driver.
+
+Drivers stream in both directions: ``put`` reads the file object in chunks
+(multipart/resumable uploads for the remote drivers) and ``open`` yields the
+content, or an inclusive byte range of it, chunk by chunk, so a PDF is never
+held in memory whole. :class:`PdfStorageRegistry` dispatches locations to
+drivers, writes new files with the configured default driver and copies a
+location to another driver (:meth:`PdfStorageRegistry.copy`, used by
+``migrate_pdf_storage.py``).
+"""
+from __future__ import annotations
+
+import abc
+import os
+import re
+import tempfile
+import unicodedata
+import uuid
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+try:
+    import boto3  # type: ignore
+except Exception:  # pragma: no cover - allow missing dependency
+    boto3 = None  # type: ignore
+
+from backend.drive_client import DriveFileNotFound
+
+CHUNK_SIZE = 1024 * 1024
+PDF_MIMETYPE = "application/pdf"
+# Copies between drivers are buffered in memory up to this size, then on disk
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+SCHEME_LOCAL = "local"
+SCHEME_S3 = "s3"
+SCHEME_DRIVE = "drive"
+
+_UNSAFE_NAME_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+class PdfNotFound(Exception):
+    """The location does not point to a stored file."""
+
+
+class PdfStorageUnavailable(Exception):
+    """The driver is not configured (no credentials, folder or bucket); retrying will not help."""
+
+
+def new_object_key(name: str) -> str:
+    """Unique key for a new file: ``"ab/ab12...-Safe_name.pdf"`` (sharded by its first two hex digits)."""
+    ascii_name = unicodedata.normalize("NFKD", name or "").encode("ascii", "ignore").decode("ascii")
+    safe = _UNSAFE_NAME_RE.sub("_", ascii_name).strip("._") or "documento.pdf"
+    token = uuid.uuid4().hex
+    return f"{token[:2]}/{token}-{safe[:120]}"
+
+
+def byte_range(start: Optional[int], end: Optional[int], size: int) -> Tuple[int, int]:
+    """Inclusive ``(start, end)`` clamped to ``size``; ``None`` means the beginning / the end of the file."""
+    first = max(0, start or 0)
+    last = size - 1 if end is None else min(end, size - 1)
+    return first, last
+
+
+def _read_chunks(fileobj: BinaryIO, remaining: Optional[int] = None) -> Iterator[bytes]:
+    while remaining is None or remaining > 0:
+        chunk = fileobj.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+        if not chunk:
+            return
+        if remaining is not None:
+            remaining -= len(chunk)
+        yield chunk
+
+
+class PdfStorage(abc.ABC):
+    """Interface of a storage driver; keys are driver-specific (a relative path, an object key, a file id)."""
+
+    scheme = ""
+
+    @abc.abstractmethod
+    def put(self, fileobj: BinaryIO, name: str) -> str:
+        """Stream ``fileobj`` (from its current position) into the store; returns the new key."""
+
+    @abc.abstractmethod
+    def open(self, key: str, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[bytes]:
+        """Chunks of the file, or of its inclusive byte range ``start``..``end``; raises :class:`PdfNotFound`."""
+
+    @abc.abstractmethod
+    def size(self, key: str) -> int:
+        """Size of the file in bytes; raises :class:`PdfNotFound`."""
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove the file; a missing file is not an error."""
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Path of the file on this machine when the driver keeps it on disk (it can be sent as is)."""
+        return None
+
+
+class LocalStorage(PdfStorage):
+    """Files under ``directory``; the key is the relative path."""
+
+    scheme = SCHEME_LOCAL
+
+    def __init__(self, directory: str):
+        self.directory = os.path.abspath(directory)
+
+    def _full_path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.directory, key))
+        if not path.startswith(self.directory + os.sep):
+            raise PdfNotFound(key)
+        return path
+
+    def put(self, fileobj: BinaryIO, name: str) -> str:
+        key = new_object_key(name)
+        path = self._full_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as fh:
+                for chunk in _read_chunks(fileobj):
+                    fh.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return key
+
+    def open(self, key: str, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[bytes]:
+        path = self._full_path(key)
+        try:
+            fh = open(path, "rb")
+        except FileNotFoundError as exc:
+            raise PdfNotFound(key) from exc
+        return self._stream(fh, start, end)
+
+    @staticmethod
+    def _stream(fh: BinaryIO, start: Optional[int], end: Optional[int]) -> Iterator[bytes]:
+        with fh:
+            first, last = byte_range(start, end, os.fstat(fh.fileno()).st_size)
+            fh.seek(first)
+            yield from _read_chunks(fh, last - first + 1)
+
+    def size(self, key: str) -> int:
+        try:
+            return os.path.getsize(self._full_path(key))
+        except OSError as exc:
+            raise PdfNotFound(key) from exc
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._full_path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self._full_path(key)
+        return path if os.path.isfile(path) else None
+
+
+class S3Storage(PdfStorage):
+    """Objects in ``bucket`` of an S3-compatible service; the key is the full object key (prefix included).
+
+    ``client`` is a boto3 S3 client (or anything with ``upload_fileobj``,
+    ``get_object``, ``head_object`` and ``delete_object``).
+    """
+
+    scheme = SCHEME_S3
+
+    def __init__(self, client: Any, bucket: str, prefix: str = ""):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+
+    @classmethod
+    def from_config(cls, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                    region: Optional[str] = None, access_key_id: Optional[str] = None,
+                    secret_access_key: Optional[str] = None) -> "S3Storage":
+        """Driver with a boto3 client; ``endpoint_url`` points it at MinIO or another S3-compatible server."""
+        if boto3 is None:
+            raise PdfStorageUnavailable("boto3 no está instalado")
+        client = boto3.client("s3", endpoint_url=endpoint_url or None, region_name=region or None,
+                              aws_access_key_id=access_key_id or None, aws_secret_access_key=secret_access_key or None)
+        return cls(client, bucket, prefix)
+
+    @staticmethod
+    def _is_missing(exc: Exception) -> bool:
+        code = str(getattr(exc, "response", {}).get("Error", {}).get("Code", ""))
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def put(self, fileobj: BinaryIO, name: str) -> str:
+        key = self.prefix + new_object_key(name)
+        # upload_fileobj switches to a multipart upload for large files, reading the source in parts
+        self.client.upload_fileobj(fileobj, self.bucket, key, ExtraArgs={"ContentType": PDF_MIMETYPE})
+        return key
+
+    def open(self, key: str, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[bytes]:
+        kwargs: Dict[str, Any] = {"Bucket": self.bucket, "Key": key}
+        if start is not None or end is not None:
+            kwargs["Range"] = f"bytes={max(0, start or 0)}-{'' if end is None else end}"
+        try:
+            body = self.client.get_object(**kwargs)["Body"]
+        except Exception as exc:
+            if self._is_missing(exc):
+                raise PdfNotFound(key) from exc
+            raise
+        return self._stream(body)
+
+    @staticmethod
+    def _stream(body: Any) -> Iterator[bytes]:
+        try:
+            if hasattr(body, "iter_chunks"):
+                yield from body.iter_chunks(CHUNK_SIZE)
+            else:
+                yield from _read_chunks(body)
+        finally:
+            body.close()
+
+    def size(self, key: str) -> int:
+        try:
+            return int(self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"])
+        except Exception as exc:
+            if self._is_missing(exc):
+                raise PdfNotFound(key) from exc
+            raise
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+
+class DriveStorage(PdfStorage):
+    """Files in a Google Drive folder; the key is the Drive file id.
+
+    ``get_client()`` returns the process Drive client (see :mod:`backend.drive_client`)
+    or ``None`` without credentials, and ``get_folder_id()`` the target folder.
+    """
+
+    scheme = SCHEME_DRIVE
+
+    def __init__(self, get_client: Callable[[], Any], get_folder_id: Callable[[], Optional[str]]):
+        self.get_client = get_client
+        self.get_folder_id = get_folder_id
+
+    def _client(self) -> Any:
+        client = self.get_client()
+        if client is None:
+            raise PdfStorageUnavailable("Google Drive sin credenciales")
+        return client
+
+    def put(self, fileobj: BinaryIO, name: str) -> str:
+        folder_id = self.get_folder_id()
+        if not folder_id:
+            raise PdfStorageUnavailable("DRIVE_FOLDER_ID no configurado")
+        file_id = self._client().upload(fileobj, name, folder_id)
+        if not file_id:
+            raise RuntimeError("Drive no devolvió el ID del archivo subido")
+        return file_id
+
+    def open(self, key: str, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[bytes]:
+        client = self._client()
+        first, last = byte_range(start, end, self.size(key))
+        return self._stream(client, key, first, last)
+
+    @staticmethod
+    def _stream(client: Any, key: str, first: int, last: int) -> Iterator[bytes]:
+        # One ranged request per chunk, like MediaIoBaseDownload, but starting anywhere in the file
+        for offset in range(first, last + 1, CHUNK_SIZE):
+            try:
+                yield client.read_range(key, offset, min(offset + CHUNK_SIZE, last + 1) - 1)
+            except DriveFileNotFound as exc:
+                raise PdfNotFound(key) from exc
+
+    def size(self, key: str) -> int:
+        try:
+            return self._client().size(key)
+        except DriveFileNotFound as exc:
+            raise PdfNotFound(key) from exc
+
+    def delete(self, key: str) -> None:
+        self._client().delete(key)
+
+
+class PdfStorageRegistry:
+    """The configured drivers by scheme; new files go to ``default``."""
+
+    def __init__(self, drivers: Iterable[PdfStorage], default: str):
+        self.drivers: Dict[str, PdfStorage] = {driver.scheme: driver for driver in drivers}
+        if default not in self.drivers:
+            raise ValueError(f"Almacenamiento de PDFs desconocido o sin configurar: {default}")
+        self.default = default
+
+    @staticmethod
+    def split(location: str) -> Tuple[str, str]:
+        """``(scheme, key)`` of a location; bare values are legacy Drive file ids."""
+        scheme, sep, key = (location or "").partition(":")
+        if sep and scheme in (SCHEME_LOCAL, SCHEME_S3, SCHEME_DRIVE):
+            return scheme, key
+        return SCHEME_DRIVE, location or ""
+
+    def resolve(self, location: str) -> Tuple[PdfStorage, str]:
+        """``(driver, key)`` of a stored location; :class:`PdfNotFound` if its driver is not configured."""
+        scheme, key = self.split(location)
+        driver = self.drivers.get(scheme)
+        if driver is None or not key:
+            raise PdfNotFound(location)
+        return driver, key
+
+    def put(self, fileobj: BinaryIO, name: str, scheme: Optional[str] = None) -> str:
+        """Store ``fileobj`` with the ``scheme`` driver (default: ``self.default``); returns its location."""
+        driver = self.drivers[scheme or self.default]
+        return f"{driver.scheme}:{driver.put(fileobj, name)}"
+
+    def open(self, location: str, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[bytes]:
+        driver, key = self.resolve(location)
+        return driver.open(key, start, end)
+
+    def read(self, location: str, start: Optional[int] = None, end: Optional[int] = None) -> bytes:
+        return b"".join(self.open(location, start, end))
+
+    def size(self, location: str) -> int:
+        driver, key = self.resolve(location)
+        return driver.size(key)
+
+    def delete(self, location: str) -> None:
+        driver, key = self.resolve(location)
+        driver.delete(key)
+
+    def local_path(self, location: str) -> Optional[str]:
+        driver, key = self.resolve(location)
+        return driver.local_path(key)
+
+    def copy(self, location: str, name: str, scheme: str) -> str:
+        """Copy a stored file to the ``scheme`` driver, streaming it through a spooled temporary file."""
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+            for chunk in self.open(location):
+                spool.write(chunk)
+            spool.seek(0)
+            return self.put(spool, name, scheme)
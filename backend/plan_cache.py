@@ -0,0 +1,214 @@
+"""Content-addressed on-disk cache for Gemini plan generation.
+
+Every Gemini call made while generating a plan (the structure prompt and each
+recipe batch prompt) is keyed on a SHA-256 of its canonical inputs: model
+name, generation config, safety settings and the prompt text. Regenerating a
+plan with unchanged inputs therefore hits the cache for the structure, which
+yields the same recipe list, the same batch prompts and more hits.
+
+Entries are JSON files named ``<key>.json``. They expire after ``ttl_seconds``
+and once ``max_entries`` or ``max_bytes`` is exceeded the least recently used
+ones are evicted down to 90% of the limit, so a full cache is not rescanned
+on every write. The entry count and total size are tracked in
+memory as entries are written, so the directory is only scanned when a limit
+is crossed or every ``rescan_seconds`` (which also picks up files written or
+removed by other processes sharing it). A missing or unreadable file is simply
+a miss.
+"""
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+_SUFFIX = ".json"
+
+
+def cache_key(*parts: Any) -> str:
+    """SHA-256 of ``parts`` serialised as canonical JSON (sorted keys, no whitespace)."""
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    """Text cache in ``directory``; with no directory every lookup misses and puts are ignored."""
+
+    suffix = _SUFFIX
+
+    def __init__(self, directory: Optional[str], ttl_seconds: Optional[float] = None,
+                 max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 rescan_seconds: float = 300):
+        self.directory = directory or None
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.rescan_seconds = rescan_seconds
+        self.hits = 0
+        self.misses = 0
+        self.scans = 0
+        self._lock = threading.Lock()
+        # Entry count and bytes on disk as of the last scan plus our own writes; None until the first scan
+        self._count: Optional[int] = None
+        self._bytes = 0
+        self._scanned_at = 0.0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return bool(self.ttl) and now - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as fh:
+                entry = json.load(fh)
+            text = entry["text"]
+            created_at = float(entry["created_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            self.misses += 1
+            return None
+        now = time.time()
+        if self._expired(created_at, now):
+            self._remove(path)
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, (now, now))  # mtime is the LRU clock
+        except OSError:
+            pass
+        self.hits += 1
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        if not self.directory:
+            return
+        payload = json.dumps({"created_at": time.time(), "text": text}, ensure_ascii=False)
+        self._write(key, payload.encode("utf-8"))
+
+    def _write(self, key: str, data: bytes) -> bool:
+        """Atomically write ``data`` as the entry for ``key``, then evict; False if it could not be written."""
+        return self._write_chunks(key, (data,))
+
+    def _write_chunks(self, key: str, chunks: Iterable[bytes]) -> bool:
+        """Stream ``chunks`` into a temporary file, then move it in place as the entry for ``key`` and evict.
+
+        False if nothing was written or the write failed; an exception raised
+        by ``chunks`` propagates after the temporary file is removed. Only the
+        final rename and the bookkeeping hold the lock.
+        """
+        path = self._path(key)
+        tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fh = open(tmp_path, "wb")
+        except OSError:
+            return False  # The cache is an optimisation; generation already succeeded
+        size, ok = 0, True
+        try:
+            for chunk in chunks:
+                try:
+                    fh.write(chunk)
+                except OSError:
+                    ok = False
+                    break
+                size += len(chunk)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                fh.close()
+            self._remove(tmp_path)
+            raise
+        try:
+            fh.close()
+        except OSError:
+            ok = False
+        if not ok or not size:
+            self._remove(tmp_path)
+            return False
+        with self._lock:
+            try:
+                try:
+                    replaced = os.stat(path).st_size
+                except OSError:
+                    replaced = None
+                os.replace(tmp_path, path)
+            except OSError:
+                self._remove(tmp_path)
+                return False
+            if self._count is not None:
+                self._count += replaced is None
+                self._bytes += size - (replaced or 0)
+            if self._needs_scan():
+                self._evict(keep=key)
+        return True
+
+    def _needs_scan(self) -> bool:
+        if self._count is None or time.time() - self._scanned_at >= self.rescan_seconds:
+            return True
+        return ((self.max_entries is not None and self._count > self.max_entries)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes))
+
+    def delete(self, key: str) -> None:
+        if self.directory:
+            self._remove(self._path(key))
+
+    def clear(self) -> None:
+        for entry in self._entries():
+            self._remove(entry.path)
+        with self._lock:
+            self._count, self._bytes = None, 0
+
+    def _entries(self):
+        if not self.directory:
+            return []
+        try:
+            return [e for e in os.scandir(self.directory) if e.name.endswith(self.suffix) and e.is_file()]
+        except OSError:
+            return []
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """Scan the directory: drop expired entries, then the least recently used ones until within limits."""
+        now = time.time()
+        self.scans += 1
+        live = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            # created_at <= mtime, so an entry untouched for longer than the TTL is expired
+            if self._expired(stat.st_mtime, now) and entry.name != (keep or "") + self.suffix:
+                self._remove(entry.path)
+                continue
+            live.append((stat.st_mtime, stat.st_size, entry))
+        live.sort(key=lambda item: item[0])
+
+        count = len(live)
+        total = sum(size for _, size, _ in live)
+        if not ((self.max_entries is not None and count > self.max_entries)
+                or (self.max_bytes is not None and total > self.max_bytes)):
+            live = []
+        for _, size, entry in live:
+            over_entries = self.max_entries is not None and count > self.max_entries - self.max_entries // 10
+            over_bytes = self.max_bytes is not None and total > self.max_bytes - self.max_bytes // 10
+            if not (over_entries or over_bytes):
+                break
+            if entry.name == (keep or "") + self.suffix:
+                continue
+            self._remove(entry.path)
+            count -= 1
+            total -= size
+        self._count, self._bytes, self._scanned_at = count, total, now
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
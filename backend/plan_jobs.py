@@ -0,0 +1,175 @@
+"""In-process background jobs for long-running plan generation.
+
+A :class:`JobQueue` runs submitted callables on a fixed-size thread pool and
+keeps a pollable :class:`Job` record for each one (state, progress, result).
+Jobs may also :meth:`Job.publish` events, which clients can follow live with
+:meth:`Job.wait_events` instead of polling (e.g. relayed as server-sent events).
+Each owner (e.g. a nutritionist's user id) may have at most
+``per_owner_limit`` jobs queued or running at a time. Finished jobs are kept
+for ``retention_seconds`` so clients can fetch the result, then dropped.
+
+Job state lives in the memory of the process that accepted the job, so
+status requests must reach that same process (a single multi-threaded
+server process, or sticky sessions in front of several).
+"""
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "error"
+
+_ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+class JobLimitExceeded(Exception):
+    """The owner already has ``per_owner_limit`` active jobs."""
+
+
+class Job:
+    """State of one submitted job; progress is a free-form dict owned by the job function."""
+
+    def __init__(self, owner: Hashable):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.state = QUEUED
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.events: List[Tuple[str, Any]] = []
+        # Set by cancel(); the job function is expected to check it and stop early
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def set_progress(self, **fields: Any) -> None:
+        with self._lock:
+            self.progress.update(fields)
+
+    def append_text(self, field: str, text: str, index: Optional[int] = None) -> None:
+        """Append to ``progress[field]`` (a string) or to ``progress[field][index]`` (a list of strings)."""
+        with self._lock:
+            if index is None:
+                self.progress[field] = self.progress.get(field, "") + text
+                return
+            parts = self.progress.setdefault(field, [])
+            if index >= len(parts):
+                parts.extend([""] * (index + 1 - len(parts)))
+            parts[index] += text
+
+    def increment(self, field: str, by: int = 1) -> None:
+        with self._lock:
+            self.progress[field] = self.progress.get(field, 0) + by
+
+    def publish(self, event: str, data: Any) -> None:
+        """Append ``(event, data)`` to the job's event log and wake :meth:`wait_events` callers."""
+        with self._changed:
+            self.events.append((event, data))
+            self._changed.notify_all()
+
+    def wait_events(self, after: int = 0, timeout: Optional[float] = None) -> Tuple[List[Tuple[str, Any]], bool]:
+        """Events published after the first ``after`` ones, waiting up to ``timeout`` for one to arrive.
+
+        Returns ``(events, finished)``; ``finished`` is true once the job is done
+        or failed and ``events`` holds everything it published.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > after or not self.active, timeout)
+            return self.events[after:], not self.active
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+
+    @property
+    def active(self) -> bool:
+        return self.state in _ACTIVE_STATES
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-serialisable copy of the job state."""
+        with self._lock:
+            progress = {k: list(v) if isinstance(v, list) else v for k, v in self.progress.items()}
+            return {
+                "job_id": self.id,
+                "status": self.state,
+                "progress": progress,
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobQueue:
+    """Thread pool of ``workers`` threads plus the registry of submitted jobs."""
+
+    def __init__(self, workers: int = 2, per_owner_limit: Optional[int] = 1,
+                 retention_seconds: float = 3600, thread_name_prefix: str = "plan-job"):
+        self.workers = max(1, int(workers or 1))
+        self.per_owner_limit = per_owner_limit
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=thread_name_prefix)
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, owner: Hashable, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Job:
+        """Queue ``fn(job, *args, **kwargs)``; its return value becomes ``job.result``.
+
+        An exception marks the job as failed with ``str(exc)`` as its error.
+        Raises :class:`JobLimitExceeded` if ``owner`` is at its limit.
+        """
+        with self._lock:
+            self._purge_finished()
+            if self.per_owner_limit:
+                active = sum(1 for j in self._jobs.values() if j.owner == owner and j.active)
+                if active >= self.per_owner_limit:
+                    raise JobLimitExceeded(f"{active} active job(s) for this owner (limit {self.per_owner_limit})")
+            job = Job(owner)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job: Job, fn: Callable[..., Any], args, kwargs) -> None:
+        with job._lock:
+            job.state, job.started_at = RUNNING, time.time()
+        try:
+            result, state, error = fn(job, *args, **kwargs), DONE, None
+        except Exception as exc:
+            result, state, error = None, FAILED, str(exc) or exc.__class__.__name__
+        with job._changed:
+            job.result, job.error, job.finished_at = result, error, time.time()
+            job.state = state
+            job._changed.notify_all()
+
+    def get(self, job_id: str, owner: Optional[Hashable] = None) -> Optional[Job]:
+        """The job, or ``None`` if unknown, purged, or (when given) owned by someone else."""
+        with self._lock:
+            self._purge_finished()
+            job = self._jobs.get(job_id)
+        if job is None or (owner is not None and job.owner != owner):
+            return None
+        return job
+
+    def active_count(self, owner: Optional[Hashable] = None) -> int:
+        with self._lock:
+            return sum(1 for j in self._jobs.values() if j.active and (owner is None or j.owner == owner))
+
+    def _purge_finished(self) -> None:
+        # Called with self._lock held
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if not job.active and job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
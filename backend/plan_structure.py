@@ -0,0 +1,117 @@
+"""Structured representation of a saved plan text.
+
+``Evaluation.edited_plan_text`` is free text: a weekly structure ("**Lunes**",
+"*   Almuerzo: ... (Ver Receta N°1)") followed by the recetario. This module
+parses it once into a JSON-serialisable dict, stored with the evaluation
+together with the :func:`structure_key` of the text it was built from, so
+read paths (PDFs, shopping list) use it without touching regexes:
+
+* ``lines``: the structure section line by line, already classified as
+  ``day`` / ``meal`` / ``item`` / ``blank`` with the text the PDFs render;
+* ``days``: ``[{"day", "meals": [{"meal", "text", "recipes": [numbers]}]}]``;
+* ``recipes``: every recipe of the recetario (see :mod:`backend.recipe_index`)
+  with its ingredients parsed into item, quantity and unit.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+from typing import Any, Dict, List
+
+from backend.ingredient_parser import parse_line
+from backend.recipe_batches import RECETARIO_MARKER
+from backend.recipe_index import index_recetario
+
+STRUCTURE_VERSION = 1
+
+LINE_DAY = "day"
+LINE_MEAL = "meal"
+LINE_ITEM = "item"
+LINE_BLANK = "blank"
+
+# Same day and meal headers the PDF builders have always recognised
+DAY_RE = re.compile(r"^\s*\*\*(Lunes|Martes|Miércoles|Jueves|Viernes|Sábado|Domingo)\s*\*\*(?::)?", re.IGNORECASE)
+MEAL_RE = re.compile(r"^\s*\*?\s*(Desayuno|Colación Mañana|Almuerzo|Colación Tarde|Cena|Merienda)\s*:\s*", re.IGNORECASE)
+# Any "Label: text" entry inside a day ("Colación: 1 manzana") for the ``days`` view
+_ENTRY_RE = re.compile(r"^[\s*\-•]*([A-Za-zÁÉÍÓÚáéíóúñÑ][A-Za-zÁÉÍÓÚáéíóúñÑ ]{1,30}?)\s*:\s*(.*)$")
+_RECIPE_REF_RE = re.compile(r"Receta\s*N°\s*(\d+)", re.IGNORECASE)
+# Recetarios that parse_all_recipes_from_text_block has always rejected
+_FAILED_RECETARIO = "No se pudieron parsear las recetas detalladas."
+
+
+def structure_key(plan_text: str) -> str:
+    """Hash of the text and the parser version: a stored structure is stale when its key differs."""
+    payload = f"v{STRUCTURE_VERSION}\n{plan_text or ''}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def split_plan_text(plan_text: str):
+    """``(structure_text, recetario_text)``, both stripped; the recetario excludes the marker."""
+    structure, _, recetario = (plan_text or "").partition(RECETARIO_MARKER)
+    return structure.strip(), recetario.strip()
+
+
+def _classify_lines(structure_text: str) -> List[Dict[str, str]]:
+    lines = []
+    for raw in structure_text.split("\n") if structure_text else []:
+        line = raw.strip()
+        if not line:
+            lines.append({"kind": LINE_BLANK, "text": ""})
+        elif DAY_RE.match(line):
+            lines.append({"kind": LINE_DAY, "text": DAY_RE.sub(r"\1:", line)})
+        elif MEAL_RE.match(line):
+            lines.append({"kind": LINE_MEAL, "text": MEAL_RE.sub(r"\1:", line)})
+        else:
+            lines.append({"kind": LINE_ITEM, "text": line.lstrip("*-• ").strip()})
+    return lines
+
+
+def _days(structure_text: str) -> List[Dict[str, Any]]:
+    days: List[Dict[str, Any]] = []
+    for raw in structure_text.split("\n") if structure_text else []:
+        day = DAY_RE.match(raw.strip())
+        if day:
+            days.append({"day": day.group(1).capitalize(), "meals": []})
+            continue
+        entry = _ENTRY_RE.match(raw)
+        if days and entry:
+            text = entry.group(2).strip()
+            days[-1]["meals"].append({
+                "meal": entry.group(1).strip(), "text": text,
+                "recipes": [int(number) for number in _RECIPE_REF_RE.findall(text)],
+            })
+    return days
+
+
+def _recipes(recetario_text: str) -> List[Dict[str, Any]]:
+    if not recetario_text or recetario_text == _FAILED_RECETARIO or "Error:" in recetario_text:
+        return []
+    recipes = []
+    for entry in index_recetario(recetario_text):
+        if not entry.title:
+            continue
+        ingredients = []
+        for raw_line in entry.ingredients:
+            # Same "* line" form the shopping list has always parsed, whatever the bullet was
+            parsed = parse_line(f"* {raw_line}")
+            ingredients.append({"raw_line": raw_line, "item": parsed.item,
+                                "quantity": parsed.quantity, "unit": parsed.unit})
+        recipes.append({
+            "number": f"Receta {entry.label}", "name": entry.title,
+            "servings": entry.servings, "num_servings": entry.num_servings,
+            "ingredients": ingredients, "instructions": entry.instructions,
+            "condiments": entry.condiments, "presentation": entry.presentation,
+        })
+    return recipes
+
+
+def build_plan_structure(plan_text: str) -> Dict[str, Any]:
+    """Parse ``plan_text`` once into the stored structure (see the module docstring)."""
+    structure_text, recetario_text = split_plan_text(plan_text)
+    return {
+        "version": STRUCTURE_VERSION,
+        "lines": _classify_lines(structure_text),
+        "days": _days(structure_text),
+        "has_recetario": bool(recetario_text),
+        "recipes": _recipes(recetario_text),
+    }
@@ -0,0 +1,142 @@
+"""Post-commit tasks of a saved evaluation, run in the background.
+
+Rendering the technical PDF, storing it (Drive by default) and rendering the patient
+PDF used to happen inside the save request. A :class:`PostSavePipeline` runs
+those steps on a :class:`~backend.plan_jobs.JobQueue` after the evaluation is
+committed, so the request returns as soon as the database write is done.
+
+The task is keyed on the evaluation id: a queue owner holds at most one
+active task, so enqueueing an evaluation that is already queued is a no-op.
+Progress is a JSON-serialisable dict (see :func:`new_state`) that the caller
+stores with the evaluation through ``load_state``/``save_state``, which makes
+it pollable from any process and lets :meth:`PostSavePipeline.run` resume a
+task interrupted by a restart: steps already ``done`` are skipped, so each
+step function must itself be idempotent (e.g. do nothing when its output is
+already stored). A step that raises or returns a falsy value is retried up to
+``max_attempts`` times with exponential backoff before the task is marked
+``failed``; later steps still run. :class:`StepAborted` fails a step at once
+(e.g. Drive is not configured, so retrying cannot help).
+"""
+from __future__ import annotations
+
+import contextlib
+import time
+from typing import Any, Callable, ContextManager, Dict, Hashable, Iterable, Optional, Sequence, Tuple
+
+from backend.plan_jobs import JobLimitExceeded, JobQueue
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+ACTIVE_STATES = (PENDING, RUNNING)
+
+StepFn = Callable[[Hashable], Any]
+
+
+class StepAborted(Exception):
+    """Raised by a step that cannot succeed on retry; the step fails without further attempts."""
+
+
+def new_state(step_names: Iterable[str]) -> Dict[str, Any]:
+    """Initial state of a task: every step ``pending`` with no attempts."""
+    return {
+        "status": PENDING,
+        "steps": {name: {"status": PENDING, "attempts": 0, "error": None} for name in step_names},
+        "updated_at": time.time(),
+    }
+
+
+def is_stale(state: Optional[Dict[str, Any]], stale_seconds: float, now: Optional[float] = None) -> bool:
+    """Whether an unfinished task has not been updated for ``stale_seconds`` (its worker probably died)."""
+    if not state or state.get("status") not in ACTIVE_STATES:
+        return False
+    now = time.time() if now is None else now
+    return now - (state.get("updated_at") or 0) >= stale_seconds
+
+
+class PostSavePipeline:
+    """Ordered ``steps`` (``[(name, fn(key))]``) run once per key on ``queue``.
+
+    ``load_state(key)`` returns the stored state (or ``None``) and
+    ``save_state(key, state)`` persists it; both are called inside
+    ``context()`` (e.g. a Flask app context) in the worker thread.
+    """
+
+    def __init__(self, queue: JobQueue, steps: Sequence[Tuple[str, StepFn]],
+                 load_state: Callable[[Hashable], Optional[Dict[str, Any]]],
+                 save_state: Callable[[Hashable, Dict[str, Any]], None],
+                 max_attempts: int = 3, backoff_seconds: float = 2.0,
+                 context: Callable[[], ContextManager[Any]] = contextlib.nullcontext,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.queue = queue
+        self.steps = list(steps)
+        self.load_state = load_state
+        self.save_state = save_state
+        self.max_attempts = max(1, int(max_attempts or 1))
+        self.backoff_seconds = backoff_seconds
+        self.context = context
+        self.sleep = sleep
+
+    @property
+    def step_names(self) -> Tuple[str, ...]:
+        return tuple(name for name, _ in self.steps)
+
+    def new_state(self) -> Dict[str, Any]:
+        return new_state(self.step_names)
+
+    def enqueue(self, key: Hashable) -> bool:
+        """Queue the task for ``key``; ``False`` if it is already queued or running in this process."""
+        try:
+            self.queue.submit(key, self._run_job, key)
+        except JobLimitExceeded:
+            return False
+        return True
+
+    def is_active(self, key: Hashable) -> bool:
+        """Whether this process has the task for ``key`` queued or running."""
+        return self.queue.active_count(key) > 0
+
+    def _run_job(self, job, key: Hashable) -> Dict[str, Any]:
+        with self.context():
+            return self.run(key)
+
+    def run(self, key: Hashable) -> Dict[str, Any]:
+        """Run the pending steps of ``key`` in the calling thread and return the final state."""
+        state = self.load_state(key) or self.new_state()
+        steps_state = state.setdefault("steps", {})
+        for name, fn in self.steps:
+            step = steps_state.setdefault(name, {"status": PENDING, "attempts": 0, "error": None})
+            if step["status"] == DONE:
+                continue
+            self._run_step(key, state, step, fn)
+        failed = any(steps_state.get(name, {}).get("status") == FAILED for name in self.step_names)
+        state["status"] = FAILED if failed else DONE
+        self._save(key, state)
+        return state
+
+    def _run_step(self, key: Hashable, state: Dict[str, Any], step: Dict[str, Any], fn: StepFn) -> None:
+        # A resumed step gets a fresh set of attempts
+        for attempt in range(1, self.max_attempts + 1):
+            state["status"], step["status"] = RUNNING, RUNNING
+            step["attempts"] += 1
+            self._save(key, state)
+            try:
+                ok, error = bool(fn(key)), None
+            except StepAborted as exc:
+                step["status"], step["error"] = FAILED, str(exc) or exc.__class__.__name__
+                return
+            except Exception as exc:
+                ok, error = False, str(exc) or exc.__class__.__name__
+            if ok:
+                step["status"], step["error"] = DONE, None
+                return
+            step["error"] = error or "step returned no result"
+            if attempt < self.max_attempts:
+                self.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+        step["status"] = FAILED
+
+    def _save(self, key: Hashable, state: Dict[str, Any]) -> None:
+        state["updated_at"] = time.time()
+        self.save_state(key, state)
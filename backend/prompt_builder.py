@@ -0,0 +1,140 @@
+"""Helpers that keep the plan-generation prompts small.
+
+The prompts are written as indented f-strings and embed user data verbatim
+(suggested preparations, ingredient names from the database). These helpers
+strip the template indentation, drop empty values, deduplicate preparations
+and ingredients, and fold ingredient variants under their base name
+("Arroz (grano, blanco, crudo / grano, integral, crudo)"), so every model call
+sends fewer tokens for the same information. Recipe batches get only the
+database ingredients related to their own dishes
+(:func:`relevant_ingredient_names`) instead of one shared list.
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from backend.recipe_index import normalize_name
+
+# Rough size of a Gemini token for Spanish prose; used when no exact count is available
+CHARS_PER_TOKEN = 4
+
+_EMPTY_VALUES = (None, "", "N/A", "n/a", "None")
+_BULLET_PADDING_RE = re.compile(r"^(\s*)([*-]|\d+\.)\s{2,}")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_WORD_RE = re.compile(r"[a-zñ]{4,}")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count (``CHARS_PER_TOKEN`` characters per token, rounded up)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def is_empty(value: Any) -> bool:
+    return value in _EMPTY_VALUES or (isinstance(value, str) and value.strip() in _EMPTY_VALUES)
+
+
+def compact_prompt(text: str, indent: int = 4) -> str:
+    """Remove the f-string indentation (up to ``indent`` columns), bullet padding,
+    trailing spaces and runs of blank lines. Relative nesting is kept."""
+    lines = []
+    for line in text.strip("\n").split("\n"):
+        stripped = line.rstrip()
+        leading = len(stripped) - len(stripped.lstrip(" "))
+        stripped = stripped[min(leading, indent):]
+        lines.append(_BULLET_PADDING_RE.sub(r"\1\2 ", stripped))
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip() + "\n"
+
+
+def join_known(pairs: Sequence[Tuple[str, Any]], unit_suffixes: Optional[Dict[str, str]] = None,
+               separator: str = "; ") -> str:
+    """``"Label: value unit"`` for every pair whose value is known ("" when none is)."""
+    unit_suffixes = unit_suffixes or {}
+    parts = [f"{label}: {value}{unit_suffixes.get(label, '')}" for label, value in pairs if not is_empty(value)]
+    return separator.join(parts)
+
+
+def _dedupe(values: Iterable[str]) -> List[str]:
+    seen, result = set(), []
+    for value in values:
+        value = " ".join(str(value).split())
+        key = value.casefold()
+        if value and not is_empty(value) and key not in seen:
+            seen.add(key)
+            result.append(value)
+    return result
+
+
+def _ingredient_text(ingredient: Any) -> Optional[str]:
+    """``"item (quantity unit)"`` for an ``original_ingredients`` entry; the quantity part only when given."""
+    if not isinstance(ingredient, dict):
+        return ingredient if isinstance(ingredient, str) else None
+    item = ingredient.get("item")
+    if not isinstance(item, str):
+        return None
+    quantity, unit = ingredient.get("quantity"), ingredient.get("unit")
+    if isinstance(quantity, (int, float)) and not isinstance(quantity, bool):
+        quantity = f"{quantity:g}"
+    amount = " ".join(str(part).strip() for part in (quantity, unit) if not is_empty(part) and str(part).strip())
+    return f"{item} ({amount})" if amount and not is_empty(item) else item
+
+
+def compact_base_foods(base_foods: Iterable[Any]) -> List[Tuple[str, List[str]]]:
+    """``[(name, [ingredient, ...])]`` from the ``base_foods`` payload.
+
+    Accepts preparation dicts (``name`` plus ``original_ingredients`` of
+    ``{"item": ..., "quantity": ..., "unit": ...}``, quantity and unit being
+    optional; any other key is ignored) and bare names. Preparations are
+    deduplicated by name (ingredients of repeated names are merged) and
+    repeated ingredients (same item and amount) within a preparation are dropped.
+    """
+    order: List[str] = []
+    merged: Dict[str, Tuple[str, List[str]]] = {}
+    for prep in base_foods or []:
+        if isinstance(prep, dict):
+            name = prep.get("name")
+            items = [_ingredient_text(ing) for ing in prep.get("original_ingredients") or []]
+        else:
+            name, items = prep, []
+        name = " ".join(str(name or "").split())
+        if is_empty(name):
+            continue
+        key = name.casefold()
+        if key not in merged:
+            order.append(key)
+            merged[key] = (name, [])
+        merged[key][1].extend(item for item in items if isinstance(item, str))
+    return [(merged[key][0], _dedupe(merged[key][1])) for key in order]
+
+
+def group_ingredient_names(names: Iterable[str]) -> str:
+    """Fold database names sharing the text before the first comma:
+    ``"Acelga, hoja", "Acelga, tallo"`` -> ``"Acelga (hoja / tallo)"``; groups are ``"; "``-separated."""
+    groups: Dict[str, List[str]] = {}
+    for name in _dedupe(names):
+        base, _, variant = name.partition(",")
+        groups.setdefault(base.strip(), [])
+        if variant.strip():
+            groups[base.strip()].append(variant.strip())
+    return "; ".join(f"{base} ({' / '.join(variants)})" if variants else base
+                     for base, variants in groups.items())
+
+
+def _words(text: str) -> Set[str]:
+    """Accent-free words of 4+ letters, without a final plural "s"."""
+    return {word[:-1] if word.endswith("s") else word for word in _WORD_RE.findall(normalize_name(text))}
+
+
+def relevant_ingredient_names(names: Iterable[str], dishes: Iterable[str], limit: Optional[int] = None) -> List[str]:
+    """Database ingredient ``names`` whose base name (the text before the first comma)
+    shares a word with one of ``dishes``, ignoring plurals ("Tomates" matches "Tomate, rojo"):
+    "Merluza al horno con puré de calabaza" keeps "Merluza, filete, crudo" and
+    "Calabaza, cruda" but not "Acelga, hoja". Order is kept; at most ``limit`` names are returned."""
+    dish_words = set().union(*(_words(dish) for dish in dishes))
+
+    def related(name: str) -> bool:
+        return any(word.startswith(dish_word) or dish_word.startswith(word)
+                   for word in _words(name.partition(",")[0]) for dish_word in dish_words)
+
+    relevant = [name for name in names if related(name)]
+    return relevant[:limit] if limit is not None else relevant
@@ -0,0 +1,85 @@
+"""Batching helpers for the recipe phase of plan generation.
+
+The recipe list extracted from the plan structure (``[("N°1", "Plato"), ...]``)
+is split into small batches that are generated concurrently; the partial
+recetarios are then merged back into a single ``== RECETARIO DETALLADO ==``
+block ordered by recipe number.
+"""
+from __future__ import annotations
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+RECETARIO_MARKER = "== RECETARIO DETALLADO =="
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_MARKER_RE = re.compile(r"^\s*==\s*RECETARIO DETALLADO\s*==\s*", re.IGNORECASE)
+# Same recipe header variants accepted by parse_all_recipes_from_text_block
+_RECIPE_START_RE = re.compile(r"^[ \t]*\**[ \t]*Receta\s*(?:N°|No\.|N\.)?\s*(\d+)\s*:", re.IGNORECASE | re.MULTILINE)
+_NUMBER_RE = re.compile(r"\d+")
+
+
+def recipe_number(label: str) -> int:
+    """``"N°12"`` -> ``12``; labels without digits sort last."""
+    match = _NUMBER_RE.search(label or "")
+    return int(match.group(0)) if match else 1 << 30
+
+
+def make_batches(recipes: Iterable[Tuple[str, str]], batch_size: int) -> List[List[Tuple[str, str]]]:
+    """Sort ``(label, name)`` pairs by recipe number and chunk them."""
+    ordered = sorted(recipes, key=lambda item: recipe_number(item[0]))
+    size = max(1, int(batch_size or 1))
+    return [ordered[i:i + size] for i in range(0, len(ordered), size)]
+
+
+def split_recipes(text: str) -> List[Tuple[int, str]]:
+    """``(number, block)`` for every "Receta N°X:" block in ``text`` (marker removed)."""
+    body = _MARKER_RE.sub("", text or "", count=1)
+    starts = list(_RECIPE_START_RE.finditer(body))
+    blocks = []
+    for i, match in enumerate(starts):
+        end = starts[i + 1].start() if i + 1 < len(starts) else len(body)
+        block = body[match.start():end].strip()
+        if block:
+            blocks.append((int(match.group(1)), block))
+    return blocks
+
+
+def assemble_recetario(batch_texts: Sequence[Optional[str]],
+                       expected: Sequence[Tuple[str, str]] = (),
+                       placeholder: Optional[Callable[[str, str], str]] = None) -> Tuple[str, List[str]]:
+    """Merge partial recetarios into one, ordered by recipe number.
+
+    The first block seen for a number wins. Recipes in ``expected`` missing
+    from every batch are reported (and rendered with ``placeholder`` if given).
+    Returns ``(recetario_text, missing_labels)``.
+    """
+    blocks: Dict[int, str] = {}
+    for text in batch_texts:
+        for number, block in split_recipes(text or ""):
+            blocks.setdefault(number, block)
+
+    missing = []
+    for label, name in expected:
+        number = recipe_number(label)
+        if number not in blocks:
+            missing.append(label)
+            if placeholder is not None:
+                blocks[number] = placeholder(label, name)
+
+    ordered = [blocks[number] for number in sorted(blocks)]
+    return RECETARIO_MARKER + "\n\n" + "\n\n".join(ordered) + ("\n" if ordered else ""), missing
+
+
+def map_concurrently(fn: Callable[[T], R], items: Sequence[T], max_workers: int) -> List[R]:
+    """``[fn(item) for item in items]`` on a thread pool, results in input order."""
+    if not items:
+        return []
+    workers = max(1, min(int(max_workers or 1), len(items)))
+    if workers == 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="recipe-batch") as executor:
+        return list(executor.map(fn, items))
@@ -0,0 +1,218 @@
+"""Single-pass index of the recetario section of a generated plan.
+
+The recetario (``== RECETARIO DETALLADO ==`` followed by "Receta N°X: Título"
+blocks) is tokenized line by line once. Each recipe becomes a
+:class:`RecipeEntry` with its servings, ingredient lines, instructions,
+condiments and presentation, and :class:`RecipeIndex` looks entries up by
+number or by normalized title. Indexes are immutable and memoized per text
+(:func:`index_recipes`), so the PDFs, the shopping list and the favorites flow
+share the same parse of a plan.
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+INDEX_CACHE_SIZE = 64
+
+SECTION_SERVINGS = "servings"
+SECTION_INGREDIENTS = "ingredients"
+SECTION_INSTRUCTIONS = "instructions"
+SECTION_CONDIMENTS = "condiments"
+SECTION_PRESENTATION = "presentation"
+
+_MARKER_RE = re.compile(r"==\s*RECETARIO DETALLADO\s*==", re.IGNORECASE)
+# "Receta N°3: Título", also "**Receta No. 3: Título**" and "### Receta N.3: Título"
+_TITLE_RE = re.compile(r"^[\s*#]*Receta\s*(?:N°|No\.|N\.)?\s*(\d+)\s*:\s*(.*?)[\s*]*$", re.IGNORECASE)
+_SECTION_RE = re.compile(
+    r"^[\s*#]*(Porciones que Rinde|Rinde|Ingredientes(?:\s*\([^)]*\))?|Preparaci[oó]n"
+    r"|Condimentos Sugeridos|Sugerencia de Presentaci[oó]n(?:\s*/\s*Servicio)?)\s*:[\s*]*(.*?)\s*$",
+    re.IGNORECASE,
+)
+_BULLET_CHARS = "*-•"
+# Non-bullet lines inside the ingredients that name a sub-recipe ("Para la salsa:")
+_SUB_HEADER_RE = re.compile(r"^[A-Za-zÁÉÍÓÚáéíóúñÑ][A-Za-zÁÉÍÓÚáéíóúñÑ\s(),'-]*:")
+# A numbered step right after the ingredients: "Preparación:" was omitted
+_STEP_RE = re.compile(r"^\d+\.\s+")
+_NUMBER_RE = re.compile(r"N°\s*(\d+)", re.IGNORECASE)
+_SERVINGS_NUMBER_RE = re.compile(r"(\d+[.,]?\d*)")
+
+
+def _section_for(header: str) -> str:
+    header = header.lower()
+    if header.startswith(("porciones", "rinde")):
+        return SECTION_SERVINGS
+    if header.startswith("ingredientes"):
+        return SECTION_INGREDIENTS
+    if header.startswith("preparaci"):
+        return SECTION_INSTRUCTIONS
+    if header.startswith("condimentos"):
+        return SECTION_CONDIMENTS
+    return SECTION_PRESENTATION
+
+
+def normalize_name(name: str) -> str:
+    """Lookup key for a recipe title: no accents, markdown or trailing dots, casefolded."""
+    decomposed = unicodedata.normalize("NFKD", name or "")
+    text = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(text.replace("*", " ").split()).strip(" .:").casefold()
+
+
+class RecipeEntry(NamedTuple):
+    """One recipe. ``ingredient_lines`` keep their bullet ("*   1 taza de arroz"),
+    with continuation lines joined; text sections are ``""`` when absent."""
+    number: int
+    title: str
+    servings: str = ""
+    ingredient_lines: Tuple[str, ...] = ()
+    instructions: str = ""
+    condiments: str = ""
+    presentation: str = ""
+
+    @property
+    def label(self) -> str:
+        return f"N°{self.number}"
+
+    @property
+    def ingredients(self) -> Tuple[str, ...]:
+        """Ingredient text without the bullet."""
+        return tuple(line.lstrip(_BULLET_CHARS + " ").strip() for line in self.ingredient_lines)
+
+    @property
+    def num_servings(self) -> Optional[float]:
+        match = _SERVINGS_NUMBER_RE.search(self.servings)
+        if not match:
+            return None
+        try:
+            return float(match.group(1).replace(",", "."))
+        except ValueError:
+            return None
+
+
+class _Builder:
+    def __init__(self, number: int, title: str):
+        self.number = number
+        self.title = title
+        self.sections: Dict[str, List[str]] = {}
+        self.ingredients: List[str] = []
+        self.current: Optional[str] = None
+
+    def start(self, section: str, inline: str) -> None:
+        self.current = section
+        if section != SECTION_INGREDIENTS:
+            lines = self.sections.setdefault(section, [])
+            if inline:
+                lines.append(inline)
+
+    def add(self, line: str) -> None:
+        stripped = line.strip()
+        if self.current == SECTION_INGREDIENTS:
+            if not stripped:
+                return
+            if stripped[0] in _BULLET_CHARS:
+                if stripped.lstrip(_BULLET_CHARS + " "):
+                    self.ingredients.append(stripped)
+                return
+            if _STEP_RE.match(stripped):
+                self.start(SECTION_INSTRUCTIONS, stripped)
+                return
+            if _SUB_HEADER_RE.match(stripped):
+                return
+            if self.ingredients:
+                self.ingredients[-1] += " " + stripped
+            return
+        if self.current is not None:
+            self.sections[self.current].append(stripped)
+
+    def build(self) -> RecipeEntry:
+        def text(section: str) -> str:
+            return "\n".join(self.sections.get(section, [])).strip()
+        return RecipeEntry(self.number, self.title, text(SECTION_SERVINGS), tuple(self.ingredients),
+                           text(SECTION_INSTRUCTIONS), text(SECTION_CONDIMENTS), text(SECTION_PRESENTATION))
+
+
+def tokenize_recetario(recetario_text: str) -> List[RecipeEntry]:
+    """Every recipe in ``recetario_text`` (with or without the marker), in text order."""
+    entries: List[RecipeEntry] = []
+    builder: Optional[_Builder] = None
+    for line in (recetario_text or "").splitlines():
+        title = _TITLE_RE.match(line)
+        if title:
+            if builder is not None:
+                entries.append(builder.build())
+            builder = _Builder(int(title.group(1)), " ".join(title.group(2).split()))
+            continue
+        if builder is None:
+            continue
+        section = _SECTION_RE.match(line)
+        if section:
+            builder.start(_section_for(section.group(1)), section.group(2).strip())
+        else:
+            builder.add(line)
+    if builder is not None:
+        entries.append(builder.build())
+    return entries
+
+
+class RecipeIndex:
+    """Recipes of one recetario by number (first occurrence wins) and by normalized title."""
+
+    def __init__(self, entries: List[RecipeEntry]):
+        self.entries: Tuple[RecipeEntry, ...] = tuple(entries)
+        self._by_number: Dict[int, RecipeEntry] = {}
+        self._by_name: Dict[str, RecipeEntry] = {}
+        for entry in self.entries:
+            self._by_number.setdefault(entry.number, entry)
+            self._by_name.setdefault(normalize_name(entry.title), entry)
+
+    @classmethod
+    def from_recetario(cls, recetario_text: str) -> "RecipeIndex":
+        return cls(tokenize_recetario(recetario_text))
+
+    @classmethod
+    def from_plan_text(cls, plan_text: str) -> "RecipeIndex":
+        """Index of the recipes after the recetario marker (empty when there is no marker)."""
+        match = _MARKER_RE.search(plan_text or "")
+        return cls.from_recetario(plan_text[match.end():] if match else "")
+
+    def __iter__(self) -> Iterator[RecipeEntry]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def by_number(self, number: int) -> Optional[RecipeEntry]:
+        return self._by_number.get(number)
+
+    def by_name(self, name: str) -> Optional[RecipeEntry]:
+        """Exact normalized title, else the first title starting with ``name``."""
+        key = normalize_name(name)
+        if not key:
+            return None
+        entry = self._by_name.get(key)
+        if entry is not None:
+            return entry
+        return next((e for k, e in self._by_name.items() if k.startswith(key)), None)
+
+    def find(self, identifier: str) -> Optional[RecipeEntry]:
+        """``"N°5"`` (by number, falling back to the name) or a recipe title."""
+        match = _NUMBER_RE.match(str(identifier or "").strip())
+        if match:
+            entry = self.by_number(int(match.group(1)))
+            if entry is not None:
+                return entry
+        return self.by_name(str(identifier or ""))
+
+
+@lru_cache(maxsize=INDEX_CACHE_SIZE)
+def index_recipes(plan_text: str) -> RecipeIndex:
+    """Memoized :meth:`RecipeIndex.from_plan_text` (indexes are never mutated)."""
+    return RecipeIndex.from_plan_text(plan_text)
+
+
+@lru_cache(maxsize=INDEX_CACHE_SIZE)
+def index_recetario(recetario_text: str) -> RecipeIndex:
+    """Memoized :meth:`RecipeIndex.from_recetario`."""
+    return RecipeIndex.from_recetario(recetario_text)
@@ -0,0 +1,230 @@
+"""Patient shopping list built from the stored plan structure.
+
+Ingredient quantities of every recipe are summed per item, then each item is
+filed under a category. When a :class:`Canonicalizer` is given, items are first
+resolved to a database ``Ingredient`` through the name/synonym resolver and
+their quantities converted to grams (millilitres for ingredients measured by
+volume) with the ``UnitEquivalence`` table, so "200 g arroz" and "1 taza de
+arroz" merge into one entry; quantities that cannot be converted stay next to
+it in their own unit. The word lists of each category are compiled
+into one alternation regex, so an item is categorized with a single scan per
+category instead of one substring test per word. The list is computed when
+the evaluation is saved and stored with it; :func:`cache_key` changes with the
+plan text, with :data:`SHOPPING_LIST_VERSION` and with the canonicalizer's
+``fingerprint`` of the ingredient tables, so editing an ingredient, synonym or
+unit equivalence makes stored lists stale. Stored lists keep their
+per-item ``totals`` so :class:`ShoppingListAccumulator` can merge the lists of
+several plans one at a time.
+"""
+from __future__ import annotations
+
+import hashlib
+import re
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from backend.plan_structure import structure_key
+
+# Bump when the aggregation or the categories change: stored lists are rebuilt
+SHOPPING_LIST_VERSION = 3
+
+UNIT_GRAMS = "g"
+UNIT_MILLILITRES = "ml"
+_VOLUME_UNITS = ("ml", "l")
+
+CATEGORY_PRODUCE = "Frutas y Verduras"
+CATEGORY_PROTEIN = "Proteínas (Carnes, Aves, Pescado, Tofu)"
+CATEGORY_GRAINS = "Granos, Legumbres y Pasta"
+CATEGORY_DAIRY = "Lácteos y Huevos"
+CATEGORY_PANTRY = "Despensa (Aceites, Condimentos, Salsas, etc.)"
+CATEGORY_OTHER = "Otros"
+
+CATEGORIES = (CATEGORY_PRODUCE, CATEGORY_PROTEIN, CATEGORY_GRAINS, CATEGORY_DAIRY, CATEGORY_PANTRY, CATEGORY_OTHER)
+
+PANTRY_WORDS = (
+    "aceite", "sal", "pimienta", "vinagre", "salsa de soja", "curry", "comino", "orégano", "laurel", "tomillo",
+    "romero", "pimentón", "jengibre", "canela", "nuez moscada", "ajo en polvo", "cebolla en polvo", "caldo",
+    "levadura", "miel", "azúcar", "edulcorante", "mostaza", "ketchup",
+)
+PROTEIN_WORDS = ("pollo", "carne", "pescado", "salmón", "merluza", "atún", "tofu", "ternera", "cerdo", "pavo")
+GRAIN_WORDS = ("arroz", "quinoa", "lenteja", "garbanzo", "fideo", "pasta", "pan")
+DAIRY_WORDS = ("leche", "queso", "yogur", "huevo")
+# Not bought: dropped from the list
+SKIPPED_WORDS = ("agua",)
+
+
+def _substring_re(words: Sequence[str]) -> "re.Pattern[str]":
+    # Longest first so the alternation never stops at a shorter prefix; matching is plain substring
+    return re.compile("|".join(re.escape(word) for word in sorted(words, key=len, reverse=True)))
+
+
+_PANTRY_RE = _substring_re(PANTRY_WORDS)
+# Checked in order for non-pantry items; the first match wins
+_CATEGORY_RULES = (
+    (_substring_re(PROTEIN_WORDS), CATEGORY_PROTEIN),
+    (_substring_re(GRAIN_WORDS), CATEGORY_GRAINS),
+    (_substring_re(DAIRY_WORDS), CATEGORY_DAIRY),
+    (_substring_re(SKIPPED_WORDS), None),
+)
+
+
+def cache_key(plan_text: str, tables_fingerprint: str = "") -> str:
+    """Key of the list built from ``plan_text`` (plan text, parser and shopping-list versions,
+    and the :attr:`Canonicalizer.fingerprint` of the ingredient tables it was built with)."""
+    payload = f"shopping-v{SHOPPING_LIST_VERSION}:{structure_key(plan_text)}:{tables_fingerprint}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def category_for(item_key: str) -> Any:
+    """Category of a lowercased item name; ``None`` for items left off the list."""
+    if _PANTRY_RE.search(item_key):
+        return CATEGORY_PANTRY
+    for pattern, category in _CATEGORY_RULES:
+        if pattern.search(item_key):
+            return category
+    return CATEGORY_PRODUCE
+
+
+class CanonicalIngredient(NamedTuple):
+    id: int
+    name: str
+
+
+class Canonicalizer:
+    """Maps shopping-list items to database ingredients and converts their quantities.
+
+    ``resolve_names`` takes every distinct item name of the list at once and
+    returns ``{name: CanonicalIngredient}`` for those it could match (one batch
+    per list); ``convert(ingredient_id, quantity, unit, reference_unit)``
+    returns the converted quantity or ``None``. ``fingerprint`` identifies the
+    table contents both answer from; it is recorded with each built list.
+    """
+
+    def __init__(self, resolve_names: Callable[[Sequence[str]], Dict[str, CanonicalIngredient]],
+                 convert: Callable[[int, float, str, str], Optional[float]], fingerprint: str = ""):
+        self.resolve_names = resolve_names
+        self.convert = convert
+        self.fingerprint = fingerprint
+
+
+def _valid_lines(recipes: Iterable[Dict[str, Any]]) -> List[Tuple[str, float, str]]:
+    lines = []
+    for recipe in recipes:
+        for ingredient in recipe.get("ingredients", []):
+            item_name = ingredient.get("item")
+            quantity = ingredient.get("quantity")
+            unit = ingredient.get("unit")
+            if not item_name or quantity is None or unit is None or unit == "N/A":
+                continue
+            lines.append((item_name, quantity, unit))
+    return lines
+
+
+def _add(summed: Dict[str, Dict[str, Any]], key: str, display_name: str, unit: str, quantity: float,
+         ingredient_id: Optional[int] = None) -> None:
+    entry = summed.setdefault(key, {"display_name": display_name, "units": {}})
+    if ingredient_id is not None:
+        entry["ingredient_id"] = ingredient_id
+    entry["units"][unit] = entry["units"].get(unit, 0.0) + quantity
+
+
+def sum_ingredients(recipes: Iterable[Dict[str, Any]],
+                    canonicalizer: Optional[Canonicalizer] = None) -> Dict[str, Dict[str, Any]]:
+    """``{item_key: {"display_name", "units": {unit: total}[, "ingredient_id"]}}`` over the parsed ingredients
+    of ``recipes`` (the ``recipes`` of a plan structure); lines without quantity or unit are skipped.
+
+    Without ``canonicalizer`` items are grouped by lowercased name and quantities
+    by unit string. With it, items resolving to the same ingredient share one entry
+    (named as the first of them appears in the plan) summed in grams, or in
+    millilitres when any of their lines is measured by volume.
+    """
+    lines = _valid_lines(recipes)
+    resolved: Dict[str, CanonicalIngredient] = {}
+    if canonicalizer is not None and lines:
+        resolved = canonicalizer.resolve_names(sorted({item for item, _, _ in lines}))
+    volume_ids = {resolved[item].id for item, _, unit in lines
+                  if item in resolved and unit.lower().strip() in _VOLUME_UNITS}
+
+    summed: Dict[str, Dict[str, Any]] = {}
+    key_for_id: Dict[int, str] = {}
+    for item_name, quantity, unit in lines:
+        match = resolved.get(item_name)
+        key = item_name.lower().strip()
+        if match is None:
+            _add(summed, key, item_name.capitalize(), unit, quantity)
+            continue
+        key = key_for_id.setdefault(match.id, key)
+        target = UNIT_MILLILITRES if match.id in volume_ids else UNIT_GRAMS
+        converted = canonicalizer.convert(match.id, quantity, unit, target) if quantity > 0 else None
+        if converted is not None:
+            unit, quantity = target, converted
+        _add(summed, key, item_name.capitalize(), unit, quantity, match.id)
+    return summed
+
+
+def _format_quantity(quantity: float) -> str:
+    return str(round(quantity, 2) if quantity % 1 != 0 else int(quantity))
+
+
+def categorize(summed: Dict[str, Dict[str, Any]]) -> Dict[str, List[str]]:
+    """Display lines per category (every category present, possibly empty).
+    Pantry items are listed by name only; the rest as ``"Name: 2 taza, 100 g"``."""
+    categories: Dict[str, List[str]] = {category: [] for category in CATEGORIES}
+    for item_key, data in summed.items():
+        category = category_for(item_key)
+        if category is None:
+            continue
+        if category == CATEGORY_PANTRY:
+            categories[category].append(data["display_name"])
+            continue
+        quantities = ", ".join(f"{_format_quantity(qty)} {unit}" for unit, qty in data["units"].items())
+        categories[category].append(f"{data['display_name']}: {quantities}")
+    return categories
+
+
+def build_shopping_list(plan_structure: Dict[str, Any],
+                        canonicalizer: Optional[Canonicalizer] = None) -> Dict[str, Any]:
+    """``{"version", "tables", "has_recetario", "items": {category: [lines]}, "totals"}`` for a
+    stored plan structure; ``totals`` is the :func:`sum_ingredients` result and ``tables`` the
+    canonicalizer's fingerprint."""
+    totals = sum_ingredients(plan_structure.get("recipes", []), canonicalizer)
+    return {
+        "version": SHOPPING_LIST_VERSION,
+        "tables": canonicalizer.fingerprint if canonicalizer else "",
+        "has_recetario": bool(plan_structure.get("has_recetario")),
+        "items": categorize(totals),
+        "totals": totals,
+    }
+
+
+def is_current(shopping_list: Any, tables_fingerprint: Optional[str] = None) -> bool:
+    """Whether a stored list was built by this version (older ones have no mergeable ``totals``)
+    and, when ``tables_fingerprint`` is given, from those ingredient tables."""
+    if not isinstance(shopping_list, dict) or shopping_list.get("version") != SHOPPING_LIST_VERSION:
+        return False
+    return tables_fingerprint is None or shopping_list.get("tables", "") == tables_fingerprint
+
+
+class ShoppingListAccumulator:
+    """Merges the ``totals`` of stored lists one plan at a time.
+
+    Memory grows with the number of distinct items, not with the number of
+    plans. Entries of the same database ingredient merge across plans even
+    when their plan names differ; quantities merge per unit.
+    """
+
+    def __init__(self) -> None:
+        self.totals: Dict[str, Dict[str, Any]] = {}
+        self.plans = 0
+        self._key_for_id: Dict[int, str] = {}
+
+    def add(self, shopping_list: Dict[str, Any]) -> None:
+        self.plans += 1
+        for key, entry in shopping_list.get("totals", {}).items():
+            ingredient_id = entry.get("ingredient_id")
+            if ingredient_id is not None:
+                key = self._key_for_id.setdefault(ingredient_id, key)
+            for unit, quantity in entry["units"].items():
+                _add(self.totals, key, entry["display_name"], unit, quantity, ingredient_id)
+
+    def categories(self) -> Dict[str, List[str]]:
+        return categorize(self.totals)
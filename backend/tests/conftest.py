@@ -0,0 +1,43 @@
+import importlib
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+_TMP_DIR = tempfile.mkdtemp(prefix='nutriapp-tests-')
+_TEST_DB_URL = 'sqlite:///' + os.path.join(_TMP_DIR, 'test.sqlite')
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    """app.py imported against a throwaway SQLite database, log files and cache directories."""
+    os.environ.update({
+        'DATABASE_URL': _TEST_DB_URL,
+        'ERROR_LOG_PATH': os.path.join(_TMP_DIR, 'error.log'),
+        'ERROR_TRACEBACK_EXPORT_PATH': os.path.join(_TMP_DIR, 'last_traceback.txt'),
+        'NUTRIENT_MATRIX_DIR': os.path.join(_TMP_DIR, 'nutrient_matrix'),
+        'PLAN_CACHE_DIR': os.path.join(_TMP_DIR, 'plans'),
+        'PDF_CACHE_DIR': os.path.join(_TMP_DIR, 'pdfs'),
+        'REMOTE_PDF_CACHE_DIR': os.path.join(_TMP_DIR, 'remote_pdfs'),
+        'PDF_STORAGE_LOCAL_DIR': os.path.join(_TMP_DIR, 'storage'),
+        'DRIVE_BACKEND': 'fake',
+    })
+    module = importlib.import_module('app')
+    if module.app.config['SQLALCHEMY_DATABASE_URI'] != _TEST_DB_URL:
+        # A .env file (loaded with override=True) points somewhere else: never touch that database
+        pytest.skip('DATABASE_URL is overridden by .env')
+    return module
+
+
+@pytest.fixture
+def app_db(app_module):
+    """An app context over empty tables, with the ingredient caches invalidated."""
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+        app_module.invalidate_ingredient_caches()
+        yield app_module
+        app_module.db.session.remove()
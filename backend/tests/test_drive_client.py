@@ -0,0 +1,104 @@
+import importlib
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+drive_client = importlib.import_module('backend.drive_client')
+
+
+class FakeCredentials:
+    def __init__(self):
+        self.valid = False
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.valid = True
+
+
+def test_fake_drive_round_trip():
+    drive = drive_client.FakeDrive()
+    file_id = drive.upload(b'%PDF-1.4 data', 'plan.pdf', 'folder')
+    assert file_id == 'fake-1'
+    assert drive.files[file_id]['parents'] == ['folder']
+    assert drive.download(file_id).read() == b'%PDF-1.4 data'
+    with pytest.raises(drive_client.DriveFileNotFound):
+        drive.download('missing')
+    assert drive.uploads == 1 and drive.downloads == 2
+
+
+def make_client(load, **kwargs):
+    return drive_client.DriveClient(load, build_service=lambda creds: object(), make_http=object, **kwargs)
+
+
+def test_client_is_built_once_and_shared_between_threads():
+    loads, credentials = [], FakeCredentials()
+
+    def load():
+        loads.append(1)
+        return credentials
+
+    client = make_client(load, pool_size=4)
+    transports, barrier = [], threading.Barrier(4)
+
+    def worker():
+        with client.http() as http:
+            barrier.wait()  # All four checked out at once
+            transports.append(http)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(loads) == 1 and client.builds == 1
+    # Concurrent calls never share a transport
+    assert len({id(http) for http in transports}) == 4 and client.connects == 4
+    assert credentials.refreshes == 1
+
+
+def test_sequential_calls_from_different_threads_reuse_one_connection():
+    client = make_client(lambda: FakeCredentials())
+    transports = []
+
+    def call():
+        with client.http() as http:
+            transports.append(http)
+
+    for _ in range(2):
+        thread = threading.Thread(target=call)
+        thread.start()
+        thread.join()
+
+    assert transports[0] is transports[1] and client.connects == 1
+
+
+def test_pool_keeps_at_most_pool_size_idle_transports():
+    client = make_client(lambda: FakeCredentials(), pool_size=1)
+    with client.http() as first, client.http() as second:
+        assert first is not second
+    with client.http() as again:
+        assert again is second  # The first one found the pool full and was dropped
+    with pytest.raises(OSError):
+        with client.http():
+            raise OSError('connection reset')
+    with client.http():
+        pass
+    assert client.connects == 3  # A transport that failed mid-request is not reused
+
+
+def test_expired_credentials_are_refreshed_and_reset_rebuilds():
+    credentials = FakeCredentials()
+    client = make_client(lambda: credentials)
+    with client.http() as http:
+        pass
+    credentials.valid = False
+    with client.http() as again:
+        assert again is http and credentials.refreshes == 2
+    client.reset()
+    with client.http() as rebuilt:
+        assert rebuilt is not http and client.builds == 2
@@ -0,0 +1,56 @@
+import importlib
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+error_logging = importlib.import_module('backend.error_logging')
+
+
+def _logger(name):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def test_errors_are_written_by_the_listener_and_export_is_coalesced(tmp_path):
+    logger = _logger('test_error_logging.coalesce')
+    log_path = str(tmp_path / 'error.log')
+    export_path = str(tmp_path / 'last_traceback.txt')
+    pipeline = error_logging.setup_error_logging(logger, log_path, export_path, min_interval_seconds=60)
+    try:
+        logger.info('not an error')
+        for i in range(12):
+            try:
+                raise ValueError(f'ingrediente {i}')
+            except ValueError:
+                logger.exception('NUTR_CALC_ERROR %d', i)
+    finally:
+        pipeline.stop()
+        logger.removeHandler(pipeline.queue_handler)
+
+    with open(log_path, encoding='utf-8') as fh:
+        log_text = fh.read()
+    assert log_text.count('NUTR_CALC_ERROR') == 12
+    assert 'not an error' not in log_text
+    assert 'Traceback' in log_text
+
+    exporter = pipeline.listener.handlers[1]
+    # First error exported immediately, the rest coalesced into one trailing export
+    assert exporter.exports == 2
+    with open(export_path, encoding='utf-8') as fh:
+        exported = fh.read()
+    assert 'NUTR_CALC_ERROR 11' in exported and 'ValueError: ingrediente 11' in exported
+
+
+def test_export_is_optional(tmp_path):
+    logger = _logger('test_error_logging.no_export')
+    pipeline = error_logging.setup_error_logging(logger, str(tmp_path / 'error.log'))
+    try:
+        logger.error('boom')
+    finally:
+        pipeline.stop()
+        logger.removeHandler(pipeline.queue_handler)
+    assert len(pipeline.listener.handlers) == 1
+    assert 'boom' in (tmp_path / 'error.log').read_text(encoding='utf-8')
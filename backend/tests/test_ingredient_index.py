@@ -0,0 +1,66 @@
+import importlib
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+index_module = importlib.import_module('backend.ingredient_index')
+
+ROWS = [
+    (1, 'Arroz blanco', json.dumps(['arroz'])),
+    (2, 'Arroz integral', '[]'),
+    (3, 'Aceite de oliva', json.dumps(['Oliva', 'aceite oliva'])),
+    (4, 'Pechuga de pollo', None),
+    (5, 'Leche entera', 'no-json'),
+    (6, 'Tomate', '[]'),
+    (7, 'Salsa de tomate', '[]'),
+]
+
+
+def test_resolution_cascade():
+    index = index_module.IngredientIndex(ROWS)
+
+    assert index.resolve('tomate') == (6, 'Tomate', 'Exact Match')
+    assert index.resolve('arroz') == (1, 'Arroz blanco', 'Prefix Match')
+    assert index.resolve('de pollo') == (4, 'Pechuga de pollo', 'Substring Match')
+    assert index.resolve('aceite oliva') == (3, 'Aceite de oliva', 'Synonym Match')
+    assert index.resolve('pollo asado al horno') == (4, 'Pechuga de pollo', 'Token-based Match')
+    assert index.resolve('quinoa') is None
+    assert index.resolve('') is None
+
+
+def test_token_match_prefers_names_starting_with_token():
+    index = index_module.IngredientIndex(ROWS)
+    # 'Tomate' starts with the token and is shorter than 'Salsa de tomate'
+    assert index.token('tomate perita') == 6
+    assert index.token('de ab') is None
+
+
+def test_cache_rebuilds_after_invalidate():
+    rows = list(ROWS)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return rows
+
+    cache = index_module.IngredientIndexCache(loader)
+    assert cache.get().resolve('quinoa') is None
+    rows.append((8, 'Quinoa', '[]'))
+    assert cache.get().resolve('quinoa') is None
+    cache.invalidate()
+    assert cache.get().resolve('quinoa').id == 8
+    assert len(calls) == 2
+
+
+def test_version_follows_the_rows_and_does_not_rebuild_on_expiry():
+    assert index_module.IngredientIndex(ROWS).version == index_module.IngredientIndex(reversed(ROWS)).version
+    edited = ROWS[:-1] + [(7, 'Salsa de tomate', json.dumps(['salsa']))]
+    assert index_module.IngredientIndex(edited).version != index_module.IngredientIndex(ROWS).version
+
+    calls = []
+    cache = index_module.IngredientIndexCache(lambda: calls.append(1) or ROWS, ttl_seconds=1e-9)
+    version = cache.version()
+    assert cache.version() == version and len(calls) == 1
+    cache.get()  # Expired: get() rebuilds
+    assert len(calls) == 2
@@ -0,0 +1,44 @@
+import importlib
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+parser_module = importlib.import_module('backend.ingredient_parser')
+
+# Recipe lines with the output of the previous per-call-regex implementation
+with open(os.path.join(os.path.dirname(__file__), 'data', 'ingredient_lines.json'), encoding='utf-8') as fh:
+    CORPUS = json.load(fh)
+
+
+def test_corpus_output_is_unchanged():
+    for case in CORPUS:
+        parsed = parser_module.parse_ingredient_line(case['line'])
+        assert parsed == {'item': case['item'], 'quantity': case['quantity'],
+                          'unit': case['unit'], 'original_line': case['line']}, case['line']
+        assert parser_module.clean_item_name(case['line'].lstrip('* ')) == case['clean'], case['line']
+
+
+def test_trailing_phrases_are_stripped_in_list_order():
+    clean = parser_module.clean_item_name
+    # "cocido" comes before "fresco" in the list and is not re-checked
+    assert clean('tomate cocido fresco') == 'tomate cocido'
+    assert clean('tomate fresco cocido') == 'tomate'
+    # "cocidas" is listed twice, so it is stripped again after "frescas"
+    assert clean('lentejas cocidas frescas') == 'lentejas'
+    assert clean('tomate pelado, cortado en cubos') == 'tomate'
+    assert clean('huevo grande') == 'huevo'
+    assert clean('picado') == 'picado'
+
+
+def test_results_are_cached_per_line():
+    parser_module.cache_clear()
+    line = '*   2 cucharadas de aceite de oliva (aprox. 30ml)'
+    first = parser_module.parse_ingredient_line(line)
+    first['item'] = 'mutated'
+    second = parser_module.parse_ingredient_line(line)
+
+    assert second['item'] == 'cucharadas de aceite de oliva'
+    assert second['quantity'] == 30.0 and second['unit'] == 'ml'
+    assert parser_module.parse_line(line).strategy == parser_module.STRATEGY_PARENTHESIZED
+    assert parser_module.cache_info()[0].hits >= 1
@@ -0,0 +1,83 @@
+import importlib
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+llm_backends = importlib.import_module('backend.llm_backends')
+recipe_batches = importlib.import_module('backend.recipe_batches')
+
+SAMPLE_PLAN = os.path.join(os.path.dirname(__file__), 'data', 'sample_plan.txt')
+RECIPE_PROMPT = """
+    **LISTA DE PLATOS PARA LOS QUE NECESITAS GENERAR RECETAS DETALLADAS:**
+    N°2. Merluza al horno con papas
+    N°42. Budín de zapallitos
+"""
+
+
+def test_replay_returns_recorded_structure_and_requested_recipes():
+    sleeps = []
+    backend = llm_backends.ReplayBackend.from_file(SAMPLE_PLAN, latency_seconds=1.5, chars_per_second=1000,
+                                                   chunk_chars=500, sleep=sleeps.append)
+    chunks = []
+    structure = backend.generate('prompt de estructura', llm_backends.PURPOSE_STRUCTURE, on_chunk=chunks.append)
+    assert structure.block_reason is None
+    assert structure.text.startswith('**Lunes**')
+    assert recipe_batches.RECETARIO_MARKER not in structure.text
+    assert ''.join(chunks) == structure.text
+    assert sleeps[0] == 1.5 and abs(sum(sleeps[1:]) - len(structure.text) / 1000) < 1e-9
+
+    recipes = backend.generate(RECIPE_PROMPT, llm_backends.PURPOSE_RECIPES)
+    blocks = recipe_batches.split_recipes(recipes.text)
+    assert [number for number, _ in blocks] == [2, 42]
+    assert blocks[0][1].startswith('Receta N°2: Merluza al horno con papas\n')
+    assert blocks[1][1].startswith('Receta N°42: Budín de zapallitos\n')
+    # Unknown numbers reuse the first recorded recipe body
+    assert blocks[1][1].split('\n', 1)[1] == backend.recipes[1].split('\n', 1)[1]
+    assert backend.calls == 2
+
+
+def test_cache_context_identifies_the_backend():
+    backend = llm_backends.ReplayBackend.from_file(SAMPLE_PLAN)
+    assert backend.cache_context() == {'backend': 'replay', 'fixture': SAMPLE_PLAN}
+    assert backend.count_tokens('x' * 40) == 10
+
+
+def test_backends_must_implement_generate():
+    class Incomplete(llm_backends.LLMBackend):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_app_reuses_the_backend_until_its_config_changes(app_module):
+    config = app_module.app.config
+    saved = {key: config.get(key) for key in ('LLM_BACKEND', 'LLM_REPLAY_FIXTURE', 'LLM_REPLAY_LATENCY_SECONDS')}
+    config.update(LLM_BACKEND='replay', LLM_REPLAY_FIXTURE=SAMPLE_PLAN, LLM_REPLAY_LATENCY_SECONDS=0)
+    try:
+        backend = app_module.crear_backend_llm()
+        assert isinstance(backend, llm_backends.ReplayBackend)
+        assert app_module.crear_backend_llm() is backend
+        config['LLM_REPLAY_LATENCY_SECONDS'] = 0.5
+        slower = app_module.crear_backend_llm()
+        assert slower is not backend and slower.latency_seconds == 0.5
+    finally:
+        config.update(saved)
+
+
+def test_gemini_result_from_response():
+    ok = SimpleNamespace(parts=['x'], text='Plan')
+    assert llm_backends.GeminiBackend.result_from_response(ok) == ('Plan', None, '', None)
+
+    partial = SimpleNamespace(
+        parts=[],
+        prompt_feedback=SimpleNamespace(block_reason='SAFETY', block_reason_message='bloqueado'),
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text='Lunes: ...')]))],
+    )
+    assert llm_backends.GeminiBackend.result_from_response(partial) == ('Lunes: ...', 'SAFETY', 'bloqueado', None)
+
+    empty = SimpleNamespace(parts=[], prompt_feedback=None, candidates=[])
+    assert llm_backends.GeminiBackend.result_from_response(empty) == ('', 'Razón desconocida', '', None)
@@ -0,0 +1,68 @@
+import importlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+llm_metrics = importlib.import_module('backend.llm_metrics')
+
+
+def test_histogram_counts_are_cumulative():
+    histogram = llm_metrics.Histogram((1, 5))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value)
+    assert histogram.to_dict() == {'count': 4, 'sum': 14.5, 'buckets': {'1': 2, '5': 3, '+Inf': 4}}
+
+
+def test_metrics_aggregate_calls_by_purpose():
+    metrics = llm_metrics.LLMMetrics()
+    usage = {'prompt_tokens': 1200, 'output_tokens': 3000, 'total_tokens': 4200}
+    metrics.record_call(llm_metrics.call_record('structure', 4.2, usage, first_chunk_seconds=0.8))
+    metrics.record_call(llm_metrics.call_record('structure', 0.01, cache_hit=True))
+    metrics.record_call(llm_metrics.call_record('recipes', 6.0, block_reason='SAFETY', partial=True))
+    metrics.record_call(llm_metrics.call_record('recipes', 1.0, error='timeout'))
+    metrics.record_plan(recipes=12, latency_seconds=10.3)
+    metrics.record_plan(recipes=0, latency_seconds=1.0, ok=False)
+
+    snapshot = metrics.snapshot()
+    structure, recipes = snapshot['calls']['structure'], snapshot['calls']['recipes']
+    assert structure['calls'] == 2 and structure['cache_hits'] == 1
+    assert structure['tokens'] == usage
+    assert structure['latency_seconds']['count'] == 1 and structure['first_chunk_seconds']['count'] == 1
+    assert structure['prompt_tokens']['buckets']['2000'] == 1
+    assert recipes['errors'] == 1 and recipes['blocked'] == 1 and recipes['partial_fallbacks'] == 1
+    assert recipes['block_reasons'] == {'SAFETY': 1} and recipes['calls_without_usage'] == 1
+    assert snapshot['plans']['total'] == 2 and snapshot['plans']['failed'] == 1
+    assert snapshot['plans']['recipes_per_plan']['buckets']['14'] == 1
+
+    metrics.reset()
+    assert metrics.snapshot()['calls'] == {}
+
+
+def test_generation_stats_summary():
+    stats = llm_metrics.GenerationStats()
+    stats.add_call(llm_metrics.call_record('structure', 2.0, {'prompt_tokens': 100, 'output_tokens': 400,
+                                                               'total_tokens': 500}))
+    stats.add_call(llm_metrics.call_record('recipes', 0.0, cache_hit=True))
+    stats.recipes = 6
+    summary = stats.summary()
+    assert summary['model_calls'] == 1 and summary['cache_hits'] == 1 and summary['blocked'] == 0
+    assert (summary['prompt_tokens'], summary['output_tokens'], summary['total_tokens']) == (100, 400, 500)
+    assert summary['recipes'] == 6 and len(summary['calls']) == 2
+
+
+def test_generation_stats_store_is_bounded_and_owned():
+    store = llm_metrics.GenerationStatsStore(max_entries=2)
+    first = store.put('nutri-1', {'model_calls': 1})
+    second = store.put('nutri-1', {'model_calls': 2})
+    assert store.get(first, 'nutri-1') == {'model_calls': 1}
+    assert store.get(first, 'nutri-2') is None
+    assert store.get({'model_calls': 9}, 'nutri-1') is None
+    store.put('nutri-2', {'model_calls': 3})
+    assert store.get(first, 'nutri-1') is None  # Oldest dropped
+    assert store.get(second, 'nutri-1') == {'model_calls': 2}
+
+    expired = llm_metrics.GenerationStatsStore(ttl_seconds=0.01)
+    generation_id = expired.put('nutri-1', {})
+    time.sleep(0.02)
+    assert expired.get(generation_id, 'nutri-1') is None
@@ -0,0 +1,95 @@
+import importlib
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+mailer = importlib.import_module('backend.mailer')
+debug_smtp = importlib.import_module('backend.debug_smtp')
+
+
+@pytest.fixture
+def server():
+    with debug_smtp.DebugSmtpServer() as smtp_server:
+        yield smtp_server
+
+
+def make_pool(server, **kwargs):
+    return mailer.SmtpPool(mailer.smtp_connector('127.0.0.1', server.port, use_tls=False, timeout=5), **kwargs)
+
+
+def message(to, subject='Tu plan', attachments=()):
+    return mailer.build_message('nutri@example.com', to, subject, '<p>Hola Ana</p>', attachments)
+
+
+def test_build_message_with_attachment():
+    msg = message('ana@example.com', 'Tu plan nutricional', [('Plan Pérez.pdf', b'%PDF-1.4', 'application/pdf')])
+    attachment = next(msg.iter_attachments())
+    assert attachment.get_filename() == 'Plan Pérez.pdf'
+    assert attachment.get_content() == b'%PDF-1.4'
+    assert msg.get_body(('html',)).get_content().strip() == '<p>Hola Ana</p>'
+
+
+def test_pool_reuses_one_connection(server):
+    pool = make_pool(server)
+    assert pool.send_many([message(f'p{i}@example.com') for i in range(3)]) == [None] * 3
+    assert pool.send_many([message('p3@example.com')]) == [None]
+    assert server.connections == 1 and pool.connects == 1
+    assert [m.rcpt_tos for m in server.messages] == [[f'p{i}@example.com'] for i in range(4)]
+    assert server.messages[0].message()['Subject'] == 'Tu plan'
+    pool.close()
+
+
+def test_pool_replaces_dead_and_worn_out_connections(server):
+    pool = make_pool(server, check_after=0, max_messages=2)
+    assert pool.send_many([message('a@example.com')]) == [None]
+    pool._idle[0].smtp.sock.shutdown(socket.SHUT_RDWR)  # The connection dies while idle
+    assert pool.send_many([message('b@example.com'), message('c@example.com'), message('d@example.com')]) == [None] * 3
+    # Reconnected after the dead idle connection, and again after two messages on one connection
+    assert pool.connects == 3 and len(server.messages) == 4
+    pool.close()
+
+
+def test_queue_retries_temporary_errors_and_fails_permanent_ones(server):
+    server.fail_next = 2
+    server.refused.add('nadie@example.com')
+    failures = []
+    queue = mailer.MailQueue(make_pool(server).send_many, batch_size=10, max_attempts=3,
+                             backoff_seconds=0.01, on_failure=failures.append)
+    flaky = queue.enqueue(message('ana@example.com'), owner=1)
+    refused = queue.enqueue(message('nadie@example.com'), owner=1)
+    assert queue.flush(timeout=5)
+    assert flaky.state == mailer.SENT and flaky.attempts == 3
+    assert refused.state == mailer.FAILED and refused.attempts == 1 and failures == [refused]
+    assert queue.get(flaky.id, owner=1) is flaky and queue.get(flaky.id, owner=2) is None
+    assert queue.get(flaky.id).snapshot()['status'] == mailer.SENT
+    assert queue.close(timeout=1)
+
+
+def test_queue_sends_bulk_in_batches_and_builds_in_the_worker(server):
+    batches = []
+    pool = make_pool(server)
+
+    def send_batch(messages):
+        batches.append(len(messages))
+        return pool.send_many(messages)
+
+    queue = mailer.MailQueue(send_batch, batch_size=4, max_attempts=1)
+    mails = queue.enqueue_many([mailer.OutgoingMail(build=lambda i=i: message(f'p{i}@example.com'))
+                                for i in range(10)] + [mailer.OutgoingMail(build=lambda: None)])
+    assert queue.flush(timeout=5)
+    assert batches == [4, 4, 2]
+    assert [mail.state for mail in mails] == [mailer.SENT] * 10 + [mailer.FAILED]
+    assert len(server.messages) == 10 and server.connections == 1
+    queue.close(timeout=1)
+    with pytest.raises(RuntimeError):
+        queue.enqueue(message('tarde@example.com'))
+
+
+def test_unreachable_server_fails_the_whole_batch_once():
+    pool = mailer.SmtpPool(mailer.smtp_connector('127.0.0.1', 1, use_tls=False, timeout=1))
+    errors = pool.send_many([message('a@example.com'), message('b@example.com')])
+    assert len(errors) == 2 and all(isinstance(e, OSError) for e in errors)
+    assert not mailer.is_permanent(errors[0])
@@ -0,0 +1,61 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('numpy')
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+matrix_module = importlib.import_module('backend.nutrient_matrix')
+
+RECORDS = [
+    (10, 100.0, 'g', 339.0, 6.9, 77.5, 0.2, {'sodio_mg': 4.0, 'hierro_mg': 0.7}),
+    (20, 100.0, 'g', 884.0, 0.0, 0.0, 100.0, {'vitamina_e_mg': 14.4, 'nota': 'aprox'}),
+    (30, 1.0, 'unidad', None, 6.3, 0.4, 5.0, {}),
+]
+
+
+def test_totals_match_per_ingredient_arithmetic():
+    matrix = matrix_module.NutrientMatrix.from_records(RECORDS)
+    rows = [matrix.row(10), matrix.row(20)]
+    totals = matrix.totals(rows, [1.5, 0.137])
+
+    assert totals['calories'] == round(339.0 * 1.5, 2) + round(884.0 * 0.137, 2)
+    assert totals['fat_g'] == round(0.2 * 1.5, 2) + round(100.0 * 0.137, 2)
+    assert totals['micros']['sodio_mg'] == pytest.approx(6.0)
+    assert totals['micros']['vitamina_e_mg'] == pytest.approx(14.4 * 0.137)
+    assert totals['micros']['nota'] == 'aprox'
+    assert 'potasio_mg' not in totals['micros']
+
+
+def test_missing_ingredient_and_empty_recipe():
+    matrix = matrix_module.NutrientMatrix.from_records(RECORDS)
+    assert matrix.row(99) is None
+    assert matrix.reference(matrix.row(30)) == (1.0, 'unidad')
+    assert matrix.totals([], []) == {'calories': 0.0, 'protein_g': 0.0, 'carb_g': 0.0, 'fat_g': 0.0, 'micros': {}}
+
+
+def test_cache_persists_and_detects_stale_copy(tmp_path):
+    fingerprint = [(3, 30)]
+    builds = []
+
+    def loader():
+        builds.append(1)
+        return RECORDS
+
+    directory = str(tmp_path / 'matrix')
+    first = matrix_module.NutrientMatrixCache(loader, lambda: fingerprint[0], directory=directory)
+    assert len(first.get()) == 3
+
+    # A fresh process with the same fingerprint reuses the memory-mapped copy
+    second = matrix_module.NutrientMatrixCache(loader, lambda: fingerprint[0], directory=directory)
+    assert second.get().totals([0], [1.0])['calories'] == 339.0
+    assert len(builds) == 1
+
+    fingerprint[0] = (4, 31)
+    third = matrix_module.NutrientMatrixCache(loader, lambda: fingerprint[0], directory=directory)
+    third.get()
+    assert len(builds) == 2
+
+    third.invalidate()
+    assert not os.path.exists(os.path.join(directory, 'meta.json'))
@@ -0,0 +1,123 @@
+import importlib
+import json
+
+import pytest
+import sqlalchemy
+
+
+def seed(app):
+    db = app.db
+    rows = [
+        # (name, synonyms, nutrient rows [(ref qty, ref unit, cal, prot, carb, fat, micros)], equivalences)
+        ('Arroz blanco', ['arroz'], [(100.0, 'g', 130, 2.7, 28.0, 0.3, {'Hierro_mg': 0.2})], [('taza', 185)]),
+        ('Leche entera', ['leche de vaca'], [(100.0, 'ml', 61, 3.2, 4.8, 3.3, {'Calcio_mg': 113})], [('taza', 240)]),
+        ('Huevo, entero, crudo', ['huevo'], [(1.0, 'unidad', 72, 6.3, 0.4, 4.8, {}),
+                                             (100.0, 'g', 143, 12.6, 0.7, 9.5, {'Hierro_mg': 1.8})], [('unidad', 50)]),
+        ('Tomate perita de estacion cosechado a mano en verano', [], [(100.0, 'g', 18, 0.9, 3.9, 0.2, {})], []),
+        ('Aceite de oliva', ['aceite'], [(100.0, 'g', 884, 0, 0, 100, {'VitaminaE_mg': 14.4})],
+         [('cucharada', 13.5), ('cucharadita', 4.5)]),
+        ('Sal fina', [], [], []),  # Sin datos nutricionales
+    ]
+    for name, synonyms, nutrients, equivalences in rows:
+        ingredient = app.Ingredient(name=name, synonyms_json=json.dumps(synonyms))
+        db.session.add(ingredient)
+        db.session.flush()
+        for qty, unit, cal, prot, carb, fat, micros in nutrients:
+            db.session.add(app.IngredientNutrient(
+                ingredient_id=ingredient.id, reference_quantity=qty, reference_unit=unit, calories=cal,
+                protein_g=prot, carb_g=carb, fat_g=fat, micronutrients_json=json.dumps(micros)))
+        for unit, grams in equivalences:
+            db.session.add(app.UnitEquivalence(ingredient_id=ingredient.id, household_unit=unit, grams_per_unit=grams))
+    db.session.commit()
+    app.invalidate_ingredient_caches()
+
+
+ITEMS = [
+    ('arroz blanco', 150, 'g'),  # Exact
+    ('arroz', 1, 'taza'),  # Prefix + household unit
+    ('leche de vaca', 200, 'ml'),  # Synonym
+    ('leche de vaca', 0.5, 'taza'),
+    ('huevo', 2, 'unidad'),  # Synonym, several nutrient rows
+    ('huevos', 120, 'g'),
+    ('tomate cherry', 80, 'g'),  # Dubious token match
+    ('aceite', 1, 'cucharada'),
+    ('aceite', 2, 'cdta'),
+    ('sal fina', 2, 'g'),  # No nutrient rows
+    ('quinoa roja', 50, 'g'),  # Not in the DB
+    ('arroz', 3, 'pizca'),  # Unit without conversion
+    ('arroz', 0, 'g'),  # Invalid quantity
+    ('', 10, 'g'),
+]
+
+
+def test_batch_matches_per_ingredient_path(app_db):
+    seed(app_db)
+    one_by_one = [app_db.get_ingredient_nutritional_info(*item) for item in ITEMS]
+    assert app_db.get_ingredients_nutritional_info_batch(ITEMS) == one_by_one
+    # The cases above exercise real matches, not only zeros
+    assert sum(1 for info in one_by_one if info['calories']) >= 7
+
+
+def test_recipe_totals_match_per_ingredient_sum(app_db, monkeypatch):
+    seed(app_db)
+    ingredients = [{'parsed_item_name': name, 'quantity': qty, 'unit': unit} for name, qty, unit in ITEMS]
+    expected = {'calories': 0.0, 'protein_g': 0.0, 'carb_g': 0.0, 'fat_g': 0.0}
+    expected_micros = {}
+    for name, qty, unit in ITEMS:
+        info = app_db.get_ingredient_nutritional_info(name, qty, unit)
+        for key in expected:
+            expected[key] += info[key]
+        for micro, value in info['micros'].items():
+            expected_micros[micro] = expected_micros.get(micro, 0.0) + value
+
+    monkeypatch.setattr(app_db, 'get_nutrient_matrix', lambda: None)
+    batch_totals = app_db.calculate_total_nutritional_info(ingredients)
+    assert batch_totals == {**{k: round(v, 2) for k, v in expected.items()}, 'micros': expected_micros}
+
+    monkeypatch.undo()
+    if app_db.get_nutrient_matrix() is None:
+        pytest.skip('numpy not installed')
+    matrix_totals = app_db.calculate_total_nutritional_info(ingredients)
+    for key in expected:
+        assert matrix_totals[key] == pytest.approx(batch_totals[key], abs=0.01)
+    assert matrix_totals['micros'] == pytest.approx(expected_micros)
+
+
+def new_process_cache(app, directory):
+    nutrient_matrix = importlib.import_module('backend.nutrient_matrix')
+    return nutrient_matrix.NutrientMatrixCache(
+        app._load_nutrient_matrix_records, app._nutrient_matrix_fingerprint, directory=str(directory))
+
+
+def test_matrix_on_disk_is_rebuilt_after_in_place_edit(app_db, tmp_path):
+    if app_db.get_nutrient_matrix() is None:
+        pytest.skip('numpy not installed')
+    seed(app_db)
+    rice = app_db.Ingredient.query.filter_by(name='Arroz blanco').one()
+    matrix = new_process_cache(app_db, tmp_path).get()
+    assert matrix.values[matrix.row(rice.id), 0] == 130
+    # Edited without invalidate_ingredient_caches(): same row count and max id
+    rice.nutrients.one().calories = 140
+    app_db.db.session.commit()
+    matrix = new_process_cache(app_db, tmp_path).get()
+    assert matrix.values[matrix.row(rice.id), 0] == 140
+
+
+def test_unchanged_table_is_not_read_to_validate_the_matrix_on_disk(app_db, tmp_path):
+    if app_db.get_nutrient_matrix() is None:
+        pytest.skip('numpy not installed')
+    seed(app_db)
+    new_process_cache(app_db, tmp_path).get()
+    row_reads = []
+
+    def count_row_reads(conn, cursor, statement, parameters, context, executemany):
+        if 'micronutrients_json' in statement:
+            row_reads.append(statement)
+
+    engine = app_db.db.engine
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', count_row_reads)
+    try:
+        matrix = new_process_cache(app_db, tmp_path).get()
+    finally:
+        sqlalchemy.event.remove(engine, 'before_cursor_execute', count_row_reads)
+    assert len(matrix) == 5 and row_reads == []
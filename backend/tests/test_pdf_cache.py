@@ -0,0 +1,107 @@
+import importlib
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+pdf_cache = importlib.import_module('backend.pdf_cache')
+plan_cache = importlib.import_module('backend.plan_cache')
+
+PDF = b'%PDF-1.4\n' + b'x' * 100
+
+
+def test_round_trip_returns_a_servable_path(tmp_path):
+    cache = pdf_cache.PdfCache(str(tmp_path))
+    key = plan_cache.cache_key('patient_pdf', 1, 42, 'Lunes: ...')
+    assert cache.get_path(key) is None
+    path = cache.put_bytes(key, PDF)
+    assert path == str(tmp_path / (key + '.pdf'))
+    assert cache.get_path(key) == path
+    with open(path, 'rb') as fh:
+        assert fh.read() == PDF
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Plan-cache JSON entries in the same directory are not PDF entries
+    plan_cache.PlanCache(str(tmp_path)).put(key, 'texto')
+    assert len(cache._entries()) == 1
+    with pytest.raises(TypeError):
+        cache.get(key)
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = pdf_cache.PdfCache(str(tmp_path), max_bytes=250)
+    cache.put_bytes('a', PDF)
+    cache.put_bytes('b', PDF)
+    past = time.time() - 100
+    os.utime(tmp_path / 'a.pdf', (past, past))
+    os.utime(tmp_path / 'b.pdf', (past - 10, past - 10))
+    assert cache.get_path('b')  # Touched: now the most recently used
+    cache.put_bytes('c', PDF)
+    assert cache.get_path('a') is None
+    assert cache.get_path('b') and cache.get_path('c')
+
+
+def test_disabled_or_empty():
+    cache = pdf_cache.PdfCache(None)
+    assert cache.put_bytes('k', PDF) is None and cache.get_path('k') is None
+
+
+def test_read_through_collapses_concurrent_misses(tmp_path):
+    cache = pdf_cache.PdfCache(str(tmp_path))
+    started, release, calls = threading.Event(), threading.Event(), []
+
+    def load():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return PDF
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('drive-id', load))) for _ in range(5)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    path = str(tmp_path / 'drive-id.pdf')
+    assert len(calls) == 1 and cache.loads == 1
+    assert results == [(path, None)] * 5
+    assert cache.get_or_load('drive-id', load) == (path, None) and len(calls) == 1
+
+
+def test_read_through_without_directory_or_data(tmp_path):
+    assert pdf_cache.PdfCache(None).get_or_load('k', lambda: PDF) == (None, PDF)
+    cache = pdf_cache.PdfCache(str(tmp_path))
+    assert cache.get_or_load('k', lambda: None) == (None, None)
+    with pytest.raises(RuntimeError):
+        cache.get_or_load('k', lambda: (_ for _ in ()).throw(RuntimeError('drive down')))
+    # A failed load is not remembered
+    assert cache.get_or_load('k', lambda: PDF)[0] == str(tmp_path / 'k.pdf')
+
+
+def test_read_through_streams_chunks_into_the_cache_file(tmp_path):
+    cache = pdf_cache.PdfCache(str(tmp_path))
+    written = []
+
+    def chunks():
+        for start in range(0, len(PDF), 32):
+            # Each chunk is pulled while the cache file is open, not collected first
+            written.append([p.suffix for p in tmp_path.iterdir()])
+            yield PDF[start:start + 32]
+
+    path, data = cache.get_or_load('drive-id', chunks)
+    assert data is None and open(path, 'rb').read() == PDF
+    assert written == [['.tmp']] * 4
+
+    def broken():
+        yield PDF[:32]
+        raise OSError('connection reset')
+
+    with pytest.raises(OSError):
+        cache.get_or_load('other-id', broken)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['drive-id.pdf']  # No partial entry or temporary file
+    assert pdf_cache.PdfCache(None).get_or_load('k', lambda: iter([PDF[:9], PDF[9:]])) == (None, PDF)
@@ -0,0 +1,127 @@
+import importlib
+import io
+import os
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+pdf_storage = importlib.import_module('backend.pdf_storage')
+drive_client = importlib.import_module('backend.drive_client')
+
+PDF = b'%PDF-1.4\n' + bytes(range(256)) * 40
+
+
+class MissingKey(Exception):
+    response = {'Error': {'Code': 'NoSuchKey'}}
+
+
+class Body(io.BytesIO):
+    def iter_chunks(self, chunk_size):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class InMemoryS3:
+    """The boto3 S3 client calls S3Storage makes, over a dict (a MinIO-style stand-in)."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self.objects[(bucket, key)] = (fileobj.read(), ExtraArgs)
+
+    def get_object(self, Bucket, Key, Range=None):
+        if (Bucket, Key) not in self.objects:
+            raise MissingKey()
+        data = self.objects[(Bucket, Key)][0]
+        if Range:
+            start, end = re.match(r'bytes=(\d+)-(\d*)', Range).groups()
+            data = data[int(start):int(end) + 1 if end else None]
+        return {'Body': Body(data)}
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise MissingKey()
+        return {'ContentLength': len(self.objects[(Bucket, Key)][0])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+def drivers(tmp_path):
+    fake_drive = drive_client.FakeDrive()
+    return [
+        pdf_storage.LocalStorage(str(tmp_path / 'pdfs')),
+        pdf_storage.S3Storage(InMemoryS3(), 'nutriapp', prefix='evaluaciones/'),
+        pdf_storage.DriveStorage(lambda: fake_drive, lambda: 'folder'),
+    ]
+
+
+@pytest.mark.parametrize('index', [0, 1, 2])
+def test_round_trip_and_ranged_reads(tmp_path, monkeypatch, index):
+    monkeypatch.setattr(pdf_storage, 'CHUNK_SIZE', 1000)  # Several chunks per file
+    driver = drivers(tmp_path)[index]
+    key = driver.put(io.BytesIO(PDF), 'Evaluación Pérez 1.pdf')
+    assert driver.size(key) == len(PDF)
+    chunks = list(driver.open(key))
+    assert b''.join(chunks) == PDF and len(chunks) > 1
+    assert b''.join(driver.open(key, 10, 2500)) == PDF[10:2501]
+    assert b''.join(driver.open(key, len(PDF) - 5)) == PDF[-5:]
+    driver.delete(key)
+    driver.delete(key)  # Already gone: not an error
+    with pytest.raises(pdf_storage.PdfNotFound):
+        b''.join(driver.open(key))
+
+
+def test_keys_are_unique_and_safe(tmp_path):
+    local, s3, _ = drivers(tmp_path)
+    key = local.put(io.BytesIO(PDF), '../Evaluación Pérez.pdf')
+    assert re.fullmatch(r'[0-9a-f]{2}/[0-9a-f]{32}-Evaluacion_Perez\.pdf', key)
+    assert local.local_path(key) == str(tmp_path / 'pdfs' / key)
+    assert s3.put(io.BytesIO(PDF), 'a.pdf').startswith('evaluaciones/')
+    with pytest.raises(pdf_storage.PdfNotFound):
+        local.size('../../etc/passwd')
+
+
+def test_registry_locations_legacy_ids_and_copy(tmp_path):
+    registry = pdf_storage.PdfStorageRegistry(drivers(tmp_path), default='drive')
+    drive_location = registry.put(io.BytesIO(PDF), 'plan.pdf')
+    assert drive_location == 'drive:fake-1'
+    # Bare values are Drive ids saved before locations had a scheme
+    assert registry.split('fake-1') == ('drive', 'fake-1') and registry.read('fake-1') == PDF
+    assert registry.local_path(drive_location) is None
+
+    local_location = registry.copy('fake-1', 'plan.pdf', 'local')
+    assert local_location.startswith('local:') and registry.read(local_location, 0, 7) == PDF[:8]
+    assert registry.local_path(local_location)
+    s3_location = registry.copy(local_location, 'plan.pdf', 's3')
+    assert registry.size(s3_location) == len(PDF)
+
+    with pytest.raises(pdf_storage.PdfNotFound):
+        registry.read('s3:evaluaciones/missing.pdf')
+    with pytest.raises(ValueError):
+        pdf_storage.PdfStorageRegistry(drivers(tmp_path)[:1], default='s3')
+
+
+def test_drive_without_folder_is_unavailable():
+    driver = pdf_storage.DriveStorage(lambda: drive_client.FakeDrive(), lambda: None)
+    with pytest.raises(pdf_storage.PdfStorageUnavailable):
+        driver.put(io.BytesIO(PDF), 'plan.pdf')
+    with pytest.raises(pdf_storage.PdfStorageUnavailable):
+        pdf_storage.DriveStorage(lambda: None, lambda: 'folder').size('id')
+
+
+def test_drivers_must_implement_the_interface():
+    class Incomplete(pdf_storage.PdfStorage):
+        scheme = 'incomplete'
+
+        def put(self, fileobj, name):
+            return name
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,81 @@
+import importlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+plan_cache = importlib.import_module('backend.plan_cache')
+
+CONTEXT = {'model': 'gemini-1.5-pro-latest', 'generation_config': {'temperature': 0.7, 'top_k': 40}}
+
+
+def test_key_is_canonical_and_content_addressed():
+    key = plan_cache.cache_key(CONTEXT, 'prompt')
+    reordered = {'generation_config': {'top_k': 40, 'temperature': 0.7}, 'model': 'gemini-1.5-pro-latest'}
+    assert plan_cache.cache_key(reordered, 'prompt') == key
+    assert plan_cache.cache_key(CONTEXT, 'prompt ') != key
+    assert plan_cache.cache_key(dict(CONTEXT, model='otro'), 'prompt') != key
+
+
+def test_round_trip_ttl_and_persistence(tmp_path):
+    cache = plan_cache.PlanCache(str(tmp_path), ttl_seconds=60)
+    key = plan_cache.cache_key(CONTEXT, 'estructura')
+    assert cache.get(key) is None
+    cache.put(key, 'Lunes: Desayuno (Ver Receta N°1)')
+    assert cache.get(key) == 'Lunes: Desayuno (Ver Receta N°1)'
+    # Another instance (e.g. another worker process) sees the same entry
+    assert plan_cache.PlanCache(str(tmp_path), ttl_seconds=60).get(key) == 'Lunes: Desayuno (Ver Receta N°1)'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    expired = plan_cache.PlanCache(str(tmp_path), ttl_seconds=60)
+    path = tmp_path / (key + '.json')
+    path.write_text('{"created_at": %f, "text": "viejo"}' % (time.time() - 120), encoding='utf-8')
+    assert expired.get(key) is None
+    assert not path.exists()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = plan_cache.PlanCache(str(tmp_path), max_entries=2)
+    keys = [plan_cache.cache_key(CONTEXT, f'lote {i}') for i in range(3)]
+    cache.put(keys[0], 'a')
+    cache.put(keys[1], 'b')
+    past = time.time() - 100
+    os.utime(tmp_path / (keys[0] + '.json'), (past, past))
+    os.utime(tmp_path / (keys[1] + '.json'), (past - 10, past - 10))
+    assert cache.get(keys[1]) == 'b'  # touched: now the most recently used
+    cache.put(keys[2], 'c')
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[1]) == 'b' and cache.get(keys[2]) == 'c'
+
+    by_size = plan_cache.PlanCache(str(tmp_path / 'size'), max_bytes=150)
+    by_size.put('k1', 'x' * 80)
+    by_size.put('k2', 'y' * 80)
+    assert by_size.get('k1') is None and by_size.get('k2') == 'y' * 80
+
+
+def test_disabled_without_directory():
+    cache = plan_cache.PlanCache(None)
+    cache.put('k', 'texto')
+    assert cache.get('k') is None
+
+
+def test_directory_is_scanned_only_when_over_a_limit(tmp_path):
+    cache = plan_cache.PlanCache(str(tmp_path), max_entries=20, rescan_seconds=3600)
+    for i in range(20):
+        cache.put(f'k{i}', 'texto')
+    cache.put('k0', 'otro texto')  # Overwrite: still 20 entries
+    assert cache.scans == 1  # The first put learns the directory's size
+    cache.put('k20', 'texto')
+    assert cache.scans == 2
+    # Evicted down to 90% of the limit, oldest first
+    assert len(list(tmp_path.iterdir())) == 18
+    assert cache.get('k20') == 'texto' and cache.get('k0') == 'otro texto'
+    for i in range(21, 23):
+        cache.put(f'k{i}', 'texto')
+    assert cache.scans == 2
+
+    # A file written by another process is picked up by the periodic rescan: 22 entries, trimmed to 18
+    cache.rescan_seconds = 0
+    (tmp_path / 'ajeno.json').write_text('{"created_at": 0, "text": "x"}', encoding='utf-8')
+    cache.put('k23', 'texto')
+    assert cache.scans == 3 and len(list(tmp_path.iterdir())) == 18
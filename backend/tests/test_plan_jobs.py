@@ -0,0 +1,119 @@
+import importlib
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+plan_jobs = importlib.import_module('backend.plan_jobs')
+
+
+def _wait(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job.snapshot()
+
+
+def test_job_reports_progress_and_result():
+    queue = plan_jobs.JobQueue(workers=1)
+    release = threading.Event()
+
+    def generate(job, name):
+        job.append_text('structure_text', 'Lunes: ')
+        job.append_text('recipes_text', 'Receta N°2', index=1)
+        job.increment('recipe_batches_done')
+        release.wait(5)
+        return {'plan': name}
+
+    job = queue.submit('nutri-1', generate, 'Ana')
+    assert queue.get(job.id) is job
+    time.sleep(0.05)
+    running = job.snapshot()
+    assert running['status'] == plan_jobs.RUNNING
+    assert running['progress'] == {'structure_text': 'Lunes: ', 'recipes_text': ['', 'Receta N°2'],
+                                   'recipe_batches_done': 1}
+    release.set()
+    done = _wait(job)
+    assert done['status'] == plan_jobs.DONE and done['result'] == {'plan': 'Ana'} and done['error'] is None
+    queue.shutdown()
+
+
+def test_failures_are_recorded():
+    queue = plan_jobs.JobQueue(workers=1)
+
+    def fail(job):
+        raise RuntimeError('Error: La IA bloqueó la respuesta.')
+
+    snapshot = _wait(queue.submit('nutri-1', fail))
+    assert snapshot['status'] == plan_jobs.FAILED
+    assert snapshot['error'] == 'Error: La IA bloqueó la respuesta.'
+    queue.shutdown()
+
+
+def test_per_owner_limit_and_ownership():
+    queue = plan_jobs.JobQueue(workers=2, per_owner_limit=1)
+    release = threading.Event()
+    first = queue.submit('nutri-1', lambda job: release.wait(5))
+    with pytest.raises(plan_jobs.JobLimitExceeded):
+        queue.submit('nutri-1', lambda job: None)
+    other = queue.submit('nutri-2', lambda job: release.wait(5))
+    assert queue.active_count() == 2
+    assert queue.get(first.id, owner='nutri-2') is None
+    assert queue.get(other.id, owner='nutri-2') is other
+
+    release.set()
+    _wait(first)
+    # The slot is freed once the job finishes
+    _wait(queue.submit('nutri-1', lambda job: 'ok'))
+    queue.shutdown()
+
+
+def test_finished_jobs_are_purged_after_retention():
+    queue = plan_jobs.JobQueue(workers=1, retention_seconds=0)
+    job = queue.submit('nutri-1', lambda job: 'ok')
+    _wait(job)
+    time.sleep(0.01)
+    assert queue.get(job.id) is None
+    queue.shutdown()
+
+
+def test_published_events_wake_waiters():
+    queue = plan_jobs.JobQueue(workers=1)
+    release = threading.Event()
+
+    def generate(job):
+        job.publish('structure', {'text': 'Lunes'})
+        release.wait(5)
+        job.publish('structure', {'text': ': avena'})
+        return 'ok'
+
+    job = queue.submit('nutri-1', generate)
+    events, finished = job.wait_events(0, timeout=5)
+    assert events == [('structure', {'text': 'Lunes'})] and not finished
+    # Nothing new: returns after the timeout
+    assert job.wait_events(1, timeout=0.05) == ([], False)
+
+    threading.Timer(0.05, release.set).start()
+    events, finished = job.wait_events(1, timeout=5)
+    assert events == [('structure', {'text': ': avena'})]
+    _wait(job)
+    assert job.wait_events(2, timeout=5) == ([], True)
+    queue.shutdown()
+
+
+def test_cancel_sets_the_flag_seen_by_the_job():
+    queue = plan_jobs.JobQueue(workers=1)
+
+    def generate(job):
+        if not job.cancelled.wait(5):
+            return 'ok'
+        raise RuntimeError('cancelado')
+
+    job = queue.submit('nutri-1', generate)
+    job.cancel()
+    snapshot = _wait(job)
+    assert snapshot['status'] == plan_jobs.FAILED and snapshot['error'] == 'cancelado'
+    queue.shutdown()
@@ -0,0 +1,79 @@
+import importlib
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+plan_structure = importlib.import_module('backend.plan_structure')
+
+SAMPLE_PLAN = os.path.join(os.path.dirname(__file__), 'data', 'sample_plan.txt')
+
+PLAN = """**Lunes**
+*   Desayuno: Avena con banana
+*   Almuerzo: Budín de zapallitos (Ver Receta N°1)
+*
+*   Colación: 1 manzana
+
+**Martes**:
+*   Cena: Budín de zapallitos (Ver Receta N°1)
+
+== RECETARIO DETALLADO ==
+
+Receta N°1: Budín de zapallitos
+Porciones que Rinde: 2 porciones
+Ingredientes:
+-   2 zapallitos (aprox. 300 g)
+*   1/2 taza de leche (aprox. 120 ml)
+Preparación:
+1. Hornear.
+"""
+
+
+def test_lines_are_classified_with_the_text_the_pdfs_render():
+    structure = plan_structure.build_plan_structure(PLAN)
+    kinds = [(line['kind'], line['text']) for line in structure['lines']]
+    # Meal headers lose the space after the colon, as the PDFs always rendered them
+    assert kinds[:5] == [('day', 'Lunes:'), ('meal', 'Desayuno:Avena con banana'),
+                         ('meal', 'Almuerzo:Budín de zapallitos (Ver Receta N°1)'),
+                         ('item', ''), ('item', 'Colación: 1 manzana')]
+    assert kinds[5] == ('blank', '') and kinds[6] == ('day', 'Martes:')
+
+
+def test_days_and_recipes_are_parsed_once():
+    structure = plan_structure.build_plan_structure(PLAN)
+    assert [day['day'] for day in structure['days']] == ['Lunes', 'Martes']
+    assert structure['days'][0]['meals'][1] == {'meal': 'Almuerzo', 'text': 'Budín de zapallitos (Ver Receta N°1)',
+                                                 'recipes': [1]}
+    assert structure['days'][0]['meals'][2]['meal'] == 'Colación'
+    assert structure['has_recetario']
+    recipe, = structure['recipes']
+    assert recipe['number'] == 'Receta N°1' and recipe['num_servings'] == 2.0
+    zapallitos, leche = recipe['ingredients']
+    assert zapallitos['raw_line'] == '2 zapallitos (aprox. 300 g)'
+    assert (zapallitos['quantity'], zapallitos['unit']) == (300.0, 'g')
+    assert (leche['quantity'], leche['unit']) == (120.0, 'ml')
+    assert json.loads(json.dumps(structure)) == structure
+
+
+def test_plans_without_recetario_or_with_failed_recetario():
+    structure = plan_structure.build_plan_structure('**Lunes**\nDesayuno: té')
+    assert not structure['has_recetario'] and structure['recipes'] == []
+    failed = plan_structure.build_plan_structure('x\n== RECETARIO DETALLADO ==\nError: bloqueado')
+    assert failed['has_recetario'] and failed['recipes'] == []
+    assert plan_structure.build_plan_structure('')['lines'] == []
+
+
+def test_structure_key_tracks_text_and_version(monkeypatch):
+    key = plan_structure.structure_key(PLAN)
+    assert key == plan_structure.structure_key(PLAN) and len(key) == 64
+    assert key != plan_structure.structure_key(PLAN + ' ')
+    monkeypatch.setattr(plan_structure, 'STRUCTURE_VERSION', plan_structure.STRUCTURE_VERSION + 1)
+    assert key != plan_structure.structure_key(PLAN)
+
+
+def test_sample_plan():
+    with open(SAMPLE_PLAN, encoding='utf-8') as fh:
+        structure = plan_structure.build_plan_structure(fh.read())
+    assert len(structure['recipes']) == 6
+    assert all(recipe['ingredients'] for recipe in structure['recipes'])
+    assert len(structure['days']) >= 1 and all(day['meals'] for day in structure['days'])
@@ -0,0 +1,190 @@
+import importlib
+import io
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+post_save = importlib.import_module('backend.post_save')
+plan_jobs = importlib.import_module('backend.plan_jobs')
+
+
+def make_pipeline(steps, store, **kwargs):
+    queue = plan_jobs.JobQueue(workers=1, per_owner_limit=1, thread_name_prefix='test-post-save')
+    sleeps = []
+    pipeline = post_save.PostSavePipeline(
+        queue, steps, store.get, store.__setitem__, sleep=sleeps.append, **kwargs)
+    return pipeline, sleeps
+
+
+def test_steps_run_in_order_and_state_is_saved():
+    calls, store = [], {}
+    pipeline, _ = make_pipeline([('pdf', lambda key: calls.append(('pdf', key)) or True),
+                                 ('drive', lambda key: calls.append(('drive', key)) or 'file-id')], store)
+    state = pipeline.run(7)
+    assert calls == [('pdf', 7), ('drive', 7)]
+    assert state['status'] == post_save.DONE and store[7] is state
+    assert state['steps']['drive'] == {'status': post_save.DONE, 'attempts': 1, 'error': None}
+
+
+def test_failed_step_is_retried_with_backoff_then_marked_failed():
+    attempts, store = [], {}
+
+    def flaky(key):
+        attempts.append(key)
+        if len(attempts) < 3:
+            raise RuntimeError('drive timeout')
+        return True
+
+    pipeline, sleeps = make_pipeline([('drive', flaky), ('patient', lambda key: False)], store,
+                                     max_attempts=3, backoff_seconds=1.5)
+    state = pipeline.run(1)
+    assert len(attempts) == 3 and state['steps']['drive']['status'] == post_save.DONE
+    # The second step still ran, and failed after its own three attempts
+    assert state['steps']['patient'] == {'status': post_save.FAILED, 'attempts': 3, 'error': 'step returned no result'}
+    assert state['status'] == post_save.FAILED
+    assert sleeps == [1.5, 3.0, 1.5, 3.0]
+
+
+def test_aborted_step_is_not_retried():
+    store = {}
+
+    def not_configured(key):
+        raise post_save.StepAborted('DRIVE_FOLDER_ID no configurado.')
+
+    pipeline, sleeps = make_pipeline([('drive', not_configured)], store, max_attempts=5)
+    state = pipeline.run(1)
+    assert state['steps']['drive'] == {'status': post_save.FAILED, 'attempts': 1, 'error': 'DRIVE_FOLDER_ID no configurado.'}
+    assert sleeps == []
+
+
+def test_resumed_task_skips_steps_already_done():
+    calls = []
+    store = {3: post_save.new_state(['pdf', 'drive'])}
+    store[3]['steps']['pdf']['status'] = post_save.DONE
+    store[3]['status'] = post_save.RUNNING
+    pipeline, _ = make_pipeline([('pdf', lambda key: calls.append('pdf') or True),
+                                 ('drive', lambda key: calls.append('drive') or True)], store)
+    assert pipeline.run(3)['status'] == post_save.DONE
+    assert calls == ['drive']
+
+
+def test_enqueue_is_idempotent_per_key():
+    release, store = threading.Event(), {}
+    pipeline, _ = make_pipeline([('pdf', lambda key: release.wait(5))], store)
+    assert pipeline.enqueue(1) is True
+    assert pipeline.enqueue(1) is False and pipeline.is_active(1)
+    release.set()
+    pipeline.queue.shutdown(wait=True)
+    assert store[1]['status'] == post_save.DONE and not pipeline.is_active(1)
+
+
+def test_is_stale():
+    state = post_save.new_state(['pdf'])
+    assert not post_save.is_stale(state, 60, now=state['updated_at'] + 10)
+    assert post_save.is_stale(state, 60, now=state['updated_at'] + 61)
+    state['status'] = post_save.DONE
+    assert not post_save.is_stale(state, 60, now=state['updated_at'] + 61)
+    assert not post_save.is_stale(None, 60)
+
+
+def add_evaluation(app, cedula='12345678', post_save_state=None):
+    patient = app.Patient(name='Ana', surname='Pérez', cedula=cedula)
+    app.db.session.add(patient)
+    app.db.session.flush()
+    evaluation = app.Evaluation(patient_id=patient.id)
+    if post_save_state:
+        evaluation.set_post_save_state(post_save_state)
+    app.db.session.add(evaluation)
+    app.db.session.commit()
+    return evaluation.id
+
+
+def test_full_pdf_step_keeps_a_pdf_saved_meanwhile(app_db, monkeypatch):
+    evaluation_id = add_evaluation(app_db)
+    uploaded = []
+
+    def save_while_an_update_commits(pdf_buffer, name):
+        uploaded.append(app_db.pdf_storage.put(pdf_buffer, name, scheme='local'))
+        # actualizar_evaluacion commits its own PDF while this one is being stored
+        app_db.db.session.execute(app_db.db.update(app_db.Evaluation).values(pdf_storage_path='drive:from-update'))
+        return uploaded[0]
+
+    monkeypatch.setattr(app_db, 'crear_pdf_v2', lambda evaluation: io.BytesIO(b'%PDF-1.4 test'))
+    monkeypatch.setattr(app_db, 'guardar_pdf_almacenado', save_while_an_update_commits)
+    assert app_db._paso_pdf_completo(evaluation_id) is True
+    app_db.db.session.expire_all()
+    assert app_db.Evaluation.query.get(evaluation_id).pdf_storage_path == 'drive:from-update'
+    assert app_db.pdf_storage.local_path(uploaded[0]) is None  # The discarded upload was deleted
+
+
+def test_tasks_interrupted_before_startup_are_enqueued_again(app_db, monkeypatch):
+    started = app_db._INICIO_PROCESO
+    interrupted = dict(post_save.new_state(['pdf']), status=post_save.RUNNING, updated_at=started - 5)
+    ids = [add_evaluation(app_db, '1', interrupted),
+           add_evaluation(app_db, '2', dict(interrupted, updated_at=started + 5)),  # Another live process runs it
+           add_evaluation(app_db, '3', dict(interrupted, status=post_save.DONE))]
+    enqueued = []
+    monkeypatch.setattr(app_db.post_save_pipeline, 'enqueue', lambda key: enqueued.append(key) or True)
+    assert app_db.reanudar_tareas_post_guardado() == 1
+    assert enqueued == [ids[0]]
+
+
+def logged_in_client(app, uid='u1'):
+    user = app.User(uid=uid)
+    app.db.session.add(user)
+    app.db.session.commit()
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+    return client, user.id
+
+
+def test_estado_pdf_reports_the_state_and_enqueues_abandoned_tasks(app_db, monkeypatch):
+    monkeypatch.setitem(app_db.app.config, 'POST_SAVE_RESUME_ON_STARTUP', False)
+    enqueued = []
+    monkeypatch.setattr(app_db.post_save_pipeline, 'enqueue', lambda key: enqueued.append(key) or True)
+    client, user_id = logged_in_client(app_db)
+    abandoned = dict(post_save.new_state(['pdf']), status=post_save.RUNNING, updated_at=time.time() - 3600)
+    evaluation_id = add_evaluation(app_db, post_save_state=abandoned)
+    evaluation = app_db.Evaluation.query.get(evaluation_id)
+    evaluation.user_id = user_id
+    app_db.db.session.commit()
+
+    response = client.get(f'/estado_pdf/{evaluation_id}')
+    assert response.status_code == 200
+    assert response.get_json() == {'evaluation_id': evaluation_id, 'status': post_save.RUNNING,
+                                   'steps': abandoned['steps'], 'pdf_storage_path': None}
+    assert enqueued == [evaluation_id]
+
+    # Requests share the fixture's app context, where Flask-Login caches the user
+    other_client, _ = logged_in_client(app_db, uid='u2')
+    app_db.g.pop('_login_user', None)
+    assert other_client.get(f'/estado_pdf/{evaluation_id}').status_code == 403
+    app_db.g.pop('_login_user', None)
+    assert app_db.app.test_client().get(f'/estado_pdf/{evaluation_id}').status_code == 302
+
+
+def test_ver_pdf_serves_ranges_and_revalidates(app_db, monkeypatch):
+    pdf = b'%PDF-1.4 ' + bytes(range(256)) * 8
+    drive = importlib.import_module('backend.drive_client').FakeDrive()
+    storage = importlib.import_module('backend.pdf_storage')
+    monkeypatch.setitem(app_db.pdf_storage.drivers, 'drive', storage.DriveStorage(lambda: drive, lambda: 'folder'))
+    client = app_db.app.test_client()
+    for location in (app_db.pdf_storage.put(io.BytesIO(pdf), 'plan.pdf', scheme='local'),
+                     'drive:' + drive.upload(pdf, 'plan.pdf', 'folder')):
+        evaluation_id = add_evaluation(app_db, cedula=location[:20])
+        app_db.Evaluation.query.get(evaluation_id).pdf_storage_path = location
+        app_db.db.session.commit()
+        loads = app_db.remote_pdf_cache.loads
+
+        full = client.get(f'/ver_pdf/{evaluation_id}')
+        assert full.status_code == 200 and full.data == pdf and full.headers['Accept-Ranges'] == 'bytes'
+        etag = full.headers['ETag']
+        partial = client.get(f'/ver_pdf/{evaluation_id}', headers={'Range': 'bytes=9-18'})
+        assert partial.status_code == 206 and partial.data == pdf[9:19]
+        assert partial.headers['Content-Range'] == f'bytes 9-18/{len(pdf)}'
+        assert client.get(f'/ver_pdf/{evaluation_id}', headers={'If-None-Match': etag}).status_code == 304
+        # A remote PDF is downloaded once, then served from the local cache
+        assert app_db.remote_pdf_cache.loads - loads == (location.startswith('drive:') and 1 or 0)
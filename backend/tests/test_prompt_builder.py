@@ -0,0 +1,63 @@
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+prompt_builder = importlib.import_module('backend.prompt_builder')
+
+
+def test_compact_prompt_strips_template_indentation():
+    prompt = """
+    **A. DATOS:**
+    *   Edad: 40
+
+
+    1.  **Estructura:**
+        *   Detalle
+N°2. Merluza al horno   
+    """
+    assert prompt_builder.compact_prompt(prompt) == (
+        "**A. DATOS:**\n* Edad: 40\n\n1. **Estructura:**\n    * Detalle\nN°2. Merluza al horno\n")
+
+
+def test_compact_base_foods_dedupes_preparations_and_ingredients():
+    base_foods = [
+        {'name': 'Tarta de zapallitos', 'id': 7, 'original_ingredients': [
+            {'item': 'Huevo, entero, crudo'}, {'item': 'huevo,  entero, crudo'}, {'item': ''}]},
+        'tarta de zapallitos', {'name': 'Tarta de zapallitos', 'original_ingredients': [{'item': 'Queso rallado'}]},
+        'Ensalada rusa', '', None,
+    ]
+    assert prompt_builder.compact_base_foods(base_foods) == [
+        ('Tarta de zapallitos', ['Huevo, entero, crudo', 'Queso rallado']), ('Ensalada rusa', [])]
+
+
+def test_compact_base_foods_keeps_quantities():
+    base_foods = [{'name': 'Tortilla', 'original_ingredients': [
+        {'item': 'Huevo, entero, crudo', 'quantity': 2.0, 'unit': 'unidad'},
+        {'item': 'Huevo, entero, crudo', 'quantity': 2, 'unit': 'unidad'},
+        {'item': 'Papa', 'quantity': 150, 'unit': 'g', 'original_line': '* 150 g de papa'},
+        {'item': 'Sal', 'quantity': None, 'unit': 'N/A'}]}]
+    assert prompt_builder.compact_base_foods(base_foods) == [
+        ('Tortilla', ['Huevo, entero, crudo (2 unidad)', 'Papa (150 g)', 'Sal'])]
+
+
+def test_relevant_ingredient_names_match_the_batch_dishes():
+    names = ['Acelga, hoja', 'Calabaza, cruda', 'Limón, jugo', 'Merluza, filete, crudo', 'Pollo, pechuga', 'Tomate, rojo']
+    dishes = ['Merluza al horno con puré de calabaza', 'Ensalada de tomates con limones']
+    assert prompt_builder.relevant_ingredient_names(names, dishes) == [
+        'Calabaza, cruda', 'Limón, jugo', 'Merluza, filete, crudo', 'Tomate, rojo']
+    assert prompt_builder.relevant_ingredient_names(names, dishes, limit=1) == ['Calabaza, cruda']
+    assert prompt_builder.relevant_ingredient_names(names, ['Sopa']) == []
+
+
+def test_group_ingredient_names_folds_variants():
+    names = ['Acelga, hoja', 'Acelga, tallo', 'Aceite de canola', 'Arroz, grano, blanco, crudo', 'Acelga, hoja']
+    assert prompt_builder.group_ingredient_names(names) == (
+        'Acelga (hoja / tallo); Aceite de canola; Arroz (grano, blanco, crudo)')
+
+
+def test_join_known_skips_missing_values():
+    pairs = [('P. Muñeca', None), ('P. Cintura', 80), ('P. Cadera', 'N/A')]
+    assert prompt_builder.join_known(pairs, {'P. Cintura': ' cm'}) == 'P. Cintura: 80 cm'
+    assert prompt_builder.join_known([('IMC', '')]) == ''
+    assert prompt_builder.estimate_tokens('a' * 9) == 3
@@ -0,0 +1,52 @@
+import importlib
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+batches_module = importlib.import_module('backend.recipe_batches')
+
+RECIPES = [('N°10', 'Tarta de acelga'), ('N°2', 'Merluza al horno'), ('N°1', 'Pollo con arroz'), ('N°3', 'Lentejas')]
+
+
+def _recipe(number, name):
+    return f"Receta N°{number}: {name}\nPorciones que Rinde: 1 porción\nIngredientes (para 1 porción):\n*   1 taza de arroz\nPreparación:\n1. Cocinar."
+
+
+def test_batches_are_sorted_by_recipe_number():
+    batches = batches_module.make_batches(RECIPES, 2)
+    assert batches == [[('N°1', 'Pollo con arroz'), ('N°2', 'Merluza al horno')],
+                       [('N°3', 'Lentejas'), ('N°10', 'Tarta de acelga')]]
+    assert batches_module.make_batches([], 3) == []
+
+
+def test_assemble_orders_by_number_and_fills_missing():
+    first = "== RECETARIO DETALLADO ==\n\n" + _recipe(3, 'Lentejas') + "\n\n" + _recipe(1, 'Pollo con arroz')
+    second = "== RECETARIO DETALLADO ==\n**Receta N°10: Tarta de acelga**\nPreparación:\n1. Hornear."
+    text, missing = batches_module.assemble_recetario(
+        [first, None, second], RECIPES, placeholder=lambda label, name: f"Receta {label}: {name}\nPreparación:\nPendiente.")
+
+    assert missing == ['N°2']
+    assert text.startswith('== RECETARIO DETALLADO ==\n\nReceta N°1: Pollo con arroz')
+    numbers = [number for number, _ in batches_module.split_recipes(text)]
+    assert numbers == [1, 2, 3, 10]
+    assert text.count('== RECETARIO DETALLADO ==') == 1
+
+
+def test_map_concurrently_keeps_order_and_overlaps_calls():
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def slow(item):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return item * 2
+
+    assert batches_module.map_concurrently(slow, [3, 1, 2], max_workers=3) == [6, 2, 4]
+    assert peak[0] > 1
+    assert batches_module.map_concurrently(slow, [], max_workers=3) == []
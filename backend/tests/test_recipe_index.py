@@ -0,0 +1,77 @@
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+recipe_index = importlib.import_module('backend.recipe_index')
+
+SAMPLE_PLAN = os.path.join(os.path.dirname(__file__), 'data', 'sample_plan.txt')
+
+RECETARIO = """Lunes: ... (Ver Receta N°1)
+
+== RECETARIO DETALLADO ==
+
+**Receta N°1: Budín de zapallitos**
+**Porciones que Rinde:** 2 porciones
+**Ingredientes (para 2 porciones):**
+*   2 zapallitos (aprox. 300 g)
+*   1 huevo
+    batido
+Para la salsa:
+-   1/2 taza de leche (aprox. 120 ml)
+**Preparación:**
+1. Rallar los zapallitos.
+
+2. Hornear 30 minutos.
+**Condimentos Sugeridos:** Nuez moscada.
+**Sugerencia de Presentación/Servicio:** Tibio,
+con ensalada.
+
+Receta No. 2: Lentejas guisadas
+Ingredientes:
+* 1 taza de lentejas
+1. Cocinar todo junto.
+Receta N°1: Duplicado
+"""
+
+
+def test_tokenizer_reads_every_section_in_one_pass():
+    index = recipe_index.RecipeIndex.from_plan_text(RECETARIO)
+    assert [entry.number for entry in index] == [1, 2, 1]
+    budin = index.by_number(1)
+    assert budin.title == 'Budín de zapallitos'
+    assert budin.servings == '2 porciones' and budin.num_servings == 2.0
+    assert budin.ingredient_lines == ('*   2 zapallitos (aprox. 300 g)', '*   1 huevo batido',
+                                      '-   1/2 taza de leche (aprox. 120 ml)')
+    assert budin.ingredients[1] == '1 huevo batido'
+    assert budin.instructions == '1. Rallar los zapallitos.\n\n2. Hornear 30 minutos.'
+    assert budin.condiments == 'Nuez moscada.'
+    assert budin.presentation == 'Tibio,\ncon ensalada.'
+
+    lentejas = index.by_number(2)
+    # A numbered step ends the ingredients even without "Preparación:"
+    assert lentejas.ingredients == ('1 taza de lentejas',) and lentejas.instructions == '1. Cocinar todo junto.'
+    assert lentejas.servings == '' and lentejas.num_servings is None
+
+
+def test_lookup_by_number_and_normalized_name():
+    index = recipe_index.RecipeIndex.from_plan_text(RECETARIO)
+    assert index.find('N°2').title == 'Lentejas guisadas'
+    assert index.find('budin de ZAPALLITOS.').number == 1
+    assert index.find('Lentejas').number == 2  # Title prefix
+    assert index.find('N°7') is None and index.find('Milanesa') is None
+    assert index.find('') is None
+
+
+def test_plan_without_recetario_has_no_recipes():
+    assert len(recipe_index.RecipeIndex.from_plan_text('Lunes: Receta N°1: Algo\n')) == 0
+    assert len(recipe_index.RecipeIndex.from_recetario('Receta N°1: Algo\n')) == 1
+
+
+def test_sample_plan_and_memoization():
+    with open(SAMPLE_PLAN, encoding='utf-8') as fh:
+        plan_text = fh.read()
+    index = recipe_index.index_recipes(plan_text)
+    assert index is recipe_index.index_recipes(plan_text)
+    assert [entry.label for entry in index] == ['N°1', 'N°2', 'N°3', 'N°4', 'N°5', 'N°6']
+    assert all(entry.ingredient_lines and entry.instructions and entry.servings == '1 porción' for entry in index)
@@ -0,0 +1,268 @@
+import datetime
+import importlib
+import json
+import os
+import sys
+
+import sqlalchemy
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+shopping_list = importlib.import_module('backend.shopping_list')
+plan_structure = importlib.import_module('backend.plan_structure')
+
+SAMPLE_PLAN = os.path.join(os.path.dirname(__file__), 'data', 'sample_plan.txt')
+
+
+def _recipe(*ingredients):
+    return {'ingredients': [dict(zip(('item', 'quantity', 'unit'), ing)) for ing in ingredients]}
+
+
+def test_quantities_are_summed_per_item_and_unit():
+    summed = shopping_list.sum_ingredients([
+        _recipe(('Arroz', 100.0, 'g'), ('arroz ', 0.5, 'taza'), ('Sal', 1.0, 'pizca')),
+        _recipe(('ARROZ', 50.0, 'g'), ('Agua', 200.0, 'ml'), ('Pimienta', None, None), ('Limón', 1.0, 'N/A')),
+    ])
+    assert summed['arroz'] == {'display_name': 'Arroz', 'units': {'g': 150.0, 'taza': 0.5}}
+    assert set(summed) == {'arroz', 'sal', 'agua'}
+
+
+def test_categories_follow_the_word_lists():
+    categories = shopping_list.categorize(shopping_list.sum_ingredients([
+        _recipe(('Pechuga de pollo', 150.0, 'g'), ('Arroz', 100.0, 'g'), ('Arroz', 0.25, 'taza'),
+                ('Queso', 30.0, 'g'), ('Aceite de oliva', 10.0, 'ml'), ('Agua', 1.0, 'taza'),
+                ('Zanahoria', 2.0, 'unidad'), ('Pan integral', 1.0, 'rebanada')),
+    ]))
+    assert list(categories) == list(shopping_list.CATEGORIES)
+    assert categories[shopping_list.CATEGORY_PROTEIN] == ['Pechuga de pollo: 150 g']
+    assert categories[shopping_list.CATEGORY_GRAINS] == ['Arroz: 100 g, 0.25 taza', 'Pan integral: 1 rebanada']
+    assert categories[shopping_list.CATEGORY_DAIRY] == ['Queso: 30 g']
+    assert categories[shopping_list.CATEGORY_PANTRY] == ['Aceite de oliva']  # Name only
+    assert categories[shopping_list.CATEGORY_PRODUCE] == ['Zanahoria: 2 unidad']
+    assert categories[shopping_list.CATEGORY_OTHER] == []
+    # Pantry words win and matching is by substring, as before
+    assert shopping_list.category_for('salmón') == shopping_list.CATEGORY_PANTRY
+    assert shopping_list.category_for('pollo al caldo') == shopping_list.CATEGORY_PANTRY
+    assert shopping_list.category_for('agua con gas') is None
+
+
+def _canonicalizer(calls):
+    ingredients = {'arroz': (1, 'Arroz, grano, blanco'), 'arroz blanco': (1, 'Arroz, grano, blanco'),
+                   'leche': (2, 'Leche, fluida'), 'huevo': (3, 'Huevo de gallina')}
+    grams = {(1, 'taza'): 180.0, (2, 'taza'): 240.0}
+
+    def resolve_names(names):
+        calls.append(list(names))
+        return {name: shopping_list.CanonicalIngredient(*ingredients[name.lower()])
+                for name in names if name.lower() in ingredients}
+
+    def convert(ingredient_id, quantity, unit, reference_unit):
+        if unit == reference_unit:
+            return quantity
+        if (ingredient_id, unit) in grams and reference_unit in ('g', 'ml'):
+            return quantity * grams[(ingredient_id, unit)]
+        return None
+
+    return shopping_list.Canonicalizer(resolve_names, convert)
+
+
+def test_canonical_aggregation_merges_units_and_synonyms():
+    calls = []
+    recipes = [
+        _recipe(('Arroz', 200.0, 'g'), ('Leche', 0.5, 'taza'), ('Huevo', 2.0, 'unidad')),
+        _recipe(('arroz blanco', 1.0, 'taza'), ('Leche', 100.0, 'ml'), ('Huevo', 1.0, 'unidad'), ('Limón', 1.0, 'unidad')),
+    ]
+    summed = shopping_list.sum_ingredients(recipes, _canonicalizer(calls))
+    assert calls == [['Arroz', 'Huevo', 'Leche', 'Limón', 'arroz blanco']]  # One batch of distinct names
+    assert summed['arroz'] == {'display_name': 'Arroz', 'units': {'g': 380.0}, 'ingredient_id': 1}
+    # Measured by volume somewhere in the plan: summed in millilitres
+    assert summed['leche']['units'] == {'ml': 220.0}
+    # No conversion available: kept in its own unit under the same entry
+    assert summed['huevo']['units'] == {'unidad': 3.0}
+    assert summed['limón']['units'] == {'unidad': 1.0}
+    categories = shopping_list.categorize(summed)
+    assert categories[shopping_list.CATEGORY_GRAINS] == ['Arroz: 380 g']
+
+
+def test_build_from_plan_structure_and_cache_key(monkeypatch):
+    with open(SAMPLE_PLAN, encoding='utf-8') as fh:
+        plan_text = fh.read()
+    built = shopping_list.build_shopping_list(plan_structure.build_plan_structure(plan_text))
+    assert built['has_recetario'] and any(built['items'].values())
+    without = shopping_list.build_shopping_list(plan_structure.build_plan_structure('**Lunes**\nCena: sopa'))
+    assert not without['has_recetario'] and not any(without['items'].values())
+
+    key = shopping_list.cache_key(plan_text)
+    assert key == shopping_list.cache_key(plan_text) and key != plan_structure.structure_key(plan_text)
+    assert key != shopping_list.cache_key(plan_text + '\n')
+    monkeypatch.setattr(shopping_list, 'SHOPPING_LIST_VERSION', shopping_list.SHOPPING_LIST_VERSION + 1)
+    assert key != shopping_list.cache_key(plan_text)
+
+
+def test_accumulator_merges_stored_lists_of_several_plans():
+    week1 = shopping_list.build_shopping_list({'has_recetario': True, 'recipes': [
+        _recipe(('Arroz', 200.0, 'g'), ('Huevo', 2.0, 'unidad'))]}, _canonicalizer([]))
+    week2 = shopping_list.build_shopping_list({'has_recetario': True, 'recipes': [
+        _recipe(('arroz blanco', 1.0, 'taza'), ('Huevo', 1.0, 'unidad'), ('Limón', 1.0, 'unidad'))]}, _canonicalizer([]))
+    assert shopping_list.is_current(week1) and not shopping_list.is_current({'has_recetario': True, 'items': {}})
+
+    accumulator = shopping_list.ShoppingListAccumulator()
+    for stored in (week1, week2):
+        accumulator.add(json.loads(json.dumps(stored)))  # As read back from shopping_list_json
+    assert accumulator.plans == 2
+    categories = accumulator.categories()
+    # Same ingredient under different plan names: one entry, named as first seen
+    assert categories[shopping_list.CATEGORY_GRAINS] == ['Arroz: 380 g']
+    assert categories[shopping_list.CATEGORY_DAIRY] == ['Huevo: 3 unidad']
+    assert categories[shopping_list.CATEGORY_PRODUCE] == ['Limón: 1 unidad']
+
+
+def test_cache_key_and_is_current_follow_the_tables_fingerprint():
+    with open(SAMPLE_PLAN, encoding='utf-8') as fh:
+        plan_text = fh.read()
+    assert shopping_list.cache_key(plan_text, 'a') != shopping_list.cache_key(plan_text, 'b')
+    built = shopping_list.build_shopping_list(plan_structure.build_plan_structure(plan_text),
+                                              shopping_list.Canonicalizer(lambda names: {}, lambda *a: None, 'a'))
+    assert built['tables'] == 'a'
+    assert shopping_list.is_current(built) and shopping_list.is_current(built, 'a')
+    assert not shopping_list.is_current(built, 'b')
+
+
+def test_stored_list_is_rebuilt_after_an_equivalence_edit(app_db):
+    rice = app_db.Ingredient(name='Arroz blanco', synonyms_json='[]')
+    app_db.db.session.add(rice)
+    app_db.db.session.commit()
+    plan = ("**Lunes**\n* Almuerzo: Arroz (Ver Receta N°1)\n\n== RECETARIO DETALLADO ==\n\n"
+            "Receta N°1: Arroz\nIngredientes (para 1 porción):\n*   1 taza de arroz blanco\n*   100 g de arroz blanco\n"
+            "Preparación:\n1. Hervir.\n")
+    evaluation = app_db.Evaluation(edited_plan_text=plan)
+    assert evaluation.refresh_shopping_list()
+    assert not evaluation.refresh_shopping_list()
+    key, items = evaluation.shopping_list_key, json.dumps(evaluation.get_shopping_list()['items'])
+    assert 'taza' in items
+
+    app_db.db.session.add(app_db.UnitEquivalence(ingredient_id=rice.id, household_unit='taza', grams_per_unit=185))
+    app_db.db.session.commit()
+    app_db.invalidate_ingredient_caches()
+    assert evaluation.refresh_shopping_list()
+    assert evaluation.shopping_list_key != key
+    assert '285 g' in json.dumps(evaluation.get_shopping_list()['items'], ensure_ascii=False)
+
+
+def test_tables_fingerprint_does_not_query_the_tables(app_db):
+    app_db.db.session.add(app_db.Ingredient(name='Arroz blanco', synonyms_json='[]'))
+    app_db.db.session.commit()
+    fingerprint = app_db.shopping_list_tables_fingerprint()
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = app_db.db.engine
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', record)
+    try:
+        assert app_db.shopping_list_tables_fingerprint() == fingerprint
+    finally:
+        sqlalchemy.event.remove(engine, 'before_cursor_execute', record)
+    assert statements == []
+    app_db.db.session.add(app_db.Ingredient(name='Lentejas', synonyms_json='[]'))
+    app_db.db.session.commit()
+    app_db.invalidate_ingredient_caches()
+    assert app_db.shopping_list_tables_fingerprint() != fingerprint
+
+
+PLAN = ("**Lunes**\n* Almuerzo: Arroz (Ver Receta N°1)\n\n== RECETARIO DETALLADO ==\n\n"
+        "Receta N°1: Arroz\nIngredientes (para 1 porción):\n*   100 g de arroz blanco\n"
+        "Preparación:\n1. Hervir.\n")
+
+
+def add_patient_evaluations(app, dates, plan=PLAN):
+    patient = app.Patient(name='Ana', surname='Pérez', cedula='12345678')
+    app.db.session.add(patient)
+    app.db.session.flush()
+    evaluations = [app.Evaluation(patient_id=patient.id, consultation_date=date, edited_plan_text=plan) for date in dates]
+    app.db.session.add_all(evaluations)
+    app.db.session.commit()
+    return patient, [evaluation.id for evaluation in evaluations]
+
+
+def test_stale_lists_are_rebuilt_and_handed_over_one_batch_at_a_time(app_db, monkeypatch):
+    monkeypatch.setattr(app_db, 'SHOPPING_LIST_STREAM_BATCH', 2)
+    _, ids = add_patient_evaluations(app_db, [datetime.datetime(2026, 1, day) for day in (5, 12, 19)])
+    refreshed = app_db._refresh_stored_shopping_lists(ids)
+    first = next(refreshed)
+    assert first[0] == ids[0] and first[2]['has_recetario']
+    stored = dict(app_db.db.session.query(app_db.Evaluation.id, app_db.Evaluation.shopping_list_json))
+    assert stored[ids[1]] and stored[ids[2]] is None  # The third one is in the next batch
+    assert [evaluation_id for evaluation_id, _, _ in refreshed] == ids[1:]
+
+
+def patient_client(app, monkeypatch, uid='patient-uid'):
+    monkeypatch.setattr(app.auth, 'verify_id_token', lambda token: {'uid': token})
+    client = app.app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {uid}'
+    return client
+
+
+def test_shopping_list_route_revalidates_with_its_etag(app_db, monkeypatch):
+    patient, ids = add_patient_evaluations(app_db, [datetime.datetime(2026, 1, 5)])
+    patient.firebase_uid = 'patient-uid'
+    app_db.db.session.commit()
+    client = patient_client(app_db, monkeypatch)
+
+    first = client.get('/api/patient/me/shopping_list')
+    assert first.status_code == 200 and first.headers['Cache-Control'] == 'private, no-cache'
+    assert 'Arroz' in json.dumps(first.get_json()['shopping_list_items'], ensure_ascii=False)
+    etag = first.headers['ETag']
+    revalidated = client.get('/api/patient/me/shopping_list', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304 and revalidated.headers['ETag'] == etag and not revalidated.data
+
+    # Plan edited (the save and update routes refresh the stored list): new ETag, new content
+    evaluation = app_db.Evaluation.query.get(ids[0])
+    evaluation.edited_plan_text = PLAN.replace('100 g de arroz blanco', '100 g de lentejas')
+    evaluation.refresh_shopping_list()
+    app_db.db.session.commit()
+    edited = client.get('/api/patient/me/shopping_list', headers={'If-None-Match': etag})
+    assert edited.status_code == 200 and edited.headers['ETag'] != etag
+    assert 'lentejas' in json.dumps(edited.get_json()['shopping_list_items'], ensure_ascii=False).lower()
+
+    # Ingredient tables edited: the ETag changes before the stored list is rebuilt
+    etag = edited.headers['ETag']
+    app_db.db.session.add(app_db.Ingredient(name='Lentejas', synonyms_json='[]'))
+    app_db.db.session.commit()
+    app_db.invalidate_ingredient_caches()
+    rebuilt = client.get('/api/patient/me/shopping_list', headers={'If-None-Match': etag})
+    assert rebuilt.status_code == 200 and rebuilt.headers['ETag'] != etag
+    assert client.get('/api/patient/me/shopping_list', headers={'If-None-Match': rebuilt.headers['ETag']}).status_code == 304
+
+
+def test_shopping_list_range_route(app_db, monkeypatch):
+    patient, ids = add_patient_evaluations(app_db, [datetime.datetime(2026, 1, day, 10) for day in (5, 12, 19)])
+    patient.firebase_uid = 'patient-uid'
+    app_db.db.session.commit()
+    client = patient_client(app_db, monkeypatch)
+    url = '/api/patient/me/shopping_list/range'
+
+    for query in ('', '?plans=0', '?plans=abc', '?start_date=2026-13-01', '?start_date=2026-01-05&end_date=19/01/2026'):
+        assert client.get(url + query).status_code == 400, query
+
+    # No list stored yet: all three are rebuilt, saved and merged
+    merged = client.get(url + '?start_date=2026-01-05&end_date=2026-01-12')
+    assert merged.status_code == 200
+    body = merged.get_json()
+    assert body['plans_count'] == 2 and (body['first_date'], body['last_date']) == ('05/01/2026', '12/01/2026')
+    assert 'Arroz' in json.dumps(body['shopping_list_items'], ensure_ascii=False)
+    stored = dict(app_db.db.session.query(app_db.Evaluation.id, app_db.Evaluation.shopping_list_json))
+    assert stored[ids[0]] and stored[ids[1]] and stored[ids[2]] is None  # The end date is inclusive, by day
+
+    latest = client.get(url + '?plans=2').get_json()
+    assert latest['plans_count'] == 2 and (latest['first_date'], latest['last_date']) == ('12/01/2026', '19/01/2026')
+    assert client.get(url + '?start_date=2027-01-01').status_code == 404
+
+    # Lists built from older ingredient tables are rebuilt with the current ones
+    app_db.db.session.add(app_db.Ingredient(name='Arroz blanco', synonyms_json='[]'))
+    app_db.db.session.commit()
+    app_db.invalidate_ingredient_caches()
+    assert client.get(url + '?plans=3').get_json()['plans_count'] == 3
+    tables = app_db.shopping_list_tables_fingerprint()
+    for shopping_list_json, in app_db.db.session.query(app_db.Evaluation.shopping_list_json):
+        assert json.loads(shopping_list_json)['tables'] == tables
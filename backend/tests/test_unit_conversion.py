@@ -0,0 +1,47 @@
+import importlib
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+conversion = importlib.import_module('backend.unit_conversion')
+
+INGREDIENTS = [(1, 'Aceite de oliva Cocinero'), (2, 'Arroz, grano, blanco, pulido, hervido'), (3, 'Leche entera')]
+EQUIVALENCES = [(2, 'taza', 158.0), (2, 'taza', 999.0), (1, 'cucharada sopera', 13.8)]
+
+
+def test_normalize_unit_and_density():
+    assert conversion.normalize_unit(' Cdas ') == 'cucharada sopera'
+    assert conversion.normalize_unit('pizca') == 'pizca'
+    assert conversion.density_for_name('Aceite de girasol') == 0.92
+    assert conversion.density_for_name('Leche descremada') == 1.03
+    assert conversion.density_for_name(None) == 1.0
+
+
+def test_conversions_match_previous_arithmetic():
+    table = conversion.UnitConversionTable(INGREDIENTS, EQUIVALENCES)
+    assert table.convert(1, 15, 'ml', 'g') == 15 * 0.92
+    assert table.convert(1, 10, 'g', 'ml') == 10 / 0.92
+    assert table.convert(2, 1.5, 'tazas', 'g') == 1.5 * 158.0
+    assert table.convert(1, 2, 'cucharada', 'ml') == (2 * 13.8) / 0.92
+    assert table.convert(2, 0.25, 'kg', 'g') == 0.25 * 1000
+    assert table.convert(3, 1, 'pizca', 'g') == 0.5
+    assert table.convert(3, 2, 'unidades', 'unidad') == 2
+    assert table.convert(3, 1, 'taza', 'g') is None
+    assert table.convert(99, 100, 'ml', 'g') == 100.0
+
+
+def test_cache_rebuilds_after_invalidate():
+    equivalences = list(EQUIVALENCES)
+    cache = conversion.UnitConversionTableCache(lambda: (INGREDIENTS, equivalences))
+    assert cache.get().grams_per_unit(3, 'taza') is None
+    equivalences.append((3, 'taza', 244.0))
+    cache.invalidate()
+    assert cache.get().grams_per_unit(3, 'taza') == 244.0
+
+
+def test_version_follows_the_rows():
+    version = conversion.UnitConversionTable(INGREDIENTS, EQUIVALENCES).version
+    assert conversion.UnitConversionTable(reversed(INGREDIENTS), EQUIVALENCES).version == version
+    assert conversion.UnitConversionTable(INGREDIENTS, EQUIVALENCES[:-1] + [(1, 'cucharada sopera', 14.0)]).version != version
+    cache = conversion.UnitConversionTableCache(lambda: (INGREDIENTS, EQUIVALENCES))
+    assert cache.version() == version
@@ -0,0 +1,194 @@
+"""Precomputed unit conversion table for NutriApp ingredients.
+
+Replaces the per-call ``Ingredient`` and ``UnitEquivalence`` queries of
+``convert_quantity_to_reference_unit`` with an in-memory table keyed by
+``(ingredient_id, normalized_unit)``. Each conversion is memoized as a plan
+``(pre, mult, div)`` applied as ``((quantity * pre) * mult) / div`` so results
+are bit-identical to the previous step-by-step arithmetic.
+"""
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+# Maps user-facing units to the canonical forms stored in
+# UnitEquivalence.household_unit (generated by populate_equivalences.py).
+UNIT_NORMALIZATION_MAP = {
+    # g/ml/kg/l (handled by specific rules below)
+    "gramos": "g", "grs": "g", "grm": "g", "gr": "g", "g.": "g",
+    "mililitros": "ml", "mls": "ml", "mlt": "ml", "cc": "ml",
+    "kilos": "kg", "kgs": "kg", "kilogramo": "kg", "kilogramos": "kg",
+    "litros": "l", "lts": "l", "litro": "l",
+
+    "tazas": "taza", "tzs": "taza", "tz": "taza",
+
+    "cucharadas soperas": "cucharada sopera", "cda sopera": "cucharada sopera",
+    "cdas soperas": "cucharada sopera", "cs": "cucharada sopera",
+    "cucharada": "cucharada sopera",  # a generic "cucharada" means "sopera"
+    "cucharadas": "cucharada sopera",
+    "cda": "cucharada sopera",
+    "cdas": "cucharada sopera",
+
+    "cucharaditas de te": "cucharadita de té", "cdta de te": "cucharadita de té",
+    "cucharadita te": "cucharadita de té",
+    "cucharaditas": "cucharadita de té",  # a generic "cucharadita" means "de té"
+    "cucharadita": "cucharadita de té",
+    "cdtas": "cucharadita de té",
+    "cdta": "cucharadita de té",
+    "cucharita": "cucharadita de té",
+    "cucharitas": "cucharadita de té",
+
+    "unidades medianas": "unidad mediana", "unid mediana": "unidad mediana", "ud mediana": "unidad mediana",
+    "rebanadas medianas": "rebanada mediana",
+    "porciones medianas": "porción mediana",
+
+    "unidades": "unidad", "unids": "unidad", "un": "unidad", "ud": "unidad",
+    "piezas": "pieza", "pzs": "pieza", "pz": "pieza",
+    "filetes": "filete",
+    "rebanadas": "rebanada",
+    "porciones": "porcion",
+}
+
+# Assumed densities (g/ml) by ingredient name substring; first match wins.
+DENSITY_RULES = [
+    (("aceite",), 0.92),
+    (("salsa de soja", "soya"), 1.18),
+    (("leche",), 1.03),
+]
+DEFAULT_DENSITY = 1.0
+PIZCA_GRAMS = 0.5
+
+# ((quantity * pre) * mult) / div
+ConversionPlan = Tuple[float, float, float]
+
+
+def normalize_unit(unit: str) -> str:
+    unit_lower = unit.lower().strip()
+    return UNIT_NORMALIZATION_MAP.get(unit_lower, unit_lower)
+
+
+def density_for_name(name: Optional[str]) -> float:
+    name_lower = (name or "").lower()
+    for needles, density in DENSITY_RULES:
+        if any(needle in name_lower for needle in needles):
+            return density
+    return DEFAULT_DENSITY
+
+
+def apply_plan(plan: ConversionPlan, quantity: float) -> float:
+    pre, mult, div = plan
+    return ((quantity * pre) * mult) / div
+
+
+class UnitConversionTable:
+    """Per-ingredient densities and household-unit weights, with memoized plans.
+
+    ``version`` is a digest of the rows it was built from (see :class:`~backend.ingredient_index.IngredientIndex`).
+    """
+
+    def __init__(self, ingredients: Iterable[Tuple[int, str]],
+                 equivalences: Iterable[Tuple[int, str, Optional[float]]]):
+        ingredients = sorted(tuple(row) for row in ingredients)
+        equivalences = [tuple(row) for row in equivalences]
+        self._density: Dict[int, float] = {
+            ing_id: density_for_name(name) for ing_id, name in ingredients
+        }
+        self.version = hashlib.sha1(repr((ingredients, equivalences)).encode("utf-8")).hexdigest()
+        self._grams: Dict[Tuple[int, str], float] = {}
+        for ing_id, household_unit, grams_per_unit in equivalences:
+            # First row per (ingredient, unit) wins, like ``.first()`` did
+            if (ing_id, household_unit) not in self._grams and grams_per_unit is not None:
+                self._grams[(ing_id, household_unit)] = grams_per_unit
+        self._plans: Dict[Tuple[int, str, str], Optional[ConversionPlan]] = {}
+        self._lock = threading.Lock()
+
+    def density(self, ingredient_id: int) -> float:
+        return self._density.get(ingredient_id, DEFAULT_DENSITY)
+
+    def grams_per_unit(self, ingredient_id: int, unit_norm: str) -> Optional[float]:
+        return self._grams.get((ingredient_id, unit_norm))
+
+    def plan(self, ingredient_id: int, unit_norm: str, ref_unit_norm: str) -> Optional[ConversionPlan]:
+        key = (ingredient_id, unit_norm, ref_unit_norm)
+        try:
+            return self._plans[key]
+        except KeyError:
+            pass
+        plan = self._compute_plan(ingredient_id, unit_norm, ref_unit_norm)
+        with self._lock:
+            self._plans[key] = plan
+        return plan
+
+    def _compute_plan(self, ingredient_id: int, unit_norm: str, ref_unit_norm: str) -> Optional[ConversionPlan]:
+        density = self.density(ingredient_id)
+        # Direct ml <-> g conversions using the assumed density
+        if unit_norm == 'ml' and ref_unit_norm == 'g':
+            return (1.0, density, 1.0)
+        if unit_norm == 'g' and ref_unit_norm == 'ml':
+            return (1.0, 1.0, density) if density != 0 else None
+
+        pre = 1.0
+        if unit_norm == 'kg':
+            pre, unit_norm = 1000.0, 'g'
+        elif unit_norm == 'l':
+            pre, unit_norm = 1000.0, 'ml'
+
+        if unit_norm == ref_unit_norm:
+            return (pre, 1.0, 1.0)
+        if unit_norm == 'pizca' and ref_unit_norm == 'g':
+            return (pre, PIZCA_GRAMS, 1.0)
+
+        grams = self.grams_per_unit(ingredient_id, unit_norm)
+        if grams is not None:
+            if ref_unit_norm == 'g':
+                return (pre, grams, 1.0)
+            if ref_unit_norm == 'ml':
+                return (pre, grams, density) if density != 0 else None
+            return None
+        return None
+
+    def convert(self, ingredient_id: int, quantity: float, unit: str, reference_unit: str) -> Optional[float]:
+        plan = self.plan(ingredient_id, normalize_unit(unit), reference_unit.lower().strip())
+        return apply_plan(plan, quantity) if plan is not None else None
+
+
+class UnitConversionTableCache:
+    """Lazily (re)builds the table from ``loader`` -> ``(ingredients, equivalences)``.
+
+    Rebuilt after :meth:`invalidate` or once ``ttl_seconds`` have elapsed, so
+    equivalences added by ``populate_equivalences.py`` are picked up.
+    """
+
+    def __init__(self, loader: Callable[[], Tuple[Iterable[Tuple[int, str]], Iterable[Tuple[int, str, Optional[float]]]]],
+                 ttl_seconds: Optional[float] = None):
+        self._loader = loader
+        self._ttl = ttl_seconds
+        self._table: Optional[UnitConversionTable] = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self) -> bool:
+        if self._table is None:
+            return False
+        return not self._ttl or (time.monotonic() - self._built_at) < self._ttl
+
+    def get(self) -> UnitConversionTable:
+        if self._is_fresh():
+            return self._table  # type: ignore[return-value]
+        with self._lock:
+            if not self._is_fresh():
+                ingredients, equivalences = self._loader()
+                self._table = UnitConversionTable(ingredients, equivalences)
+                self._built_at = time.monotonic()
+            return self._table  # type: ignore[return-value]
+
+    def version(self) -> str:
+        """Version of the table in use, built if there is none; unlike :meth:`get` it never rebuilds on TTL expiry."""
+        table = self._table
+        return table.version if table is not None else self.get().version
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._table = None
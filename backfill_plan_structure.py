@@ -0,0 +1,37 @@
+# backfill_plan_structure.py
+from app import app, db, Evaluation
+
+def backfill_plan_structures(batch_size=200):
+    """Guarda la estructura parseada del plan y la lista de compras en las evaluaciones que no las tienen o cuyo texto cambió."""
+    with app.app_context():
+        total = Evaluation.query.filter(Evaluation.edited_plan_text.isnot(None)).count()
+        updated_count = 0
+        error_count = 0
+
+        print(f"Revisando la estructura del plan de {total} evaluaciones...")
+
+        query = Evaluation.query.filter(Evaluation.edited_plan_text.isnot(None)).order_by(Evaluation.id)
+        for offset in range(0, total, batch_size):
+            for evaluation in query.offset(offset).limit(batch_size).all():
+                try:
+                    # La lista de compras se calcula a partir de la estructura del plan
+                    structure_updated = evaluation.refresh_plan_structure()
+                    if evaluation.refresh_shopping_list() or structure_updated:
+                        updated_count += 1
+                except Exception as e:
+                    print(f"Error parseando el plan de la Evaluación ID {evaluation.id}: {e}")
+                    error_count += 1
+            # Confirmar por lote para no mantener miles de planes en la sesión
+            db.session.commit()
+            db.session.expunge_all()
+
+        print("\n--- Estructura de Planes Completada ---")
+        print(f"Evaluaciones actualizadas: {updated_count}")
+        print(f"Evaluaciones ya al día: {total - updated_count - error_count}")
+        if error_count:
+            print(f"Evaluaciones con errores: {error_count}")
+
+if __name__ == '__main__':
+    print("Iniciando script de estructura de planes...")
+    backfill_plan_structures()
+    print("Script de estructura de planes finalizado.")
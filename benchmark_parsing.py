@@ -0,0 +1,327 @@
+"""Micro-benchmark del parser de líneas de ingredientes.
+
+Uso:
+    python benchmark_parsing.py [--repeat N] [--plan] [--log-level DEBUG|INFO]
+
+Usa el corpus de backend/tests/data/ingredient_lines.json y reporta el tiempo
+por línea de la implementación anterior (regex compiladas en cada llamada, copiada
+abajo tal cual estaba en app.py) y de backend/ingredient_parser.py con la caché vacía
+(solo regex precompiladas) y con la caché llena. Antes de medir se comprueba que las
+dos den el mismo resultado para cada línea.
+Con --plan también mide el parseo completo de backend/tests/data/sample_plan.txt
+(recetario + ingredientes de cada receta) con el logger de la app al nivel indicado;
+el índice memoizado del recetario (backend/recipe_index.py) se vacía en cada repetición.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import re
+import time
+
+from backend import ingredient_parser, recipe_index
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'tests', 'data')
+CORPUS_PATH = os.path.join(DATA_DIR, 'ingredient_lines.json')
+SAMPLE_PLAN_PATH = os.path.join(DATA_DIR, 'sample_plan.txt')
+
+# --- Implementación anterior (app.py antes de backend/ingredient_parser.py), solo para comparar ---
+# Mismo logger que usaba (app.logger, en ERROR): los f-strings se siguen formateando en cada llamada.
+legacy_logger = logging.getLogger('benchmark_parsing.legacy')
+legacy_logger.setLevel(logging.ERROR)
+
+def _clean_item_name_further(name_str: str) -> str:
+    """Helper to perform final cleaning on a presumed item name."""
+    original_input_for_log = name_str # Guardar el original para logging
+    legacy_logger.debug(f"NUTR_CLEAN_DEBUG (_clean_item_name_further) - INPUT: '{name_str}'")
+    
+    # 1. Strip general whitespace and common list markers
+    cleaned_name = name_str.lstrip('*-• ').strip()
+
+    # Eliminar dos puntos al final y otros caracteres que podrían quedar pegados
+    cleaned_name = cleaned_name.rstrip(':,*-.').strip()
+
+    # 2. Remove specific parenthesized quantities/units if not caught by main parser
+    cleaned_name = re.sub(r"\s*\((?:aprox\.\s*)?[\d.,/\s]+(?:g|ml|kg|l|unidad|taza|cucharada|cucharadita|pizca|porcion|rebanada|filete|pieza)[a-zA-ZáéíóúñÑ]*\s*\)$", "", cleaned_name, flags=re.IGNORECASE).strip()
+
+    # Remove leading phrases like "bloque de", "diente de", etc.
+    leading_phrases_to_remove = [
+        "bloque de ", "diente de ", "loncha de ", "filete de ", 
+        "cabeza de ", "ramita de ", "hojas de ", "trozo de "
+    ]
+    for phrase in leading_phrases_to_remove:
+        if cleaned_name.lower().startswith(phrase):
+            cleaned_name = cleaned_name[len(phrase):].strip()
+            legacy_logger.debug(f"NUTR_CLEAN_DEBUG (_clean_item_name_further) - After removing leading phrase '{phrase}': '{cleaned_name}'")
+
+    # 3. Remove general parenthetical explanations (e.g., (opcional), (escurrido))
+    # This is more aggressive, so it's after specific quantity/unit removal.
+    # Avoid removing if it's like "Maiz (Zea mays)" - check if content is mostly non-numeric/non-unit
+    cleaned_name = re.sub(r"\s*\((?![^)]*Zea mays)(?:[^()]*?)\)$", lambda m: "" if not re.search(r'\d', m.group(0)) and not any(u in m.group(0).lower() for u in ['g','ml','kg','l','taza']) else m.group(0), cleaned_name, flags=re.IGNORECASE).strip()
+    legacy_logger.debug(f"NUTR_CLEAN_DEBUG (_clean_item_name_further) - After removing general parentheses: '{cleaned_name}'")
+
+    # Remove common trailing adjectives/phrases.
+    # This list needs to be curated carefully.
+    trailing_phrases_to_remove = [
+        "cocidos", "cocidas", "crudos", "crudas", "picados", "picadas", "molidos", "molidas", "rallados", "ralladas", # Plurales
+        "cocido", "cocida", "crudo", "cruda", "picado", "picada", "molido", "molida", "rallado", "rallada", # Singulares
+        "en cubos", "en trozos", "en juliana", "en rodajas", "en floretes", "fileteado", "troceado", "troceada", "laminado", "laminada",
+        "frescos", "frescas", "enteros", "enteras", "congelados", "congeladas", "secos", "secas", # Plurales
+        "fresco", "fresca", "entero", "entera", "congelado", "congelada", "seco", "seca", # Singulares
+        "medianos", "medianas", "pequeños", "pequeñas", # Plurales - 'grandes' puede ser parte de un nombre
+        # "grandes", # Comentado porque "huevo grande" es válido
+        "mediano", "mediana", "pequeño", "pequeña", "grande", "cortado", "cortada", "pelado", "pelada", "desmenuzado", "desmenuzada", "deshuesado", "deshuesada", # Singulares
+        "maduro", "madura", "rallado", "rallada", r"etc\.", r"aprox\.",
+        "sin piel", "con piel", "deshuesado", "deshuesada", "escurrido", "escurrida", "en conserva", "al natural", "en agua",
+        "firme, prensado y", "firme", "prensado", "triturado", "virgen extra", "en lonchas", "asadas", "salteadas", "cocidas", "cocidos" # Específicos para casos vistos
+    ]
+    for phrase in trailing_phrases_to_remove:
+        # Regex to match the phrase at the end, possibly preceded by a comma or space
+        # Ensures we don't cut off part of a compound name if the phrase is in the middle.
+        pattern = rf"^(.*?)(?:,\s*|\s+)\b{re.escape(phrase)}\b\s*$"
+        match = re.match(pattern, cleaned_name, re.IGNORECASE)
+        if match and match.group(1).strip(): 
+            cleaned_name = match.group(1).strip()
+            legacy_logger.debug(f"NUTR_CLEAN_DEBUG (_clean_item_name_further) - After removing trailing phrase '{phrase}': '{cleaned_name}'")
+    
+    # 4. Remove leading quantities like "1/2", "2", "10 unidades de"
+    cleaned_name = re.sub(r"^\s*(?:\d+/\d+\s+|\d+\s+(?:unidad(?:es)?\s+de\s+)?)", "", cleaned_name, flags=re.IGNORECASE).strip()
+    legacy_logger.debug(f"NUTR_CLEAN_DEBUG (_clean_item_name_further) - After removing leading quantities: '{cleaned_name}'")
+
+    cleaned_name = re.sub(r"\s+\d+/\d+$", "", cleaned_name).strip()
+    
+    if cleaned_name.lower().startswith("de ") and len(cleaned_name.split()) > 2:
+        cleaned_name = cleaned_name[3:].strip()
+    # legacy_logger.debug(f"_clean_item_name_further - OUTPUT: '{cleaned_name.strip()}'") # Puede ser muy verboso
+    return cleaned_name.strip()
+
+def _parse_ingredient_line(line_text_with_star: str) -> dict:
+    """
+    Parses a single ingredient line to extract item, quantity, and unit.
+    Prioritizes standardized units (g, ml) and common household units.
+    """
+    original_line = line_text_with_star
+    text_to_parse = line_text_with_star.lstrip('*').strip()
+
+    item_name = text_to_parse
+    quantity = 0.0
+    unit = "N/A" 
+    
+    std_parenthesized_match = re.search(
+        r"\((?:aprox\.\s*)?([\d.,/\s]+)\s*([gmkltzcs]+[a-zA-ZáéíóúñÑ]*)\s*\)",
+        text_to_parse,
+        re.IGNORECASE
+    )
+    
+    if std_parenthesized_match:
+        qty_str_paren = std_parenthesized_match.group(1).strip()
+        unit_str_paren = std_parenthesized_match.group(2).strip().lower()
+        parsed_qty_from_paren = None
+        parsed_unit_from_paren = None
+        try:
+            if '/' in qty_str_paren:
+                num, den = map(float, qty_str_paren.split('/'))
+                parsed_qty_from_paren = num / den if den != 0 else 0.0
+            else:
+                parsed_qty_from_paren = float(qty_str_paren.replace(',', '.'))
+
+            if unit_str_paren in ['gramos', 'gr', 'grs', 'grm', 'g']: parsed_unit_from_paren = 'g'
+            elif unit_str_paren in ['mililitros', 'ml', 'mls', 'mlt', 'cc']: parsed_unit_from_paren = 'ml'
+            elif unit_str_paren in ['kilos', 'kg', 'kgs']: parsed_qty_from_paren *= 1000; parsed_unit_from_paren = 'g'
+            elif unit_str_paren in ['litros', 'lts', 'l', 'litro']: parsed_qty_from_paren *= 1000; parsed_unit_from_paren = 'ml'
+            else: 
+                parsed_qty_from_paren = None 
+                parsed_unit_from_paren = None
+            
+            if parsed_qty_from_paren is not None:
+                definitive_quantity = parsed_qty_from_paren
+                definitive_unit = parsed_unit_from_paren
+                # Remove the matched parenthesized part AND any leading list markers for cleaning
+                text_for_item_name_extraction = text_to_parse.replace(std_parenthesized_match.group(0), "").lstrip('*-• ').strip()
+                
+                item_name_final = _clean_item_name_further(text_for_item_name_extraction)
+
+                legacy_logger.info(f"_parse_ingredient_line (Parenthesized Std Qty + Item Re-Parse): Item='{item_name_final}', Qty={definitive_quantity}, Unit='{definitive_unit}' from '{original_line}'")
+                return {'item': item_name_final, 'quantity': definitive_quantity, 'unit': definitive_unit, 'original_line': original_line}
+        except ValueError:
+            legacy_logger.warning(f"_parse_ingredient_line - ValueError parsing parenthesized std quantity '{qty_str_paren}' from '{original_line}'.")
+
+    qty_unit_pattern = r"([\d.,/\s]+)\s*([a-zA-ZáéíóúÁÉÍÓÚñÑ]+(?:\s+de)?)"
+    match_A = re.match(rf"^{qty_unit_pattern}\s+(.+)", text_to_parse, re.IGNORECASE)
+    match_B = re.match(rf"(.+?)\s+{qty_unit_pattern}$", text_to_parse, re.IGNORECASE)
+
+    chosen_match = None
+    item_name_candidate = text_to_parse 
+
+    if match_A:
+        chosen_match = match_A
+        qty_str = chosen_match.group(1).strip()
+        unit_str_raw = chosen_match.group(2).strip()
+        item_name_candidate = chosen_match.group(3).lstrip('*-• ').strip() # Clean leading markers
+    elif match_B:
+        chosen_match = match_B
+        item_name_candidate = chosen_match.group(1).lstrip('*-• ').strip() # Clean leading markers
+        if item_name_candidate and item_name_candidate.endswith(':'):
+            item_name_candidate = item_name_candidate[:-1].strip()
+        qty_str = chosen_match.group(2).strip()
+        unit_str_raw = chosen_match.group(3).strip()
+
+    if chosen_match:
+        try:
+            if '/' in qty_str:
+                num, den = map(float, qty_str.split('/'))
+                parsed_quantity = num / den if den != 0 else 0.0
+            else:
+                parsed_quantity = float(qty_str.replace(',', '.'))
+            
+            quantity = parsed_quantity
+            unit_str_cleaned_for_check = unit_str_raw.lower().replace(" de", "").strip()
+            final_item_name_candidate = item_name_candidate
+            final_unit = "N/A"
+
+            known_units_map = {
+                'g': 'g', 'gramos': 'g', 'gr': 'g', 'grs': 'g', 'grm': 'g',
+                'ml': 'ml', 'mililitros': 'ml', 'mls': 'ml', 'mlt': 'ml', 'cc': 'ml',
+                'kg': 'g', 'kilos': 'g', 'kgs': 'g', 
+                'l': 'ml', 'litros': 'ml', 'lts': 'ml', 'litro': 'ml', 
+                'cucharadita': 'cucharadita', 'cdta': 'cucharadita', 'cucharaditas': 'cucharadita', 'cucharadita de té': 'cucharadita', 'cucharadita te': 'cucharadita', 'cdté': 'cucharadita',
+                'cucharada': 'cucharada', 'cda': 'cucharada', 'cucharadas': 'cucharada', 'cucharada sopera': 'cucharada', 'cs': 'cucharada', 'cdas': 'cucharada',
+                'taza': 'taza', 'tz': 'taza', 'tazas': 'taza',
+                'unidad': 'unidad', 'unidades': 'unidad', 'unid': 'unidad', 'u': 'unidad', 'un.': 'unidad',
+                'pieza': 'pieza', 'piezas': 'pieza', 'pz': 'pieza',
+                'filete': 'filete', 'filetes': 'filete',
+                'rebanada': 'rebanada', 'rebanadas': 'rebanada',
+                'porcion': 'porcion', 'porción': 'porcion', 'porciones': 'porcion'
+            }
+            normalized_unit_from_map = known_units_map.get(unit_str_cleaned_for_check)
+
+            if normalized_unit_from_map:
+                final_unit = normalized_unit_from_map
+                if unit_str_cleaned_for_check in ['kg', 'kilos', 'kgs']: quantity *= 1000
+                elif unit_str_cleaned_for_check in ['l', 'litros', 'lts', 'litro']: quantity *= 1000
+            else:
+                final_item_name_candidate = f"{unit_str_raw} {item_name_candidate}".strip()
+                if quantity == 1.0 or quantity == 0.5 or (quantity > 0 and quantity < 2 and "/" in qty_str):
+                    final_unit = "unidad"
+                legacy_logger.debug(f"_parse_ingredient_line: Non-standard unit '{unit_str_raw}' treated as part of item. New item candidate: '{final_item_name_candidate}', New unit: '{final_unit}'.")
+
+            item_name_to_return = _clean_item_name_further(final_item_name_candidate)
+            legacy_logger.info(f"_parse_ingredient_line (General Pattern): Item='{item_name_to_return}', Qty={quantity}, Unit='{final_unit}' from '{original_line}'")
+            return {'item': item_name_to_return, 'quantity': quantity, 'unit': final_unit, 'original_line': original_line}
+
+        except ValueError:
+            legacy_logger.warning(f"_parse_ingredient_line - ValueError parsing general quantity '{qty_str}' from '{original_line}'. Fallback.")
+            item_name = _clean_item_name_further(text_to_parse)
+            quantity = 0.0 
+            unit = "N/A"   
+            if not item_name and text_to_parse:
+                item_name = text_to_parse.strip()
+                legacy_logger.warning(f"_parse_ingredient_line (Fallback after General Pattern error, _clean_item_name_further resulted in empty, using raw): Item='{item_name}' from '{original_line}'")
+            else:
+                legacy_logger.info(f"_parse_ingredient_line (Fallback after General Pattern error): Item='{item_name}' from '{original_line}'")
+            # No retornamos aquí, dejamos que caiga al fallback general si no se pudo parsear cantidad
+            pass # Explicitly fall through
+
+    # --- Fallback logic if no specific quantity/unit pattern matched above ---
+    item_name_final_cleaned = _clean_item_name_further(text_to_parse)
+    parsed_quantity_final = 0.0
+    parsed_unit_final = "N/A"
+
+    al_gusto_keywords = ["al gusto", "a gusto", "cantidad necesaria", "c.n.", "c/n", "a su gusto"]
+    common_spices_for_pizca = [
+        "sal y pimienta", "sal", "pimienta", "especias", "orégano", "comino", 
+        "nuez moscada", "pimentón", "curry", "cúrcuma", "jengibre en polvo", 
+        "ajo en polvo", "cebolla en polvo", "canela", "clavo molido", "laurel",
+        "tomillo", "romero", "albahaca", "perejil seco", "cilantro seco" 
+    ]
+
+    original_text_lower = text_to_parse.lower()
+    item_name_lower_for_check = item_name_final_cleaned.lower()
+
+    is_explicitly_al_gusto = any(keyword in original_text_lower for keyword in al_gusto_keywords)
+    is_common_spice_candidate_for_pizca = item_name_lower_for_check in common_spices_for_pizca
+
+    if is_explicitly_al_gusto or is_common_spice_candidate_for_pizca:
+        parsed_quantity_final = 1.0
+        parsed_unit_final = "pizca"
+        log_message_prefix = "Al Gusto/Spice Default"
+    else:
+        log_message_prefix = "Fallback/Simple Item"
+
+    if not item_name_final_cleaned and text_to_parse: 
+        item_name_final_cleaned = text_to_parse.strip()
+        legacy_logger.warning(f"_parse_ingredient_line ({log_message_prefix}, _clean_item_name_further resulted in empty, using raw): Item='{item_name_final_cleaned}', Qty={parsed_quantity_final}, Unit='{parsed_unit_final}' from '{original_line}'")
+    else:
+        legacy_logger.info(f"_parse_ingredient_line ({log_message_prefix}): Item='{item_name_final_cleaned}', Qty={parsed_quantity_final}, Unit='{parsed_unit_final}' from '{original_line}'")
+
+    return {'item': item_name_final_cleaned, 'quantity': parsed_quantity_final, 'unit': parsed_unit_final, 'original_line': original_line}
+
+# --- Fin de la implementación anterior ---
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding='utf-8') as fh:
+        return [case['line'] for case in json.load(fh)]
+
+
+def time_per_line(fn, lines, repeat, clear_cache):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        if clear_cache:
+            ingredient_parser.cache_clear()
+        for line in lines:
+            fn(line)
+    return (time.perf_counter() - start) / (repeat * len(lines))
+
+
+def time_plan_parsing(repeat, log_level):
+    """Milisegundos por plan: parse_all_recipes_from_text_block + parse_recipe_from_text por receta."""
+    import app as nutriapp
+
+    with open(SAMPLE_PLAN_PATH, encoding='utf-8') as fh:
+        plan_text = fh.read()
+    recetario = plan_text[plan_text.index('== RECETARIO DETALLADO =='):]
+    numbers = re.findall(r"Receta (N°\d+):", recetario)
+
+    nutriapp.app.logger.setLevel(log_level)
+    # Los mensajes emitidos se descartan, pero se formatean y se pasan al handler igual que en producción
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            recipe_index.index_recipes.cache_clear()
+            recipe_index.index_recetario.cache_clear()
+            nutriapp.parse_all_recipes_from_text_block(recetario)
+            for number in numbers:
+                nutriapp.parse_recipe_from_text(number, plan_text)
+        elapsed = time.perf_counter() - start
+    return elapsed / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--plan', action='store_true', help='medir también el parseo de un plan completo')
+    parser.add_argument('--log-level', default='INFO', help='nivel del logger de la app para --plan')
+    args = parser.parse_args()
+
+    if args.plan:
+        per_plan = time_plan_parsing(args.repeat, args.log_level.upper())
+        print(f"Parseo de plan de ejemplo (logger en {args.log_level.upper()}): {per_plan * 1e3:8.3f} ms/plan")
+
+    logging.disable(logging.WARNING)
+    lines = load_corpus()
+    for line in lines:
+        if _parse_ingredient_line(line) != ingredient_parser.parse_ingredient_line(line):
+            raise SystemExit(f"Las implementaciones difieren en la línea: {line!r}")
+    legacy = time_per_line(_parse_ingredient_line, lines, args.repeat, clear_cache=False)
+    cold = time_per_line(ingredient_parser.parse_ingredient_line, lines, args.repeat, clear_cache=True)
+    warm = time_per_line(ingredient_parser.parse_ingredient_line, lines, args.repeat, clear_cache=False)
+    print(f"Líneas en el corpus: {len(lines)} (x{args.repeat})")
+    print(f"Implementación anterior:          {legacy * 1e6:8.2f} µs/línea")
+    print(f"parse_ingredient_line sin caché:  {cold * 1e6:8.2f} µs/línea ({legacy / cold:.1f}x)")
+    print(f"parse_ingredient_line con caché:  {warm * 1e6:8.2f} µs/línea ({legacy / warm:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -22,12 +22,112 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER') or os.environ.get('MAIL_USERNAME')
+    # Envío en segundo plano (backend/mailer.py): hilos, mensajes por conexión en cada tanda, intentos por mensaje
+    # y espera inicial entre intentos (se duplica en cada uno); conexiones SMTP abiertas que se reutilizan, segundos
+    # que puede quedar ociosa una y mensajes tras los que se renueva. Para probar en local sin enviar nada:
+    # python -m backend.debug_smtp --port 1025 con MAIL_SERVER=localhost, MAIL_PORT=1025, MAIL_USE_TLS=False
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS') or 1)
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE') or 20)
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS') or 5)
+    MAIL_BACKOFF_SECONDS = float(os.environ.get('MAIL_BACKOFF_SECONDS') or 10)
+    MAIL_POOL_SIZE = int(os.environ.get('MAIL_POOL_SIZE') or 2)
+    MAIL_IDLE_TIMEOUT_SECONDS = float(os.environ.get('MAIL_IDLE_TIMEOUT_SECONDS') or 60)
+    MAIL_MAX_MESSAGES_PER_CONNECTION = int(os.environ.get('MAIL_MAX_MESSAGES_PER_CONNECTION') or 100)
+    MAIL_TIMEOUT_SECONDS = float(os.environ.get('MAIL_TIMEOUT_SECONDS') or 30)
+    # Máximo de evaluaciones por pedido en el envío masivo de planes (/enviar_planes_por_email)
+    MAIL_BULK_MAX_EVALUATIONS = int(os.environ.get('MAIL_BULK_MAX_EVALUATIONS') or 200)
 
     # Firebase Configuration (placeholders, set in .env or environment)
     FIREBASE_API_KEY = os.environ.get('FIREBASE_API_KEY')
     FIREBASE_AUTH_DOMAIN = os.environ.get('FIREBASE_AUTH_DOMAIN')
     FIREBASE_PROJECT_ID = os.environ.get('FIREBASE_PROJECT_ID')
 
+    # Nivel del logger de la app (DEBUG solo en desarrollo: activa las trazas por ingrediente)
+    LOG_LEVEL = (os.environ.get('LOG_LEVEL') or 'INFO').upper()
+
+    # Log de errores y exportación del último traceback (escritos en segundo plano)
+    ERROR_LOG_PATH = os.environ.get('ERROR_LOG_PATH') or 'error.log'
+    ERROR_TRACEBACK_EXPORT_PATH = os.environ.get('ERROR_TRACEBACK_EXPORT_PATH', 'last_traceback.txt')
+    # Como máximo una exportación cada N segundos; los errores intermedios se agrupan en la última
+    ERROR_TRACEBACK_EXPORT_INTERVAL_SECONDS = float(os.environ.get('ERROR_TRACEBACK_EXPORT_INTERVAL_SECONDS') or 5)
+
+    # Índice de ingredientes en memoria: segundos antes de reconstruirlo (0 = solo al invalidar)
+    INGREDIENT_INDEX_TTL_SECONDS = float(os.environ.get('INGREDIENT_INDEX_TTL_SECONDS') or 300)
+    # Copia en disco (memory-mapped) de la matriz de nutrientes; vacío para mantenerla solo en memoria.
+    # Cada NUTRIENT_MATRIX_TTL_SECONDS se comparan filas, id máximo y última edición de ingredient_nutrient y se reconstruye si cambiaron
+    NUTRIENT_MATRIX_DIR = os.environ.get('NUTRIENT_MATRIX_DIR', os.path.join(basedir, 'cache', 'nutrient_matrix'))
+    NUTRIENT_MATRIX_TTL_SECONDS = float(os.environ.get('NUTRIENT_MATRIX_TTL_SECONDS') or 300)
+    # Tabla de conversión de unidades (unit_equivalence) en memoria: segundos antes de recargarla (0 = solo al invalidar)
+    UNIT_CONVERSION_TTL_SECONDS = float(os.environ.get('UNIT_CONVERSION_TTL_SECONDS') or 300)
+
+    # Cliente de Google Drive: 'google' o 'fake' (archivos en memoria, sin red; para pruebas)
+    DRIVE_BACKEND = (os.environ.get('DRIVE_BACKEND') or 'google').lower()
+    DRIVE_HTTP_TIMEOUT_SECONDS = float(os.environ.get('DRIVE_HTTP_TIMEOUT_SECONDS') or 60)
+    # Conexiones HTTP a Drive inactivas que se guardan para reutilizar entre solicitudes
+    DRIVE_HTTP_POOL_SIZE = int(os.environ.get('DRIVE_HTTP_POOL_SIZE') or 4)
+
+    # Backend de generación de planes: 'gemini' o 'replay' (plan grabado, sin red; para pruebas de carga)
+    LLM_BACKEND = (os.environ.get('LLM_BACKEND') or 'gemini').lower()
+    GEMINI_MODEL_NAME = os.environ.get('GEMINI_MODEL_NAME') or 'gemini-1.5-pro-latest'
+    # Tokens de cada prompt antes de enviarlo: exactos con count_tokens de Gemini (una llamada extra) o estimados
+    GEMINI_EXACT_TOKEN_COUNT = os.environ.get('GEMINI_EXACT_TOKEN_COUNT', 'False').lower() in ['true', 'on', '1']
+    LLM_REPLAY_FIXTURE = os.environ.get('LLM_REPLAY_FIXTURE') or os.path.join(basedir, 'backend', 'tests', 'data', 'sample_plan.txt')
+    # Latencia simulada por llamada (hasta el primer fragmento) y velocidad de salida (0 = todo de una vez)
+    LLM_REPLAY_LATENCY_SECONDS = float(os.environ.get('LLM_REPLAY_LATENCY_SECONDS') or 1.0)
+    LLM_REPLAY_CHARS_PER_SECOND = float(os.environ.get('LLM_REPLAY_CHARS_PER_SECOND') or 0)
+
+    # Generación de recetas con Gemini: recetas por lote y lotes enviados en paralelo
+    GEMINI_RECIPES_PER_BATCH = int(os.environ.get('GEMINI_RECIPES_PER_BATCH') or 3)
+    GEMINI_RECIPE_CONCURRENCY = int(os.environ.get('GEMINI_RECIPE_CONCURRENCY') or 4)
+
+    # Caché en disco de respuestas de Gemini (por hash de modelo + configuración + prompt); vacío para desactivarla
+    PLAN_CACHE_DIR = os.environ.get('PLAN_CACHE_DIR', os.path.join(basedir, 'cache', 'plans'))
+    PLAN_CACHE_TTL_SECONDS = float(os.environ.get('PLAN_CACHE_TTL_SECONDS') or 7 * 24 * 3600)
+    PLAN_CACHE_MAX_ENTRIES = int(os.environ.get('PLAN_CACHE_MAX_ENTRIES') or 2000)
+    PLAN_CACHE_MAX_BYTES = int(os.environ.get('PLAN_CACHE_MAX_BYTES') or 50 * 1024 * 1024)
+
+    # Caché en disco de PDFs de paciente ya renderizados (por hash del contenido); vacío para desactivarla
+    PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR', os.path.join(basedir, 'cache', 'pdfs'))
+    PDF_CACHE_MAX_ENTRIES = int(os.environ.get('PDF_CACHE_MAX_ENTRIES') or 500)
+    PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_BYTES') or 200 * 1024 * 1024)
+
+    # Almacenamiento de los PDFs técnicos nuevos: 'drive', 'local' (PDF_STORAGE_LOCAL_DIR) o 's3' (S3 o compatible,
+    # p. ej. MinIO con PDF_STORAGE_S3_ENDPOINT_URL). Los ya guardados se leen de donde estén; ver migrate_pdf_storage.py
+    PDF_STORAGE_BACKEND = (os.environ.get('PDF_STORAGE_BACKEND') or 'drive').lower()
+    PDF_STORAGE_LOCAL_DIR = os.environ.get('PDF_STORAGE_LOCAL_DIR') or os.path.join(basedir, 'storage', 'pdfs')
+    PDF_STORAGE_S3_BUCKET = os.environ.get('PDF_STORAGE_S3_BUCKET')
+    PDF_STORAGE_S3_PREFIX = os.environ.get('PDF_STORAGE_S3_PREFIX') or 'evaluaciones'
+    PDF_STORAGE_S3_ENDPOINT_URL = os.environ.get('PDF_STORAGE_S3_ENDPOINT_URL')
+    PDF_STORAGE_S3_REGION = os.environ.get('PDF_STORAGE_S3_REGION')
+    PDF_STORAGE_S3_ACCESS_KEY_ID = os.environ.get('PDF_STORAGE_S3_ACCESS_KEY_ID')
+    PDF_STORAGE_S3_SECRET_ACCESS_KEY = os.environ.get('PDF_STORAGE_S3_SECRET_ACCESS_KEY')
+
+    # Copias locales de los PDFs técnicos guardados en Drive o S3 (por ubicación); vacío para desactivarla
+    REMOTE_PDF_CACHE_DIR = os.environ.get('REMOTE_PDF_CACHE_DIR', os.path.join(basedir, 'cache', 'remote_pdfs'))
+    REMOTE_PDF_CACHE_MAX_ENTRIES = int(os.environ.get('REMOTE_PDF_CACHE_MAX_ENTRIES') or 1000)
+    REMOTE_PDF_CACHE_MAX_BYTES = int(os.environ.get('REMOTE_PDF_CACHE_MAX_BYTES') or 500 * 1024 * 1024)
+
+    # Generación de planes en segundo plano (/generar_plan/jobs): hilos del pool, trabajos activos
+    # por usuario (0 = sin límite) y segundos que se conserva el resultado de un trabajo terminado
+    PLAN_JOB_WORKERS = int(os.environ.get('PLAN_JOB_WORKERS') or 2)
+    PLAN_JOBS_PER_USER = int(os.environ.get('PLAN_JOBS_PER_USER') or 1)
+    PLAN_JOB_RETENTION_SECONDS = float(os.environ.get('PLAN_JOB_RETENTION_SECONDS') or 3600)
+    # Cada cuántos segundos sin eventos /generar_plan/jobs/<id>/stream envía un comentario para mantener viva la conexión
+    PLAN_JOB_STREAM_KEEPALIVE_SECONDS = float(os.environ.get('PLAN_JOB_STREAM_KEEPALIVE_SECONDS') or 15)
+
+    # Tareas posteriores al guardado de una evaluación (PDF técnico guardado, PDF del paciente): hilos,
+    # intentos por paso, espera inicial entre intentos (se duplica en cada uno) y segundos sin avance
+    # tras los que una tarea pendiente se considera abandonada y se vuelve a encolar
+    POST_SAVE_WORKERS = int(os.environ.get('POST_SAVE_WORKERS') or 2)
+    POST_SAVE_MAX_ATTEMPTS = int(os.environ.get('POST_SAVE_MAX_ATTEMPTS') or 3)
+    POST_SAVE_BACKOFF_SECONDS = float(os.environ.get('POST_SAVE_BACKOFF_SECONDS') or 2)
+    POST_SAVE_STALE_SECONDS = float(os.environ.get('POST_SAVE_STALE_SECONDS') or 600)
+    # Al atender la primera solicitud, volver a encolar las tareas que un reinicio dejó a medias
+    POST_SAVE_RESUME_ON_STARTUP = os.environ.get('POST_SAVE_RESUME_ON_STARTUP', 'True').lower() in ['true', 'on', '1']
+
+    # Lista de compras de varios planes (/api/patient/me/shopping_list/range): máximo de planes por pedido
+    SHOPPING_LIST_MAX_PLANS = int(os.environ.get('SHOPPING_LIST_MAX_PLANS') or 52)
+
     # Constantes de la aplicación para formularios y lógica
     PROFESSIONS = [
     ('nutricionista', 'Nutricionista'),
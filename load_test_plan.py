@@ -0,0 +1,182 @@
+"""Prueba de carga de /generar_plan -> /guardar_evaluacion sin red.
+
+Uso:
+    python load_test_plan.py [--users N] [--plans-per-user M] [--mode sync|jobs]
+                             [--latency S] [--chars-per-second C] [--fixture PLAN.txt]
+                             [--database-url URL] [--use-cache]
+
+Cada usuario virtual es un nutricionista distinto que, en su propio hilo,
+genera un plan y lo guarda como evaluación de un paciente nuevo, M veces.
+La generación usa el backend 'replay' (backend/llm_backends.py): responde con
+el plan grabado en --fixture tras --latency segundos por llamada a la IA,
+sin red ni tokens. Con --mode jobs el plan se pide a /generar_plan/jobs y se
+consulta el estado hasta que termina. Drive queda desactivado.
+
+La app corre en este proceso (cliente de pruebas de Flask) contra una base
+SQLite temporal, salvo --database-url. Reporta latencias (p50/p95/máx) por
+endpoint, planes por minuto, tokens por llamada a la IA (estimados por el
+backend 'replay', ver /metrics/llm) y errores.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'tests', 'data', 'sample_plan.txt')
+
+# Mismos campos que envía generarPlan() en static/js/main.js
+BASE_PLAN_REQUEST = {
+    'patient_id': None, 'surname': 'Carga', 'dob': '1985-06-15', 'sex': 'femenino',
+    'email': '', 'phone_number': '', 'education_level': 'secundaria', 'purchasing_power': 'medio',
+    'height_cm': 165, 'weight_at_plan': 68, 'wrist_circumference_cm': None,
+    'waist_circumference_cm': None, 'hip_circumference_cm': None, 'gestational_age_weeks': 0,
+    'activity_factor': 1.375, 'pathologies': [], 'other_pathologies_text': '', 'postoperative_text': '',
+    'allergies': [], 'intolerances': [], 'preferences': [], 'aversions': [],
+    'diet_type': 'Mediterranea', 'other_diet_type_text': '', 'target_weight': 62, 'target_waist_cm': None,
+    'target_protein_perc': None, 'target_carb_perc': None, 'target_fat_perc': None,
+    'micronutrients': {}, 'base_foods': [], 'references': {},
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def configure_environment(args):
+    """Variables leídas por config.py al importar la app (antes del import)."""
+    workdir = tempfile.mkdtemp(prefix='nutriapp_load_')
+    database_url = args.database_url or 'sqlite:///' + os.path.join(workdir, 'load_test.db')
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['ERROR_LOG_PATH'] = os.path.join(workdir, 'error.log')
+    os.environ['ERROR_TRACEBACK_EXPORT_PATH'] = ''
+    return workdir, database_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=8, help='nutricionistas concurrentes')
+    parser.add_argument('--plans-per-user', type=int, default=3)
+    parser.add_argument('--mode', choices=('sync', 'jobs'), default='sync')
+    parser.add_argument('--latency', type=float, default=2.0, help='segundos por llamada a la IA')
+    parser.add_argument('--chars-per-second', type=float, default=0, help='velocidad de salida simulada (0 = instantánea)')
+    parser.add_argument('--fixture', default=DEFAULT_FIXTURE, help='plan grabado (estructura + recetario)')
+    parser.add_argument('--database-url', help='por defecto, una base SQLite temporal')
+    parser.add_argument('--use-cache', action='store_true', help='permitir aciertos de la caché de planes')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='segundos entre consultas en --mode jobs')
+    args = parser.parse_args()
+
+    workdir, database_url = configure_environment(args)
+    import app as nutriapp
+
+    flask_app = nutriapp.app
+    if flask_app.config['SQLALCHEMY_DATABASE_URI'] != database_url:
+        # config.py carga .env con override=True: no escribir en una base que no es la de la prueba
+        sys.exit(f"DATABASE_URL de .env ({flask_app.config['SQLALCHEMY_DATABASE_URI']}) reemplaza a la de la prueba; abortando.")
+    flask_app.config.update(
+        LLM_BACKEND='replay', LLM_REPLAY_FIXTURE=args.fixture,
+        LLM_REPLAY_LATENCY_SECONDS=args.latency, LLM_REPLAY_CHARS_PER_SECOND=args.chars_per_second,
+        WTF_CSRF_ENABLED=False,
+    )
+    nutriapp.DRIVE_FOLDER_ID = None
+    if not args.use_cache:
+        nutriapp.plan_cache.directory = None
+    flask_app.logger.setLevel('WARNING')
+
+    with flask_app.app_context():
+        nutriapp.db.create_all()
+        user_ids = []
+        for i in range(args.users):
+            uid = f'loadtest-{os.getpid()}-{i}'
+            user = nutriapp.User.query.filter_by(uid=uid).first()
+            if user is None:
+                user = nutriapp.User(uid=uid)
+                nutriapp.db.session.add(user)
+                nutriapp.db.session.commit()
+            user_ids.append(user.id)
+
+    timings = {'generar_plan': [], 'guardar_evaluacion': [], 'plan_completo': []}
+    errors = []
+    lock = threading.Lock()
+    cedula_base = int(time.time()) % 10**7 * 1000
+
+    def generate(client, payload):
+        if args.mode == 'sync':
+            resp = client.post('/generar_plan', json=payload)
+            body = resp.get_json(silent=True) or {}
+            if resp.status_code != 200:
+                raise RuntimeError(f"/generar_plan {resp.status_code}: {body.get('error')}")
+            return body
+        resp = client.post('/generar_plan/jobs', json=payload)
+        body = resp.get_json(silent=True) or {}
+        if resp.status_code != 202:
+            raise RuntimeError(f"/generar_plan/jobs {resp.status_code}: {body.get('error')}")
+        while True:
+            time.sleep(args.poll_interval)
+            status = client.get(body['status_url']).get_json()
+            if status['status'] == 'done':
+                return status['result']
+            if status['status'] == 'error':
+                raise RuntimeError(f"trabajo {body['job_id']}: {status['error']}")
+
+    def virtual_user(index):
+        client = flask_app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user_ids[index])
+            sess['_fresh'] = True
+        for n in range(args.plans_per_user):
+            cedula = str(cedula_base + index * args.plans_per_user + n)
+            # Email único: patient.email es UNIQUE (también para '')
+            payload = dict(BASE_PLAN_REQUEST, name=f'Paciente{index}x{n}', cedula=cedula, email=f'carga{cedula}@example.com')
+            try:
+                start = time.perf_counter()
+                plan = generate(client, payload)
+                generated = time.perf_counter()
+                resp = client.post('/guardar_evaluacion', json={
+                    'plan_data': plan['plan_data_for_save'], 'edited_plan_text': plan['gemini_raw_text'],
+                    'generation_id': plan.get('generation_id'),
+                })
+                saved = time.perf_counter()
+                if resp.status_code != 200:
+                    raise RuntimeError(f"/guardar_evaluacion {resp.status_code}: {(resp.get_json(silent=True) or {}).get('error')}")
+            except Exception as exc:
+                with lock:
+                    errors.append(str(exc))
+                continue
+            with lock:
+                timings['generar_plan'].append(generated - start)
+                timings['guardar_evaluacion'].append(saved - generated)
+                timings['plan_completo'].append(saved - start)
+
+    threads = [threading.Thread(target=virtual_user, args=(i,)) for i in range(args.users)]
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_start
+
+    completed = len(timings['plan_completo'])
+    print(f"Modo {args.mode}: {args.users} usuarios x {args.plans_per_user} planes, latencia IA {args.latency:.2f} s/llamada")
+    for name, values in timings.items():
+        if values:
+            print(f"  {name:<20} p50 {percentile(values, 0.5):7.3f} s   p95 {percentile(values, 0.95):7.3f} s"
+                  f"   máx {max(values):7.3f} s   media {statistics.mean(values):7.3f} s")
+    print(f"  Planes guardados: {completed} en {wall:.1f} s ({completed / wall * 60:.1f} planes/min)")
+    for purpose, stats in nutriapp.llm_metrics.snapshot()['calls'].items():
+        tokens = stats['tokens']
+        print(f"  IA ({purpose}): {stats['calls']} llamadas, {stats['cache_hits']} desde caché, {stats['blocked']} bloqueadas,"
+              f" tokens prompt {tokens['prompt_tokens']} / salida {tokens['output_tokens']}")
+    print(f"  Errores: {len(errors)}")
+    for message in sorted(set(errors))[:5]:
+        print(f"    - {message}")
+    print(f"  Archivos de la prueba en {workdir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# migrate_pdf_storage.py
+"""
+Mueve los PDFs técnicos ya guardados (pdf_storage_path y historical_pdf_ids_json) a otro almacenamiento.
+
+    python migrate_pdf_storage.py --to local [--dry-run] [--delete-source] [--batch-size 100]
+
+Cada archivo se copia en streaming con el driver de destino (ver backend/pdf_storage.py) y la evaluación pasa a
+apuntar a la nueva ubicación; lo que ya está en el destino se saltea, así que el script puede repetirse.
+Con --delete-source se borran los originales, después de confirmar en la base las nuevas ubicaciones.
+"""
+import argparse
+import json
+
+from app import app, db, Evaluation, pdf_storage, _nombre_pdf_completo
+
+def migrate_pdf_storage(target, dry_run=False, delete_source=False, batch_size=100):
+    if target not in pdf_storage.drivers:
+        raise SystemExit(f"Almacenamiento '{target}' desconocido o sin configurar (disponibles: {', '.join(pdf_storage.drivers)}).")
+    with app.app_context():
+        query = Evaluation.query.filter(
+            (Evaluation.pdf_storage_path.isnot(None)) | (Evaluation.historical_pdf_ids_json.notin_(['', '[]']))
+        ).order_by(Evaluation.id)
+        total = query.count()
+        print(f"Evaluaciones con PDFs guardados: {total}")
+        moved_count = skipped_count = error_count = 0
+        moved_sources = []
+
+        def move(evaluation, location, name):
+            nonlocal moved_count, skipped_count, error_count
+            if pdf_storage.split(location)[0] == target:
+                skipped_count += 1
+                return location
+            if dry_run:
+                moved_count += 1
+                return location
+            try:
+                new_location = pdf_storage.copy(location, name, target)
+            except Exception as e:
+                print(f"Error copiando {location} (Evaluación ID {evaluation.id}): {e}")
+                error_count += 1
+                return location
+            moved_sources.append(location)
+            moved_count += 1
+            return new_location
+
+        last_id = 0
+        while True:
+            batch = query.filter(Evaluation.id > last_id).limit(batch_size).all()
+            if not batch:
+                break
+            for evaluation in batch:
+                last_id = evaluation.id
+                name = _nombre_pdf_completo(evaluation) if evaluation.patient else f"Evaluacion_{evaluation.id}.pdf"
+                if evaluation.pdf_storage_path:
+                    evaluation.pdf_storage_path = move(evaluation, evaluation.pdf_storage_path, name)
+                history = evaluation.get_historical_pdf_ids()
+                if history:
+                    new_history = [move(evaluation, location, name.replace('.pdf', f'_historico_{i}.pdf'))
+                                   for i, location in enumerate(history, start=1) if location]
+                    if new_history != history:
+                        evaluation.historical_pdf_ids_json = json.dumps(new_history)
+            if dry_run:
+                db.session.rollback()
+            else:
+                # Confirmar por lote: una falla posterior no deja evaluaciones apuntando a archivos ya borrados
+                db.session.commit()
+                if delete_source:
+                    for location in moved_sources:
+                        try:
+                            pdf_storage.delete(location)
+                        except Exception as e:
+                            print(f"No se pudo borrar el original {location}: {e}")
+            moved_sources.clear()
+            db.session.expunge_all()
+
+        print("\n--- Migración de PDFs Completada ---")
+        print(f"PDFs {'a mover' if dry_run else 'movidos'} a '{target}': {moved_count}")
+        print(f"PDFs ya en '{target}': {skipped_count}")
+        if error_count:
+            print(f"PDFs con errores (siguen en su ubicación anterior): {error_count}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mueve los PDFs técnicos guardados a otro almacenamiento.')
+    parser.add_argument('--to', dest='target', default=app.config.get('PDF_STORAGE_BACKEND'),
+                        help="destino: 'local', 's3' o 'drive' (por defecto PDF_STORAGE_BACKEND)")
+    parser.add_argument('--dry-run', action='store_true', help='solo contar lo que se movería')
+    parser.add_argument('--delete-source', action='store_true', help='borrar los originales después de moverlos')
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+    print("Iniciando migración de PDFs...")
+    migrate_pdf_storage(args.target, dry_run=args.dry_run, delete_source=args.delete_source, batch_size=args.batch_size)
+    print("Migración de PDFs finalizada.")
@@ -1,6 +1,6 @@
 # recalculate_preparation_nutrition.py
 import json
-from app import app, db, UserPreparation, calculate_total_nutritional_info, _parse_ingredient_line
+from app import app, db, UserPreparation, calculate_total_nutritional_info, rebuild_nutrient_matrix, _parse_ingredient_line
 
 def recalculate_all_preparations_nutrition():
     with app.app_context():
@@ -11,6 +11,13 @@ def recalculate_all_preparations_nutrition():
 
         print(f"Iniciando recálculo nutricional para {len(preparations)} preparaciones...")
 
+        # Reconstruir la matriz de nutrientes una sola vez desde la BD; todas las recetas se suman contra ella
+        matrix = rebuild_nutrient_matrix()
+        if matrix is not None:
+            print(f"Matriz de nutrientes construida: {len(matrix)} ingredientes x {len(matrix.columns)} nutrientes.")
+        else:
+            print("numpy no disponible: se usará el cálculo ingrediente por ingrediente.")
+
         for prep in preparations:
             try:
                 # Solo recalcular si no tiene calorías o si quieres forzarlo
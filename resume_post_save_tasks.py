@@ -0,0 +1,30 @@
+# resume_post_save_tasks.py
+from app import app, db, Evaluation, post_save_pipeline
+from backend.post_save import ACTIVE_STATES, FAILED
+
+def resume_post_save_tasks(include_failed=False):
+    """Ejecuta (en este proceso, sin encolar) las tareas posteriores al guardado que quedaron pendientes o a medias.
+    Los pasos ya terminados se saltean; con include_failed también se reintentan las tareas fallidas."""
+    statuses = list(ACTIVE_STATES) + ([FAILED] if include_failed else [])
+    with app.app_context():
+        ids = [row.id for row in db.session.query(Evaluation.id)
+               .filter(Evaluation.post_save_status.in_(statuses)).order_by(Evaluation.id)]
+        print(f"Tareas a reanudar: {len(ids)}")
+        failed_count = 0
+        for evaluation_id in ids:
+            state = post_save_pipeline.run(evaluation_id)
+            if state['status'] == FAILED:
+                failed_count += 1
+                errors = {name: step.get('error') for name, step in state['steps'].items() if step.get('error')}
+                print(f"Evaluación ID {evaluation_id}: falló ({errors})")
+
+        print("\n--- Tareas Posteriores al Guardado ---")
+        print(f"Completadas: {len(ids) - failed_count}")
+        if failed_count:
+            print(f"Con errores: {failed_count}")
+
+if __name__ == '__main__':
+    import sys
+    print("Iniciando reanudación de tareas posteriores al guardado...")
+    resume_post_save_tasks(include_failed='--failed' in sys.argv)
+    print("Reanudación finalizada.")
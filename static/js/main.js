@@ -9,6 +9,7 @@ const auth = getAuth(app);
 // --- Globals ---
 let lastCalculatedReferences = {};
 let currentPlanDataBaseData = null;
+let currentGenerationId = null; // Id de la última generación: el servidor guarda sus tokens y latencias con la evaluación
 let patientChatIntervalId = null; // Variable global para el temporizador del chat del paciente
 
 // --- Helper to check if it's a patient app route ---
@@ -210,7 +211,8 @@ async function sendPlanByEmail(evaluationId) {
     });
     const result = await resp.json();
     if (!resp.ok) throw new Error(result.error || `Error del servidor: ${resp.status}`);
-    showFinalMessage(result.message || 'Email enviado correctamente.', 'success');
+    showFinalMessage(result.message || 'Email encolado para su envío.', 'info', false);
+    if (result.status_url) seguirEstadoEmail(result.status_url, token);
   } catch (err) {
     console.error('Error en sendPlanByEmail:', err);
     showFinalMessage(`Error al enviar email: ${err.message}`, 'danger');
@@ -222,6 +224,28 @@ async function sendPlanByEmail(evaluationId) {
   }
 }
 
+// Consulta /estado_email/<id> hasta que el servidor envía el email encolado o lo da por fallido.
+const EMAIL_POLL_INTERVAL_MS = 2000;
+const EMAIL_MAX_POLLS = 90;
+
+async function seguirEstadoEmail(statusUrl, token) {
+  const authHeaders = { 'Authorization': `Bearer ${token}` };
+  for (let i = 0; i < EMAIL_MAX_POLLS; i++) {
+    await new Promise(resolve => setTimeout(resolve, EMAIL_POLL_INTERVAL_MS));
+    const resp = await fetch(statusUrl, { headers: authHeaders }).catch(() => null);
+    if (!resp || !resp.ok) return;
+    const status = await resp.json().catch(() => ({}));
+    if (status.status === 'sent') {
+      showFinalMessage('Plan enviado por email exitosamente.', 'success');
+      return;
+    }
+    if (status.status === 'failed') {
+      showFinalMessage(`No se pudo enviar el email con el plan: ${status.error || 'error desconocido'}`, 'danger', false);
+      return;
+    }
+  }
+}
+
 function getCsrfToken() {
   const csrfTokenElement = document.querySelector('meta[name="csrf-token"]');
   if (csrfTokenElement) {
@@ -731,6 +755,109 @@ async function loadRelevantPreparationsForPatient() {
   }
 }
 
+const RECIPE_SECTION_MARKER = "== RECETARIO DETALLADO ==";
+
+const PLAN_JOB_POLL_INTERVAL_MS = 1000;
+
+// Muestra el plan parcial mientras se genera: la estructura y, debajo, el texto de cada lote de recetas.
+function renderPartialPlan(textarea, structureText, recipeBatches) {
+  const recipesText = (recipeBatches || [])
+    .map(text => (text || "").replace(RECIPE_SECTION_MARKER, "").trim())
+    .filter(Boolean)
+    .join("\n\n");
+  textarea.value = structureText + (recipesText ? `\n\n${RECIPE_SECTION_MARKER}\n\n${recipesText}` : "");
+  textarea.scrollTop = textarea.scrollHeight;
+}
+
+function parseJobEvent(messageEvent) {
+  try {
+    return JSON.parse(messageEvent.data);
+  } catch (e) {
+    return {};
+  }
+}
+
+// Sigue el trabajo por /generar_plan/jobs/<id>/stream (EventSource, con la cookie de sesión) y muestra
+// la estructura y las recetas a medida que llegan. Si la conexión se corta, EventSource se reconecta solo
+// enviando Last-Event-ID; si el servidor rechaza el stream, retorna null y se consulta el estado.
+function seguirTrabajoPorStream(job, textarea) {
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(job.stream_url);
+    let structureText = "";
+    let recipeBatches = [];
+    const finish = (fn, value) => { source.close(); fn(value); };
+
+    source.addEventListener("structure", e => {
+      structureText += parseJobEvent(e).text || "";
+      renderPartialPlan(textarea, structureText, recipeBatches);
+    });
+    source.addEventListener("recipes_start", e => {
+      recipeBatches = new Array(parseJobEvent(e).batches || 0).fill("");
+      renderPartialPlan(textarea, structureText, recipeBatches);
+    });
+    source.addEventListener("recipes", e => {
+      const data = parseJobEvent(e);
+      recipeBatches[data.batch] = (recipeBatches[data.batch] || "") + (data.text || "");
+      renderPartialPlan(textarea, structureText, recipeBatches);
+    });
+    source.addEventListener("done", e => finish(resolve, parseJobEvent(e)));
+    // Evento 'error' del servidor (con datos) o error de conexión de EventSource (sin datos)
+    source.addEventListener("error", e => {
+      if (e.data) {
+        finish(reject, new Error(parseJobEvent(e).error || "Error al generar el plan."));
+      } else if (source.readyState === EventSource.CLOSED) {
+        finish(resolve, null); // El servidor rechazó el stream (p. ej. 404): se sigue consultando el estado
+      }
+    });
+  });
+}
+
+// Consulta el estado del trabajo hasta que termina, mostrando el texto parcial (sin soporte de EventSource).
+async function seguirTrabajoPorEstado(job, authHeaders, textarea) {
+  let lastRendered = "";
+  while (true) {
+    await new Promise(resolve => setTimeout(resolve, PLAN_JOB_POLL_INTERVAL_MS));
+    const statusResp = await fetch(job.status_url, { headers: authHeaders });
+    if (statusResp.status === 401) throw new Error('Sesión expirada. Por favor, inicie sesión de nuevo.');
+    const status = await statusResp.json().catch(() => ({}));
+    if (!statusResp.ok) throw new Error(status.error || `Error del servidor: ${statusResp.status}`);
+
+    if (status.status === "done") return status.result;
+    if (status.status === "error") throw new Error(status.error || "Error al generar el plan.");
+
+    const progress = status.progress || {};
+    const partial = JSON.stringify([progress.structure_text, progress.recipes_text]);
+    if (progress.structure_text && partial !== lastRendered) {
+      renderPartialPlan(textarea, progress.structure_text, progress.recipes_text);
+      lastRendered = partial;
+    }
+  }
+}
+
+// Encola la generación en /generar_plan/jobs y sigue el trabajo hasta que termina, mostrando el texto parcial.
+// Retorna el mismo objeto que /generar_plan: { gemini_raw_text, plan_data_for_save, generation_stats, generation_id }.
+async function generarPlanEnSegundoPlano(requestBody, token, textarea) {
+  const authHeaders = { 'Authorization': `Bearer ${token}` };
+  const resp = await fetch("/generar_plan/jobs", {
+    method: "POST",
+    headers: {
+      ...authHeaders,
+      "Content-Type": "application/json",
+      "X-CSRFToken": getCsrfToken()
+    },
+    body: JSON.stringify(requestBody)
+  });
+  if (resp.status === 401) throw new Error('Sesión expirada. Por favor, inicie sesión de nuevo.');
+  const job = await resp.json().catch(() => ({}));
+  if (!resp.ok || !job.status_url) throw new Error(job.error || `Error del servidor: ${resp.status}`);
+
+  if (window.EventSource && job.stream_url) {
+    const result = await seguirTrabajoPorStream(job, textarea);
+    if (result) return result;
+  }
+  return seguirTrabajoPorEstado(job, authHeaders, textarea);
+}
+
 async function generarPlan() {
   console.log("****** generarPlan() triggered ******");
   hideFinalMessage();
@@ -802,6 +929,9 @@ async function generarPlan() {
     references: lastCalculatedReferences
   };
 
+  // Sin esta marca el servidor reutiliza el plan ya generado para los mismos datos
+  const generationOptions = { force_regenerate: !!document.getElementById("force_regenerate")?.checked };
+
   const required = [
     "name", "surname", "cedula", "dob", "sex", "height_cm", "weight_at_plan", "activity_factor", "target_weight"
   ];
@@ -821,31 +951,21 @@ async function generarPlan() {
   const textarea = document.getElementById("planTextArea");
   textarea.value = "Generando plan con IA... Por favor, espere.";
   textarea.disabled = true;
+  currentGenerationId = null;
 
   try {
     const user = auth.currentUser;
     if (!user) throw new Error("No autenticado. Por favor, inicie sesión.");
     const token = await user.getIdToken();
 
-    const resp = await fetch("/generar_plan", {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-        'Authorization': `Bearer ${token}`,
-        "X-CSRFToken": getCsrfToken()
-      },
-      body: JSON.stringify(planBaseData)
-    });
-    if (resp.status === 401) throw new Error('Sesión expirada. Por favor, inicie sesión de nuevo.');
-    const res = await resp.json();
-    if (!resp.ok) throw new Error(res.error || `Error del servidor: ${resp.status}`);
+    const res = await generarPlanEnSegundoPlano({ ...planBaseData, ...generationOptions }, token, textarea);
     
     textarea.value = res.gemini_raw_text || "Error: plan inválido recibido del servidor.";
     currentPlanDataBaseData = res.plan_data_for_save;
+    currentGenerationId = res.generation_id || null;
 
     const fullPlanText = res.gemini_raw_text;
-    const recipeSectionMarker = "== RECETARIO DETALLADO ==";
-    const parts = fullPlanText.split(recipeSectionMarker);
+    const parts = fullPlanText.split(RECIPE_SECTION_MARKER);
     const recipesDetailedText = parts.length > 1 ? parts[1].trim() : "";
 
     const recipesContainer = document.getElementById('favoriteRecipesContainer');
@@ -900,6 +1020,31 @@ async function generarPlan() {
   }
 }
 
+// Consulta /estado_pdf/<id> hasta que terminan los PDFs que el servidor genera tras guardar la evaluación.
+const POST_SAVE_POLL_INTERVAL_MS = 2000;
+const POST_SAVE_MAX_POLLS = 90;
+
+async function seguirEstadoPdf(statusUrl, token, savedMessage) {
+  const authHeaders = { 'Authorization': `Bearer ${token}` };
+  for (let i = 0; i < POST_SAVE_MAX_POLLS; i++) {
+    await new Promise(resolve => setTimeout(resolve, POST_SAVE_POLL_INTERVAL_MS));
+    const resp = await fetch(statusUrl, { headers: authHeaders }).catch(() => null);
+    if (!resp || !resp.ok) return;
+    const status = await resp.json().catch(() => ({}));
+    if (status.status === "done") {
+      showFinalMessage(`${savedMessage} PDFs generados${status.pdf_storage_path ? " y guardados" : ""}.`, "success", false);
+      return;
+    }
+    if (status.status === "failed") {
+      const steps = status.steps || {};
+      const storageFailed = steps.pdf_completo && steps.pdf_completo.status === "failed";
+      const detail = storageFailed ? "No se pudo guardar el PDF completo." : "No se pudo generar el PDF para el paciente.";
+      showFinalMessage(`${savedMessage} Advertencia: ${detail}`, "warning", false);
+      return;
+    }
+  }
+}
+
 async function finalizar() {
     console.log("****** INICIO finalizar() ******");
     hideFinalMessage();
@@ -923,7 +1068,8 @@ async function finalizar() {
         plan_data: planData,
         edited_plan_text: editedPlanText,
         user_observations: document.getElementById("user_observations")?.value || "",
-        selected_favorite_recipes: Array.from(document.querySelectorAll('input[name="favorite_recipes_frontend"]:checked')).map(cb => cb.value)
+        selected_favorite_recipes: Array.from(document.querySelectorAll('input[name="favorite_recipes_frontend"]:checked')).map(cb => cb.value),
+        generation_id: currentGenerationId
     };
     const loadedEvalId = document.getElementById("loaded_evaluation_id")?.value || null;
     const endpoint = loadedEvalId ? `/actualizar_evaluacion/${loadedEvalId}` : "/guardar_evaluacion";
@@ -954,6 +1100,10 @@ async function finalizar() {
             document.getElementById("loaded_evaluation_id").value = result.evaluation_id;
             setupActionButtons(result.evaluation_id);
         }
+        if (result.post_save_status_url) {
+            showFinalMessage(`${result.message} Generando PDFs...`, "success", false);
+            seguirEstadoPdf(result.post_save_status_url, token, result.message);
+        }
     } catch (error) {
         console.error("ERROR en finalizar():", error);
         showFinalMessage(`Error al guardar: ${error.message}`, "danger");